@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+"""Throughput benchmark of `cat_fastq` against the text path it replaced.
+
+Synthetic paired-end FASTQ files are written to a temporary directory, both
+implementations interleave and rename them into memory, and the outputs are checked to
+be identical.
+
+Usage:
+    python scripts/bench_cat_fastq.py --num_samples 4 --num_reads 200000 [--gzip]
+        [--num_workers 4]
+"""
+
+import argparse
+import functools
+import gzip
+import io
+import os
+import random
+import tempfile
+import time
+
+from easy_amplicon.utils import (
+    _rename_read_illumina,
+    cat_fastq,
+    find_paired_end_files,
+    smart_open,
+)
+
+
+def write_fastq(path: str, num_reads: int, read_length: int, seed: int) -> None:
+    rng = random.Random(seed)
+    seqs = ["".join(rng.choices("ACGT", k=read_length)) for _ in range(1000)]
+    quals = ["".join(rng.choices("FF:,#", k=read_length)) for _ in range(1000)]
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt") as f:
+        for i in range(num_reads):
+            f.write(
+                f"@M00001:1:000000000-ABCDE:1:1101:{i}:1000 1:N:0:1\n"
+                f"{seqs[i % 1000]}\n+\n{quals[i % 1000]}\n"
+            )
+
+
+def cat_fastq_text(directory: str, output_fp) -> None:
+    """The original text implementation of `cat_fastq`, kept here as the baseline."""
+    for r1_path, r2_path, sample_name in find_paired_end_files(directory):
+        with smart_open(r1_path) as r1_file, smart_open(r2_path) as r2_file:
+            paired_read_iter = zip(
+                zip(*[r1_file] * 4, strict=True),
+                zip(*[r2_file] * 4, strict=True),
+                strict=True,
+            )
+            for read_index, (r1_lines, r2_lines) in enumerate(
+                paired_read_iter, start=1
+            ):
+                output_fp.write(
+                    (
+                        _rename_read_illumina(r1_lines[0], sample_name, 1, read_index)
+                        + "".join(r1_lines[1:])
+                    ).encode()
+                )
+                output_fp.write(
+                    (
+                        _rename_read_illumina(r2_lines[0], sample_name, 2, read_index)
+                        + "".join(r2_lines[1:])
+                    ).encode()
+                )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-s", "--num_samples", type=int, default=4)
+    parser.add_argument("-n", "--num_reads", type=int, default=200_000)
+    parser.add_argument("-l", "--read_length", type=int, default=150)
+    parser.add_argument("--gzip", action="store_true", help="Gzip the input files")
+    parser.add_argument(
+        "-w",
+        "--num_workers",
+        type=int,
+        default=1,
+        help="Also time the parallel mode of `cat_fastq` with this many workers",
+    )
+    args = parser.parse_args()
+
+    ext = ".fq.gz" if args.gzip else ".fq"
+    with tempfile.TemporaryDirectory() as temp_dir:
+        for i in range(args.num_samples):
+            for read in [1, 2]:
+                write_fastq(
+                    os.path.join(temp_dir, f"sample{i}_R{read}{ext}"),
+                    args.num_reads,
+                    args.read_length,
+                    seed=i * 2 + read,
+                )
+        results = {}
+        funcs = [("text", cat_fastq_text), ("bytes", cat_fastq)]
+        if args.num_workers > 1:
+            funcs.append(
+                (
+                    f"bytes x{args.num_workers}",
+                    functools.partial(cat_fastq, num_workers=args.num_workers),
+                )
+            )
+        for name, func in funcs:
+            out = io.BytesIO()
+            start = time.perf_counter()
+            func(temp_dir, out)
+            elapsed = time.perf_counter() - start
+            results[name] = out.getvalue()
+            num_bytes = len(results[name])
+            num_reads = args.num_samples * args.num_reads * 2
+            print(
+                f"{name:>8}: {elapsed:7.2f} s, {num_bytes / elapsed / 1e6:8.1f} MB/s, "
+                f"{num_reads / elapsed / 1e6:6.2f} M reads/s"
+            )
+        if any(result != results["text"] for result in results.values()):
+            raise RuntimeError("Outputs of the text and bytes paths differ.")
+        print("Outputs are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python
+"""Throughput benchmark of `parse_fastx`/`write_fastx` against Bio.SeqIO.
+
+A synthetic FASTQ (or multi-line FASTA) file is written to a temporary directory and
+parsed with `Bio.SeqIO.parse`, `parse_fastx` (str and bytes) and
+`parse_fastx_batches`; it is then written back with `Bio.SeqIO.write` and
+`write_fastx`. Parsed records and written outputs are checked to be identical.
+
+Usage:
+    python scripts/bench_fastx_parser.py --num_reads 500000 [--fasta] [--gzip]
+"""
+
+import argparse
+import gzip
+import io
+import os
+import random
+import tempfile
+import time
+
+from Bio import SeqIO
+
+from easy_amplicon.utils import parse_fastx, parse_fastx_batches, write_fastx
+
+
+def write_fastx_file(path: str, num_reads: int, read_length: int, fasta: bool) -> None:
+    rng = random.Random(0)
+    seqs = ["".join(rng.choices("ACGT", k=read_length)) for _ in range(1000)]
+    quals = ["".join(rng.choices("FF:,#", k=read_length)) for _ in range(1000)]
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "wt") as f:
+        for i in range(num_reads):
+            seq = seqs[i % 1000]
+            if fasta:  # wrapped at 60 like SeqIO does
+                lines = "\n".join(seq[j : j + 60] for j in range(0, len(seq), 60))
+                f.write(f">read{i} size={i % 100}\n{lines}\n")
+            else:
+                f.write(f"@read{i} 1:N:0:1\n{seq}\n+\n{quals[i % 1000]}\n")
+
+
+def parse_seqio(path: str, fmt: str) -> list[tuple]:
+    with gzip.open(path, "rt") if path.endswith(".gz") else open(path) as f:
+        if fmt == "fasta":
+            return [(r.id, str(r.seq), None) for r in SeqIO.parse(f, "fasta")]
+        return [
+            (
+                r.id,
+                str(r.seq),
+                "".join(chr(q + 33) for q in r.letter_annotations["phred_quality"]),
+            )
+            for r in SeqIO.parse(f, "fastq")
+        ]
+
+
+def report(name: str, elapsed: float, num_bytes: int, num_reads: int) -> None:
+    print(
+        f"{name:>14}: {elapsed:7.2f} s, {num_bytes / elapsed / 1e6:8.1f} MB/s, "
+        f"{num_reads / elapsed / 1e6:6.2f} M reads/s"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("-n", "--num_reads", type=int, default=500_000)
+    parser.add_argument("-l", "--read_length", type=int, default=150)
+    parser.add_argument("--fasta", action="store_true", help="Benchmark FASTA")
+    parser.add_argument("--gzip", action="store_true", help="Gzip the input file")
+    args = parser.parse_args()
+
+    fmt = "fasta" if args.fasta else "fastq"
+    ext = (".fa" if args.fasta else ".fq") + (".gz" if args.gzip else "")
+    with tempfile.TemporaryDirectory() as temp_dir:
+        path = os.path.join(temp_dir, f"reads{ext}")
+        write_fastx_file(path, args.num_reads, args.read_length, args.fasta)
+        num_bytes = os.path.getsize(path)
+
+        parsers = [
+            ("SeqIO.parse", lambda: parse_seqio(path, fmt)),
+            ("parse_fastx", lambda: list(parse_fastx(path))),
+            ("  as_bytes", lambda: list(parse_fastx(path, as_bytes=True))),
+            ("  batches", lambda: list(parse_fastx_batches(path))),
+        ]
+        results = {}
+        for name, func in parsers:
+            start = time.perf_counter()
+            results[name] = func()
+            report(name, time.perf_counter() - start, num_bytes, args.num_reads)
+        if results["parse_fastx"] != results["SeqIO.parse"]:
+            raise RuntimeError("Records parsed by SeqIO and parse_fastx differ.")
+
+        records = results["parse_fastx"]
+        with gzip.open(path, "rt") if args.gzip else open(path) as f:
+            seq_records = list(SeqIO.parse(f, fmt))
+        writers = [
+            ("SeqIO.write", lambda out: SeqIO.write(seq_records, out, fmt)),
+            ("write_fastx", lambda out: write_fastx(out, records, fmt)),
+        ]
+        outputs = {}
+        for name, func in writers:
+            out = io.StringIO()
+            start = time.perf_counter()
+            func(out)
+            report(name, time.perf_counter() - start, num_bytes, args.num_reads)
+            # SeqIO wraps FASTA sequences, compare the records written
+            outputs[name] = list(parse_fastx(io.BytesIO(out.getvalue().encode()), fmt))
+        if outputs["write_fastx"] != outputs["SeqIO.write"]:
+            raise RuntimeError("Records written by SeqIO and write_fastx differ.")
+        print("Outputs are identical.")
+
+
+if __name__ == "__main__":
+    main()
@@ -37,6 +37,14 @@ trim.py --mode simple \
   --input_dir "$data_dir/fastq_bulk_16s" \
   --output "$data_dir/output_unoise3_16s/merged.fq.gz"
 
+# Trimming, unoise3 and search_global below can also run as one command, which reads the
+# trimmed reads once instead of decompressing merged.fq.gz twice:
+# easy_amplicon run --mode simple \
+#   --input_dir "$data_dir/fastq_bulk_16s" \
+#   --output_dir "$data_dir/output_unoise3_16s" \
+#   --relabel_prefix "16S-U" \
+#   --unknown_name "16S-U_UNKNOWN"
+
 # Command 1: Run unoise3
 usearch_workflow.py unoise3 \
   --input_fastq "$data_dir/output_unoise3_16s/merged.fq.gz" \
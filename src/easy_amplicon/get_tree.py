@@ -1,22 +1,24 @@
 #!/usr/bin/env python
 import argparse
+import io
 import os
 import shutil
 import subprocess
 import tempfile
 from typing import Iterable
 
-from Bio import SeqIO
-from Bio import SeqRecord
+from easy_amplicon.utils import parse_fastx, write_fastx
+from easy_amplicon.utils_cpu import add_threads_argument, resolve_threads
+from easy_amplicon.utils_index import iter_records_by_id
 
 
 # Reading the FASTA file and filtering sequences
 def filter_sequences(
     input_fasta: str, names_to_keep: list[str]
-) -> Iterable[SeqRecord.SeqRecord]:
-    for record in SeqIO.parse(input_fasta, "fasta"):
-        if record.id in names_to_keep:
-            yield record
+) -> Iterable[tuple[str, str, None]]:
+    # look the records up in the (cached) index instead of parsing the whole file
+    for record in iter_records_by_id(input_fasta, names_to_keep):
+        yield from parse_fastx(io.BytesIO(record), "fasta", full_title=True)
 
 
 # Function to run MAFFT
@@ -50,7 +52,7 @@ def run_trimal(input_aln: str, output_phy: str, tree_method: str = "raxml"):
 
 
 # Function to run RAxML
-def run_raxml(alignment_file: str, output_dir: str):
+def run_raxml(alignment_file: str, output_dir: str, threads: int | str | None = "auto"):
     # RAxML command
     raxml_cmd = [
         "raxmlHPC-PTHREADS-SSE3",
@@ -69,7 +71,7 @@ def run_raxml(alignment_file: str, output_dir: str):
         "-n",
         "whatever",
         "-T",
-        str(16),
+        str(resolve_threads(threads)),
         "-w",
         output_dir,
     ]
@@ -98,6 +100,7 @@ def process_sequences(
     tree_out: str,
     seq_names: list[str] = None,
     tree_method: str = "raxml",
+    threads: int | str | None = "auto",
 ) -> int:
     if seq_names is None:
         input_fasta = zotu_fasta_path
@@ -107,11 +110,10 @@ def process_sequences(
         # ) as temp_fasta:
         temp_fasta = tempfile.NamedTemporaryFile(mode="w", suffix=".fasta")
         # Filter and write sequences to a temp file
-        _ = SeqIO.write(
-            list(filter_sequences(zotu_fasta_path, seq_names)),
-            temp_fasta,
-            "fasta",
+        _ = write_fastx(
+            temp_fasta, filter_sequences(zotu_fasta_path, seq_names), "fasta"
         )
+        temp_fasta.flush()
         input_fasta = temp_fasta.name
 
     # Run MAFFT on the temp file and check if it ran successfully
@@ -139,7 +141,7 @@ def process_sequences(
     if tree_method == "raxml":
         # Run RAxML, output to a temporary directory, copy the tree file to the output path
         with tempfile.TemporaryDirectory() as temp_dir:
-            raxml_result = run_raxml(alignment_out, temp_dir)
+            raxml_result = run_raxml(alignment_out, temp_dir, threads)
             tree_file = os.path.join(temp_dir, "RAxML_bestTree.whatever")
         # Check if RAxML ran successfully
         if raxml_result.returncode != 0:
@@ -192,6 +194,7 @@ def main() -> None:
         default="fasttree",
         choices=["raxml", "fasttree"],
     )
+    add_threads_argument(parser)
     args = parser.parse_args()
 
     # Read the sequence names file
@@ -204,7 +207,13 @@ def main() -> None:
     )
     aln_file = prefix + (".phy" if args.tree_method == "raxml" else ".alnfna")
     tree_file = prefix + ".newick"
-    process_sequences(args.input_fasta, aln_file, tree_file, tree_method="fasttree")
+    process_sequences(
+        args.input_fasta,
+        aln_file,
+        tree_file,
+        tree_method="fasttree",
+        threads=args.threads,
+    )
 
     # Read the tree file and print the tree
     # tree = Phylo.read(args.output, "newick")
@@ -0,0 +1,218 @@
+#!/usr/bin/env python
+"""Run the whole workflow from raw FASTQ files to a ZOTU table in one command.
+
+Run separately, `trim.py` writes the trimmed reads compressed, `usearch_workflow.py
+unoise3` decompresses them to find ZOTUs and `usearch_workflow.py search_global`
+decompresses them again to count reads per ZOTU. `easy_amplicon run` instead:
+1. Trims the raw reads (read once) into an uncompressed spool file in the output
+    directory, with any mode of trim.py writing a single FASTQ.
+2. Reads the spool once, compressing it to `merged.fq.gz` while feeding the same
+    bytes to the quality filtering, dereplication and clustering of `unoise3` through
+    a named pipe, so compression and clustering run side by side.
+3. Maps the spool to the ZOTUs with `search_global` (no decompression), then removes
+    it.
+
+Outputs are those of the separate commands: `merged.fq.gz` and the reports of
+trim.py, the ZOTU FASTA (`unoise3_zotu.fa`) and the ZOTU table (`unoise3_zotu.biom`
+by default) with reads matching no ZOTU counted under `--unknown_name`.
+"""
+
+import argparse
+import contextlib
+import errno
+import os
+import threading
+import time
+
+from easy_amplicon.trim import add_trim_arguments, check_trim_arguments, run_mode
+from easy_amplicon.usearch_workflow import search_global_add_unknown, unoise3
+from easy_amplicon.utils_cpu import resolve_threads
+from easy_amplicon.utils_gzip import open_gzip_write
+from easy_amplicon.utils_preview import (
+    print_preview_report,
+    summarize_trim,
+    summarize_zotus,
+)
+
+# Size of the blocks of the spool read and handed to the compressor and to unoise3.
+TEE_BLOCK_SIZE = 4 * 1024 * 1024
+# Trimming modes writing a single FASTQ.
+RUN_MODES = [
+    "simple",
+    "r1",
+    "isolate_150",
+    "isolate_150_early_stop",
+    "maps_round0",
+    "maps_round1",
+    "maps_round2",
+    "maps_round3",
+]
+
+
+def tee_unoise3(
+    input_fastq: str,
+    output_fastq: str,
+    zotu_fasta: str,
+    min_size: int,
+    relabel_prefix: str | None = None,
+    num_threads: int = 8,
+) -> None:
+    """Compress a FASTQ file to `output_fastq` while clustering its reads into ZOTUs
+    with `unoise3`, reading it once.
+
+    Reads are fed to unoise3 through a named pipe next to `zotu_fasta`, from which
+    vsearch reads as from a file.
+    """
+    fifo_dir = os.path.join(os.path.dirname(os.path.abspath(zotu_fasta)), ".tmp")
+    os.makedirs(fifo_dir, exist_ok=True)
+    fifo_path = os.path.join(fifo_dir, f"unoise3.{os.getpid()}.fq")
+    os.mkfifo(fifo_path)
+    errors = []
+
+    def cluster():
+        try:
+            unoise3(
+                fifo_path,
+                zotu_fasta,
+                min_size=min_size,
+                relabel_prefix=relabel_prefix,
+                num_threads=num_threads,
+            )
+        except Exception as e:
+            errors.append(e)
+
+    clusterer = threading.Thread(target=cluster, daemon=True)
+    clusterer.start()
+    try:
+        fd = _open_fifo(fifo_path, clusterer)
+        if fd is None:
+            raise errors[0] if errors else RuntimeError("unoise3 exited early.")
+        with (
+            open(input_fastq, "rb") as f,
+            open_gzip_write(output_fastq, threads=num_threads) as out,
+            open(fd, "wb") as pipe,
+        ):
+            for block in iter(lambda: f.read(TEE_BLOCK_SIZE), b""):
+                out.write(block)
+                pipe.write(block)
+    finally:
+        clusterer.join()
+        os.remove(fifo_path)
+        with contextlib.suppress(OSError):
+            os.rmdir(fifo_dir)
+    if errors:
+        raise errors[0]
+
+
+def _open_fifo(path: str, reader: threading.Thread) -> int | None:
+    """Open a named pipe for writing once its reader opened it, or return None if
+    the thread starting the reader is done before.
+    """
+    while True:
+        try:
+            fd = os.open(path, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno != errno.ENXIO:
+                raise
+            if not reader.is_alive():
+                return None
+            time.sleep(0.01)
+            continue
+        os.set_blocking(fd, True)
+        return fd
+
+
+def run(args: argparse.Namespace) -> None:
+    """Trim, cluster and count reads as described in the module docstring, given the
+    parsed arguments of `easy_amplicon run`.
+    """
+    output_dir = args.output_dir
+    os.makedirs(output_dir, exist_ok=True)
+    spool_path = os.path.join(output_dir, f"merged.{os.getpid()}.tmp.fq")
+    output_fastq = os.path.join(output_dir, "merged.fq.gz")
+    zotu_fasta = os.path.join(output_dir, "unoise3_zotu.fa")
+    otu_table = os.path.join(output_dir, args.otu_table)
+    num_threads = resolve_threads(args.threads)
+
+    args.output = spool_path
+    try:
+        run_mode(args)
+        tee_unoise3(
+            spool_path,
+            output_fastq,
+            zotu_fasta,
+            min_size=args.minsize,
+            relabel_prefix=args.relabel_prefix,
+            num_threads=num_threads,
+        )
+        search_global_add_unknown(
+            spool_path,
+            zotu_fasta,
+            otu_table,
+            id_=args.id,
+            unknown_name=args.unknown_name,
+            num_threads=num_threads,
+        )
+    finally:
+        if os.path.exists(spool_path):
+            os.remove(spool_path)
+    if args.preview is not None:
+        print_preview_report(args.mode, summarize_trim(output_dir))
+        if otu_table.endswith(".tsv"):
+            print_preview_report("unoise3", summarize_zotus(otu_table))
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Amplicon workflows from raw FASTQ files."
+    )
+    subparsers = parser.add_subparsers(dest="subcommand", required=True)
+    run_parser = subparsers.add_parser(
+        "run",
+        help="Trim raw reads, cluster them into ZOTUs with UNOISE3 and count reads "
+        "per ZOTU, with a single pass over the trimmed reads",
+    )
+    add_trim_arguments(run_parser)
+    run_parser.add_argument(
+        "-o",
+        "--output_dir",
+        type=str,
+        required=True,
+        help="Output directory of the trimmed reads (merged.fq.gz), reports, ZOTUs "
+        "(unoise3_zotu.fa) and ZOTU table",
+    )
+    run_parser.add_argument(
+        "--minsize", type=int, default=8, help="Minimum cluster size of UNOISE3"
+    )
+    run_parser.add_argument(
+        "--relabel_prefix", type=str, default=None, help="Prefix for ZOTU labels"
+    )
+    run_parser.add_argument(
+        "--id", type=float, default=0.97, help="Minimum identity to a ZOTU"
+    )
+    run_parser.add_argument(
+        "--unknown_name",
+        type=str,
+        default="ZOTU_UNKNOWN",
+        help="Name of the row counting reads that match no ZOTU",
+    )
+    run_parser.add_argument(
+        "--otu_table",
+        type=str,
+        default="unoise3_zotu.biom",
+        help="File name of the ZOTU table in the output directory, ending with "
+        ".biom or .tsv",
+    )
+
+    args = parser.parse_args()
+    if args.subcommand == "run":
+        check_trim_arguments(run_parser, args)
+        if args.mode not in RUN_MODES:
+            run_parser.error(f"--mode must be one of {', '.join(RUN_MODES)}.")
+        if not args.otu_table.endswith((".biom", ".tsv")):
+            run_parser.error("--otu_table must end with .biom or .tsv.")
+        run(args)
+
+
+if __name__ == "__main__":
+    main()
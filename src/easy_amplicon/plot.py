@@ -29,6 +29,7 @@ from easy_amplicon.plot_tree import (
     get_taxon2color,
     plot_tree,
 )
+from easy_amplicon.utils_cpu import available_cpus
 
 
 def _get_dendrogram(df: pd.DataFrame, rows_to_ignore=None):
@@ -542,7 +543,7 @@ def _get_subplots(
 
 
 def _rarefying(
-    df: pd.DataFrame, ref: list[int], repeat_num: int = 20
+    df: pd.DataFrame, ref: list[int], repeat_num: int = 20, n_jobs: int | None = None
 ) -> list[pd.DataFrame | list]:
     """Rarefy the dataframe to the reference list or integer.
 
@@ -552,7 +553,8 @@ def _rarefying(
     `repeat_num` times, resulting in a dataframe with shape (sample x features x
     repeat_num), except for samples whose reference is themselves, which will be
     repeated only once. Sample name in the returned output will be like
-    <original_sample_name>_rarefied_<repeat_num>.
+    <original_sample_name>_rarefied_<repeat_num>. Samples are rarefied by `n_jobs`
+    processes, defaults to the number of available CPUs.
     """
     # make sure all columns in df are positive integers and are in ref.
     if not len(ref) == len(df):
@@ -561,7 +563,7 @@ def _rarefying(
         )
 
     # get a list of 2d numpy array using joblib parallisim
-    res = Parallel(n_jobs=4)(
+    res = Parallel(n_jobs=n_jobs or available_cpus())(
         delayed(rarefy_array)(df.iloc[idx].to_numpy(), n, repeat_num)
         for idx, n in enumerate(ref)
     )
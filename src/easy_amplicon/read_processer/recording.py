@@ -1,8 +1,6 @@
 import argparse
 import os
 import subprocess
-import gzip
-import shutil
 from glob import glob
 from collections import Counter
 import tempfile
@@ -10,8 +8,6 @@ import sys
 from contextlib import contextmanager
 
 import pandas as pd
-from Bio import Seq, SeqIO
-from Bio.SeqRecord import SeqRecord
 from umi_tools import UMIClusterer
 from tqdm.auto import tqdm
 from rich import print as rprint
@@ -26,7 +22,18 @@ from easy_amplicon.trim import (
     RECORDING_PRIMER_5,
     get_min_overlap,
 )
-from easy_amplicon.utils import print_command, smart_open, find_paired_end_files
+from easy_amplicon.utils import (
+    smart_open,
+    find_paired_end_files,
+    parse_fastx,
+    write_fastx,
+)
+from easy_amplicon.utils_files import copy_file, move_file
+from easy_amplicon.utils_gzip import DEFAULT_COMPRESS_LEVEL
+from easy_amplicon.utils_index import iter_records_by_id
+from easy_amplicon.utils_stats import fastx_stats
+from easy_amplicon.utils_cpu import add_threads_argument
+from easy_amplicon.utils_run import run_command
 from easy_amplicon.read_processer.map_utils import map_se
 
 
@@ -88,9 +95,14 @@ def fastp_merge(sample: str, read1: str, read2: str, output_dir: str, cpus: int)
         f"{output_dir}/log/{sample}.merge.json",
     ]
 
-    with open(f"{output_dir}/log/{sample}.merge.err", "w") as err_file:
-        print_command(merge_cmd)
-        subprocess.run(merge_cmd, stderr=err_file)
+    output_options = ["--merged_out", "--unpaired1", "--unpaired2", "--out1", "--out2"]
+    output_options += ["--failed_out", "--html", "--json"]
+    run_command(
+        merge_cmd,
+        [read1, read2],
+        [merge_cmd[merge_cmd.index(option) + 1] for option in output_options],
+        stderr=f"{output_dir}/log/{sample}.merge.err",
+    )
 
 
 def run_cutadapt(
@@ -119,6 +131,9 @@ def run_cutadapt(
         if adapter_3 is not None:
             cmd.extend(["-a", adapter_3])
 
+    outputs = [output_file]
+    if isinstance(untrimmed_output, str):
+        outputs.append(untrimmed_output)
     if rc:
         seqkit_cmd_1 = [
             "seqkit",
@@ -160,34 +175,12 @@ def run_cutadapt(
             output_file,
         ]
 
-        if log_file is not None:
-            with open(log_file, "w") as log:
-                print_command(seqkit_cmd_1)
-                p1 = subprocess.Popen(seqkit_cmd_1, stdout=subprocess.PIPE)
-                print_command(cutadapt_cmd)
-                p2 = subprocess.Popen(
-                    cutadapt_cmd,
-                    stdin=p1.stdout,
-                    stdout=subprocess.PIPE,
-                    stderr=log,
-                )
-                print_command(seqkit_cmd_2)
-                p3 = subprocess.Popen(
-                    seqkit_cmd_2, stdin=p2.stdout, stdout=subprocess.PIPE
-                )
-                _, _ = p3.communicate()
-        else:
-            print_command(seqkit_cmd_1)
-            p1 = subprocess.Popen(seqkit_cmd_1, stdout=subprocess.PIPE)
-            print_command(cutadapt_cmd)
-            p2 = subprocess.Popen(
-                cutadapt_cmd,
-                stdin=p1.stdout,
-                stdout=subprocess.PIPE,
-            )
-            print_command(seqkit_cmd_2)
-            p3 = subprocess.Popen(seqkit_cmd_2, stdin=p2.stdout, stdout=subprocess.PIPE)
-            _, _ = p3.communicate()
+        run_command(
+            [seqkit_cmd_1, cutadapt_cmd, seqkit_cmd_2],
+            [input_file],
+            outputs,
+            stderr=log_file,
+        )
 
     else:
         cutadapt_cmd = [
@@ -210,13 +203,7 @@ def run_cutadapt(
             cutadapt_cmd.extend(["--minimum-length", str(min_length)])
         cutadapt_cmd.append(input_file)
 
-        if log_file is not None:
-            with open(log_file, "w") as log:
-                print_command(cutadapt_cmd)
-                _ = subprocess.run(cutadapt_cmd, stdout=log)
-        else:
-            print_command(cutadapt_cmd)
-            _ = subprocess.run(cutadapt_cmd)
+        run_command(cutadapt_cmd, [input_file], outputs, stdout=log_file)
 
 
 def cutadapt_fix_1(
@@ -291,19 +278,12 @@ def cutadapt_fix_1(
         "-o",
         output1,
     ]
-    with open(log_file, "w") as log:
-        print_command(seqkit_cmd_1)
-        p1 = subprocess.Popen(seqkit_cmd_1, stdout=subprocess.PIPE)
-        print_command(cutadapt_cmd)
-        p2 = subprocess.Popen(
-            cutadapt_cmd,
-            stdin=p1.stdout,
-            stdout=subprocess.PIPE,
-            stderr=log,
-        )
-        print_command(seqkit_cmd_2)
-        p3 = subprocess.Popen(seqkit_cmd_2, stdin=p2.stdout, stdout=subprocess.PIPE)
-        p3.communicate()
+    run_command(
+        [seqkit_cmd_1, cutadapt_cmd, seqkit_cmd_2],
+        [input1, input2],
+        [output1, output2],
+        stderr=log_file,
+    )
 
 
 def cutadapt_fix_2(
@@ -342,35 +322,22 @@ def cutadapt_fix_2(
     if min_length is not None:
         cutadapt_cmd.extend(["--minimum-length", str(min_length)])
     cutadapt_cmd.extend([input1, input2])
-    if log_file is not None:
-        with open(log_file, "w") as log:
-            print_command(cutadapt_cmd)
-            subprocess.run(cutadapt_cmd, stdout=log)
-    else:
-        print_command(cutadapt_cmd)
-        subprocess.run(cutadapt_cmd)
+    run_command(cutadapt_cmd, [input1, input2], [output1, output2], stdout=log_file)
 
 
-def stitch_reads(read1: str, read2: str, output: str):
+def stitch_reads(read1: str, read2: str, output: str, compresslevel: int | str = 1):
     os.makedirs(os.path.dirname(output), exist_ok=True)
-    r1 = smart_open(read1)
-    r2 = smart_open(read2)
-    out = smart_open(output, "w")
-    for r1_record, r2_record in zip(SeqIO.parse(r1, "fastq"), SeqIO.parse(r2, "fastq")):
-        r1_seq = r1_record.seq
-        r2_seq = get_rc(r2_record.seq)
-        r1_qual = r1_record.letter_annotations["phred_quality"]
-        r2_qual = r2_record.letter_annotations["phred_quality"][::-1]
-        record = SeqRecord(
-            Seq.Seq(r1_seq + r2_seq),
-            id=r1_record.id,
-            description=r1_record.description,
+    r1 = parse_fastx(read1, "fastq", full_title=True)
+    r2 = parse_fastx(read2, "fastq")
+    # stitched reads are an intermediate, favor speed over size by default
+    with smart_open(output, "w", compresslevel=compresslevel) as out:
+        write_fastx(
+            out,
+            (
+                (title, r1_seq + get_rc(r2_seq), r1_qual + r2_qual[::-1])
+                for (title, r1_seq, r1_qual), (_, r2_seq, r2_qual) in zip(r1, r2)
+            ),
         )
-        record.letter_annotations["phred_quality"] = r1_qual + r2_qual
-        SeqIO.write(record, out, "fastq")
-    r1.close()
-    r2.close()
-    out.close()
 
 
 def cutadapt_remove_nonedited(
@@ -397,12 +364,7 @@ def cutadapt_remove_nonedited(
         read1,
         read2,
     ]
-    print_command(cutadapt_cmd)
-    if log_file is not None:
-        with open(log_file, "w") as log:
-            subprocess.run(cutadapt_cmd, stdout=log)
-    else:
-        subprocess.run(cutadapt_cmd)
+    run_command(cutadapt_cmd, [read1, read2], [output1, output2], stdout=log_file)
 
 
 def makedirs(*directories):
@@ -593,18 +555,8 @@ def process_one_sample(
                 "-o",
                 output_spacer_rest_temp,
             ]
-            print_command(args_seq)
-            prog_seq = subprocess.Popen(
-                args_seq, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
-            )
-            print_command(args_grep)
-            prog_grep = subprocess.Popen(
-                args_grep,
-                stdin=prog_seq.stdout,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.DEVNULL,
-            )
-            prog_grep.communicate()
+            # the output replaces an input, which leaves nothing to cache
+            run_command([args_seq, args_grep], stderr=subprocess.DEVNULL)
             # args = [
             #     "seqkit",
             #     "common",
@@ -615,7 +567,7 @@ def process_one_sample(
             # ]
             # print_command(args)
             # subprocess.run(args)
-            shutil.move(output_spacer_rest_temp, output_spacer_rest)
+            move_file(output_spacer_rest_temp, output_spacer_rest)
 
         if all_sequences_empty(output_spacer_rest):
             break
@@ -638,13 +590,11 @@ def process_one_sample(
         output_spacer = f"{output_dir}/spacer{k}/spacer_concat/{sample}.fq.gz"
         os.makedirs(os.path.dirname(output_spacer), exist_ok=True)
         if k == 1:
-            shutil.copy(spacer_files[0], output_spacer)
+            copy_file(spacer_files[0], output_spacer)
         else:
             seqkit_log = f"{output_dir}/spacer{k}/log/{sample}.concat.err"
             seqkit_cmd = ["seqkit", "concat"] + spacer_files + ["-o", output_spacer]
-            print_command(seqkit_cmd)
-            with open(seqkit_log, "w") as log:
-                subprocess.run(seqkit_cmd, stderr=log)
+            run_command(seqkit_cmd, spacer_files, [output_spacer], stderr=seqkit_log)
 
         # run mmseqs2 to cluster concatenated spacer right after like this:
         mmseqs2_prefix = f"{output_dir}/spacer{k}/mmseqs2_clust/{sample}"
@@ -666,17 +616,24 @@ def process_one_sample(
                 "1",
                 "--remove-tmp-files",
             ]
-            print_command(mmseqs_cmd)
-            with open(mmseqs2_log, "w") as log, open(mmseqs2_out, "w") as out:
-                subprocess.run(mmseqs_cmd, stderr=log, stdout=out)
+            run_command(
+                mmseqs_cmd,
+                [output_spacer],
+                [
+                    f"{mmseqs2_prefix}_{suffix}"
+                    for suffix in ["cluster.tsv", "rep_seq.fasta", "all_seqs.fasta"]
+                ],
+                stdout=mmseqs2_out,
+                stderr=mmseqs2_log,
+                ignore=[temp_dir],
+            )
 
 
 def all_sequences_empty(fastq_file: str) -> bool:
     """Check if all sequences in a FASTQ file are empty, or if the file itself is empty."""
-    with gzip.open(fastq_file, "rt") as handle:
-        for record in SeqIO.parse(handle, "fastq"):
-            if len(record.seq) > 0:
-                return False
+    for _, seq, _ in parse_fastx(fastq_file, "fastq", as_bytes=True):
+        if seq:
+            return False
     return True
 
 
@@ -709,11 +666,9 @@ def collect_spacer_info(
     spacers = []
     spacer_idx = -1
     # first add 5' umi and 3' umi
-    with gzip.open(umi5_path, "rt") as f:
-        seq2umi5 = {record.id: str(record.seq) for record in SeqIO.parse(f, "fastq")}
+    seq2umi5 = {name: seq for name, seq, _ in parse_fastx(umi5_path, "fastq")}
     umi5_df = pd.Series(seq2umi5, name="umi_5").to_frame()
-    with gzip.open(umi3_path, "rt") as f:
-        seq2umi3 = {record.id: str(record.seq) for record in SeqIO.parse(f, "fastq")}
+    seq2umi3 = {name: seq for name, seq, _ in parse_fastx(umi3_path, "fastq")}
     umi3_df = pd.Series(seq2umi3, name="umi_3").to_frame()
     df_data = pd.merge(
         umi5_df, umi3_df, how="outer", left_index=True, right_index=True
@@ -734,25 +689,21 @@ def collect_spacer_info(
         clust_path = os.path.join(spacer_dir, "mmseqs2_clust", f"{sample}_cluster.tsv")
         if not os.path.exists(spacer_path):
             continue
-        with gzip.open(spacer_path, "rt") as f:
-            for idx, record in enumerate(SeqIO.parse(f, "fastq")):
-                seq = str(record.seq)
-                qual = record.letter_annotations["phred_quality"]
-                if not seq:  # skip empty sequences
-                    continue
-                if seq not in spacers_set:
-                    spacers.append(seq)
-                    spacers_set.add(seq)
-                    spacer_idx += 1
-                try:
-                    seqs[record.id]["num_spacers"] = spacer_order
-                    seqs[record.id]["spacer_idxs"].append(spacer_idx)
-                    seqs[record.id]["spacer_lens"].append(len(seq))
-                    seqs[record.id]["spacer_qual"] += sum(qual)
-                except KeyError:
-                    print(
-                        f"Spacer {spacer_order} of read {record.id} not found in UMI files."
-                    )
+        for name, seq, qual in parse_fastx(spacer_path, "fastq"):
+            if not seq:  # skip empty sequences
+                continue
+            if seq not in spacers_set:
+                spacers.append(seq)
+                spacers_set.add(seq)
+                spacer_idx += 1
+            try:
+                seqs[name]["num_spacers"] = spacer_order
+                seqs[name]["spacer_idxs"].append(spacer_idx)
+                seqs[name]["spacer_lens"].append(len(seq))
+                # sum of Phred scores from the raw Phred+33 quality string
+                seqs[name]["spacer_qual"] += sum(qual.encode()) - 33 * len(qual)
+            except KeyError:
+                print(f"Spacer {spacer_order} of read {name} not found in UMI files.")
         if os.path.exists(clust_path):
             dfs_clust.append(pd.read_table(clust_path, names=["centroid", "seq"]))
     df_data = pd.concat([df_data, pd.DataFrame(seqs).transpose()], axis=1)
@@ -817,6 +768,7 @@ def collect_spacers(
     data_dir: str,
     output_path: str,
     sample: str,
+    compresslevel: int | str = DEFAULT_COMPRESS_LEVEL,
 ) -> None:
     spacer_orders = [int(i[-1]) for i in glob(os.path.join(data_dir, "spacer*"))]
     # output_path = os.path.join(data_dir, "collect_spacers", "spacer", f"{sample}.fq.gz")
@@ -837,73 +789,37 @@ def collect_spacers(
     #         raise ValueError(f"Unknown collapse mode: {collapse_mode}")
 
     good_reads = set(df_data.index)
+    sizes = df_data["size"].to_dict()
 
-    with gzip.open(output_path, "wt") as f_out:
+    with smart_open(output_path, "w", compresslevel=compresslevel) as f_out:
         for spacer_order in sorted(spacer_orders):
             spacer_path = os.path.join(
                 data_dir, f"spacer{spacer_order}", "spacer", f"{sample}.fq.gz"
             )
             if not os.path.exists(spacer_path):
                 continue
-            with gzip.open(spacer_path, "rt") as f_in:
-                for record in SeqIO.parse(f_in, "fastq"):
-                    if record.id in good_reads:
-                        size = df_data.loc[record.id, "size"]
-                        # add order to the read name as another :<order>
-                        record.id = f"{record.id};order={spacer_order};size={size}"
-                        SeqIO.write(record, f_out, "fastq")
+            # indexed lookup for plain and BGZF files, a single scan otherwise
+            for record in iter_records_by_id(spacer_path, good_reads):
+                title, seq, _, qual = record.decode().splitlines()[:4]
+                read_id = title[1:].split(maxsplit=1)[0]
+                # add order to the read name as another :<order>, keeping the
+                # original title as description like SeqIO.write does
+                new_id = f"{read_id};order={spacer_order};size={sizes[read_id]}"
+                f_out.write(f"@{new_id} {title[1:]}\n{seq}\n+\n{qual}\n")
 
 
 def get_fastq_length(file_path: str) -> int:
     """
-    Calculate the number of sequences in a gzipped FASTQ file.
+    Calculate the number of sequences in a (gzipped) FASTQ or FASTA file.
 
     Args:
-        file_path (str): Path to the gzipped FASTQ file.
+        file_path (str): Path to the FASTQ or FASTA file.
 
     Returns:
-        int: Number of sequences in the gzipped FASTQ file.
+        int: Number of sequences in the file.
     """
-    # Return 0 if file is empty
-    # if os.path.getsize(file_path) == 0:
-    #     return 0
-
-    # Use subprocess to count the number of lines in the gzipped file
-    if file_path.endswith(".fa.gz") or file_path.endswith(".fasta.gz"):
-        prog = "zcat"
-        factor = 2
-    elif file_path.endswith(".fq.gz") or file_path.endswith(".fastq.gz"):
-        prog = "zcat"
-        factor = 4
-    elif (
-        file_path.endswith(".fa")
-        or file_path.endswith(".fasta")
-        or file_path.endswith(".fna")
-    ):
-        prog = "cat"
-        factor = 2
-    elif file_path.endswith(".fq") or file_path.endswith(".fastq"):
-        prog = "cat"
-        factor = 4
-    else:
-        raise ValueError(f"Unknown file extension: {file_path}")
-
-    result = subprocess.run(
-        # [prog, file_path, "|", "wc", "-l"],
-        f"{prog} {file_path} | wc -l",
-        capture_output=True,
-        text=True,
-        shell=True,
-        check=True,
-    )
-
-    if result.returncode != 0:
-        raise RuntimeError(f"Error counting lines in file: {result.stderr}")
-
-    # Each sequence in a FASTQ file spans four lines
-    num_lines = int(result.stdout.strip())
-    num_sequences = num_lines // factor
-    return num_sequences
+    # counted in process and cached next to the file, see `easy_amplicon.utils_stats`
+    return fastx_stats(file_path)["num_seqs"]
 
 
 # if __name__ == "__main__":
@@ -933,6 +849,7 @@ def main():
         help="Path to the reference genome file",
     )
     parser.add_argument("--quiet", action="store_true", help="Suppress output")
+    add_threads_argument(parser)
 
     args = parser.parse_args()
 
@@ -952,8 +869,6 @@ def main():
     for i, (read1, read2, sample) in enumerate(bar):
         if "Undetermined" in sample:
             continue
-        # if i < 66:
-        #     continue
         bar.set_description(sample)
         # ==================================
         rprint(f"[bold green]Extracting spacers from reads of {sample}..[/bold green]")
@@ -965,7 +880,7 @@ def main():
                 read1=read1,
                 read2=read2,
                 output_dir=output_dir,
-                cpus=4,
+                cpus=args.threads,
             )
 
         # # ==================================
@@ -1,14 +1,60 @@
 #!/usr/bin/env python
 
-import glob
+import itertools
 import os
+import re
 import shutil
 import subprocess
 import argparse
+import zlib
+from typing import IO, Iterator
 
+import pandas as pd
 from Bio.Seq import Seq
 
-from easy_amplicon.utils import cat_fastq, cat_fastq_se, smart_open, print_command
+from easy_amplicon.utils import (
+    FASTQ_BLOCK_SIZE,
+    _format_read_indices,
+    _iter_fastq_blocks,
+    _iter_fastq_chunks,
+    _iter_sample_chunks,
+    cat_fastq,
+    cat_fastq_se,
+    find_paired_end_files,
+    smart_open,
+    print_command,
+    write_read_stats,
+)
+from easy_amplicon.utils_cpu import (
+    add_threads_argument,
+    available_cpus,
+    resolve_threads,
+    split_threads,
+)
+from easy_amplicon.utils_demux import (
+    DEFAULT_BARCODE_LAYOUT,
+    BarcodeLayout,
+    demultiplex_pairs,
+)
+from easy_amplicon.utils_fanout import (
+    ShardedTool,
+    get_renamed_key,
+    get_sample_sizes,
+    run_sample_pool,
+)
+from easy_amplicon.utils_files import move_file, move_files, rename_files
+from easy_amplicon.utils_gzip import DEFAULT_COMPRESS_LEVEL
+from easy_amplicon.utils_index import write_bgzf_fastq
+from easy_amplicon.utils_pipe import PipeFeeder
+from easy_amplicon.utils_preview import (
+    _iter_preview_chunks,
+    print_preview_report,
+    summarize_trim,
+)
+from easy_amplicon.utils_primer import PrimerTrimmer, parse_linked_adapter
+from easy_amplicon.utils_reads import READS_EXTENSION, is_reads_file, write_reads
+from easy_amplicon.utils_run import run_command
+from easy_amplicon.utils_shards import write_fastq_shards
 
 
 def get_rc(seq: str) -> str:
@@ -35,6 +81,10 @@ ECREC_DR = "GTGTTCCCCGCGCCAGCGGGGATAAACC"
 ECREC_LEADER = "CTGGCTTAAAAAATCATTAATTAATAATAGGTTATGTTTAGA"
 RECORDING_PRIMER_3 = "AGATCGGAAGAGCACACGTCTGA"
 RECORDING_PRIMER_5 = "CCTACACGACGCTCTTCCGATCT"
+# FASTQ files written by BCL Convert, see `merge`.
+_BCL_CONVERT_PATTERN = re.compile(
+    r"^(?P<sample>[^_]+)(_.*)?_L001_R(?P<read>[12])_001\.f(ast)?q(\.gz)?$"
+)
 
 
 def run_trim_galore(input_dir, output_dir, pair):
@@ -55,7 +105,12 @@ def run_trim_galore(input_dir, output_dir, pair):
     return subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 
 
-def run_trimmomatic(input_fastq_1: str, input_fastq_2: str, output_dir: str) -> None:
+def run_trimmomatic(
+    input_fastq_1: str,
+    input_fastq_2: str,
+    output_dir: str,
+    threads: int | str | None = "auto",
+) -> None:
     """Run trimmomatic on the given pair of files using subprocess, following this example:
     trimmomatic-0.30.jar PE s_1_1_sequence.txt.gz s_1_2_sequence.txt.gz
     lane1_forward_paired.fq.gz lane1_forward_unpaired.fq.gz lane1_reverse_paired.fq.gz
@@ -73,12 +128,12 @@ def run_trimmomatic(input_fastq_1: str, input_fastq_2: str, output_dir: str) ->
     output_trim_log = os.path.join(output_dir, "trimmomatic.log")
     output_summary = os.path.join(output_dir, "trimmomatic.summary")
     os.makedirs(output_dir, exist_ok=True)
-    subprocess.run(
+    run_command(
         [
             "trimmomatic",
             "PE",
             "-threads",
-            "8",
+            str(resolve_threads(threads)),
             "-trimlog",
             output_trim_log,
             "-summary",
@@ -94,12 +149,24 @@ def run_trimmomatic(input_fastq_1: str, input_fastq_2: str, output_dir: str) ->
             "TRAILING:3",
             "SLIDINGWINDOW:4:15",
             "MINLEN:36",
-        ]
+        ],
+        [input_fastq_1, input_fastq_2],
+        [
+            output_fastq_1,
+            output_fastq_1_unpaired,
+            output_fastq_2,
+            output_fastq_2_unpaired,
+            output_summary,
+        ],
     )
 
 
 def run_fastp(
-    input_fastq_1: str, input_fastq_2: str, output_dir: str, stdout: bool = False
+    input_fastq_1: str,
+    input_fastq_2: str,
+    output_dir: str,
+    stdout: bool = False,
+    threads: int | str | None = "auto",
 ) -> subprocess.Popen[bytes]:
     output_fastq_1 = os.path.join(output_dir, os.path.basename(input_fastq_1))
     output_fastq_2 = os.path.join(output_dir, os.path.basename(input_fastq_2))
@@ -144,7 +211,7 @@ def run_fastp(
             "--json",
             report_out,
             "-w",
-            "8",
+            str(resolve_threads(threads)),
         ]
         + (
             [
@@ -166,6 +233,7 @@ def run_fastp_cutadapt(
     input_fastq_2: str,
     output_dir: str,
     amplicon_type: str = "ITS",
+    threads: int | str | None = "auto",
 ):
     """Quality trimming and filtering by fastp, then adapter trimming by cutadapt.
     For read 1, trim RC of i7 adapter from the 3' end; For read 2, trim RC of i5 adapter
@@ -178,10 +246,16 @@ def run_fastp_cutadapt(
     if amplicon_type not in ["ITS", "16S"]:
         raise ValueError("amplicon_type must be either ITS or 16S.")
 
-    fastp_proc = run_fastp(input_fastq_1, input_fastq_2, output_dir, stdout=True)
+    # fastp and cutadapt run side by side
+    fastp_threads, cutadapt_threads = split_threads(resolve_threads(threads), [1, 1])
+    fastp_proc = run_fastp(
+        input_fastq_1, input_fastq_2, output_dir, stdout=True, threads=fastp_threads
+    )
     _ = subprocess.run(
         [
             "cutadapt",
+            "--cores",
+            str(cutadapt_threads),
             "-a",
             get_rc(PRIMER_ITS_7 if amplicon_type == "ITS" else PRIMER_16S_7),
             "-A",
@@ -200,7 +274,19 @@ def run_fastp_cutadapt(
     fastp_proc.wait()
 
 
-def simple_preprocess(fastq_dir: str, output_fastq: str) -> None:
+# fastp worker threads per process of `simple_preprocess` with `per_sample`, which
+# runs as many processes as this leaves room for.
+FASTP_SAMPLE_THREADS = 2
+
+
+def simple_preprocess(
+    fastq_dir: str,
+    output_fastq: str,
+    num_shards: int = 1,
+    threads: int | str | None = "auto",
+    preview: int | None = None,
+    per_sample: bool = False,
+) -> None:
     """Given a directory of fastq files, perform renaming, quality trimming, adapter
     trimming and length filtering using just python and fastp. fastp takes interleaved
     input from stdin, to which we write the renamed and interleaved paired-end reads.
@@ -210,76 +296,165 @@ def simple_preprocess(fastq_dir: str, output_fastq: str) -> None:
         analysis, which is more versatile and robust.
     - fastp can also merge pairs, but we don't do it here but with the following ZOTU
         pipeline, just to be more coherent.
+    - With `num_shards` > 1, samples are split among that many fastp processes (see
+        `ShardedTool`), whose JSON reports are summed. They share `threads`.
+    - With `preview`, only a sample of that many read pairs of each sample is
+        processed (see `easy_amplicon.utils_preview`).
+    - With `per_sample`, each sample goes through its own fastp process instead, on
+        a pool of processes sharing `threads` (see `run_sample_pool`), and QC metrics
+        of each sample are written to `<output_dir>/fastp/sample_report.tsv` (see
+        `fastp_sample_report`). HTML reports are kept per sample.
     """
     output_dir = os.path.dirname(output_fastq)
     os.makedirs(output_dir, exist_ok=True)
     os.makedirs(os.path.join(output_dir, "fastp"), exist_ok=True)
-    fastp_proc = subprocess.Popen(
-        [
-            "fastp",
-            # "-i",
-            # os.path.join(fastq_dir, "*_R1_001.fastq.gz"),
-            # "-I",
-            # os.path.join(fastq_dir, "*_R2_001.fastq.gz"),
-            "--stdin",
-            "--interleaved_in",
-            output_fastq,
-            "-w",  # number of threads
-            "8",
-            # don't trim, so that amplicons have uniform length, as suggested by Edgar
-            "--length_required",
-            "200",
-            # if you don't want to merge, modify the following arguments
-            # for the meaning of each of the following arguments, see fastp github README
-            "--merge",
-            "--merged_out",
-            output_fastq,
-            "--unpaired1",
-            os.path.join(output_dir, "fastp", "unpaired_R1.fastq.gz"),
-            "--unpaired2",
-            os.path.join(output_dir, "fastp", "unpaired_R2.fastq.gz"),
-            "--failed_out",
-            os.path.join(output_dir, "fastp", "failed.fastq.gz"),
-            "--out1",
-            os.path.join(output_dir, "fastp", "unmerged_R1.fastq.gz"),
-            "--out2",
-            os.path.join(output_dir, "fastp", "unmerged_R2.fastq.gz"),
-            "--html",  # report
-            os.path.join(output_dir, "fastp", "report.html"),
-            "--json",
-            os.path.join(output_dir, "fastp", "report.json"),
-        ],
-        stdin=subprocess.PIPE,
-        # stdout=subprocess.PIPE,
+    outputs = [output_fastq] + [
+        os.path.join(output_dir, "fastp", name)
+        for name in [
+            "unpaired_R1.fastq.gz",
+            "unpaired_R2.fastq.gz",
+            "failed.fastq.gz",
+            "unmerged_R1.fastq.gz",
+            "unmerged_R2.fastq.gz",
+            "report.html",
+            "report.json",
+        ]
+    ]
+    threads = resolve_threads(threads)
+    stats_path = os.path.join(output_dir, "read_stats.tsv")
+    proc_args = [
+        "fastp",
+        # "-i",
+        # os.path.join(fastq_dir, "*_R1_001.fastq.gz"),
+        # "-I",
+        # os.path.join(fastq_dir, "*_R2_001.fastq.gz"),
+        "--stdin",
+        "--interleaved_in",
+        output_fastq,
+        "-w",  # number of threads
+        str(max(threads // num_shards, 1)),
+        # don't trim, so that amplicons have uniform length, as suggested by Edgar
+        "--length_required",
+        "200",
+        # if you don't want to merge, modify the following arguments
+        # for the meaning of each of the following arguments, see fastp github README
+        "--merge",
+        "--merged_out",
+        output_fastq,
+        "--unpaired1",
+        os.path.join(output_dir, "fastp", "unpaired_R1.fastq.gz"),
+        "--unpaired2",
+        os.path.join(output_dir, "fastp", "unpaired_R2.fastq.gz"),
+        "--failed_out",
+        os.path.join(output_dir, "fastp", "failed.fastq.gz"),
+        "--out1",
+        os.path.join(output_dir, "fastp", "unmerged_R1.fastq.gz"),
+        "--out2",
+        os.path.join(output_dir, "fastp", "unmerged_R2.fastq.gz"),
+        "--html",  # report
+        os.path.join(output_dir, "fastp", "report.html"),
+        "--json",
+        os.path.join(output_dir, "fastp", "report.json"),
+    ]
+    if per_sample:
+        tasks = [
+            ((r1_path, r2_path), sample_name, False, True)
+            for r1_path, r2_path, sample_name in find_paired_end_files(fastq_dir)
+            if sample_name != "Undetermined"
+        ]
+        iter_chunks = _iter_sample_chunks
+        if preview is not None:
+            tasks = [(*task, preview) for task in tasks]
+            iter_chunks = _iter_preview_chunks
+        num_procs = max(min(len(tasks), threads // FASTP_SAMPLE_THREADS), 1)
+        proc_args[proc_args.index("-w") + 1] = str(max(threads // num_procs, 1))
+        sample_stats = {}
+        reports = run_sample_pool(
+            proc_args, outputs, tasks, num_procs, sample_stats, iter_chunks
+        )
+        write_read_stats(sample_stats, stats_path)
+        report_json = os.path.join(output_dir, "fastp", "report.json")
+        fastp_sample_report(reports[report_json]).to_csv(
+            os.path.join(output_dir, "fastp", "sample_report.tsv"), sep="\t"
+        )
+        return
+    fastp = ShardedTool(
+        proc_args, outputs, get_sample_sizes(fastq_dir), num_shards, quiet=False
     )
-    cat_fastq(fastq_dir, output_fp_r1=fastp_proc.stdin, output_fp_r2=fastp_proc.stdin)
-    fastp_proc.stdin.close()
-    fastp_proc.wait()
-
+    with fastp:
+        cat_fastq(
+            fastq_dir,
+            output_fp_r1=fastp,
+            output_fp_r2=fastp,
+            # per-sample depth of the input, collected while streaming
+            stats_path=stats_path,
+            preview=preview,
+        )
 
-def rename_files_with_mmv(file_dir: str, patterns_file: str) -> None:
-    # Step 1: Resolve absolute path of the patterns file
-    patterns_file_abs = os.path.abspath(patterns_file)
 
-    # Save the current working directory
-    original_dir = os.getcwd()
+def fastp_sample_report(reports: dict[str, dict]) -> pd.DataFrame:
+    """Gather QC metrics of each sample from the fastp JSON reports of samples.
 
-    # Step 2: Change to the temporary directory
-    os.chdir(file_dir)
+    Columns are the number of input reads (R1 and R2), of reads passing filters and
+    of those failing each filter, the fraction passing, Q30 rates before and after
+    filtering, the mean read length after filtering, the duplication rate and the
+    peak of the insert size.
+    """
+    rows = {}
+    for sample, report in reports.items():
+        before = report["summary"]["before_filtering"]
+        after = report["summary"]["after_filtering"]
+        result = report.get("filtering_result", {})
+        rows[sample] = {
+            "input_reads": before["total_reads"],
+            "passed_reads": result.get("passed_filter_reads"),
+            "low_quality_reads": result.get("low_quality_reads"),
+            "too_many_n_reads": result.get("too_many_N_reads"),
+            "too_short_reads": result.get("too_short_reads"),
+            "passed_fraction": round(
+                result.get("passed_filter_reads", 0) / max(before["total_reads"], 1), 4
+            ),
+            "q30_rate_before": before.get("q30_rate"),
+            "q30_rate_after": after.get("q30_rate"),
+            "mean_length_after": after.get("read1_mean_length"),
+            "duplication_rate": report.get("duplication", {}).get("rate"),
+            "insert_size_peak": report.get("insert_size", {}).get("peak"),
+        }
+    df = pd.DataFrame.from_dict(rows, orient="index")
+    df.index.name = "sample"
+    return df
 
-    # Step 3: Execute the mmv command
-    # with open(patterns_file_abs) as file:
-    #     subprocess.run(["mmv", "-d"], stdin=file)
-    with open(patterns_file_abs) as f:
-        for line in f:
-            line = line.strip()
-            if not line:
-                continue
-            old_name, new_name = line.split()
-            subprocess.run(["mv", old_name, new_name])
 
-    # Step 4: Change back to the original directory
-    os.chdir(original_dir)
+def rename_files_with_mmv(file_dir: str, patterns_file: str) -> None:
+    """Rename files in `file_dir` following `patterns_file`, which has one
+    whitespace-separated `old_name new_name` pair per line. Missing files are reported
+    and skipped, as `mv` would.
+    """
+    with open(patterns_file) as f:
+        pairs = [line.split() for line in f if line.strip()]
+    for old_name in rename_files(pairs, file_dir, missing_ok=True):
+        print(f"WARNING: cannot rename {old_name}, file does not exist.")
+
+
+# cutadapt options taking the path of an output file
+_CUTADAPT_OUTPUT_OPTIONS = {
+    "-o",
+    "-p",
+    "--untrimmed-output",
+    "--untrimmed-paired-output",
+    "--too-short-output",
+    "--too-short-paired-output",
+    "--json",
+}
+
+
+def get_cutadapt_outputs(proc_args: list[str]) -> list[str]:
+    """Return the paths of the output files of a cutadapt command."""
+    return [
+        proc_args[i + 1]
+        for i, arg in enumerate(proc_args[:-1])
+        if arg in _CUTADAPT_OUTPUT_OPTIONS
+    ]
 
 
 def get_min_overlap(adapter: str, frac: float = 0.8) -> int:
@@ -345,15 +520,34 @@ def get_primer_set(name: str) -> tuple[str, str | None] | dict[str, str] | str:
 
 def isolate_150_preprocess(
     fastq_dir: str,
-    barcode_fwd_fasta: str,
-    barcode_rev_fasta: str,
-    rename_pattern: str,
+    barcode_layout: str | BarcodeLayout,
     output_fastq: str,
     primer_set: str,
     first_k: int | None = None,
     min_length: int = 100,
     early_stop: bool = False,
+    num_workers: int | None = None,
+    keep_wells: bool = False,
+    num_shards: int = 1,
+    threads: int | str | None = "auto",
+    preview: int | None = None,
 ) -> None:
+    """Demultiplex isolate plates into wells by their inline barcodes (see
+    `easy_amplicon.utils_demux`) and trim primers with cutadapt.
+
+    Demultiplexed pairs are streamed into cutadapt as interleaved FASTQ, so wells are
+    never written to disk unless `keep_wells` is set, in which case per-well files are
+    also kept in `<output_dir>/demux` for debugging. Pairs without a well go to
+    `<output_dir>/demux_failed`. Read counts and barcode mismatches of each well are
+    written to `<output_dir>/demux_report.tsv`, read statistics to
+    `<output_dir>/read_stats.tsv`. With `num_shards` > 1, plates are split among that
+    many cutadapt processes (see `ShardedTool`).
+
+    Demultiplexing and trimming run side by side and share `threads`, unless the
+    number of demultiplexing workers is set with `num_workers`. With `preview`, only
+    a sample of that many read pairs of each plate is processed (see
+    `easy_amplicon.utils_preview`).
+    """
     output_dir, output_f = os.path.split(output_fastq)
     output_dir_demux = os.path.join(output_dir, "demux")
     output_dir_demux_fail = os.path.join(output_dir, "demux_failed")
@@ -361,64 +555,12 @@ def isolate_150_preprocess(
     output_fastq_r1 = "_R1.".join(output_f.split(".", 1))
     output_fastq_r2 = "_R2.".join(output_f.split(".", 1))
     os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(output_dir_demux, exist_ok=True)
     os.makedirs(output_dir_demux_fail, exist_ok=True)
     os.makedirs(output_dir_cutadapt, exist_ok=True)
+    demux_threads, cutadapt_threads = split_threads(resolve_threads(threads), [1, 1])
+    num_workers = num_workers or demux_threads
 
-    # demultiplex with cutadapt
-    proc_args = [
-        "cutadapt",
-        "-e",
-        "0.15",
-        "--no-indels",
-        "-g",
-        f"^file:{barcode_fwd_fasta}",
-        "-G",
-        f"^file:{barcode_rev_fasta}",
-        "-o",
-        os.path.join(output_dir_demux, "{name1}-{name2}_R1.fq.gz"),
-        "-p",
-        os.path.join(output_dir_demux, "{name1}-{name2}_R2.fq.gz"),
-        "--cores",
-        "1",
-        "--interleaved",
-        "-",
-    ]
-    print_command(proc_args)
-    cutadapt_demux_proc = subprocess.Popen(
-        proc_args,
-        stdin=subprocess.PIPE,
-        # silence cutadapt's output
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
-    cat_fastq(
-        fastq_dir,
-        output_fp_r1=cutadapt_demux_proc.stdin,
-        output_fp_r2=cutadapt_demux_proc.stdin,
-    )
-    cutadapt_demux_proc.stdin.close()
-    cutadapt_demux_proc.wait()
-    rename_files_with_mmv(output_dir_demux, rename_pattern)
-
-    # move all remaining files (whose name1 or name2 is "unknown") to output_dir/demux_failed
-    demux_failed_files = list(
-        set(
-            glob.glob(os.path.join(output_dir_demux, "*-unknown_R1.fq.gz"))
-            + glob.glob(os.path.join(output_dir_demux, "*-unknown_R2.fq.gz"))
-            + glob.glob(os.path.join(output_dir_demux, "unknown-*_R1.fq.gz"))
-            + glob.glob(os.path.join(output_dir_demux, "unknown-*_R2.fq.gz"))
-        )
-    )
-    subprocess.run(
-        [
-            "mv",
-            *demux_failed_files,
-            os.path.join(output_dir, "demux_failed"),
-        ]
-    )
-
-    # trim with cutadapt
+    # trim with cutadapt, reading interleaved pairs from stdin
     a, A = get_primer_set(primer_set)
     proc_args = (
         ["cutadapt", "-e", "0.15", "-a", a]
@@ -442,34 +584,41 @@ def isolate_150_preprocess(
             os.path.join(output_dir_cutadapt, "too_short_1.fq.gz"),
             "--too-short-paired-output",
             os.path.join(output_dir_cutadapt, "too_short_2.fq.gz"),
+            "--json",
+            os.path.join(output_dir_cutadapt, "report.json"),
             "--cores",
-            "4",
-            "--interleaved",
-            "-",
+            str(max(cutadapt_threads // num_shards, 1)),
         ]
     )
     if first_k is not None:
         proc_args.extend(["-l", str(first_k)])
+    proc_args.extend(["--interleaved", "-"])
     print_command(proc_args)
-    cutadapt_trim_proc = subprocess.Popen(
+    # reads are named `@sample=<plate>_<well> ...`, shards are balanced by plate
+    plate_sizes = get_sample_sizes(fastq_dir)
+    cutadapt = ShardedTool(
         proc_args,
-        stdin=subprocess.PIPE,
-        # silence cutadapt's output
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
+        get_cutadapt_outputs(proc_args),
+        plate_sizes,
+        num_shards,
+        key=get_renamed_key(plate_sizes, prefix=True),
     )
-    cat_fastq(
-        output_dir_demux,
-        output_fp_r1=cutadapt_trim_proc.stdin,
-        output_fp_r2=cutadapt_trim_proc.stdin,
-        _have_sample_name=True,
-    )
-    cutadapt_trim_proc.stdin.close()
-    cutadapt_trim_proc.wait()
+    # demultiplex straight into cutadapt
+    with cutadapt:
+        demultiplex_pairs(
+            fastq_dir,
+            output_dir_demux if keep_wells else None,
+            barcode_layout,
+            failed_dir=output_dir_demux_fail,
+            output_fp=cutadapt,
+            num_workers=num_workers,
+            report_path=os.path.join(output_dir, "demux_report.tsv"),
+            stats_path=os.path.join(output_dir, "read_stats.tsv"),
+            preview=preview,
+        )
 
-    # copy merged_1 to output_fastq
-    shutil.copy(os.path.join(output_dir_cutadapt, output_fastq_r1), output_fastq)
-    shutil.rmtree(output_dir_demux)
+    # move merged_1 to output_fastq, a rename unless they are on different file systems
+    move_file(os.path.join(output_dir_cutadapt, output_fastq_r1), output_fastq)
 
 
 def cutadapt_demux_se(fastq_path: str, output_dir: str, barcode_fastq: str):
@@ -494,13 +643,12 @@ def cutadapt_demux_se(fastq_path: str, output_dir: str, barcode_fastq: str):
         os.path.join(output_dir_demux, "{name}.fq.gz"),
     ]
     proc_args.append(fastq_path)
-    subprocess.run(proc_args)
-    subprocess.run(
-        [
-            "mv",
-            os.path.join(output_dir_demux, "unknown.fq.gz"),
-            os.path.join(output_dir, "demux_failed"),
-        ]
+    run_command(proc_args, [fastq_path])
+    move_files(
+        [os.path.join(output_dir_demux, "unknown.fq.gz")],
+        os.path.join(output_dir, "demux_failed"),
+        # like `mv`, do not fail when there is no unknown file
+        missing_ok=True,
     )
 
 
@@ -509,8 +657,17 @@ def cutadapt_demux_merge_trim_se(
     output_fastq: str,
     primer_set: str,
     barcode_fastq: str,
+    num_workers: int | None = None,
+    num_shards: int = 1,
+    threads: int | str | None = "auto",
+    preview: int | None = None,
 ) -> None:
-    """Demultiplex and merge single-end reads using cutadapt."""
+    """Demultiplex and merge single-end reads using cutadapt. With `num_shards` > 1,
+    barcodes are split among that many cutadapt processes for primer trimming (see
+    `ShardedTool`). Renaming (`num_workers` processes unless given) and trimming
+    share `threads`. With `preview`, only a sample of that many reads of each sample
+    of a directory is demultiplexed (see `easy_amplicon.utils_preview`).
+    """
     if not os.path.isfile(barcode_fastq):
         raise ValueError(f"{barcode_fastq} does not exist.")
     output_dir, output_f = os.path.split(output_fastq)
@@ -521,6 +678,10 @@ def cutadapt_demux_merge_trim_se(
     os.makedirs(output_dir_demux, exist_ok=True)
     os.makedirs(output_dir_demux_fail, exist_ok=True)
     os.makedirs(output_dir_cutadapt, exist_ok=True)
+    threads = resolve_threads(threads)
+    # renaming and trimming run side by side
+    rename_threads, cutadapt_threads = split_threads(threads, [1, 2])
+    num_workers = num_workers or rename_threads
 
     # demultiplex with cutadapt
     proc_args = [
@@ -532,6 +693,8 @@ def cutadapt_demux_merge_trim_se(
         f"^file:{barcode_fastq}",
         "-o",
         os.path.join(output_dir_demux, "{name}.fq.gz"),
+        "--cores",
+        str(threads),
     ]
     if os.path.isdir(fastq_path):
         proc_args.append("-")
@@ -542,65 +705,83 @@ def cutadapt_demux_merge_trim_se(
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
         )
-        cat_fastq_se(
-            fastq_path,
-            output_fp=cutadapt_demux_proc.stdin,
-        )
-        cutadapt_demux_proc.stdin.close()
+        with PipeFeeder(cutadapt_demux_proc.stdin, verbose=True) as feeder:
+            cat_fastq_se(
+                fastq_path,
+                output_fp=feeder,
+                preview=preview,
+            )
         cutadapt_demux_proc.wait()
     else:
-        print_command(proc_args)
         proc_args.append(fastq_path)
-        subprocess.run(proc_args)
+        # the demultiplexed files are removed once merged, nothing to cache
+        run_command(proc_args, [fastq_path])
 
     # no need for renaming
     # rename_files_with_mmv(output_dir_demux, rename_pattern)
 
-    subprocess.run(
-        [
-            "mv",
-            os.path.join(output_dir_demux, "unknown.fq.gz"),
-            os.path.join(output_dir, "demux_failed"),
-        ]
+    move_files(
+        [os.path.join(output_dir_demux, "unknown.fq.gz")],
+        os.path.join(output_dir, "demux_failed"),
+        # like `mv`, do not fail when there is no unknown file
+        missing_ok=True,
     )
 
     a, _ = get_primer_set(primer_set)
-    cutadapt_trim_proc = subprocess.Popen(
-        [
-            "cutadapt",
-            # "-a" if "..." in a else "-g",
-            "-g",
-            a,
-            "-o",
-            output_fastq,
-            "--untrimmed-output",
-            os.path.join(output_dir_cutadapt, "untrimmed.fq.gz"),
-            # "--too-short-output",
-            # os.path.join(output_dir_cutadapt, "too_short.fq.gz"),
-            "--cores",
-            "8",
-            "-",
-        ],
-        stdin=subprocess.PIPE,
-        # silence cutadapt's output
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
-    cat_fastq_se(
-        output_dir_demux,
-        output_fp=cutadapt_trim_proc.stdin,
-        _have_sample_name=True,
+    proc_args = [
+        "cutadapt",
+        # "-a" if "..." in a else "-g",
+        "-g",
+        a,
+        "-o",
+        output_fastq,
+        "--untrimmed-output",
+        os.path.join(output_dir_cutadapt, "untrimmed.fq.gz"),
+        # "--too-short-output",
+        # os.path.join(output_dir_cutadapt, "too_short.fq.gz"),
+        "--json",
+        os.path.join(output_dir_cutadapt, "report.json"),
+        "--cores",
+        str(max(cutadapt_threads // num_shards, 1)),
+        "-",
+    ]
+    # reads are named `@sample=<sample>_<barcode> ...`, shards are balanced by barcode
+    barcode_sizes = get_sample_sizes(output_dir_demux)
+    cutadapt = ShardedTool(
+        proc_args,
+        get_cutadapt_outputs(proc_args),
+        barcode_sizes,
+        num_shards,
+        key=get_renamed_key(barcode_sizes, prefix=False),
     )
-    cutadapt_trim_proc.stdin.close()
-    cutadapt_trim_proc.wait()
+    with cutadapt:
+        cat_fastq_se(
+            output_dir_demux,
+            output_fp=cutadapt,
+            _have_sample_name=True,
+            num_workers=num_workers,
+            stats_path=os.path.join(output_dir, "read_stats.tsv"),
+        )
 
     shutil.rmtree(output_dir_demux)
 
 
 def cutadapt_demux_merge_trim_pe(
-    fastq_path: str, output_dir: str, primer_set: str, barcode_fastq: str
+    fastq_path: str,
+    output_dir: str,
+    primer_set: str,
+    barcode_fastq: str,
+    num_workers: int | None = None,
+    num_shards: int = 1,
+    threads: int | str | None = "auto",
+    preview: int | None = None,
 ) -> None:
-    """Demultiplex and merge paired-end reads using cutadapt."""
+    """Demultiplex and merge paired-end reads using cutadapt. With `num_shards` > 1,
+    barcodes are split among that many cutadapt processes for primer trimming (see
+    `ShardedTool`). Renaming (`num_workers` processes unless given) and trimming
+    share `threads`. With `preview`, only a sample of that many read pairs of each
+    sample of a directory is demultiplexed (see `easy_amplicon.utils_preview`).
+    """
     if not os.path.isfile(barcode_fastq):
         raise ValueError(f"{barcode_fastq} does not exist.")
     output_dir_cutadapt = os.path.join(output_dir, "cutadapt")
@@ -610,6 +791,10 @@ def cutadapt_demux_merge_trim_pe(
     os.makedirs(output_dir_demux, exist_ok=True)
     os.makedirs(output_dir_demux_fail, exist_ok=True)
     os.makedirs(output_dir_cutadapt, exist_ok=True)
+    threads = resolve_threads(threads)
+    # renaming and trimming run side by side
+    rename_threads, cutadapt_threads = split_threads(threads, [1, 1])
+    num_workers = num_workers or rename_threads
 
     # demultiplex with cutadapt
     proc_args = [
@@ -623,6 +808,8 @@ def cutadapt_demux_merge_trim_pe(
         os.path.join(output_dir_demux, "{name}_R1.fq.gz"),
         "-p",
         os.path.join(output_dir_demux, "{name}_R2.fq.gz"),
+        "--cores",
+        str(threads),
     ]
     if os.path.isdir(fastq_path):
         proc_args.extend(["--interleaved", "-"])
@@ -633,27 +820,28 @@ def cutadapt_demux_merge_trim_pe(
             stdout=subprocess.DEVNULL,
             stderr=subprocess.DEVNULL,
         )
-        cat_fastq(
-            fastq_path,
-            output_fp_r1=cutadapt_demux_proc.stdin,
-            output_fp_r2=cutadapt_demux_proc.stdin,
-        )
-        cutadapt_demux_proc.stdin.close()
+        with PipeFeeder(cutadapt_demux_proc.stdin, verbose=True) as feeder:
+            cat_fastq(
+                fastq_path,
+                output_fp_r1=feeder,
+                output_fp_r2=feeder,
+                preview=preview,
+            )
         cutadapt_demux_proc.wait()
     else:
-        print_command(proc_args)
-        proc_args.extend([fastq_path])
-        subprocess.run(proc_args)
+        proc_args.append(fastq_path)
+        run_command(proc_args, [fastq_path])
 
     # no need for renaming
     # rename_files_with_mmv(output_dir_demux, rename_pattern)
-    subprocess.run(
+    move_files(
         [
-            "mv",
             os.path.join(output_dir_demux, "unknown_R1.fq.gz"),
             os.path.join(output_dir_demux, "unknown_R2.fq.gz"),
-            os.path.join(output_dir, "demux_failed"),
-        ]
+        ],
+        os.path.join(output_dir, "demux_failed"),
+        # like `mv`, do not fail when there is no unknown file
+        missing_ok=True,
     )
     a, A = get_primer_set(primer_set)
     proc_args = [
@@ -674,27 +862,32 @@ def cutadapt_demux_merge_trim_pe(
         os.path.join(output_dir_cutadapt, "untrimmed_1.fq.gz"),
         "--untrimmed-paired-output",
         os.path.join(output_dir_cutadapt, "untrimmed_2.fq.gz"),
+        "--json",
+        os.path.join(output_dir_cutadapt, "report.json"),
         "--cores",
-        "4",
+        str(max(cutadapt_threads // num_shards, 1)),
         "--interleaved",
         "-",
     ]
     print_command(proc_args)
-    cutadapt_trim_proc = subprocess.Popen(
+    # reads are named `@sample=<sample>_<barcode> ...`, shards are balanced by barcode
+    barcode_sizes = get_sample_sizes(output_dir_demux)
+    cutadapt = ShardedTool(
         proc_args,
-        stdin=subprocess.PIPE,
-        # silence cutadapt's output
-        stdout=subprocess.DEVNULL,
-        stderr=subprocess.DEVNULL,
-    )
-    cat_fastq(
-        output_dir_demux,
-        output_fp_r1=cutadapt_trim_proc.stdin,
-        output_fp_r2=cutadapt_trim_proc.stdin,
-        _have_sample_name=True,
+        get_cutadapt_outputs(proc_args),
+        barcode_sizes,
+        num_shards,
+        key=get_renamed_key(barcode_sizes, prefix=False),
     )
-    cutadapt_trim_proc.stdin.close()
-    cutadapt_trim_proc.wait()
+    with cutadapt:
+        cat_fastq(
+            output_dir_demux,
+            output_fp_r1=cutadapt,
+            output_fp_r2=cutadapt,
+            _have_sample_name=True,
+            num_workers=num_workers,
+            stats_path=os.path.join(output_dir, "read_stats.tsv"),
+        )
 
     shutil.rmtree(output_dir_demux)
 
@@ -706,24 +899,71 @@ def cutadapt_merge_trim_se(
     first_k: int = None,
     min_length: int = None,
     _r2: bool = False,
+    num_shards: int = 1,
+    threads: int | str | None = "auto",
+    engine: str = "native",
+    preview: int | None = None,
 ) -> None:
+    """Trim primers of single-end reads with cutadapt. If `fastq_path` is a directory,
+    its samples are renamed and concatenated, and split among `num_shards` cutadapt
+    processes (see `ShardedTool`), which share `threads`.
+
+    With `engine="native"`, primer sets made of an anchored 5' primer and an optional
+    3' one (e.g. "16s" and "its") are trimmed in-process by `PrimerTrimmer`, which
+    only passes the reads it cannot resolve to cutadapt, with the same outputs.
+
+    With `preview`, only a sample of that many reads of each sample of a directory is
+    trimmed (see `easy_amplicon.utils_preview`).
+    """
+    if engine not in ("native", "cutadapt"):
+        raise ValueError(f"Engine must be 'native' or 'cutadapt', getting {engine}.")
     output_dir, output_f = os.path.split(output_fastq)
+    output_dir_cutadapt = os.path.join(output_dir, "cutadapt")
     os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(output_dir_cutadapt, exist_ok=True)
     a, A = get_primer_set(primer_set)
+    primers = parse_linked_adapter(a) if engine == "native" else None
+    if primers is not None:
+        trimmer = PrimerTrimmer(
+            *primers,
+            output_fastq,
+            too_short_output=(
+                os.path.join(output_dir_cutadapt, "too_short_1.fq.gz")
+                if min_length is not None
+                else None
+            ),
+            first_k=int(first_k) if first_k is not None else None,
+            min_length=int(min_length) if min_length is not None else None,
+            report=os.path.join(output_dir_cutadapt, "report.json"),
+            threads=resolve_threads(threads),
+        )
+        with trimmer:
+            if os.path.isdir(fastq_path):
+                cat_fastq_se(
+                    fastq_path,
+                    output_fp=trimmer,
+                    _r2=_r2,
+                    stats_path=os.path.join(output_dir, "read_stats.tsv"),
+                    preview=preview,
+                )
+            else:
+                with smart_open(fastq_path, "rb") as f:
+                    shutil.copyfileobj(f, trimmer, FASTQ_BLOCK_SIZE)
+        return
     proc_args = [
         "cutadapt",
         "-g" if primer_set.endswith("_5") == "fwd" else "-a",
         a,
         "-o",
         output_fastq,
+        "--json",
+        os.path.join(output_dir_cutadapt, "report.json"),
         "--cores",
-        "8",
+        str(max(resolve_threads(threads) // num_shards, 1)),
     ]
     if first_k is not None:
         proc_args.extend(["-l", str(first_k)])
     if min_length is not None:
-        output_dir_cutadapt = os.path.join(output_dir, "cutadapt")
-        os.makedirs(output_dir_cutadapt, exist_ok=True)
         proc_args.extend(
             [
                 "--minimum-length",
@@ -734,35 +974,46 @@ def cutadapt_merge_trim_se(
         )
     if os.path.isdir(fastq_path):
         proc_args.append("-")
-        cutadapt_trim_proc = subprocess.Popen(
+        cutadapt = ShardedTool(
             proc_args,
-            stdin=subprocess.PIPE,
-            stdout=subprocess.DEVNULL,
-            stderr=subprocess.DEVNULL,
+            get_cutadapt_outputs(proc_args),
+            get_sample_sizes(fastq_path),
+            num_shards,
         )
-        cat_fastq_se(fastq_path, output_fp=cutadapt_trim_proc.stdin, _r2=_r2)
-        cutadapt_trim_proc.stdin.close()
-        cutadapt_trim_proc.wait()
+        with cutadapt:
+            cat_fastq_se(
+                fastq_path,
+                output_fp=cutadapt,
+                _r2=_r2,
+                stats_path=os.path.join(output_dir, "read_stats.tsv"),
+                preview=preview,
+            )
     else:
         proc_args.append(fastq_path)
         subprocess.run(proc_args)
 
 
-def extract_r2_16s_v3v4(fastq_dir: str, output_fastq: str) -> None:
+def extract_r2_16s_v3v4(
+    fastq_dir: str, output_fastq: str, threads: int | str | None = "auto"
+) -> None:
     length = 150
     output_dir, output_f = os.path.split(output_fastq)
     os.makedirs(output_dir, exist_ok=True)
     log_dir = os.path.join(output_dir, "fastp")
+    # the three tools of the pipeline run side by side, fastp does the most work
+    fastp_threads, seqkit_threads, cutadapt_threads = split_threads(
+        resolve_threads(threads), [2, 1, 1]
+    )
     args = (
-        f"fastp -w 8 "
+        f"fastp -w {fastp_threads} "
         f"--length_required {length} "
         f"--cut_right "
         f"--stdin "
         f"--stdout "
         f"--json {log_dir}/report.json "
         f"--html {log_dir}/report.html "
-        f"| seqkit seq -rp "
-        f"| cutadapt -o {output_fastq} -l {length} -"
+        f"| seqkit seq -rp -j {seqkit_threads} "
+        f"| cutadapt -o {output_fastq} -l {length} --cores {cutadapt_threads} -"
     )
     print_command(args)
     preprocess_proc = subprocess.Popen(
@@ -772,88 +1023,161 @@ def extract_r2_16s_v3v4(fastq_dir: str, output_fastq: str) -> None:
         stdout=subprocess.DEVNULL,
         stderr=subprocess.DEVNULL,
     )
-    cat_fastq_se(fastq_dir, output_fp=preprocess_proc.stdin, _r2=True)
-    preprocess_proc.stdin.close()
+    with PipeFeeder(preprocess_proc.stdin, verbose=True) as feeder:
+        cat_fastq_se(
+            fastq_dir,
+            output_fp=feeder,
+            _r2=True,
+            stats_path=os.path.join(output_dir, "read_stats.tsv"),
+        )
     preprocess_proc.wait()
 
 
-def merge(fastq_dir: str, output_dir: str) -> None:
+def merge(
+    fastq_dir: str,
+    output_dir: str,
+    num_workers: int | None = None,
+    compresslevel: int = DEFAULT_COMPRESS_LEVEL,
+) -> None:
     """Take output directory of Illumina BCL Convert, merge the fastq files and rename
-    each read to `@<sample_name> <read_index> <read 1 or read 2>`. Output are written to
-    `output_dir/merged_R1.fastq.gz` and `output_dir/merged_R2.fastq.gz`.
+    each read to `@sample=<sample_name> <read_index> <read 1 or read 2>`. Output are
+    written to `output_dir/merged_R1.fastq.gz` and `output_dir/merged_R2.fastq.gz`.
 
     Note:
         The name of the fastq files are supposed to follow the naming convention of
-            `<sample_name>_S<sample_number>_L001_R[1/2]_001.fastq.gz`
-
-    Concatenate files by using subprocess to run something like this:
-
-    for fq1 in "$RAW_DATA_DIR"/*_1.fq; do
-        fq2="${fq1%_1.fq}_2.fq"
-        sample_name=$(basename "$fq1" "_1.fq")
-
-        awk -v sn="$sample_name" 'BEGIN {
-            read_index=1
-        }
-        {
-            if(NR%4==1) {
-                print "@sample=" sn " " read_index " 1"
-                read_index++
-            } else {
-                print $0
-            }
-        }' "$fq1" | gzip >> "$TEMP_DIR/all_samples_1.fq.gz"
-
-        awk -v sn="$sample_name" 'BEGIN {
-            read_index=1
-        }
-        {
-            if(NR%4==1) {
-                print "@sample=" sn " " read_index " 2"
-                read_index++
-            } else {
-                print $0
-            }
-        }' "$fq2" | gzip >> "$TEMP_DIR/all_samples_2.fq.gz"
-
+            `<sample_name>_S<sample_number>_L001_R[1/2]_001.fastq.gz`, plain or
+            gzipped, with .fastq or .fq.
+
+    Samples are renamed and compressed in worker processes (this used to be one
+    `awk | gzip >>` shell per file), each into a single gzip member per read
+    direction, and written in the order of their names. Where the member of each
+    sample lies is saved to `output_dir/merged_index.tsv`, with columns "sample",
+    "read_count", "R1_offset", "R1_size", "R2_offset" and "R2_size" (in compressed
+    bytes), so that a sample can be read on its own by decompressing `size` bytes
+    from `offset`.
+
+    Args:
+        fastq_dir: Directory of BCL Convert output.
+        output_dir: Output directory.
+        num_workers: Number of worker processes, defaults to the number of available
+            CPUs.
+        compresslevel: Compression level from 0 to 9.
     """
-    r1_files = glob.glob(os.path.join(fastq_dir, "*_L001_R1_001.fastq.gz"))
-    r2_files = glob.glob(os.path.join(fastq_dir, "*_L001_R2_001.fastq.gz"))
-    r1_sample_names = [os.path.basename(f).split("_")[0] for f in r1_files]
-    r2_sample_names = [os.path.basename(f).split("_")[0] for f in r2_files]
-    # check pairing and uniqueness
-    if r1_sample_names != r2_sample_names:
+    files = {}
+    for name in sorted(os.listdir(fastq_dir)):
+        match = _BCL_CONVERT_PATTERN.match(name)
+        if match is None:
+            continue
+        sample_files = files.setdefault(match.group("sample"), {})
+        if match.group("read") in sample_files:
+            raise ValueError("Sample names are not unique.")
+        sample_files[match.group("read")] = os.path.join(fastq_dir, name)
+    # check pairing
+    if any(len(sample_files) != 2 for sample_files in files.values()):
         raise ValueError("Sample names in R1 and R2 do not match.")
-    if len(set(r1_sample_names)) != len(r1_sample_names):
-        raise ValueError("Sample names are not unique.")
 
     out_r1 = os.path.join(output_dir, "merged_R1.fastq.gz")
     out_r2 = os.path.join(output_dir, "merged_R2.fastq.gz")
-    # remove old files if exist
-    if os.path.isfile(out_r1):
-        os.remove(out_r1)
-    if os.path.isfile(out_r2):
-        os.remove(out_r2)
     os.makedirs(output_dir, exist_ok=True)
 
     # merge
-    for r1_file, r2_file, sample_name in zip(r1_files, r2_files, r1_sample_names):
-        # merge R1
-        for read_num, fq_in, fq_out in zip(
-            [1, 2], [r1_file, r2_file], [out_r1, out_r2]
+    tasks = [
+        ((sample_files["1"], sample_files["2"]), sample_name, compresslevel)
+        for sample_name, sample_files in files.items()
+    ]
+    sample_stats = {}
+    with open(out_r1, "wb") as f_r1, open(out_r2, "wb") as f_r2:
+        for member_r1, member_r2 in _iter_fastq_chunks(
+            tasks,
+            num_workers or available_cpus(),
+            sample_stats=sample_stats,
+            iter_chunks=_iter_merged_members,
+        ):
+            f_r1.write(member_r1)
+            f_r2.write(member_r2)
+
+    offsets = {"R1": 0, "R2": 0}
+    with open(os.path.join(output_dir, "merged_index.tsv"), "w") as f:
+        f.write("sample\tread_count\tR1_offset\tR1_size\tR2_offset\tR2_size\n")
+        for sample_name, stats in sample_stats.items():
+            row = [sample_name, stats["read_count"]]
+            for read in offsets:
+                row += [offsets[read], stats[f"{read}_size"]]
+                offsets[read] += stats[f"{read}_size"]
+            f.write("\t".join(map(str, row)) + "\n")
+
+
+def _iter_merged_members(
+    paths: tuple[str, str], sample_name: str, compresslevel: int, stats: dict
+) -> Iterator[tuple[bytes, bytes]]:
+    """Yield pieces of one gzip member of renamed reads per read direction of a
+    sample, counting its reads and compressed sizes in `stats`. Runs in the workers
+    of `_iter_fastq_chunks`.
+    """
+    stats.update(R1_size=0, R2_size=0)
+    compressors = [zlib.compressobj(compresslevel, zlib.DEFLATED, 31) for _ in paths]
+    with smart_open(paths[0], "rb") as f_r1, smart_open(paths[1], "rb") as f_r2:
+        for chunk_r1, chunk_r2 in itertools.zip_longest(
+            _iter_indexed_chunks(f_r1, sample_name, 1),
+            _iter_indexed_chunks(f_r2, sample_name, 2),
+            fillvalue=b"",
         ):
-            process = [
-                "awk",
-                "-v",
-                f"sn={sample_name}",
-                f"""'BEGIN {{ read_index=1 }} {{ if(NR%4==1) {{ print "@sample=" sn " " read_index " {read_num}"; read_index++ }} else {{ print $0 }} }}'""",
-                fq_in,
-                "|",
-                "gzip",
-                ">>",
-                fq_out,
+            stats["read_count"] += chunk_r1.count(b"\n") // 4
+            pieces = [
+                compressors[0].compress(chunk_r1),
+                compressors[1].compress(chunk_r2),
             ]
-            subprocess.run(" ".join(process), shell=True)
+            stats["R1_size"] += len(pieces[0])
+            stats["R2_size"] += len(pieces[1])
+            yield tuple(pieces)
+    pieces = [compressor.flush() for compressor in compressors]
+    stats["R1_size"] += len(pieces[0])
+    stats["R2_size"] += len(pieces[1])
+    yield tuple(pieces)
+
+
+def _iter_indexed_chunks(
+    file_: IO[bytes], sample_name: str, read_num: int
+) -> Iterator[bytes]:
+    """Yield chunks of reads from a binary FASTQ file, with headers replaced by
+    `@sample=<sample_name> <read_index> <read_num>`.
+    """
+    prefix = f"@sample={sample_name} ".encode()
+    suffix = f" {read_num}\n".encode()
+    read_index = 1
+    for block, newlines, _ in _iter_fastq_blocks(file_):
+        num_reads = len(newlines) // 4
+        parts = [b""] * (num_reads * 4)
+        parts[0::4] = [prefix] * num_reads
+        parts[1::4] = _format_read_indices(read_index, num_reads)
+        parts[2::4] = [suffix] * num_reads
+        parts[3::4] = [
+            block[start:end]
+            for start, end in zip(
+                (newlines[0::4] + 1).tolist(), (newlines[3::4] + 1).tolist()
+            )
+        ]
+        read_index += num_reads
+        yield b"".join(parts)
+
+
+def shard_output(output_fastq: str, threads: int | None = None) -> str:
+    """Replace the merged output FASTQ with per-sample shards and their manifest in
+    `<output_dir>/shards`, see `write_fastq_shards`. Returns the path to the manifest.
+    """
+    shard_dir = os.path.join(os.path.dirname(output_fastq), "shards")
+    manifest_path = write_fastq_shards(output_fastq, shard_dir, threads=threads)
+    os.remove(output_fastq)
+    print(f"Reads split into per-sample shards, manifest at {manifest_path}")
+    return manifest_path
+
+
+def bgzf_output(output_fastq: str, threads: int | None = None) -> None:
+    """Recompress the merged output FASTQ in place to BGZF and save its sample index,
+    see `write_bgzf_fastq`.
+    """
+    sample_index = write_bgzf_fastq(output_fastq, output_fastq, threads=threads)
+    print(f"Output compressed to BGZF, indexed {len(sample_index)} samples")
 
 
 def rename_output_files(output_dir, pair):
@@ -877,11 +1201,30 @@ def rename_output_files(output_dir, pair):
         os.rename(r2_old, r2_new)
 
 
-# if __name__ == "__main__":
-def main():
-    parser = argparse.ArgumentParser(
-        description="Process and rename FASTQ files using trim_galore."
-    )
+def get_barcode_layout(args: argparse.Namespace) -> BarcodeLayout:
+    """Build the barcode layout of isolate modes from `--barcode_layout`, or from
+    `--barcode_fwd`, `--barcode_rev` and `--pattern` as they were given to cutadapt.
+    Files are first looked for as normal file paths, then in the data directory.
+    """
+
+    def resolve(path: str) -> str:
+        if not os.path.isfile(path):
+            return os.path.join(os.path.dirname(__file__), "data", path)
+        return path
+
+    if args.barcode_layout is not None:
+        return BarcodeLayout.from_tsv(resolve(args.barcode_layout))
+    if None not in (args.barcode_fwd, args.barcode_rev, args.pattern):
+        return BarcodeLayout.from_fasta(
+            resolve(args.barcode_fwd), resolve(args.barcode_rev), resolve(args.pattern)
+        )
+    return BarcodeLayout.from_tsv(DEFAULT_BARCODE_LAYOUT)
+
+
+def add_trim_arguments(parser: argparse.ArgumentParser) -> None:
+    """Add the arguments of trimming modes (all but the output) to a parser, see
+    `run_mode`.
+    """
     parser.add_argument(
         "-i",
         "--input_dir",
@@ -889,13 +1232,6 @@ def main():
         help="Input directory containing FASTQ files",
         required=True,
     )
-    parser.add_argument(
-        "-o",
-        "--output",
-        type=str,
-        help="Output FASTQ file (could be gzipped) path or directory",
-        required=True,
-    )
     parser.add_argument(
         "-p",
         "--primer_set",
@@ -923,6 +1259,30 @@ def main():
         type=str,
         help="Pattern file for mmv, used to rename the files",
     )
+    parser.add_argument(
+        "-bl",
+        "--barcode_layout",
+        type=str,
+        default=None,
+        help="Barcode layout TSV of isolate plates (columns well, bcF, linkF, bcR and "
+        "linkR). Defaults to the layout shipped in data/isolate unless barcode fasta "
+        "files and a pattern file are given",
+    )
+    add_threads_argument(parser)
+    parser.add_argument(
+        "--shards",
+        type=int,
+        default=1,
+        help="Number of trimming processes (cutadapt or fastp), each run on a subset "
+        "of samples. Their outputs are merged in sample order and their JSON reports "
+        "summed",
+    )
+    parser.add_argument(
+        "--keep_wells",
+        action="store_true",
+        help="In isolate_150 modes, also keep demultiplexed reads of each well in "
+        "per-well files under `demux` next to the output, for debugging",
+    )
     parser.add_argument(
         "-m",
         "--mode",
@@ -947,52 +1307,68 @@ def main():
     parser.add_argument(
         "-l", "--min_length", default=100, help="Minimum length to keep"
     )
+    parser.add_argument(
+        "--primer_engine",
+        type=str,
+        default="native",
+        choices=["native", "cutadapt"],
+        help="How the r1 mode trims primers: in-process, with cutadapt only for reads "
+        "with errors in the primers (native), or with cutadapt for all reads",
+    )
+    parser.add_argument(
+        "--per_sample",
+        action="store_true",
+        help="In simple mode, run one fastp process per sample, as many at a time "
+        "as --threads allows (instead of --shards processes), and write QC metrics "
+        "of each sample to fastp/sample_report.tsv",
+    )
+    parser.add_argument(
+        "--preview",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Only process a reproducible sample of N reads (or read pairs) of each "
+        "sample and print a summary of the reports, to check a run quickly. Read "
+        "statistics still cover all reads",
+    )
 
-    args = parser.parse_args()
 
-    if args.mode == "simple":
-        simple_preprocess(args.input_dir, args.output)
-    elif args.mode == "isolate_150":
-        # for barcode_fwd, barcode_rev and pattern, first look for them as if they are
-        # normal file path, if not exist, then look for them in script_dir/../../data
-        if args.barcode_fwd is not None and not os.path.isfile(args.barcode_fwd):
-            barcode_fwd = os.path.join(
-                os.path.dirname(__file__), "data", args.barcode_fwd
-            )
-        else:
-            barcode_fwd = args.barcode_fwd
-        if args.barcode_rev is not None and not os.path.isfile(args.barcode_rev):
-            barcode_rev = os.path.join(
-                os.path.dirname(__file__), "data", args.barcode_rev
-            )
-        else:
-            barcode_rev = args.barcode_rev
-        if args.pattern is not None and not os.path.isfile(args.pattern):
-            pattern = os.path.join(os.path.dirname(__file__), "data", args.pattern)
-        else:
-            pattern = args.pattern
+def check_trim_arguments(
+    parser: argparse.ArgumentParser, args: argparse.Namespace
+) -> None:
+    """Exit through `parser.error` if arguments of `add_trim_arguments` conflict."""
+    if args.preview is not None and (
+        args.preview < 1 or not os.path.isdir(args.input_dir)
+    ):
+        parser.error("--preview needs a positive number and an input directory.")
 
-        isolate_150_preprocess(
+
+def run_mode(args: argparse.Namespace) -> None:
+    """Run the trimming mode of parsed arguments (see `add_trim_arguments`), writing
+    to `args.output`.
+    """
+    if args.mode == "simple":
+        simple_preprocess(
             args.input_dir,
-            barcode_fwd,
-            barcode_rev,
-            pattern,
             args.output,
-            primer_set=args.primer_set,
-            first_k=args.first_k,
-            min_length=args.min_length,
+            num_shards=args.shards,
+            threads=args.threads,
+            preview=args.preview,
+            per_sample=args.per_sample,
         )
-    elif args.mode == "isolate_150_early_stop":
+    elif args.mode in ["isolate_150", "isolate_150_early_stop"]:
         isolate_150_preprocess(
             args.input_dir,
-            args.barcode_fwd,
-            args.barcode_rev,
-            args.pattern,
+            get_barcode_layout(args),
             args.output,
             primer_set=args.primer_set,
             first_k=args.first_k,
             min_length=args.min_length,
-            early_stop=True,
+            early_stop=args.mode == "isolate_150_early_stop",
+            keep_wells=args.keep_wells,
+            num_shards=args.shards,
+            threads=args.threads,
+            preview=args.preview,
         )
     elif args.mode == "r1":
         cutadapt_merge_trim_se(
@@ -1001,12 +1377,19 @@ def main():
             primer_set=args.primer_set,
             first_k=args.first_k,
             min_length=args.min_length,
+            num_shards=args.shards,
+            threads=args.threads,
+            engine=args.primer_engine,
+            preview=args.preview,
         )
     elif args.mode == "maps_round0":
         cutadapt_merge_trim_se(
             args.input_dir,
             args.output,
             primer_set="maps_0",
+            num_shards=args.shards,
+            threads=args.threads,
+            preview=args.preview,
         )
     elif args.mode == "maps_round1":
         cutadapt_demux_merge_trim_se(
@@ -1014,6 +1397,9 @@ def main():
             args.output,
             barcode_fastq=args.barcode_fwd,
             primer_set="maps_1",
+            num_shards=args.shards,
+            threads=args.threads,
+            preview=args.preview,
         )
     elif args.mode == "maps_round2":
         cutadapt_demux_merge_trim_se(
@@ -1021,6 +1407,9 @@ def main():
             args.output,
             barcode_fastq=args.barcode_fwd,
             primer_set="maps_2",
+            num_shards=args.shards,
+            threads=args.threads,
+            preview=args.preview,
         )
     elif args.mode == "maps_round3":
         cutadapt_demux_merge_trim_se(
@@ -1028,6 +1417,9 @@ def main():
             args.output,
             barcode_fastq=args.barcode_fwd,
             primer_set="maps_3",
+            num_shards=args.shards,
+            threads=args.threads,
+            preview=args.preview,
         )
     elif args.mode == "maps_rand_hex_test":
         cutadapt_demux_merge_trim_pe(
@@ -1035,4 +1427,70 @@ def main():
             args.output,
             barcode_fastq=args.barcode_fwd,
             primer_set="maps_rand_hex_test",
+            num_shards=args.shards,
+            threads=args.threads,
+            preview=args.preview,
+        )
+
+
+# if __name__ == "__main__":
+def main():
+    parser = argparse.ArgumentParser(
+        description="Process and rename FASTQ files using trim_galore."
+    )
+    add_trim_arguments(parser)
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=str,
+        help="Output FASTQ file (could be gzipped) path or directory",
+        required=True,
+    )
+    parser.add_argument(
+        "--output_format",
+        type=str,
+        default="fastq",
+        choices=["fastq", "shards", "bgzf", "fqa"],
+        help="Write a single FASTQ file, one gzip shard per sample (or per group of "
+        "small samples) plus a manifest in `shards` next to the output path, a "
+        "single BGZF file indexed by sample (output path ending with .gz), or a "
+        "compact read table (output path ending with .fqa)",
+    )
+
+    args = parser.parse_args()
+    check_trim_arguments(parser, args)
+    if args.output_format == "shards" and args.mode == "maps_rand_hex_test":
+        parser.error("--output_format shards needs a mode with a single output FASTQ.")
+    if args.output_format == "bgzf" and (
+        args.mode == "maps_rand_hex_test" or not args.output.endswith(".gz")
+    ):
+        parser.error(
+            "--output_format bgzf needs a mode with a single output FASTQ ending with "
+            ".gz."
+        )
+    if args.output_format == "fqa":
+        if args.mode == "maps_rand_hex_test" or not is_reads_file(args.output):
+            parser.error(
+                "--output_format fqa needs a mode with a single output ending with "
+                f"{READS_EXTENSION}."
+            )
+        # modes write FASTQ, converted to a read table at the end
+        reads_output, args.output = args.output, f"{args.output}.{os.getpid()}.tmp.fq"
+
+    run_mode(args)
+    if args.output_format == "shards":
+        shard_output(args.output, threads=args.threads)
+    elif args.output_format == "bgzf":
+        bgzf_output(args.output, threads=args.threads)
+    elif args.output_format == "fqa":
+        num_reads = write_reads(args.output, reads_output)
+        os.remove(args.output)
+        print(f"Wrote {num_reads} reads to {reads_output}")
+    if args.preview is not None:
+        # the paired-end mode writes to a directory
+        output_dir = (
+            args.output
+            if args.mode == "maps_rand_hex_test"
+            else os.path.dirname(args.output)
         )
+        print_preview_report(args.mode, summarize_trim(output_dir))
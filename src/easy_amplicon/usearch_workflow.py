@@ -1,7 +1,6 @@
 #!/usr/bin/env python
 import argparse
 import glob
-import io
 import os
 import subprocess
 import shutil
@@ -20,7 +19,36 @@ from Bio.Seq import Seq
 from Bio.SeqRecord import SeqRecord
 from tqdm.auto import tqdm
 
-from easy_amplicon.utils import read_table, write_table
+from easy_amplicon.utils import (
+    _iter_fastq_blocks,
+    parse_fastx,
+    read_table,
+    write_table,
+)
+from easy_amplicon.utils_cpu import add_threads_argument, available_cpus
+from easy_amplicon.utils_files import concat_files
+from easy_amplicon.utils_index import (
+    fetch_sample,
+    get_compression,
+    get_sample_index,
+    write_bgzf_fastq,
+)
+from easy_amplicon.utils_manifest import get_fastq_manifest
+from easy_amplicon.utils_preview import (
+    print_preview_report,
+    summarize_zotus,
+    write_preview_fastq,
+)
+from easy_amplicon.utils_reads import get_read_samples, is_reads_file, iter_fastq_chunks
+from easy_amplicon.utils_run import run_command
+from easy_amplicon.utils_shards import (
+    fastq_input_path,
+    is_shard_manifest,
+    read_sample_fastq,
+    read_shard_manifest,
+)
+from easy_amplicon.utils_stats import fastx_stats, fastx_stats_many
+from easy_amplicon.utils_zran import get_gzip_index, read_gzip_slice
 
 
 def merge_pairs(
@@ -53,7 +81,11 @@ def merge_pairs(
         # `fastq_dir` could be a path regex so that we can easily do merging for a
         # subset of samples in a directory.
         if os.path.isdir(fastq_dir):
-            files = sorted(glob.glob(f"{fastq_dir}/*.fastq"))
+            files = sorted(
+                entry["path"]
+                for entry in get_fastq_manifest(fastq_dir)
+                if entry["path"].endswith(".fastq")
+            )
             if not files:
                 raise ValueError(f"No fastq files found in {fastq_dir}")
         else:
@@ -95,13 +127,12 @@ def merge_pairs(
             [p.wait() for p in tqdm(ps)]
             [f.close() for f in fs]
 
-        subprocess.run(
-            f"cat {output_dir}/temp/*_R1.fastq > {output_dir}/temp_R1.fastq", shell=True
-        )
-        subprocess.run(
-            f"cat {output_dir}/temp/*_R2.fastq > {output_dir}/temp_R2.fastq", shell=True
-        )
-        subprocess.run(
+        for read in ["R1", "R2"]:
+            concat_files(
+                sorted(glob.glob(f"{output_dir}/temp/*_{read}.fastq")),
+                f"{output_dir}/temp_{read}.fastq",
+            )
+        run_command(
             [
                 "vsearch",
                 "--fastq_mergepairs",
@@ -118,7 +149,9 @@ def merge_pairs(
                 "50",
                 "--threads",
                 str(num_threads),
-            ]
+            ],
+            [f"{output_dir}/temp_R1.fastq", f"{output_dir}/temp_R2.fastq"],
+            [fastq_out],
         )
         os.remove(f"{output_dir}/temp_R1.fastq")
         os.remove(f"{output_dir}/temp_R2.fastq")
@@ -130,14 +163,29 @@ def qc(
     output_fasta: str | None = None,
     num_threads: int = 16,
     backend: str = "vsearch",
+    bgzf: bool = False,
 ) -> str:
     """Output fasta is default to be modified from input fastq, but can be specified.
     For example, if input fastq file is /data/merged.fq.gz, then output fasta will be
     /data/merged.filtered.fq.gz, unless otherwise specified.
+
+    The input can also be a shard manifest written by `trim.py --output_format shards`
+    (e.g., /data/shards/manifest.json, then output is /data/shards.filtered.fq.gz).
+
+    A regular gzip input whose checkpoint index is cached (see `split_fastq`) is
+    filtered by `num_threads` vsearch processes, each on a slice of the file.
+
+    With `bgzf`, the vsearch output keeps the sample label of each read after its new
+    name and is compressed to BGZF with a sample index, so that the reads of a sample
+    can be read directly (see `write_bgzf_fastq`).
     """
     if output_fasta is None:
-        output_dir = os.path.dirname(input_fastq)
-        filename = os.path.basename(input_fastq).split(".")[0]
+        if is_shard_manifest(input_fastq):
+            shard_dir = os.path.dirname(os.path.abspath(input_fastq))
+            output_dir, filename = os.path.split(shard_dir)
+        else:
+            output_dir = os.path.dirname(input_fastq)
+            filename = os.path.basename(input_fastq).split(".")[0]
         output_fastx = os.path.join(output_dir, f"{filename}.filtered.fq")
     else:
         output_fastx = output_fasta.rstrip(".gz")
@@ -145,7 +193,7 @@ def qc(
     if backend == "usearch":
         num_splits = None
         # Split the merged FASTQ file into multiple pieces
-        total_lines = int(subprocess.check_output(["wc", "-l", input_fastq]).split()[0])
+        total_lines = fastx_stats(input_fastq)["num_seqs"] * 4
         lines_per_file = ((total_lines + num_splits - 1) // num_splits // 4) * 4
         base_dir = os.path.dirname(input_fastq)
         if num_splits > 1:
@@ -206,34 +254,138 @@ def qc(
                 ]
             )
     elif backend == "vsearch":
-        # we don't need to split anymore since there is no memory limit.
-        subprocess.run(
-            [
-                "vsearch",
-                "--fastq_filter",
+        filter_args = [
+            "--fastq_maxee",
+            "0.5",
+            "--fastq_minlen",
+            "100",
+            "--fastq_maxns",
+            "0",
+        ]
+        # regular gzip inputs indexed beforehand (see `split_fastq`) are filtered in
+        # slices in parallel
+        index = None
+        if (
+            num_threads > 1
+            and not is_shard_manifest(input_fastq)
+            and get_compression(input_fastq) == "gzip"
+        ):
+            index = get_gzip_index(input_fastq, build=False)
+        if index is not None and len(index) > 1:
+            _filter_gzip_slices(
                 input_fastq,
-                "--fastqout",
+                index.split(num_threads),
                 output_fastx,
-                "--fastq_maxee",
-                "0.5",
-                "--fastq_minlen",
-                "100",
-                "--fastq_maxns",
-                "0",
-                "--relabel",
-                "filtered",
-                # "--threads",
-                # str(num_threads),
-            ]
-        )
-        subprocess.run(["pigz", "-f", output_fastx])
+                filter_args,
+                bgzf,
+                num_threads,
+            )
+        else:
+            # we don't need to split anymore since there is no memory limit.
+            with fastq_input_path(input_fastq) as input_path:
+                subprocess.run(
+                    [
+                        "vsearch",
+                        "--fastq_filter",
+                        input_path,
+                        "--fastqout",
+                        output_fastx,
+                        *filter_args,
+                        "--relabel",
+                        "filtered",
+                        *(["--relabel_keep"] if bgzf else []),
+                        # "--threads",
+                        # str(num_threads),
+                    ]
+                )
+        if bgzf:
+            write_bgzf_fastq(output_fastx, output_fastx + ".gz", threads=num_threads)
+            os.remove(output_fastx)
+        else:
+            subprocess.run(["pigz", "-f", output_fastx])
         output_fastx += ".gz"
     return output_fastx
 
 
+def _filter_gzip_slices(
+    input_fastq: str,
+    slices: list[tuple],
+    output_fastx: str,
+    filter_args: list[str],
+    keep_labels: bool,
+    num_threads: int,
+) -> None:
+    """Run `vsearch --fastq_filter` on slices of a regular gzip FASTQ file (see
+    `GzipIndex.split`) in parallel, and concatenate the outputs with reads relabeled as
+    a single run with `--relabel filtered` (and `--relabel_keep`) would.
+    """
+    part_paths = [f"{output_fastx}.part{i}" for i in range(len(slices))]
+    executor = get_reusable_executor(max_workers=min(num_threads, len(slices)))
+    for _ in executor.map(
+        _filter_gzip_slice,
+        [input_fastq] * len(slices),
+        [point for point, _ in slices],
+        [end for _, end in slices],
+        part_paths,
+        [filter_args] * len(slices),
+    ):
+        pass
+    num_reads = 0
+    with open(output_fastx, "wb") as out:
+        for part_path in part_paths:
+            with open(part_path, "rb") as f:
+                for block, _, _ in _iter_fastq_blocks(f):
+                    lines = block.split(b"\n")
+                    for i in range(0, len(lines) - 1, 4):
+                        num_reads += 1
+                        label = b"@filtered%d" % num_reads
+                        lines[i] = label + b" " + lines[i][1:] if keep_labels else label
+                    out.write(b"\n".join(lines))
+            os.remove(part_path)
+
+
+def _filter_gzip_slice(
+    input_fastq: str, point: tuple, end: int, output_path: str, filter_args: list[str]
+) -> None:
+    command = ["vsearch", "--fastq_filter", "-", "--fastqout", output_path]
+    with subprocess.Popen([*command, *filter_args], stdin=subprocess.PIPE) as process:
+        for chunk in read_gzip_slice(input_fastq, point, end):
+            process.stdin.write(chunk)
+        process.stdin.close()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, process.args)
+
+
+def _write_gzip_slice(
+    input_fastq: str, point: tuple, end: int, output_path: str
+) -> None:
+    with open(output_path, "wb") as f:
+        for chunk in read_gzip_slice(input_fastq, point, end):
+            f.write(chunk)
+
+
 def split_fastq(args):
+    if get_compression(args.input_file) == "gzip":
+        # regular gzip is cut at checkpoints of its (cached) index and the pieces are
+        # decompressed in parallel, each with about the same number of bytes
+        slices = get_gzip_index(args.input_file).split(args.num_splits)
+        executor = get_reusable_executor(max_workers=min(len(slices), available_cpus()))
+        for _ in executor.map(
+            _write_gzip_slice,
+            [args.input_file] * len(slices),
+            [point for point, _ in slices],
+            [end for _, end in slices],
+            [
+                os.path.join(args.output_dir, f"split_{i:02d}.fastq")
+                for i in range(len(slices))
+            ],
+        ):
+            pass
+        print(f"FASTQ file has been split into {len(slices)} pieces.")
+        return
+
     # Calculate the number of lines in the FASTQ file (each read consists of 4 lines)
-    total_lines = int(subprocess.check_output(["wc", "-l", args.input_file]).split()[0])
+    total_lines = fastx_stats(args.input_file)["num_seqs"] * 4
     # Calculate the number of lines for each split file, ensuring that the total number of lines is divisible by 4
     lines_per_file = ((total_lines + args.num_splits - 1) // args.num_splits // 4) * 4
 
@@ -253,7 +405,14 @@ def split_fastq(args):
     print(f"FASTQ file has been split into {args.num_splits} pieces.")
 
 
-def add_depth_to_metadata(fastq_dir: str, metadata_path: str) -> None:
+def add_depth_to_metadata(
+    fastq_dir: str, metadata_path: str, read_stats: str = None
+) -> None:
+    """Add the read count of each sample to the metadata, counting the reads in
+    `fastq_dir/*_R1.fastq`, or taking them from `read_stats` (the per-sample
+    statistics written by `cat_fastq`/`cat_fastq_se` with `stats_path`, or a shard
+    manifest) without reading any FASTQ.
+    """
     # Generate metadata for the input FASTQ files
 
     # data = []
@@ -262,24 +421,30 @@ def add_depth_to_metadata(fastq_dir: str, metadata_path: str) -> None:
     #         sample_name = f.replace("_R1.fastq", "")
     #         count = sum(1 for line in open(os.path.join(fastq_dir, f))) / 4
     #         data.append([sample_name, count])
-    command = f"seqkit stats {fastq_dir}/*_R1.fastq -T"
-    result = subprocess.run(command, capture_output=True, text=True, shell=True)
-
-    # Check if the command was successful
-    if result.returncode != 0:
-        print("Error executing command:", result.stderr)
-        exit()
-
-    # Split the captured output into lines
-    lines = result.stdout.splitlines()
-
-    # Use pandas to read the tab-separated output into a DataFrame
-    df_rc = pd.read_csv(io.StringIO("\n".join(lines)), sep="\t")
-    df_rc["sample"] = df_rc.file.apply(
-        lambda x: os.path.basename(x).replace("_R1.fastq", "")
-    )
-    df_rc = df_rc[["sample", "num_seqs"]].set_index("sample")
-    df_rc.columns = ["read_count"]
+    if read_stats is not None:
+        if is_shard_manifest(read_stats):
+            df_rc = pd.DataFrame.from_dict(
+                read_shard_manifest(read_stats)["samples"], orient="index"
+            ).rename(columns={"num_reads": "read_count"})
+        elif read_stats.endswith(".json"):
+            df_rc = pd.read_json(read_stats, orient="index")
+        else:
+            df_rc = pd.read_table(read_stats, index_col="sample")
+        df_rc = df_rc[["read_count"]]
+        df_rc.index = df_rc.index.astype(str)
+        df_rc.index.name = "sample"
+    else:
+        files = [
+            entry["path"]
+            for entry in get_fastq_manifest(fastq_dir)
+            if entry["path"].endswith("_R1.fastq")
+        ]
+        df_rc = pd.DataFrame(
+            {
+                "sample": [os.path.basename(f).replace("_R1.fastq", "") for f in files],
+                "read_count": [stats["num_seqs"] for stats in fastx_stats_many(files)],
+            }
+        ).set_index("sample")
 
     df = pd.read_table(metadata_path, index_col="sample")
     if "read_count" in df.columns:
@@ -393,7 +558,7 @@ def db_construct(
         output_path = output_fasta.rstrip(".gz")
 
     if backend == "usearch":
-        subprocess.run(
+        run_command(
             [
                 "usearch11",
                 "-fastx_uniques",
@@ -402,9 +567,11 @@ def db_construct(
                 f"{output_dir}/{base_name_noext}.uniq.fa",
                 "-sizeout",
             ],
+            [input_fastx],
+            [f"{output_dir}/{base_name_noext}.uniq.fa"],
             check=True,
         )
-        subprocess.run(
+        run_command(
             [
                 "usearch11",
                 "-sortbysize",
@@ -414,9 +581,11 @@ def db_construct(
                 "-minsize",
                 "2",
             ],
+            [f"{output_dir}/{base_name_noext}.uniq.fa"],
+            [f"{output_dir}/{base_name_noext}.sorted.fa"],
             check=True,
         )
-        subprocess.run(
+        run_command(
             [
                 "usearch11",
                 "-search_exact",
@@ -430,6 +599,8 @@ def db_construct(
                 "-t",
                 str(num_threads),
             ],
+            [input_fastx, f"{output_dir}/{base_name_noext}.sorted.fa"],
+            [f"{output_dir}/{base_name_noext}.unmatched.fa"],
             check=True,
         )
     elif backend == "vsearch":
@@ -454,7 +625,7 @@ def cluster_uparse(
     if output_dir is None:
         output_dir = os.path.dirname(input_fastq)
     os.makedirs(output_dir, exist_ok=True)
-    subprocess.run(
+    run_command(
         [
             "usearch11",
             "-cluster_otus",
@@ -464,31 +635,36 @@ def cluster_uparse(
             "-relabel",
             "OTU",
         ],
+        [db_fasta],
+        [f"{output_dir}/uparse_otu.fa"],
         check=True,
     )
-    subprocess.run(
-        [
-            "usearch10",
-            "-usearch_global",
-            input_fastq,
-            "-db",
-            f"{output_dir}/uparse_otu.fa",
-            "-strand",
-            "both",
-            "-id",
-            "0.97",
-            "-otutabout",
-            f"{output_dir}/uparse_otu.tsv",
-            "-biomout",
-            f"{output_dir}/uparse_otu.biom",
-            "-threads",
-            str(num_threads),
-            "-sample_delim",
-            ".",
-        ],
-        check=True,
-    )
-    subprocess.run(
+    with fastq_input_path(input_fastq) as input_path:
+        run_command(
+            [
+                "usearch10",
+                "-usearch_global",
+                input_path,
+                "-db",
+                f"{output_dir}/uparse_otu.fa",
+                "-strand",
+                "both",
+                "-id",
+                "0.97",
+                "-otutabout",
+                f"{output_dir}/uparse_otu.tsv",
+                "-biomout",
+                f"{output_dir}/uparse_otu.biom",
+                "-threads",
+                str(num_threads),
+                "-sample_delim",
+                ".",
+            ],
+            [input_path, f"{output_dir}/uparse_otu.fa"],
+            [f"{output_dir}/uparse_otu.tsv", f"{output_dir}/uparse_otu.biom"],
+            check=True,
+        )
+    run_command(
         [
             "usearch11",
             "-calc_distmx",
@@ -502,9 +678,11 @@ def cluster_uparse(
             "-threads",
             str(num_threads),
         ],
+        [f"{output_dir}/uparse_otu.fa"],
+        [f"{output_dir}/uparse_otu.dist"],
         check=True,
     )
-    subprocess.run(
+    run_command(
         [
             "usearch11",
             "-cluster_aggd",
@@ -518,6 +696,8 @@ def cluster_uparse(
             "-linkage",
             "min",
         ],
+        [f"{output_dir}/uparse_otu.dist"],
+        [f"{output_dir}/uparse_otu.tree", f"{output_dir}/uparse_otu.clust"],
         check=True,
     )
 
@@ -699,7 +879,7 @@ def search_global_add_unknown(
 ) -> None:
     if not os.path.isfile(zotu_fasta):
         raise ValueError(f"ZOTU fasta file (database) {zotu_fasta} does not exist")
-    if not os.path.isfile(input_fastq):
+    if not os.path.isfile(input_fastq) and not is_shard_manifest(input_fastq):
         raise ValueError(f"Query fastq file {input_fastq} does not exist")
     if output_tsv is None:
         output_dir = os.path.dirname(input_fastq)
@@ -709,16 +889,17 @@ def search_global_add_unknown(
         os.makedirs(output_dir, exist_ok=True)
     output_not_matched = os.path.join(output_dir, "notmatched.fa")
 
-    search_global(
-        input_fastq, zotu_fasta, output_tsv, output_not_matched, id_, num_threads
-    )
+    with fastq_input_path(input_fastq) as input_path:
+        search_global(
+            input_path, zotu_fasta, output_tsv, output_not_matched, id_, num_threads
+        )
 
     # add a ZOTU_UNKNOWN to the zotu table by counting the number of reads that do not
     # matched to anything in database
     zotu_table = read_table(output_tsv)
     counter = {i: 0 for i in zotu_table.columns}
-    for record in SeqIO.parse(output_not_matched, "fasta"):
-        counter[record.id.split("=")[1]] += 1
+    for name, _, _ in parse_fastx(output_not_matched, "fasta"):
+        counter[name.split("=")[1]] += 1
     zotu_table.loc[unknown_name] = pd.Series(counter)
     write_table(zotu_table, output_tsv)
 
@@ -772,10 +953,7 @@ def _workflow_one_sample(
     )
     try:
         zotus_name, zotus_seq = zip(
-            *(
-                (record.id, str(record.seq))
-                for record in SeqIO.parse(db_fasta.name, "fasta")
-            )
+            *((name, seq) for name, seq, _ in parse_fastx(db_fasta.name, "fasta"))
         )
     except ValueError:
         zotus_name, zotus_seq = [], []
@@ -801,29 +979,11 @@ def _workflow_one_sample(
     return zotus_name, zotus_seq, counts
 
 
-def workflow_per_sample(
-    input_fastq: str,
-    output_path: str,
-    min_size: int,
-    prefix: str | None = None,
-    num_threads: int = 8,
-    search: bool = True,
-) -> None:
-    """Split input fastq file by sample and run a separate unoise3 workflow for each
-        sample, so that each sample has one set of ZOTUs and counts.
-
-    We assume sequences in the input fastq file are named like `@sample=<sample1>` and
-        sequences from the same sample form consecutive blocks.
-
-    If output path ends with json, save results in a json file like:
-        `{<sample>: {"zotus": ["ATCG", "GCTA", ...], "counts": [10, 2, ...]}, ...}`.
-    If output path ends with fasta, save results in a fasta file file like:
-        ```
-        >ATCG
-        ATCG
-        ```
-        where sequence names are just sequences themselves. Identical sequences appear
-        only once.
+def _workflow_merged_fastq(
+    input_fastq: str, executor, min_size: int, prefix: str | None, search: bool
+) -> dict[str, tuple[list[str], list[str], list[int]]]:
+    """Run `_workflow_one_sample` on each block of consecutive reads of a sample in a
+    single FASTQ file.
     """
     from easy_amplicon.utils import smart_open
 
@@ -834,11 +994,6 @@ def workflow_per_sample(
     # sample2future = {}
     results = {}
 
-    executor = (
-        get_reusable_executor(max_workers=num_threads, kill_workers=True, reuse=False)
-        if num_threads > 1
-        else None
-    )
     f = smart_open(input_fastq, "r")
     for entry in zip(f, f, f, f):
         # Parse the header line to extract the sample name
@@ -886,14 +1041,110 @@ def workflow_per_sample(
             results[current_sample] = _workflow_one_sample(
                 fastq_for_current_sample, min_size, prefix, search
             )
+    return results
+
+
+def _workflow_by_sample(
+    input_fastq: str, executor, min_size: int, prefix: str | None, search: bool
+) -> dict[str, tuple[list[str], list[str], list[int]]]:
+    """Run `_workflow_one_sample` on each sample of a shard store, a read table or a
+    BGZF FASTQ file with a sample index. Each worker reads its own sample directly,
+    so samples are read in parallel.
+    """
+    if is_shard_manifest(input_fastq):
+        source = read_shard_manifest(input_fastq)
+        samples = list(source["samples"])
+    elif is_reads_file(input_fastq):
+        source = input_fastq
+        samples = list(get_read_samples(input_fastq))
+    else:
+        source = input_fastq
+        samples = list(get_sample_index(input_fastq))
+    if executor is None:
+        return {
+            sample: _workflow_one_indexed_sample(
+                source, sample, min_size, prefix, search
+            )
+            for sample in samples
+        }
+    future2sample = {
+        executor.submit(
+            _workflow_one_indexed_sample, source, sample, min_size, prefix, search
+        ): sample
+        for sample in samples
+    }
+    results = {}
+    for future in tqdm(as_completed(future2sample), total=len(future2sample)):
+        results[future2sample[future]] = future.result()
+    return {sample: results[sample] for sample in samples}
+
+
+def _workflow_one_indexed_sample(
+    source: dict | str, sample: str, min_size: int, prefix: str | None, search: bool
+) -> tuple[list[str], list[str], list[int]]:
+    if isinstance(source, dict):
+        data = read_sample_fastq(source, sample)
+    elif is_reads_file(source):
+        data = b"".join(iter_fastq_chunks(source, [sample]))
+    else:
+        data = fetch_sample(source, sample)
+    lines = data.decode().splitlines(keepends=True)
+    seqs_sample = ["".join(lines[i : i + 4]) for i in range(0, len(lines), 4)]
+    return _workflow_one_sample(seqs_sample, min_size, prefix, search)
+
+
+def workflow_per_sample(
+    input_fastq: str,
+    output_path: str,
+    min_size: int,
+    prefix: str | None = None,
+    num_threads: int = 8,
+    search: bool = True,
+) -> None:
+    """Split input fastq file by sample and run a separate unoise3 workflow for each
+        sample, so that each sample has one set of ZOTUs and counts.
+
+    We assume sequences in the input fastq file are named like `@sample=<sample1>` and
+        sequences from the same sample form consecutive blocks. Shard stores, read
+        tables and BGZF files (see `qc` with `bgzf`) are instead read sample by sample
+        through their manifest, sample column or sample index, in any order.
+
+    If output path ends with json, save results in a json file like:
+        `{<sample>: {"zotus": ["ATCG", "GCTA", ...], "counts": [10, 2, ...]}, ...}`.
+    If output path ends with fasta, save results in a fasta file file like:
+        ```
+        >ATCG
+        ATCG
+        ```
+        where sequence names are just sequences themselves. Identical sequences appear
+        only once.
+    """
+    from easy_amplicon.utils import smart_open
+
+    executor = (
+        get_reusable_executor(max_workers=num_threads, kill_workers=True, reuse=False)
+        if num_threads > 1
+        else None
+    )
+    if (
+        is_shard_manifest(input_fastq)
+        or is_reads_file(input_fastq)
+        or get_compression(input_fastq) == "bgzf"
+    ):
+        results = _workflow_by_sample(input_fastq, executor, min_size, prefix, search)
+    else:
+        results = _workflow_merged_fastq(
+            input_fastq, executor, min_size, prefix, search
+        )
     # Assuming each task's result could be aggregated into a final result dictionary
     # This step depends on how you implement the process_queue and task results handling
     # You would collect results from each completed task here
     # This could involve collecting returned values or reading from a shared resource
-    ext = os.path.splitext(output_path)[1]
+    # outputs ending with .gz are compressed in parallel by smart_open
+    ext = os.path.splitext(output_path.removesuffix(".gz"))[1]
     if ext == ".json":
         results = {s: {"zotus": z, "counts": c} for s, (_, z, c) in results.items()}
-        with open(output_path, "w") as outfile:
+        with smart_open(output_path, "w") as outfile:
             json.dump(results, outfile, indent=4)
     elif ext in set([".fa", ".fasta", ".fna"]):
         prefix = prefix or "ZOTU"
@@ -908,11 +1159,12 @@ def workflow_per_sample(
             SeqRecord(Seq(z), id=f"{prefix}{i}", description=str(zotus[z]))
             for i, z in enumerate(sorted(zotus, key=zotus.get, reverse=True), 1)
         ]
-        with open(output_path, "w") as outfile:
+        with smart_open(output_path, "w") as outfile:
             SeqIO.write(records, outfile, "fasta")
     else:
         raise ValueError(
-            f"Invalid output file extension {ext}. Must be one of .json, .fa, .fasta, .fna"
+            f"Invalid output file extension {ext}. Must be one of .json, .fa, .fasta, "
+            ".fna, optionally followed by .gz"
         )
 
 
@@ -927,8 +1179,10 @@ def aggregate_samples(
     """
     if prefix is None:
         prefix = "ZOTU"
+    from easy_amplicon.utils import smart_open
+
     # Load JSON data from file
-    with open(input_json) as json_file:
+    with smart_open(input_json) as json_file:
         data = json.load(json_file)
 
     # Extract unique sequences and calculate their total counts, keeping track of "#UNKNOWN" separately
@@ -1054,35 +1308,38 @@ def _cluster_unoise3(
         output_dir = os.path.dirname(input_fastq)
     os.makedirs(output_dir, exist_ok=True)
     if backend == "usearch":
-        subprocess.run(
+        run_command(
             [
                 "usearch11",
                 "-unoise3",
                 db_fasta,
                 "-zotus",
-                f"{output_dir}/unoise3_zotu.fa",
+                f"{output_dir}/unoise3_zotu_raw.fa",
                 "-tabbedout",
-                f"{output_dir}/unoise3_zotu.tsv",
+                f"{output_dir}/unoise3_zotu_raw.tsv",
             ],
+            [db_fasta],
+            [f"{output_dir}/unoise3_zotu_raw.fa", f"{output_dir}/unoise3_zotu_raw.tsv"],
             check=True,
         )
-        subprocess.run(
+        # relabeled to a file of its own, so that no step overwrites the outputs of
+        # another and all are skipped when run again
+        run_command(
             [
                 "usearch11",
                 "-fastx_relabel",
-                f"{output_dir}/unoise3_zotu.fa",
+                f"{output_dir}/unoise3_zotu_raw.fa",
                 "-prefix",
                 "ZOTU",
                 "-fastaout",
-                f"{output_dir}/unoise3_zotu_relabel.fa",
+                f"{output_dir}/unoise3_zotu.fa",
                 "-keep_annots",
             ],
+            [f"{output_dir}/unoise3_zotu_raw.fa"],
+            [f"{output_dir}/unoise3_zotu.fa"],
             check=True,
         )
-        os.rename(
-            f"{output_dir}/unoise3_zotu_relabel.fa", f"{output_dir}/unoise3_zotu.fa"
-        )
-        subprocess.run(
+        run_command(
             [
                 "usearch10",
                 "-otutab",
@@ -1107,9 +1364,17 @@ def _cluster_unoise3(
                 "-sample_delim",
                 ".",
             ],
+            [input_fastq, f"{output_dir}/unoise3_zotu.fa"],
+            [
+                f"{output_dir}/unoise3_zotu.tsv",
+                f"{output_dir}/unoise3_zotu.biom",
+                f"{output_dir}/unoise3_zotu.map",
+                f"{output_dir}/unoise3_zotu_notmatched.fa",
+                f"{output_dir}/unoise3_zotu_dbmatched.fa",
+            ],
             check=True,
         )
-        subprocess.run(
+        run_command(
             [
                 "usearch10",
                 "-otutab_stats",
@@ -1117,9 +1382,11 @@ def _cluster_unoise3(
                 "-output",
                 f"{output_dir}/unoise3_zotu_report.txt",
             ],
+            [f"{output_dir}/unoise3_zotu.tsv"],
+            [f"{output_dir}/unoise3_zotu_report.txt"],
             check=True,
         )
-        subprocess.run(
+        run_command(
             [
                 "usearch11",
                 "-calc_distmx",
@@ -1131,9 +1398,11 @@ def _cluster_unoise3(
                 "-termdist",
                 "0.3",
             ],
+            [f"{output_dir}/unoise3_zotu.fa"],
+            [f"{output_dir}/unoise3_zotu.dist"],
             check=True,
         )
-        subprocess.run(
+        run_command(
             [
                 "usearch11",
                 "-cluster_aggd",
@@ -1147,6 +1416,8 @@ def _cluster_unoise3(
                 "-linkage",
                 "min",
             ],
+            [f"{output_dir}/unoise3_zotu.dist"],
+            [f"{output_dir}/unoise3_zotu.tree", f"{output_dir}/unoise3_zotu.clust"],
             check=True,
         )
     elif backend == "vsearch":
@@ -1156,7 +1427,7 @@ def _cluster_unoise3(
         # to replace `--otutab`, but the other commands are not implemented.
         # Besides, in usearch chimera is removed as part of the clustering step, but
         # in vsearch chimera removal is a separate step.
-        subprocess.run(
+        run_command(
             [
                 "vsearch",
                 "--cluster_unoise",
@@ -1168,9 +1439,11 @@ def _cluster_unoise3(
                 "--strand",
                 "both",
             ],
+            [db_fasta],
+            [f"{output_dir}/temp.fa"],
             check=True,
         )
-        subprocess.run(
+        run_command(
             [
                 "vsearch",
                 "--uchime3_denovo",
@@ -1180,16 +1453,23 @@ def _cluster_unoise3(
                 "--relabel",
                 "ZOTU",
             ],
+            [f"{output_dir}/temp.fa"],
+            [f"{output_dir}/unoise3_zotu.fa"],
         )
         os.remove(f"{output_dir}/temp.fa")
         # convert input fastq to fasta
-        with open(f"{os.path.splitext(input_fastq)[0]}.fa", "w") as f:
-            subprocess.run(["seqtk", "seq", "-A", input_fastq], stdout=f, check=True)
-        subprocess.run(
+        input_fasta = f"{os.path.splitext(input_fastq)[0]}.fa"
+        run_command(
+            ["seqtk", "seq", "-A", input_fastq],
+            [input_fastq],
+            stdout=input_fasta,
+            check=True,
+        )
+        run_command(
             [
                 "vsearch",
                 "--usearch_global",
-                f"{os.path.splitext(input_fastq)[0]}.fa",
+                input_fasta,
                 "--db",
                 f"{output_dir}/unoise3_zotu.fa",
                 "--strand",
@@ -1209,7 +1489,15 @@ def _cluster_unoise3(
                 "--sizeout",
                 "--threads",
                 str(num_threads),
-            ]
+            ],
+            [input_fasta, f"{output_dir}/unoise3_zotu.fa"],
+            [
+                f"{output_dir}/unoise3_zotu.tsv",
+                f"{output_dir}/unoise3_zotu.biom",
+                f"{output_dir}/unoise3_zotu.aln",
+                f"{output_dir}/unoise3_zotu_dbmatched.fa",
+                f"{output_dir}/unoise3_zotu_dbnotmatched.fa",
+            ],
         )
 
 
@@ -1223,7 +1511,7 @@ def tax_nbc(
     if backend == "usearch":
         if db_fasta is None:
             raise ValueError("db_fasta is required when using usearch")
-        _ = subprocess.run(
+        run_command(
             [
                 "usearch11",
                 "-nbc_tax",
@@ -1237,6 +1525,8 @@ def tax_nbc(
                 "-threads",
                 str(num_threads),
             ],
+            [input_fasta, db_fasta],
+            [output_path],
             check=True,
         )
     elif backend == "rdp_classifier":
@@ -1295,6 +1585,56 @@ def tax_sintax(
         )
 
 
+def preview_unoise3(
+    input_fastq: str,
+    output_fasta: str,
+    num_reads: int,
+    min_size: int,
+    relabel_prefix: str | None = None,
+    sintax_db: str | None = None,
+    num_threads: int = 8,
+) -> None:
+    """Run unoise3, search_global and, if `sintax_db` is given, tax_sintax on a
+    reproducible sample of `num_reads` reads of each sample (see
+    `easy_amplicon.utils_preview`) and print a summary of the results.
+
+    The sample is written to `preview_reads.fastq`, the ZOTU table to
+    `preview_otutab.tsv` and the taxonomy of ZOTUs to `preview_sintax.tsv`, next to
+    `output_fasta`.
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_fasta))
+    os.makedirs(output_dir, exist_ok=True)
+    preview_fastq = os.path.join(output_dir, "preview_reads.fastq")
+    otutab_tsv = os.path.join(output_dir, "preview_otutab.tsv")
+    sintax_tsv = os.path.join(output_dir, "preview_sintax.tsv")
+    sample_sizes = write_preview_fastq(input_fastq, preview_fastq, num_reads)
+    num_sampled = sum(min(size, num_reads) for size in sample_sizes.values())
+    print(
+        f"Sampled {num_sampled:,} of {sum(sample_sizes.values()):,} input reads, up to "
+        f"{num_reads} of each of {len(sample_sizes)} samples."
+    )
+    unoise3(
+        preview_fastq,
+        output_fasta,
+        min_size=min_size,
+        relabel_prefix=relabel_prefix,
+        num_threads=num_threads,
+    )
+    if not os.path.getsize(output_fasta):
+        print(
+            f"WARNING: no ZOTU of at least {min_size} reads in the preview, try a "
+            "larger sample or a smaller minimum size."
+        )
+        return
+    search_global(preview_fastq, output_fasta, otutab_tsv, num_threads=num_threads)
+    if sintax_db is not None:
+        tax_sintax(output_fasta, sintax_db, sintax_tsv, num_threads)
+    print_preview_report(
+        "unoise3",
+        summarize_zotus(otutab_tsv, sintax_tsv if sintax_db is not None else None),
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(description="Perform QC on FASTQ files")
     subparsers = parser.add_subparsers(dest="subcommand")
@@ -1308,15 +1648,15 @@ def main():
     merge_pairs_parser.add_argument(
         "-o", "--fastq_out", help="Output path for merged fastq file"
     )
-    merge_pairs_parser.add_argument(
-        "-t", "--num_threads", type=int, default=16, help="Number of threads to use"
-    )
+    add_threads_argument(merge_pairs_parser, "-t", "--num_threads", "--threads")
 
     db_construct_parser = subparsers.add_parser(
         "db_construct", help="Construct a database from a FASTA file"
     )
     db_construct_parser.add_argument(
-        "-i", "--input_fastq", help="Input FASTA file to construct the database from"
+        "-i",
+        "--input_fastq",
+        help="Input FASTQ file (or shard manifest) to construct the database from",
     )
     db_construct_parser.add_argument(
         "-o",
@@ -1325,15 +1665,22 @@ def main():
         type=str,
         default=None,
     )
+    add_threads_argument(db_construct_parser, "-t", "--num_threads", "--threads")
     db_construct_parser.add_argument(
-        "-t", "--num_threads", type=int, default=16, help="Number of threads to use"
+        "--bgzf",
+        action="store_true",
+        help="Keep sample labels in the filtered FASTQ and compress it to BGZF with a "
+        "sample index",
     )
 
     cluster_uparse_parser = subparsers.add_parser(
         "cluster_uparse", help="Cluster reads using UPARSE"
     )
     cluster_uparse_parser.add_argument(
-        "-i", "--input_fastq", help="Input FASTQ file to cluster", type=str
+        "-i",
+        "--input_fastq",
+        help="Input FASTQ file (or shard manifest) to cluster",
+        type=str,
     )
     cluster_uparse_parser.add_argument(
         "-d", "--db_fasta", help="Input FASTA file to cluster against", type=str
@@ -1345,9 +1692,7 @@ def main():
         type=str,
         default=None,
     )
-    cluster_uparse_parser.add_argument(
-        "-t", "--num_threads", type=int, default=16, help="Number of threads to use"
-    )
+    add_threads_argument(cluster_uparse_parser, "-t", "--num_threads", "--threads")
 
     cluster_unoise3_parser = subparsers.add_parser(
         "cluster_unoise3", help="Cluster reads using UNOISE3"
@@ -1367,7 +1712,7 @@ def main():
     unoise3_parser.add_argument(
         "-i",
         "--input_fastq",
-        help="Input FASTQ file to cluster",
+        help="Input FASTQ file (or shard manifest) to cluster",
         type=str,
         required=True,
     )
@@ -1385,13 +1730,28 @@ def main():
         "-l", "--relabel_prefix", type=str, default=None, help="Prefix for ZOTU labels"
     )
     unoise3_parser.add_argument(
-        "-t", "--num_threads", type=int, default=4, help="Number of threads to use"
+        "--preview",
+        type=int,
+        default=None,
+        metavar="N",
+        help="Only cluster a reproducible sample of N reads of each sample, then map "
+        "it to the ZOTUs (and classify them with --sintax_db) and print a summary",
+    )
+    unoise3_parser.add_argument(
+        "--sintax_db",
+        type=str,
+        default=None,
+        help="Database to classify ZOTUs against with SINTAX in preview mode",
     )
+    add_threads_argument(unoise3_parser, "-t", "--num_threads", "--threads")
     search_global_parser = subparsers.add_parser(
         "search_global", help="Search reads against a database"
     )
     search_global_parser.add_argument(
-        "-i", "--input_fastq", help="Input FASTQ file to search", type=str
+        "-i",
+        "--input_fastq",
+        help="Input FASTQ file (or shard manifest) to search",
+        type=str,
     )
     search_global_parser.add_argument(
         "-d", "--zotu_fasta", help="Input FASTA file to search against", type=str
@@ -1412,14 +1772,29 @@ def main():
         default="ZOTU_UNKNOWN",
         help="Name for unknown ZOTUs",
     )
-    search_global_parser.add_argument(
-        "-t", "--num_threads", type=int, default=8, help="Number of threads to use"
+    add_threads_argument(search_global_parser, "-t", "--num_threads", "--threads")
+    split_fastq_parser = subparsers.add_parser(
+        "split_fastq",
+        help="Split a FASTQ file into pieces, indexing regular gzip files so that "
+        "they are split (and filtered by db_construct) in parallel",
+    )
+    split_fastq_parser.add_argument(
+        "-i", "--input_file", help="Input FASTQ file, plain or gzipped", required=True
+    )
+    split_fastq_parser.add_argument(
+        "-o", "--output_dir", help="Output directory of the pieces", required=True
+    )
+    split_fastq_parser.add_argument(
+        "-n", "--num_splits", type=int, default=8, help="Number of pieces"
     )
     workflow_per_sample_parser = subparsers.add_parser(
         "workflow_per_sample", help="Run UNOISE3 workflow per sample"
     )
     workflow_per_sample_parser.add_argument(
-        "-i", "--input_fastq", help="Input FASTQ file to cluster", type=str
+        "-i",
+        "--input_fastq",
+        help="Input FASTQ file (or shard manifest) to cluster",
+        type=str,
     )
     workflow_per_sample_parser.add_argument(
         "-o", "--output_path", help="Output path", type=str
@@ -1434,9 +1809,7 @@ def main():
         default="ZOTU",
         help="Prefix for ZOTU labels",
     )
-    workflow_per_sample_parser.add_argument(
-        "-t", "--num_threads", type=int, default=16, help="Number of threads to use"
-    )
+    add_threads_argument(workflow_per_sample_parser, "-t", "--num_threads", "--threads")
     workflow_per_sample_parser.add_argument(
         "--search",
         action="store_true",
@@ -1474,15 +1847,16 @@ def main():
     tax_nbc_parser.add_argument(
         "-o", "--output_path", help="Output path for NBC results", type=str
     )
-    tax_nbc_parser.add_argument(
-        "-t", "--num_threads", type=int, default=16, help="Number of threads to use"
-    )
+    add_threads_argument(tax_nbc_parser, "-t", "--num_threads", "--threads")
 
     tax_sintax_parser = subparsers.add_parser(
         "tax_sintax", help="Taxonomy classification using SINTAX"
     )
     tax_sintax_parser.add_argument(
-        "-i", "--input_fastq", help="Input FASTQ file to classify", type=str
+        "-i",
+        "--input_fastq",
+        help="Input FASTQ file (or shard manifest) to classify",
+        type=str,
     )
     tax_sintax_parser.add_argument(
         "-d", "--db_udb", help="Input udb file to classify against", type=str
@@ -1490,14 +1864,12 @@ def main():
     tax_sintax_parser.add_argument(
         "-o", "--output_path", help="Output path for SINTAX results", type=str
     )
-    tax_sintax_parser.add_argument(
-        "-t", "--num_threads", type=int, default=16, help="Number of threads to use"
-    )
+    add_threads_argument(tax_sintax_parser, "-t", "--num_threads", "--threads")
 
     args = parser.parse_args()
 
     if args.subcommand == "db_construct":
-        fastx_post_qc = qc(args.input_fastq, None, args.num_threads)
+        fastx_post_qc = qc(args.input_fastq, None, args.num_threads, bgzf=args.bgzf)
         db_construct(fastx_post_qc, args.output_fasta, args.num_threads)
     elif args.subcommand == "cluster_uparse":
         cluster_uparse(
@@ -1505,14 +1877,25 @@ def main():
         )
     elif args.subcommand == "cluster_unoise3":
         cluster_unoise3(args.uniq_fasta, args.minsize, args.out_fasta)
-    elif args.subcommand == "unoise3":
-        unoise3(
+    elif args.subcommand == "unoise3" and args.preview is not None:
+        preview_unoise3(
             args.input_fastq,
             args.output_fasta,
+            args.preview,
             min_size=args.minsize,
             relabel_prefix=args.relabel_prefix,
+            sintax_db=args.sintax_db,
             num_threads=args.num_threads,
         )
+    elif args.subcommand == "unoise3":
+        with fastq_input_path(args.input_fastq) as input_fastq:
+            unoise3(
+                input_fastq,
+                args.output_fasta,
+                min_size=args.minsize,
+                relabel_prefix=args.relabel_prefix,
+                num_threads=args.num_threads,
+            )
     elif args.subcommand == "search_global":
         search_global_add_unknown(
             args.input_fastq,
@@ -1531,6 +1914,8 @@ def main():
             num_threads=args.num_threads,
             search=args.search,
         )
+    elif args.subcommand == "split_fastq":
+        split_fastq(args)
     elif args.subcommand == "aggregate_samples":
         aggregate_samples(
             args.input_json, args.output_fasta, args.output_count, prefix=args.prefix
@@ -1538,7 +1923,8 @@ def main():
     elif args.subcommand == "tax_nbc":
         tax_nbc(args.input_fasta, args.db_fasta, args.output_path, args.num_threads)
     elif args.subcommand == "tax_sintax":
-        tax_sintax(args.input_fastq, args.db_udb, args.output_path, args.num_threads)
+        with fastq_input_path(args.input_fastq) as input_fastq:
+            tax_sintax(input_fastq, args.db_udb, args.output_path, args.num_threads)
     else:
         raise ValueError(f"Invalid subcommand: {args.subcommand}")
 
@@ -1,57 +1,47 @@
+import contextlib
 import io
-import glob
-import gzip
-import os
-import re
+import itertools
+import multiprocessing
+import queue
 import warnings
-from typing import IO
+from typing import IO, Callable, Iterable, Iterator
 
+import numpy as np
 import pandas as pd
 import biom
 from tqdm.auto import tqdm
 
-
-PATTERN_ILLUMINA = re.compile(r"^(.+?)_S\d+_L\d{3}_(R[12])_001.f(ast)?q(.gz)?$")
-# - sample_R1.fq.gz or sample_R2.fq.gz (or fastq.gz, same for the following)
-# - sample_1.fq.gz or sample_2.fq.gz
-# - sample.R1.fq.gz or sample.R2.fq.gz
-# - sample.1.fq.gz or sample.2.fq.gz
-PATTERN_CUSTOM = re.compile(r"^(.+?)(?:_|\.)((?:R)?[12]).f(ast)?q(.gz)?$")
+from easy_amplicon.utils_gzip import (
+    DEFAULT_COMPRESS_LEVEL,
+    PREFETCH_SIZE,
+    open_gzip_read,
+    open_gzip_write,
+)
+from easy_amplicon.utils_manifest import (  # noqa: F401
+    PATTERN_CUSTOM,
+    PATTERN_ILLUMINA,
+    get_fastq_manifest,
+)
 
 
 def find_paired_end_files(directory: str) -> list[tuple[str, str, str]]:
     # Dictionary to store file pairs
     file_pairs = {}
 
-    # Find all .fastq.gz and .fq.gz files in the directory
-    fastq_files = (
-        glob.glob(os.path.join(directory, "*.fastq.gz"))
-        + glob.glob(os.path.join(directory, "*.fq.gz"))
-        + glob.glob(os.path.join(directory, "*.fastq"))
-        + glob.glob(os.path.join(directory, "*.fq"))
-    )
+    # Process each .fastq.gz, .fq.gz, .fastq and .fq file of the (cached) manifest
+    for entry in get_fastq_manifest(directory):
+        file_ = entry["path"]
+        if entry["sample"] is None:
+            warnings.warn(f"File {file_} does not match any known pattern.")
+            continue
+
+        pair_key = (entry["sample"], entry["read"])
 
-    # Process each file using pattern functions
-    for file_ in fastq_files:
-        for pattern in [PATTERN_ILLUMINA, PATTERN_CUSTOM]:
-            match = pattern.search(os.path.basename(file_))
-            if match:
-                sample_name, read_type = match.groups()[:2]
-                read_type = {"1": "R1", "2": "R2"}.get(read_type, read_type)
-                if read_type not in ["R1", "R2"]:
-                    warnings.warn(f"Invalid read type for file: {file_}")
-                    continue
-
-                pair_key = (sample_name, read_type)
-
-                # Add the file to the dictionary and check for duplicates
-                if pair_key in file_pairs:
-                    warnings.warn(f"Duplicate file for {pair_key}: {file_}")
-                else:
-                    file_pairs[pair_key] = file_
-                break
+        # Add the file to the dictionary and check for duplicates
+        if pair_key in file_pairs:
+            warnings.warn(f"Duplicate file for {pair_key}: {file_}")
         else:
-            warnings.warn(f"File {file_} does not match any known pattern.")
+            file_pairs[pair_key] = file_
 
     # Match R1 and R2 pairs and prepare the output
     matched_pairs = []
@@ -81,31 +71,64 @@ def find_paired_end_files(directory: str) -> list[tuple[str, str, str]]:
     return matched_pairs
 
 
-def smart_open(file_path: str, mode: str = "r") -> IO[str] | gzip.GzipFile:
+def smart_open(
+    file_path: str,
+    mode: str = "r",
+    backend: str = "auto",
+    prefetch_size: int = PREFETCH_SIZE,
+    compresslevel: int | str = DEFAULT_COMPRESS_LEVEL,
+    threads: int | None = None,
+) -> IO[str] | IO[bytes]:
     """Open a file as text or as a gzip file based on its magic number.
 
     Args:
         file_path (str): Path to the file to be opened.
         mode (str): Mode in which the file should be opened. Defaults to 'rt' (read text).
+            'rb' returns a binary file object with transparent gzip decompression.
+        backend (str): Inflate backend for gzip files in read modes, see
+            `easy_amplicon.utils_gzip`. Defaults to the fastest available one.
+        prefetch_size (int): Bytes of decompressed data read ahead on a background
+            thread for gzip files in read modes, 0 to decompress on the calling thread.
+        compresslevel (int | str): Compression level of .gz files in write mode, or
+            "auto" to pick one from the measured CPU and disk throughput (output
+            then not reproducible).
+        threads (int | None): Number of compression threads of .gz files in write
+            mode, defaults to the number of available CPUs.
 
     Returns:
-        IO[str] | gzip.GzipFile: A file object or a gzip file object.
+        IO[str] | IO[bytes]: A file object, which decompresses gzip files (and decodes
+            read tables, see `easy_amplicon.utils_reads`) transparently.
     """
 
-    if mode == "r":
+    if mode in ("r", "rb"):
         with open(file_path, "rb") as f:
-            first_two_bytes = f.read(2)
-        if first_two_bytes == b"\x1f\x8b":  # Magic number for gzip files
-            return gzip.open(file_path, "rt")
+            magic = f.read(6)
+        if magic[:2] == b"\x1f\x8b":  # Magic number for gzip files
+            f = open_gzip_read(file_path, backend, prefetch_size)
+            return io.TextIOWrapper(f) if mode == "r" else f
+        elif magic == b"ARROW1" and file_path.endswith(".fqa"):
+            # read tables are streamed as FASTQ text
+            from easy_amplicon.utils_reads import open_reads_fastq
+
+            f = open_reads_fastq(file_path)
+            return io.TextIOWrapper(f) if mode == "r" else f
         else:
-            return open(file_path, "r")
+            return open(file_path, mode)
     elif mode == "w":
         if file_path.endswith(".gz") or file_path.endswith(".gzip"):
-            return gzip.open(file_path, "wt")
+            return io.TextIOWrapper(open_gzip_write(file_path, compresslevel, threads))
         else:
             return open(file_path, "w")
     else:
-        raise ValueError(f"Mode must be 'r' or 'w' if specified, getting {mode}.")
+        raise ValueError(f"Mode must be 'r', 'rb' or 'w' if specified, getting {mode}.")
+
+
+# Size of the raw blocks read from each input FASTQ by the bytes kernel below. Large
+# blocks amortize the Python overhead of parsing and renaming over many records.
+FASTQ_BLOCK_SIZE = 4 * 1024 * 1024
+# Maximum number of renamed chunks (each up to about two blocks) buffered between the
+# worker processes and the writer in the parallel mode of `cat_fastq`/`cat_fastq_se`.
+MAX_CHUNKS_IN_FLIGHT = 16
 
 
 def cat_fastq(
@@ -115,6 +138,10 @@ def cat_fastq(
     metadata: str = None,
     _remove_undet: bool = True,
     _have_sample_name: bool = False,
+    num_workers: int = 1,
+    ordered: bool = True,
+    stats_path: str = None,
+    preview: int | None = None,
 ) -> None:
     """Process FASTQ files in the given directory, renaming reads,and write the output
     to the specified file pointers. Output fastq will be interleaved if `output_fp_r2`
@@ -123,10 +150,26 @@ def cat_fastq(
     This function reinvents the wheel implemented in many bioinformatics tools, but I
     am still doing this for customizing the read renaming.
 
+    Reads are parsed, renamed and written in large blocks of bytes (see
+    `_iter_fastq_pair_chunks`), the output is identical to renaming each record with
+    `_rename_read_illumina` or `_rename_read_concat`.
+
     Args:
         directory: Directory containing FASTQ files.
         output_fp_r1: File pointer to write the R1 output.
         output_fp_r2: File pointer to write the R2 output.
+        num_workers: Number of worker processes decompressing and renaming samples
+            in parallel. The output is still written from the calling process.
+        ordered: Only relevant when `num_workers` > 1. If True, samples are written
+            in the same order as with a single worker. Otherwise chunks of different
+            samples are written as soon as they are ready, which keeps all workers
+            busy when sample sizes are uneven. Read pairs stay intact either way.
+        stats_path: If given, per-sample read statistics (see `write_read_stats`) are
+            collected while streaming and written to this .tsv or .json file at the
+            end, which saves a separate pass over the input for depth metadata.
+        preview: If given, only a reproducible sample of this many read pairs of each
+            sample is written, see `easy_amplicon.utils_preview`. Read statistics still
+            cover all reads.
     """
     matched_pairs = find_paired_end_files(directory)
     if output_fp_r2 is None:
@@ -136,63 +179,26 @@ def cat_fastq(
     else:
         samples_in_meta = None
 
-    if (
-        (
-            isinstance(output_fp_r1, gzip.GzipFile)
-            and isinstance(output_fp_r2, gzip.GzipFile)
-        )
-        or (
-            isinstance(output_fp_r1, io.BufferedWriter)
-            and isinstance(output_fp_r2, io.BufferedWriter)
-        )
-        or (
-            isinstance(output_fp_r1, io.BytesIO)
-            and isinstance(output_fp_r2, io.BytesIO)
-        )
-    ):
-
-        def write_line(line1, line2: str):
-            output_fp_r1.write(line1.encode())
-            output_fp_r2.write(line2.encode())
-
-    elif isinstance(output_fp_r1, io.TextIOBase) and isinstance(
-        output_fp_r2, io.TextIOBase
-    ):
-
-        def write_line(line1, line2: str):
-            output_fp_r1.write(line1)
-            output_fp_r2.write(line2)
-
-    else:
-        raise ValueError("Output file pointers must be both gzip or both text file.")
-
-    if _have_sample_name:
-        rename_read = _rename_read_concat
-    else:
-        rename_read = _rename_read_illumina
+    write_r1, write_r2 = _get_chunk_writers(output_fp_r1, output_fp_r2)
+    interleaved = output_fp_r1 is output_fp_r2
 
-    for r1_path, r2_path, sample_name in tqdm(matched_pairs):
+    tasks = []
+    for r1_path, r2_path, sample_name in matched_pairs:
         if samples_in_meta is not None and sample_name not in samples_in_meta:
             continue
         if _remove_undet and sample_name == "Undetermined":
             continue
-        with smart_open(r1_path) as r1_file, smart_open(r2_path) as r2_file:
-            paired_read_iter = zip(
-                zip(*[r1_file] * 4, strict=True),
-                zip(*[r2_file] * 4, strict=True),
-                strict=True,
-            )
+        tasks.append(((r1_path, r2_path), sample_name, _have_sample_name, interleaved))
 
-            for read_index, (r1_lines, r2_lines) in enumerate(
-                paired_read_iter, start=1
-            ):
-                # Renaming reads
-                write_line(
-                    rename_read(r1_lines[0], sample_name, 1, read_index)
-                    + "".join(r1_lines[1:]),
-                    rename_read(r2_lines[0], sample_name, 2, read_index)
-                    + "".join(r2_lines[1:]),
-                )
+    sample_stats = {} if stats_path is not None else None
+    for chunk_r1, chunk_r2 in _iter_fastq_chunks(
+        tasks, num_workers, ordered, sample_stats, preview=preview
+    ):
+        write_r1(chunk_r1)
+        if chunk_r2 is not None:
+            write_r2(chunk_r2)
+    if stats_path is not None:
+        write_read_stats(sample_stats, stats_path)
 
 
 def cat_fastq_se(
@@ -202,75 +208,611 @@ def cat_fastq_se(
     _remove_undet: bool = True,
     _have_sample_name: bool = False,
     _r2: bool = False,
+    num_workers: int = 1,
+    ordered: bool = True,
+    stats_path: str = None,
+    preview: int | None = None,
 ):
     """Similar as above but simply list all fastq/fq/fastq.gz/fq.gz files in the
     directory and concatenate them into a single file with new read names. Good for
-    single-end reads.
+    single-end reads. Statistics of files of the same sample are summed up, while
+    `preview` samples each file on its own.
     """
-    fastq_files = (
-        glob.glob(os.path.join(directory, "*.fastq.gz"))
-        + glob.glob(os.path.join(directory, "*.fq.gz"))
-        + glob.glob(os.path.join(directory, "*.fastq"))
-        + glob.glob(os.path.join(directory, "*.fq"))
-    )
-
     files = []
-    for file_ in fastq_files:
-        for pattern in [PATTERN_ILLUMINA, PATTERN_CUSTOM]:
-            match = pattern.search(os.path.basename(file_))
-            if match:
-                sample_name, read_type = match.groups()[:2]
-                read_type = {"1": "R1", "2": "R2"}.get(read_type, read_type)
-                if read_type not in ["R1", "R2"]:
-                    warnings.warn(f"Invalid read type for file: {file_}")
-                    continue
-                if _r2:
-                    if read_type == "R1":
-                        continue
-                else:
-                    if read_type == "R2":
-                        continue
-                files.append((file_, sample_name, read_type))
-                break
+    for entry in get_fastq_manifest(directory):
+        if entry["sample"] is None or entry["read"] != ("R2" if _r2 else "R1"):
+            continue
+        files.append((entry["path"], entry["sample"], entry["read"]))
 
     if metadata is not None:
         samples_in_meta = pd.read_table(metadata, index_col=0).index.to_list()
     else:
         samples_in_meta = None
 
-    if isinstance(output_fp, gzip.GzipFile) or isinstance(output_fp, io.BufferedWriter):
+    write_chunk, _ = _get_chunk_writers(output_fp, output_fp)
+
+    tasks = []
+    for file_, sample_name, read_type in files:
+        # match = PATTERN_ILLUMINA.search(os.path.basename(file_))
+        # if match:
+        # sample_name = match.group(1)
+        # sample_name = os.path.basename(file_).split(".")[0].split("_")[0]
+        if samples_in_meta is not None and sample_name not in samples_in_meta:
+            continue
+        if _remove_undet and sample_name == "Undetermined":
+            continue
+        tasks.append(((file_,), sample_name, _have_sample_name, True))
+
+    sample_stats = {} if stats_path is not None else None
+    for chunk, _ in _iter_fastq_chunks(
+        tasks, num_workers, ordered, sample_stats, preview=preview
+    ):
+        write_chunk(chunk)
+    if stats_path is not None:
+        write_read_stats(sample_stats, stats_path)
+
 
-        def write_line(line):
-            output_fp.write(line.encode())
+# Expected number of errors of a base given its Phred+33 quality character.
+_EXPECTED_ERROR = (10 ** (-(np.arange(256, dtype=np.float64) - 33) / 10)).clip(max=1)
 
-    elif isinstance(output_fp, io.TextIOBase):
 
-        def write_line(line):
-            output_fp.write(line)
+def _new_read_stats() -> dict:
+    return {
+        "read_count": 0,
+        "num_records": 0,
+        "num_bases": 0,
+        "ee_sum": 0.0,
+        "n_bases": 0,
+    }
 
+
+def _tap_read_stats(
+    stats: dict, block: bytes, newlines: np.ndarray, read_number: int
+) -> None:
+    """Add the records of a block from `_iter_fastq_blocks` to the statistics of a
+    sample. Only R1 (or single-end) records count as reads, R2 records add their
+    bases, expected errors and Ns.
+    """
+    # joining the sequence and quality lines and counting in C is faster than
+    # gathering and reducing them with numpy
+    ends = newlines.tolist()
+    seqs = b"".join([block[i + 1 : j] for i, j in zip(ends[0::4], ends[1::4])])
+    quals = b"".join([block[i + 1 : j] for i, j in zip(ends[2::4], ends[3::4])])
+    qual_hist = np.bincount(np.frombuffer(quals, dtype=np.uint8), minlength=256)
+    if read_number == 1:
+        stats["read_count"] += len(ends) // 4
+    stats["num_records"] += len(ends) // 4
+    stats["num_bases"] += len(seqs)
+    stats["ee_sum"] += float(qual_hist @ _EXPECTED_ERROR)
+    stats["n_bases"] += seqs.count(b"N")
+
+
+def write_read_stats(sample_stats: dict[str, dict], output_path: str) -> None:
+    """Write per-sample read statistics collected by `cat_fastq`/`cat_fastq_se`.
+
+    Columns are "read_count" (reads, or read pairs), "num_bases" (bases of all
+    reads), "mean_ee" (mean expected number of errors per read, from base qualities)
+    and "n_fraction" (fraction of bases that are N). The output is a JSON object keyed
+    by sample if `output_path` ends with .json, otherwise a TSV indexed by sample.
+    """
+    df = pd.DataFrame.from_dict(
+        sample_stats,
+        orient="index",
+        columns=["read_count", "num_records", "num_bases", "ee_sum", "n_bases"],
+    )
+    df["mean_ee"] = (df["ee_sum"] / df["num_records"].clip(lower=1)).round(4)
+    df["n_fraction"] = (df["n_bases"] / df["num_bases"].clip(lower=1)).round(6)
+    df = df[["read_count", "num_bases", "mean_ee", "n_fraction"]]
+    df.index.name = "sample"
+    if output_path.endswith(".json"):
+        df.to_json(output_path, orient="index", indent=2)
     else:
-        raise ValueError("Output file pointer must be gzip or text file.")
+        df.to_csv(output_path, sep="\t")
+
 
-    if _have_sample_name:
-        rename_read = _rename_read_concat
+def _iter_sample_chunks(
+    paths: tuple[str, ...],
+    sample_name: str,
+    have_sample_name: bool,
+    interleaved: bool,
+    stats: dict = None,
+) -> Iterator[tuple[bytes, bytes | None]]:
+    """Yield renamed chunks of one sample, given as a single-end FASTQ or an R1/R2
+    pair, in the format of `_iter_fastq_pair_chunks`. Read statistics are added to
+    `stats` if given.
+    """
+    if len(paths) == 1:
+        with smart_open(paths[0], "rb") as f:
+            for chunk in _iter_fastq_se_chunks(
+                f, sample_name, have_sample_name, stats=stats
+            ):
+                yield chunk, None
+        return
+    with smart_open(paths[0], "rb") as r1_file, smart_open(paths[1], "rb") as r2_file:
+        yield from _iter_fastq_pair_chunks(
+            r1_file, r2_file, sample_name, have_sample_name, interleaved, stats=stats
+        )
+
+
+def _iter_fastq_chunks(
+    tasks: list[tuple],
+    num_workers: int = 1,
+    ordered: bool = True,
+    sample_stats: dict[str, dict] = None,
+    iter_chunks: Callable[..., Iterator[tuple]] = _iter_sample_chunks,
+    preview: int | None = None,
+) -> Iterator[tuple[bytes, bytes | None]]:
+    """Yield renamed chunks of all samples, where each task holds the arguments of
+    `iter_chunks`, whose second one is the sample name. With more than one worker,
+    samples are processed in worker processes that hand chunks over through bounded
+    queues, so at most about `MAX_CHUNKS_IN_FLIGHT` chunks are held in memory. If
+    `sample_stats` is given, read statistics are collected along the way and stored in
+    it by sample name.
+
+    `iter_chunks` defaults to `_iter_sample_chunks`. Any other must be a module level
+    function (workers are spawned) taking a `stats` keyword like it. With `preview`,
+    only a sample of that many reads of each sample is yielded, see
+    `easy_amplicon.utils_preview`.
+    """
+    if preview is not None:
+        if iter_chunks is not _iter_sample_chunks:
+            raise ValueError("Previews are only supported with `_iter_sample_chunks`.")
+        # imported here, utils_preview builds on this module
+        from easy_amplicon.utils_preview import _iter_preview_chunks
+
+        tasks = [(*task, preview) for task in tasks]
+        iter_chunks = _iter_preview_chunks
+    tap = sample_stats is not None
+    num_workers = min(num_workers, len(tasks))
+    if num_workers <= 1:
+        for task in tqdm(tasks):
+            stats = _new_read_stats() if tap else None
+            yield from iter_chunks(*task, stats=stats)
+            if tap:
+                _merge_read_stats(sample_stats, task[1], stats)
+        return
+
+    # spawn instead of fork so that workers do not inherit pipes to child processes
+    # (e.g. fastp's stdin), which would keep them open after the parent closes them
+    context = multiprocessing.get_context("spawn")
+    if ordered:
+        # samples are assigned round-robin and each worker has its own queue, which
+        # is read in sample order
+        task_queues = [context.Queue() for _ in range(num_workers)]
+        chunk_queues = [
+            context.Queue(max(1, MAX_CHUNKS_IN_FLIGHT // num_workers))
+            for _ in range(num_workers)
+        ]
+        for i, task in enumerate(tasks):
+            task_queues[i % num_workers].put(task)
     else:
-        rename_read = _rename_read_illumina
+        # workers take samples as they become free and share one queue
+        task_queues = [context.Queue()] * num_workers
+        chunk_queues = [context.Queue(MAX_CHUNKS_IN_FLIGHT)] * num_workers
+        for task in tasks:
+            task_queues[0].put(task)
+    for task_queue in task_queues:
+        task_queue.put(None)
+    workers = [
+        context.Process(
+            target=_fastq_chunk_worker,
+            args=(task_queues[i], chunk_queues[i], tap, iter_chunks),
+            daemon=True,
+        )
+        for i in range(num_workers)
+    ]
+    for worker in workers:
+        worker.start()
 
-    for file_, sample_name, read_type in tqdm(files):
-        # match = PATTERN_ILLUMINA.search(os.path.basename(file_))
-        # if match:
-        # sample_name = match.group(1)
-        # sample_name = os.path.basename(file_).split(".")[0].split("_")[0]
-        if samples_in_meta is not None and sample_name not in samples_in_meta:
+    try:
+        with tqdm(total=len(tasks)) as pbar:
+            for i in range(len(tasks)):
+                worker_id = i % num_workers if ordered else None
+                while True:
+                    item = _get_chunk(chunk_queues[i % num_workers], workers, worker_id)
+                    if isinstance(item, dict):  # end of a sample
+                        if tap:
+                            _merge_read_stats(
+                                sample_stats, item["sample"], item["stats"]
+                            )
+                        pbar.update()
+                        break
+                    yield item
+        for worker in workers:
+            worker.join()
+    finally:
+        for worker in workers:
+            if worker.is_alive():
+                worker.terminate()
+
+
+def _fastq_chunk_worker(
+    task_queue: multiprocessing.Queue,
+    chunk_queue: multiprocessing.Queue,
+    tap: bool = False,
+    iter_chunks: Callable[..., Iterator[tuple]] = _iter_sample_chunks,
+) -> None:
+    """Rename the samples from `task_queue` with `iter_chunks` until None is received
+    and put their chunks to `chunk_queue`, followed by `{"sample": ..., "stats": ...}`
+    after each sample, where "stats" is None unless `tap`. An exception is put to the
+    queue instead if anything fails.
+    """
+    try:
+        for task in iter(task_queue.get, None):
+            stats = _new_read_stats() if tap else None
+            for chunks in iter_chunks(*task, stats=stats):
+                chunk_queue.put(chunks)
+            chunk_queue.put({"sample": task[1], "stats": stats})
+    except Exception as e:
+        chunk_queue.put(e)
+
+
+def _merge_read_stats(sample_stats: dict, sample_name: str, stats: dict) -> None:
+    if sample_name not in sample_stats:
+        sample_stats[sample_name] = stats
+        return
+    for key, value in stats.items():
+        sample_stats[sample_name][key] += value
+
+
+def _get_chunk(
+    chunk_queue: multiprocessing.Queue,
+    workers: list[multiprocessing.Process],
+    worker_id: int | None = None,
+) -> tuple[bytes, bytes | None] | dict:
+    """Get an item from a worker queue, raising the exception sent by a worker or
+    RuntimeError if the workers feeding the queue died without sending anything.
+    """
+    feeding = workers if worker_id is None else [workers[worker_id]]
+    while True:
+        try:
+            item = chunk_queue.get(timeout=1)
+        except queue.Empty:
+            if not any(worker.is_alive() for worker in feeding):
+                raise RuntimeError("FASTQ worker process exited unexpectedly.")
             continue
-        if _remove_undet and sample_name == "Undetermined":
+        if isinstance(item, Exception):
+            raise item
+        return item
+
+
+def _get_chunk_writers(output_fp_r1, output_fp_r2) -> tuple[Callable, Callable]:
+    """Return functions writing chunks of bytes to the two output file pointers, which
+    must be both binary or both text.
+    """
+    # e.g. gzip.GzipFile, io.BytesIO, PipeFeeder or ShardedTool
+    binary_types = (io.BufferedIOBase, io.RawIOBase)
+    if isinstance(output_fp_r1, binary_types) and isinstance(
+        output_fp_r2, binary_types
+    ):
+        return output_fp_r1.write, output_fp_r2.write
+    elif isinstance(output_fp_r1, io.TextIOBase) and isinstance(
+        output_fp_r2, io.TextIOBase
+    ):
+        return (
+            lambda chunk: output_fp_r1.write(chunk.decode()),
+            lambda chunk: output_fp_r2.write(chunk.decode()),
+        )
+    else:
+        raise ValueError("Output file pointers must be both gzip or both text file.")
+
+
+def _iter_fastq_blocks(
+    file_: IO[bytes], block_size: int = FASTQ_BLOCK_SIZE
+) -> Iterator[tuple[bytes, np.ndarray, bool]]:
+    """Read a binary FASTQ file in large blocks and yield blocks of complete records.
+
+    Each item is `(block, newlines, terminated)`, where `block` ends with a newline,
+    `newlines` holds the positions of all newlines in the block, and `terminated`
+    tells whether the file has a newline at the end of the block, which is only False
+    for the last block of a file without trailing newline. Line endings are normalized
+    the same way as universal newlines in text mode.
+    """
+    pending = b""
+    while True:
+        block = file_.read(block_size)
+        if not block:
+            break
+        if block.endswith(b"\r"):  # do not split a \r\n across two blocks
+            block += file_.read(1)
+        if b"\r" in block:
+            block = block.replace(b"\r\n", b"\n").replace(b"\r", b"\n")
+        if pending:
+            block = pending + block
+        newlines = np.flatnonzero(np.frombuffer(block, dtype=np.uint8) == 10)
+        # cut after the newline ending the last complete record
+        num_lines = len(newlines) // 4 * 4
+        if not num_lines:
+            pending = block
             continue
-        with smart_open(file_) as f:
-            for read_index, lines in enumerate(zip(*[f] * 4, strict=True), start=1):
-                write_line(
-                    rename_read(lines[0], sample_name, 1, read_index)
-                    + "".join(lines[1:])
-                )
+        end = newlines[num_lines - 1] + 1
+        pending = block[end:]
+        yield block[:end], newlines[:num_lines], True
+    if pending:
+        terminated = pending.endswith(b"\n")
+        if not terminated:
+            pending += b"\n"
+        newlines = np.flatnonzero(np.frombuffer(pending, dtype=np.uint8) == 10)
+        if len(newlines) % 4:
+            raise ValueError("Number of lines in FASTQ file is not a multiple of 4.")
+        yield pending, newlines, terminated
+
+
+# Number of parts a renamed record is made of in `_format_records`.
+_RECORD_PARTS = 6
+
+
+def _format_records(
+    block: bytes,
+    newlines: np.ndarray,
+    sample_name: str,
+    read_number: int,
+    read_index_start: int,
+    have_sample_name: bool,
+) -> list[bytes]:
+    """Rename all records in a block of complete FASTQ records and return them as a
+    list of parts to be joined by b"", `_RECORD_PARTS` parts per record.
+
+    The output is identical to calling `_rename_read_illumina` (or
+    `_rename_read_concat` if `have_sample_name`) on the header of each record. To keep
+    the number of Python objects per record low, headers are located with NumPy and
+    the block is cut into pieces with a single `bytes.split`. Blocks with unusual
+    headers fall back to renaming record by record.
+    """
+    num_reads = len(newlines) // 4
+    if not num_reads:
+        return []
+    header_ends = newlines[0::4]
+    header_starts = np.empty_like(header_ends)
+    header_starts[0] = 0
+    header_starts[1:] = newlines[3:-1:4] + 1
+
+    # control characters other than newlines include whitespaces that `str.split()`
+    # would split headers on, blocks containing any of them (rare in practice) are
+    # renamed record by record, as are blocks with non-ASCII characters
+    parts = None
+    arr = np.frombuffer(block, dtype=np.uint8)
+    if block.isascii() and np.count_nonzero(arr < 32) == len(newlines):
+        if have_sample_name:
+            parts = _split_concat_headers(
+                block, header_starts, header_ends, sample_name
+            )
+        else:
+            parts = _split_illumina_headers(
+                block,
+                header_starts,
+                header_ends,
+                sample_name,
+                read_number,
+                read_index_start,
+            )
+    if parts is not None:
+        return parts
+
+    # fall back to the reference implementation record by record
+    rename_read = _rename_read_concat if have_sample_name else _rename_read_illumina
+    lines = block.split(b"\n")
+    parts = [b""] * (num_reads * _RECORD_PARTS)
+    parts[0::_RECORD_PARTS] = [
+        rename_read(header.decode() + "\n", sample_name, read_number, i).encode()
+        for i, header in enumerate(lines[0:-1:4], start=read_index_start)
+    ]
+    parts[1::_RECORD_PARTS] = [
+        b"%s\n%s\n%s\n" % record
+        for record in zip(lines[1::4], lines[2::4], lines[3::4])
+    ]
+    return parts
+
+
+def _split_illumina_headers(
+    block: bytes,
+    header_starts: np.ndarray,
+    header_ends: np.ndarray,
+    sample_name: str,
+    read_number: int,
+    read_index_start: int,
+) -> list[bytes] | None:
+    """Rename records with `@<name>[ <comment>]` headers to
+    `@sample=<sample_name> <read_number> <read_index> <name>`, or return None if any
+    header is unusual.
+    """
+    arr = np.frombuffer(block, dtype=np.uint8)
+    num_reads = len(header_starts)
+    # an empty header or one starting with a space is handled differently by
+    # `_rename_read_illumina`
+    if (header_ends == header_starts).any() or (arr[header_starts] == 32).any():
+        return None
+    spaces = np.flatnonzero(arr == 32)
+    marked = arr.copy()
+    marked[header_starts] = 0
+    if not len(spaces):
+        # no comments, cut each record after the "@"
+        rests = marked.tobytes().split(b"\x00")[1:]
+    else:
+        # the last header may have no space after it
+        first_spaces = np.append(spaces, len(block))[
+            np.searchsorted(spaces, header_starts)
+        ]
+        if (first_spaces >= header_ends).any():
+            return None
+        comment_lengths = header_ends - first_spaces
+        if (
+            len(spaces) == num_reads
+            and (comment_lengths == comment_lengths[0]).all()
+            and (
+                arr[first_spaces[:, None] + np.arange(comment_lengths[0])]
+                == arr[first_spaces[0] : header_ends[0]]
+            ).all()
+        ):
+            # all spaces are in headers, one per header, and all reads have the same
+            # comment (e.g. " 1:N:0:1"), which can be removed in one go
+            comment = block[first_spaces[0] : header_ends[0] + 1]
+            rests = marked.tobytes().replace(comment, b"\n").split(b"\x00")[1:]
+        else:
+            marked[first_spaces] = 0
+            marked[header_ends] = 0
+            pieces = marked.tobytes().split(b"\x00")
+            parts = [b"\n"] * (num_reads * _RECORD_PARTS)
+            parts[3::_RECORD_PARTS] = pieces[1::3]
+            parts[5::_RECORD_PARTS] = pieces[3::3]
+            rests = None
+    if rests is not None:
+        parts = [b""] * (num_reads * _RECORD_PARTS)
+        parts[3::_RECORD_PARTS] = rests
+    parts[0::_RECORD_PARTS] = [f"@sample={sample_name} {read_number} ".encode()] * (
+        num_reads
+    )
+    parts[1::_RECORD_PARTS] = _format_read_indices(read_index_start, num_reads)
+    parts[2::_RECORD_PARTS] = [b" "] * num_reads
+    return parts
+
+
+def _split_concat_headers(
+    block: bytes,
+    header_starts: np.ndarray,
+    header_ends: np.ndarray,
+    sample_name: str,
+) -> list[bytes] | None:
+    """Rename records with `@<key>=<sample> <comment>` headers to
+    `@sample=<sample>_<sample_name> <comment>`, or return None if any header is
+    unusual.
+    """
+    arr = np.frombuffer(block, dtype=np.uint8)
+    num_reads = len(header_starts)
+    spaces = np.append(np.flatnonzero(arr == 32), len(block))
+    equals = np.append(np.flatnonzero(arr == ord("=")), len(block))
+    first_spaces = spaces[np.searchsorted(spaces, header_starts)]
+    first_equals = equals[np.searchsorted(equals, header_starts)]
+    # `_rename_read_concat` raises on headers without "=" in the name or without a
+    # comment, and strips all whitespaces between them, single spaces are handled here
+    if (
+        (first_spaces <= header_starts + 1).any()
+        or (first_equals >= first_spaces).any()
+        or (first_spaces + 1 >= header_ends).any()
+        or (arr[first_spaces + 1] == 32).any()
+    ):
+        return None
+    marked = arr.copy()
+    marked[header_starts] = 0
+    marked[first_equals] = 0
+    marked[first_spaces] = 0
+    pieces = marked.tobytes().split(b"\x00")
+    parts = [b""] * (num_reads * _RECORD_PARTS)
+    parts[0::_RECORD_PARTS] = [b"@sample="] * num_reads
+    parts[1::_RECORD_PARTS] = pieces[2::3]
+    parts[2::_RECORD_PARTS] = [f"_{sample_name} ".encode()] * num_reads
+    parts[3::_RECORD_PARTS] = pieces[3::3]
+    return parts
+
+
+def _format_read_indices(start: int, num_reads: int) -> list[bytes]:
+    """Return `str(read_index).encode()` for `num_reads` consecutive read indices from
+    `start`, built with NumPy instead of one `str` call per index.
+    """
+    read_indices = np.arange(start, start + num_reads, dtype=np.int64)
+    num_digits = np.ones(num_reads, dtype=np.int64)
+    for power in range(1, len(str(start + num_reads))):
+        num_digits += read_indices >= 10**power
+    # one row per read index, digits are right-aligned and followed by a newline
+    width = int(num_digits.max()) + 1
+    grid = np.full((num_reads, width), ord("0"), dtype=np.uint8)
+    grid[:, -1] = ord("\n")
+    remainder = read_indices
+    for column in range(width - 2, -1, -1):
+        remainder, digit = np.divmod(remainder, 10)
+        grid[:, column] += digit.astype(np.uint8)
+    mask = np.arange(width) >= width - 1 - num_digits[:, None]
+    return grid[mask].tobytes().split(b"\n")[:-1]
+
+
+def _iter_fastq_se_chunks(
+    file_: IO[bytes],
+    sample_name: str,
+    have_sample_name: bool = False,
+    block_size: int = FASTQ_BLOCK_SIZE,
+    stats: dict = None,
+) -> Iterator[bytes]:
+    """Yield chunks of renamed reads (bytes) from a single-end binary FASTQ file."""
+    read_index = 1
+    for block, newlines, terminated in _iter_fastq_blocks(file_, block_size):
+        if stats is not None:
+            _tap_read_stats(stats, block, newlines, 1)
+        parts = _format_records(
+            block, newlines, sample_name, 1, read_index, have_sample_name
+        )
+        read_index += len(parts) // _RECORD_PARTS
+        yield b"".join(parts) if terminated else b"".join(parts)[:-1]
+
+
+def _iter_fastq_pair_chunks(
+    file_r1: IO[bytes],
+    file_r2: IO[bytes],
+    sample_name: str,
+    have_sample_name: bool = False,
+    interleaved: bool = True,
+    block_size: int = FASTQ_BLOCK_SIZE,
+    stats: dict = None,
+) -> Iterator[tuple[bytes, bytes | None]]:
+    """Yield chunks of renamed read pairs from a pair of binary FASTQ files.
+
+    If `interleaved`, each item is `(chunk, None)` where R1 and R2 records alternate in
+    `chunk`, otherwise each item is `(chunk_r1, chunk_r2)` holding the same reads.
+    Raises ValueError if the two files have different numbers of records. Read
+    statistics are added to `stats` if given.
+    """
+    iter_r1 = _iter_fastq_blocks(file_r1, block_size)
+    iter_r2 = _iter_fastq_blocks(file_r2, block_size)
+    no_block = (b"", np.zeros(0, dtype=np.int64), True)
+    parts_r1, parts_r2 = [], []
+    term_r1 = term_r2 = True
+    index_r1 = index_r2 = 1
+    while True:
+        # keep both buffers non-empty so that records can be paired up
+        if not parts_r1:
+            block, newlines, term_r1 = next(iter_r1, no_block)
+            if stats is not None:
+                _tap_read_stats(stats, block, newlines, 1)
+            parts_r1 = _format_records(
+                block, newlines, sample_name, 1, index_r1, have_sample_name
+            )
+            index_r1 += len(parts_r1) // _RECORD_PARTS
+        if not parts_r2:
+            block, newlines, term_r2 = next(iter_r2, no_block)
+            if stats is not None:
+                _tap_read_stats(stats, block, newlines, 2)
+            parts_r2 = _format_records(
+                block, newlines, sample_name, 2, index_r2, have_sample_name
+            )
+            index_r2 += len(parts_r2) // _RECORD_PARTS
+        if not parts_r1 and not parts_r2:
+            break
+        if not parts_r1 or not parts_r2:
+            raise ValueError(
+                f"R1 and R2 of sample {sample_name} have different number of reads."
+            )
+        num_parts = min(len(parts_r1), len(parts_r2))
+        batch_r1, parts_r1 = parts_r1[:num_parts], parts_r1[num_parts:]
+        batch_r2, parts_r2 = parts_r2[:num_parts], parts_r2[num_parts:]
+        if not interleaved:
+            chunk_r1, chunk_r2 = b"".join(batch_r1), b"".join(batch_r2)
+            # only the last record of a file can miss its newline
+            if not (term_r1 or parts_r1):
+                chunk_r1 = chunk_r1[:-1]
+            if not (term_r2 or parts_r2):
+                chunk_r2 = chunk_r2[:-1]
+            yield chunk_r1, chunk_r2
+            continue
+        if not (term_r1 or parts_r1):
+            batch_r1[-_RECORD_PARTS:] = [b"".join(batch_r1[-_RECORD_PARTS:])[:-1]]
+            batch_r1 += [b""] * (_RECORD_PARTS - 1)
+        if not (term_r2 or parts_r2):
+            batch_r2[-_RECORD_PARTS:] = [b"".join(batch_r2[-_RECORD_PARTS:])[:-1]]
+            batch_r2 += [b""] * (_RECORD_PARTS - 1)
+        parts = batch_r1 + batch_r2
+        for i in range(_RECORD_PARTS):
+            parts[i :: 2 * _RECORD_PARTS] = batch_r1[i::_RECORD_PARTS]
+            parts[i + _RECORD_PARTS :: 2 * _RECORD_PARTS] = batch_r2[i::_RECORD_PARTS]
+        yield b"".join(parts), None
 
 
 def _rename_read_illumina(
@@ -303,6 +845,244 @@ def _rename_read_concat(
     return f"@sample={new_sample} {comment}"
 
 
+FASTA_EXTENSIONS = [".fa", ".fasta", ".fna"]
+# .fqa is the columnar read format of `easy_amplicon.utils_reads`, read as FASTQ
+FASTQ_EXTENSIONS = [".fq", ".fastq", ".fqa"]
+# Raw block size for FASTA files, whose records are cut at header lines.
+FASTA_BLOCK_SIZE = 4 * 1024 * 1024
+# Number of records joined into a single write by `write_fastx`.
+WRITE_BATCH_SIZE = 10000
+
+
+def get_fastx_format(file_path: str) -> str:
+    """Return "fastq" or "fasta" given the extension of a (optionally gzipped) file."""
+    name = file_path.removesuffix(".gz")
+    if any(name.endswith(ext) for ext in FASTQ_EXTENSIONS):
+        return "fastq"
+    elif any(name.endswith(ext) for ext in FASTA_EXTENSIONS):
+        return "fasta"
+    else:
+        raise ValueError(f"Unknown file extension: {file_path}")
+
+
+def parse_fastx(
+    file_: str | IO,
+    fmt: str = None,
+    as_bytes: bool = False,
+    full_title: bool = False,
+) -> Iterator[tuple]:
+    """Parse a FASTQ or FASTA file into `(id, seq, qual)` tuples.
+
+    This is a lightweight replacement of `Bio.SeqIO.parse` for the hot paths: the file
+    is read in large blocks (see `_iter_fastq_blocks`) and split into lines in C, so
+    no SeqRecord is built per read. Multi-line FASTA records are supported; FASTQ
+    records must have 4 lines each. Read tables (.fqa) are decoded directly.
+
+    Args:
+        file_: Path to a plain or gzipped file, or a file object opened in binary
+            mode (a text file object is read through its underlying buffer).
+        fmt: "fastq" or "fasta". Told by the file extension if not given.
+        as_bytes: Whether to yield bytes instead of str, which saves decoding.
+        full_title: Whether to yield the whole header line (without "@"/">") instead
+            of the id, i.e., what is `description` instead of `id` in a SeqRecord.
+
+    Returns:
+        An iterator of `(id, seq, qual)`, where `qual` is the raw quality string
+        (Phred+33) for FASTQ and None for FASTA.
+    """
+    if isinstance(file_, str) and file_.endswith(".fqa"):
+        from easy_amplicon.utils_reads import parse_reads
+
+        yield from parse_reads(file_, as_bytes, full_title)
+        return
+    with _open_fastx(file_, fmt) as (f, fmt):
+        if fmt == "fastq":
+            for block, newlines, _ in _iter_fastq_blocks(f):
+                _check_fastq_block(block, newlines)
+                lines = (block if as_bytes else block.decode()).split(
+                    b"\n" if as_bytes else "\n"
+                )
+                titles = _parse_titles(lines[0:-1:4], full_title, 1)
+                yield from zip(titles, lines[1::4], lines[3::4])
+        else:
+            for block in _iter_fasta_blocks(f):
+                if not as_bytes:
+                    block = block.decode()
+                sep, start = block[-1:], block[:1]  # newline and ">" of the same type
+                titles, seqs = [], []
+                # the block starts with ">" and ends with a newline
+                for record in block[1:].split(sep + start):
+                    title, _, seq = record.partition(sep)
+                    titles.append(title)
+                    seqs.append(seq.replace(sep, block[:0]))
+                titles = _parse_titles(titles, full_title, 0)
+                yield from zip(titles, seqs, [None] * len(seqs))
+
+
+def parse_fastx_batches(
+    file_: str | IO, fmt: str = None, full_title: bool = False
+) -> Iterator[dict]:
+    """Parse a FASTQ or FASTA file into NumPy-backed batches of records.
+
+    Sequences (and qualities) of a batch are concatenated into a single uint8 array,
+    with record `i` at `seq[offsets[i]:offsets[i + 1]]`, which suits vectorized
+    processing of many short reads.
+
+    Args:
+        file_: See `parse_fastx`.
+        fmt: See `parse_fastx`.
+        full_title: See `parse_fastx`.
+
+    Returns:
+        An iterator of dicts with keys "ids" (list of str), "offsets" (int64 array of
+        length number of records + 1), "seq" (uint8 array) and "qual" (uint8 array of
+        raw Phred+33 values, None for FASTA).
+    """
+    if isinstance(file_, str) and file_.endswith(".fqa"):
+        from easy_amplicon.utils_reads import iter_read_batches
+
+        for batch in iter_read_batches(file_, full_title):
+            del batch["samples"]
+            yield batch
+        return
+    with _open_fastx(file_, fmt) as (f, fmt):
+        if fmt == "fastq":
+            for block, newlines, _ in _iter_fastq_blocks(f):
+                _check_fastq_block(block, newlines)
+                lines = block.split(b"\n")
+                lengths = newlines[1::4] - newlines[0::4] - 1
+                offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+                np.cumsum(lengths, out=offsets[1:])
+                yield {
+                    "ids": _parse_titles(
+                        b"\n".join(lines[0:-1:4]).decode().split("\n"), full_title, 1
+                    ),
+                    "offsets": offsets,
+                    "seq": np.frombuffer(b"".join(lines[1::4]), dtype=np.uint8),
+                    "qual": np.frombuffer(b"".join(lines[3::4]), dtype=np.uint8),
+                }
+        else:
+            for block in _iter_fasta_blocks(f):
+                titles, seqs = [], []
+                for record in block[1:].split(b"\n>"):
+                    title, _, seq = record.partition(b"\n")
+                    titles.append(title.decode())
+                    seqs.append(seq.replace(b"\n", b""))
+                offsets = np.zeros(len(seqs) + 1, dtype=np.int64)
+                np.cumsum([len(seq) for seq in seqs], out=offsets[1:])
+                yield {
+                    "ids": _parse_titles(titles, full_title, 0),
+                    "offsets": offsets,
+                    "seq": np.frombuffer(b"".join(seqs), dtype=np.uint8),
+                    "qual": None,
+                }
+
+
+def write_fastx(file_: IO, records: Iterable[tuple], fmt: str = "fastq") -> int:
+    """Write `(id, seq, qual)` records, as yielded by `parse_fastx`, to a file.
+
+    Records are formatted in batches and written with a single call per batch. Each
+    record is written on a single line per field, with the id (or full title) as
+    header, like `Bio.SeqIO.write` does for SeqRecords whose description starts with
+    their id (except that FASTA sequences are not wrapped).
+
+    Args:
+        file_: File object, in text mode for str records and in binary mode for bytes
+            records.
+        records: Iterable of `(id, seq, qual)`. `qual` is ignored for FASTA.
+        fmt: "fastq" or "fasta".
+
+    Returns:
+        Number of records written.
+    """
+    if fmt not in ("fastq", "fasta"):
+        raise ValueError(f"Format must be 'fastq' or 'fasta', getting {fmt}.")
+    num_records = 0
+    records = iter(records)
+    while True:
+        batch = list(itertools.islice(records, WRITE_BATCH_SIZE))
+        if not batch:
+            break
+        num_records += len(batch)
+        as_bytes = isinstance(batch[0][1], bytes)
+        nl, head = (b"\n", b"@") if as_bytes else ("\n", "@")
+        if fmt == "fastq":
+            parts = [b"+" if as_bytes else "+"] * (len(batch) * 4)
+            for i, (name, seq, qual) in enumerate(batch):
+                if qual is None or len(qual) != len(seq):
+                    raise ValueError(
+                        f"Quality of FASTQ record {name} is missing or "
+                        "does not match the sequence length."
+                    )
+                parts[4 * i] = head + name
+                parts[4 * i + 1] = seq
+                parts[4 * i + 3] = qual
+        else:
+            head = b">" if as_bytes else ">"
+            parts = [head] * (len(batch) * 2)
+            parts[0::2] = [head + name for name, _, _ in batch]
+            parts[1::2] = [seq for _, seq, _ in batch]
+        file_.write(nl.join(parts) + nl)
+    return num_records
+
+
+@contextlib.contextmanager
+def _open_fastx(file_: str | IO, fmt: str | None) -> Iterator[tuple[IO[bytes], str]]:
+    if isinstance(file_, str):
+        if fmt is None:
+            fmt = get_fastx_format(file_)
+        with smart_open(file_, "rb") as f:
+            yield f, fmt
+        return
+    if fmt not in ("fastq", "fasta"):
+        raise ValueError(f"Format must be 'fastq' or 'fasta', getting {fmt}.")
+    yield file_.buffer if isinstance(file_, io.TextIOBase) else file_, fmt
+
+
+def _check_fastq_block(block: bytes, newlines: np.ndarray) -> None:
+    arr = np.frombuffer(block, dtype=np.uint8)
+    starts = np.empty_like(newlines)
+    starts[0] = 0
+    starts[1:] = newlines[:-1] + 1
+    if not (arr[starts[0::4]] == ord("@")).all():
+        raise ValueError("FASTQ record does not start with '@'.")
+    if not np.array_equal(newlines[1::4] - starts[1::4], newlines[3::4] - starts[3::4]):
+        raise ValueError("Sequence and quality of a FASTQ record differ in length.")
+
+
+def _parse_titles(titles: list, full_title: bool, start: int) -> list:
+    """Turn header lines, from `start` on, into ids (first word) or stripped titles,
+    the same way as SeqIO.
+    """
+    if full_title:
+        return [title[start:].rstrip() for title in titles]
+    return [(title[start:].split(None, 1) or [title[:0]])[0] for title in titles]
+
+
+def _iter_fasta_blocks(
+    file_: IO[bytes], block_size: int = FASTA_BLOCK_SIZE
+) -> Iterator[bytes]:
+    """Yield blocks of complete FASTA records, each starting with ">" and ending with a
+    newline.
+    """
+    pending = b""
+    while True:
+        block = file_.read(block_size)
+        if not block:
+            break
+        block = pending + block.replace(b"\r", b"")
+        if not block.startswith(b">"):
+            raise ValueError("FASTA file does not start with '>'.")
+        end = block.rfind(b"\n>")
+        if end == -1:
+            pending = block
+            continue
+        pending = block[end + 1 :]
+        yield block[: end + 1]
+    if pending:
+        yield pending if pending.endswith(b"\n") else pending + b"\n"
+
+
 def print_command(command: str | list[str]) -> None:
     """Print the given command in a readable format.
     Iterate through the command list and print each element on a new line if starts with
@@ -17,6 +17,7 @@ from Bio import Entrez
 from tqdm import tqdm, trange
 
 from easy_amplicon.utils import print_command
+from easy_amplicon.utils_cpu import add_threads_argument, resolve_threads
 
 
 def blast_online(
@@ -173,7 +174,9 @@ def fetch_taxonomy_ids(
     return taxonomy_ids
 
 
-def blast_local(input_path: str, database: str) -> pd.DataFrame:
+def blast_local(
+    input_path: str, database: str, threads: int | str | None = "auto"
+) -> pd.DataFrame:
     """performs blasts and returns the results"""
     # custom_blast_format = '6 qseqid qlen sseqid pident length qstart qend sstart send evalue bitscore slen staxids'
     custom_blast_format = "6 qseqid qlen sseqid pident length qstart qend sstart send evalue bitscore slen staxids"
@@ -189,7 +192,7 @@ def blast_local(input_path: str, database: str) -> pd.DataFrame:
         "-db",
         database,
         "-num_threads",
-        "16",
+        str(resolve_threads(threads)),
         "-task",
         "megablast",
         "-word_size",
@@ -343,6 +346,7 @@ def main():
         help="number of sequences to blast at once",
     )
     parser.add_argument("-e", "--email", help="email to use for NCBI E-utilities")
+    add_threads_argument(parser)
 
     args = parser.parse_args()
 
@@ -355,7 +359,7 @@ def main():
         df = parse_blast_results(input_)
         df.to_csv(blast_output, index=False, sep="\t")
     elif os.path.isdir(os.path.dirname(database)):
-        df = blast_local(input_, database)
+        df = blast_local(input_, database, args.threads)
         df.to_csv(blast_output, index=False, sep="\t")
     else:
         # must be a fasta file
@@ -0,0 +1,141 @@
+"""CPU budget of the process and its split among tools running at the same time.
+
+Thread counts of external tools used to be hardcoded (fastp `-w 8`, cutadapt
+`--cores 4`, blastn `-num_threads 16`...), which oversubscribes a small container and
+leaves most of a large node idle. `available_cpus` counts the CPUs this process may
+actually use: those of its affinity mask (`os.sched_getaffinity`, set by taskset,
+Slurm or `docker --cpuset-cpus`), capped by the CPU quota of its cgroup (`cpu.max` of
+cgroup v2, `cpu.cfs_quota_us` of cgroup v1, set by `docker --cpus` or Kubernetes
+limits). Command line tools take `--threads auto|N` (see `add_threads_argument`), and
+pipelines hand each of their concurrent stages a proportional share of it with
+`split_threads`.
+"""
+
+import argparse
+import math
+import os
+
+# Mount point of the cgroup file systems, and the cgroups of this process.
+CGROUP_ROOT = "/sys/fs/cgroup"
+PROC_CGROUP = "/proc/self/cgroup"
+
+
+def available_cpus() -> int:
+    """Return the number of CPUs this process can use, at least 1."""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:  # not available on macOS
+        cpus = os.cpu_count() or 1
+    limit = get_cgroup_cpu_limit()
+    if limit is not None:
+        cpus = min(cpus, math.ceil(limit))
+    return max(cpus, 1)
+
+
+def get_cgroup_cpu_limit() -> float | None:
+    """Return the CPU quota of the cgroup of this process and of its parents, in
+    CPUs (e.g. 1.5), or None if there is none.
+    """
+    try:
+        with open(PROC_CGROUP) as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return None
+    limits = []
+    for line in lines:
+        _, controllers, path = line.split(":", 2)
+        if not controllers:  # cgroup v2
+            for directory in _cgroup_dirs(CGROUP_ROOT, path):
+                limits.append(_read_cpu_max(directory))
+        elif "cpu" in controllers.split(","):  # cgroup v1
+            for mount in [controllers, "cpu"]:
+                for directory in _cgroup_dirs(os.path.join(CGROUP_ROOT, mount), path):
+                    limits.append(_read_cfs_quota(directory))
+    limits = [limit for limit in limits if limit is not None]
+    return min(limits) if limits else None
+
+
+def _cgroup_dirs(mount: str, path: str) -> list[str]:
+    """Return the directories of cgroup `path` and of its parents under `mount`. In
+    a container, only the root of the mount, which is the cgroup of the container,
+    may exist.
+    """
+    parts = [part for part in path.split("/") if part]
+    directories = [os.path.join(mount, *parts[:i]) for i in range(len(parts), -1, -1)]
+    return [directory for directory in directories if os.path.isdir(directory)]
+
+
+def _read_cpu_max(directory: str) -> float | None:
+    try:
+        with open(os.path.join(directory, "cpu.max")) as f:
+            quota, period = f.read().split()[:2]
+    except (OSError, ValueError):
+        return None
+    if quota == "max":
+        return None
+    return int(quota) / int(period)
+
+
+def _read_cfs_quota(directory: str) -> float | None:
+    try:
+        with open(os.path.join(directory, "cpu.cfs_quota_us")) as f:
+            quota = int(f.read())
+        with open(os.path.join(directory, "cpu.cfs_period_us")) as f:
+            period = int(f.read())
+    except (OSError, ValueError):
+        return None
+    if quota <= 0 or period <= 0:
+        return None
+    return quota / period
+
+
+def resolve_threads(threads: int | str | None = "auto") -> int:
+    """Return `threads` as a positive number, where "auto" or None stand for all
+    available CPUs.
+    """
+    if threads is None or threads == "auto":
+        return available_cpus()
+    threads = int(threads)
+    if threads < 1:
+        raise ValueError(f"Number of threads must be positive, getting {threads}.")
+    return threads
+
+
+def parse_threads(value: str) -> int:
+    """argparse type of `--threads`, "auto" or a positive number."""
+    try:
+        return resolve_threads(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(
+            f"Expected 'auto' or a positive number, getting {value!r}."
+        )
+
+
+def add_threads_argument(
+    parser: argparse.ArgumentParser, *flags: str, default: int | str = "auto"
+) -> None:
+    """Add `--threads` (or `flags`) to `parser`, parsed into a number of threads."""
+    parser.add_argument(
+        *(flags or ["--threads"]),
+        type=parse_threads,
+        default=default,
+        help='Number of threads, or "auto" for all CPUs available to the process '
+        f"(affinity mask and cgroup quota). Default: {default}",
+    )
+
+
+def split_threads(threads: int, weights: list[float]) -> list[int]:
+    """Split `threads` among stages running at the same time in proportion to
+    `weights`. Every stage gets at least one thread, so the shares add up to more
+    than `threads` when there are more stages than threads.
+    """
+    if not weights or min(weights) <= 0:
+        raise ValueError(f"Weights must be positive, getting {weights}.")
+    spare = max(threads - len(weights), 0)
+    shares = [1 + spare * weight / sum(weights) for weight in weights]
+    counts = [int(share) for share in shares]
+    # hand out what rounding down left over, largest remainders first
+    order = sorted(range(len(shares)), key=lambda i: counts[i] - shares[i])
+    for i in order[: len(weights) + spare - sum(counts)]:
+        counts[i] += 1
+    return counts
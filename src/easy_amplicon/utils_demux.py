@@ -0,0 +1,567 @@
+"""Error-tolerant demultiplexing of isolate plates by combinatorial inline barcodes.
+
+Each well of a plate is told by a pair of inline barcodes: `bcF` at the start of read
+1 and `bcR` at the start of read 2, each followed by a spacer of `linkF`/`linkR`
+arbitrary bases. The layout is a TSV with one well per row:
+
+    well    bcF         linkF   bcR         linkR
+    A1      CGATACTG    1       GACCGCCA    1
+
+`demultiplex_pairs` assigns read pairs to wells in a single pass, without the
+`cutadapt` demultiplexing → per-combination files → rename → re-read round trip. All
+barcode variants within `max_mismatches` substitutions (an N in the read counts as a
+mismatch) are precomputed into lookup tables indexed by the first bases of a read
+encoded in base 5, so assigning a chunk of reads is a few NumPy gathers. Variants as
+close to two barcodes are ambiguous and left unassigned, like reads too short to hold
+a barcode and its spacer. Barcodes and spacers are removed and the well is appended
+to the sample name of each read (`@sample=<plate>_<well> ...`, as `cat_fastq` with
+`_have_sample_name` does), and reads are streamed straight into per-well gzip files,
+or into a single interleaved stream for the next tool (e.g. cutadapt trimming
+primers), or both.
+"""
+
+import itertools
+import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO
+
+import numpy as np
+import pandas as pd
+from loky import get_reusable_executor
+
+from easy_amplicon.utils import (
+    _EXPECTED_ERROR,
+    _iter_fastq_chunks,
+    _merge_read_stats,
+    _new_read_stats,
+    find_paired_end_files,
+    parse_fastx,
+    write_read_stats,
+)
+from easy_amplicon.utils_files import move_file
+from easy_amplicon.utils_shards import _SampleWriter
+
+DEFAULT_BARCODE_LAYOUT = os.path.join(
+    os.path.dirname(__file__), "data", "isolate", "barcode_layout.tsv"
+)
+# Substitutions tolerated per barcode, what cutadapt allows for 8 bp barcodes at the
+# error rate of 0.15 it used to demultiplex with.
+DEMUX_MAX_MISMATCHES = 1
+# Barcodes are looked up in tables of 5 ** length entries (A, C, G, T and N).
+MAX_BARCODE_LENGTH = 10
+UNKNOWN_WELL = "unknown"
+# Per-well files are intermediate and read once, fast compression pays off.
+DEMUX_COMPRESS_LEVEL = 1
+
+# base (byte) -> symbol 0-3 for ACGT, 4 for N and anything else
+_SYMBOLS = np.full(256, 4, dtype=np.int64)
+for _i, _base in enumerate(b"ACGT"):
+    _SYMBOLS[_base] = _i
+    _SYMBOLS[ord(chr(_base).lower())] = _i
+_NO_MATCH = -1
+_AMBIGUOUS = -2
+# parts of a record output by `_demultiplex_chunk`: sample name, well suffix, rest of
+# the header, sequence, separator and quality
+_NUM_PARTS = 6
+
+
+class BarcodeLayout:
+    """Wells of a plate and their barcode pairs, with the lookup tables assigning
+    read prefixes to barcodes.
+
+    Args:
+        wells: Well names.
+        fwd: Read 1 barcode of each well.
+        fwd_spacers: Length of the spacer following each read 1 barcode.
+        rev: Read 2 barcode of each well.
+        rev_spacers: Length of the spacer following each read 2 barcode.
+        max_mismatches: Substitutions tolerated per barcode.
+    """
+
+    def __init__(
+        self,
+        wells: list[str],
+        fwd: list[str],
+        fwd_spacers: list[int],
+        rev: list[str],
+        rev_spacers: list[int],
+        max_mismatches: int = DEMUX_MAX_MISMATCHES,
+    ):
+        if len(set(wells)) != len(wells):
+            raise ValueError("Well names in the barcode layout are not unique.")
+        if UNKNOWN_WELL in wells:
+            raise ValueError(f"{UNKNOWN_WELL} is not allowed as a well name.")
+        self.wells = list(wells)
+        self.max_mismatches = max_mismatches
+        self._args = (wells, fwd, fwd_spacers, rev, rev_spacers, max_mismatches)
+        self.fwd = _BarcodeTable(fwd, fwd_spacers, max_mismatches)
+        self.rev = _BarcodeTable(rev, rev_spacers, max_mismatches)
+        # well by (read 1 barcode, read 2 barcode), the extra last row and column
+        # (index -1) are for reads without a barcode
+        self.num_wells = len(wells)
+        self.grid = np.full(
+            (len(self.fwd.barcodes) + 1, len(self.rev.barcodes) + 1),
+            self.num_wells,
+            dtype=np.int64,
+        )
+        for i, (f, r) in enumerate(zip(fwd, rev)):
+            f = self.fwd.barcodes.index(f.upper())
+            r = self.rev.barcodes.index(r.upper())
+            if self.grid[f, r] != self.num_wells:
+                raise ValueError(
+                    f"Wells {wells[self.grid[f, r]]} and {wells[i]} have "
+                    "the same barcodes."
+                )
+            self.grid[f, r] = i
+
+    def __reduce__(self):
+        # the lookup tables are rebuilt in worker processes instead of being pickled
+        return (BarcodeLayout, self._args)
+
+    @classmethod
+    def from_tsv(
+        cls,
+        path: str = DEFAULT_BARCODE_LAYOUT,
+        max_mismatches: int = DEMUX_MAX_MISMATCHES,
+    ) -> "BarcodeLayout":
+        """Read a layout with columns `well`, `bcF`, `linkF`, `bcR` and `linkR`."""
+        df = pd.read_table(path, dtype={"well": str, "bcF": str, "bcR": str})
+        missing = {"well", "bcF", "linkF", "bcR", "linkR"} - set(df.columns)
+        if missing:
+            raise ValueError(f"Barcode layout {path} misses columns {sorted(missing)}.")
+        return cls(
+            df["well"].tolist(),
+            df["bcF"].tolist(),
+            df["linkF"].astype(int).tolist(),
+            df["bcR"].tolist(),
+            df["linkR"].astype(int).tolist(),
+            max_mismatches,
+        )
+
+    @classmethod
+    def from_fasta(
+        cls,
+        fwd_fasta: str,
+        rev_fasta: str,
+        pattern_file: str,
+        max_mismatches: int = DEMUX_MAX_MISMATCHES,
+    ) -> "BarcodeLayout":
+        """Build a layout from the inputs of the former cutadapt demultiplexing:
+        anchored barcodes with their spacers as trailing Ns (e.g. `CGATACTGN`), and
+        a rename pattern file with lines like `fwd_1-rev_1_R1.fq.gz A1_R1.fq.gz`.
+        """
+        fwd = {name: seq for name, seq, _ in parse_fastx(fwd_fasta, fmt="fasta")}
+        rev = {name: seq for name, seq, _ in parse_fastx(rev_fasta, fmt="fasta")}
+        columns = {"well": [], "bcF": [], "linkF": [], "bcR": [], "linkR": []}
+        with open(pattern_file) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                old_name, new_name = line.split()
+                if not old_name.endswith("_R1.fq.gz"):
+                    continue
+                name_fwd, name_rev = old_name.removesuffix("_R1.fq.gz").split("-", 1)
+                for name, barcodes, bc, link in [
+                    (name_fwd, fwd, "bcF", "linkF"),
+                    (name_rev, rev, "bcR", "linkR"),
+                ]:
+                    if name not in barcodes:
+                        raise ValueError(f"Barcode {name} is not in the FASTA files.")
+                    barcode = barcodes[name].upper().rstrip("N")
+                    columns[bc].append(barcode)
+                    columns[link].append(len(barcodes[name]) - len(barcode))
+                columns["well"].append(new_name.removesuffix("_R1.fq.gz"))
+        return cls(*columns.values(), max_mismatches)
+
+    def assign(
+        self, arr_r1: np.ndarray, seqs_r1: tuple, arr_r2: np.ndarray, seqs_r2: tuple
+    ) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """Assign read pairs to wells, given each read as `(seq_starts, seq_lengths)`
+        into the bytes of its chunk.
+
+        Returns:
+            `(well, fwd_mismatches, rev_mismatches, fwd_trim, rev_trim)` per read
+            pair, where the well is `num_wells` for unassigned pairs, mismatches are -1
+            for reads without a barcode and trims are the bases to remove from the
+            start of each read (0 for unassigned pairs).
+        """
+        fwd, fwd_mm = self.fwd.lookup(arr_r1, *seqs_r1)
+        rev, rev_mm = self.rev.lookup(arr_r2, *seqs_r2)
+        well = self.grid[fwd, rev]
+        assigned = well < self.num_wells
+        fwd_trim = np.where(assigned, self.fwd.trims[fwd], 0)
+        rev_trim = np.where(assigned, self.rev.trims[rev], 0)
+        return well, fwd_mm, rev_mm, fwd_trim, rev_trim
+
+
+class _BarcodeTable:
+    """Lookup table from the base-5 code of the first `length` bases of a read to
+    the closest barcode within `max_mismatches` substitutions and its distance.
+    """
+
+    def __init__(self, barcodes: list[str], spacers: list[int], max_mismatches: int):
+        # wells share barcodes, which are kept once in order of appearance
+        self.barcodes = []
+        trims = []
+        for barcode, spacer in zip(barcodes, spacers):
+            barcode = barcode.upper()
+            if barcode not in self.barcodes:
+                self.barcodes.append(barcode)
+                trims.append(len(barcode) + spacer)
+            elif trims[self.barcodes.index(barcode)] != len(barcode) + spacer:
+                raise ValueError(f"Barcode {barcode} has different spacer lengths.")
+        lengths = {len(barcode) for barcode in self.barcodes}
+        if len(lengths) != 1:
+            raise ValueError("Barcodes of a read must all have the same length.")
+        self.length = lengths.pop()
+        if not 0 < self.length <= MAX_BARCODE_LENGTH:
+            raise ValueError(
+                f"Barcodes must have 1-{MAX_BARCODE_LENGTH} bases, getting {self.length}."
+            )
+        if any(set(barcode) - set("ACGT") for barcode in self.barcodes):
+            raise ValueError("Barcodes must only have A, C, G and T.")
+        # the extra last entry (index -1) is for reads without a barcode
+        self.trims = np.array(trims + [0], dtype=np.int64)
+        self._weights = 5 ** np.arange(self.length - 1, -1, -1, dtype=np.int64)
+        self.index = np.full(5**self.length, _NO_MATCH, dtype=np.int16)
+        self.distance = np.full(5**self.length, max_mismatches + 1, dtype=np.int8)
+        for i, barcode in enumerate(self.barcodes):
+            symbols = _SYMBOLS[np.frombuffer(barcode.encode(), dtype=np.uint8)]
+            for num_mismatches in range(max_mismatches + 1):
+                codes = self._neighbours(symbols, num_mismatches)
+                closer = self.distance[codes] > num_mismatches
+                tie = (self.distance[codes] == num_mismatches) & (
+                    self.index[codes] != i
+                )
+                self.index[codes[closer]] = i
+                self.distance[codes[closer]] = num_mismatches
+                self.index[codes[tie]] = _AMBIGUOUS
+
+    def _neighbours(self, symbols: np.ndarray, num_mismatches: int) -> np.ndarray:
+        """Codes of all sequences with exactly `num_mismatches` substitutions."""
+        base = symbols @ self._weights
+        if not num_mismatches:
+            return np.array([base])
+        codes = []
+        for positions in itertools.combinations(range(self.length), num_mismatches):
+            positions = list(positions)
+            # each substituted position takes one of the 4 other symbols
+            shifts = np.array(
+                list(itertools.product(range(1, 5), repeat=num_mismatches)),
+                dtype=np.int64,
+            )
+            new_symbols = (symbols[positions] + shifts) % 5
+            codes.append(
+                base + (new_symbols - symbols[positions]) @ self._weights[positions]
+            )
+        return np.concatenate(codes)
+
+    def lookup(
+        self, arr: np.ndarray, seq_starts: np.ndarray, seq_lengths: np.ndarray
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Return the barcode index (-1 for none) and the number of mismatches (-1 for
+        none) of reads starting at `seq_starts` in `arr`.
+        """
+        positions = seq_starts[:, None] + np.arange(self.length)
+        np.minimum(positions, len(arr) - 1, out=positions)
+        codes = _SYMBOLS[arr[positions]] @ self._weights
+        index = self.index[codes].astype(np.int64)
+        index[index == _AMBIGUOUS] = _NO_MATCH
+        # the barcode and its spacer must fit in the read
+        index[seq_lengths < self.trims[index]] = _NO_MATCH
+        index[seq_lengths < self.length] = _NO_MATCH
+        mismatches = np.where(index == _NO_MATCH, -1, self.distance[codes])
+        return index, mismatches
+
+
+def demultiplex_pairs(
+    fastq_dir: str,
+    output_dir: str | None,
+    layout: BarcodeLayout | str = DEFAULT_BARCODE_LAYOUT,
+    failed_dir: str | None = None,
+    output_fp: IO[bytes] | None = None,
+    num_workers: int = 1,
+    compresslevel: int = DEMUX_COMPRESS_LEVEL,
+    report_path: str | None = None,
+    stats_path: str | None = None,
+    preview: int | None = None,
+) -> list[tuple[str, str, str]]:
+    """Demultiplex the paired-end samples (plates) of a directory into per-well gzip
+    files `<output_dir>/<well>_R1.fq.gz` and `<output_dir>/<well>_R2.fq.gz`, and/or
+    into a single interleaved stream.
+
+    Reads are renamed like `cat_fastq` does, then barcodes and spacers are removed and
+    the well is appended to the sample name: `@sample=<plate>_<well> 1 <index> <name>`.
+
+    Args:
+        fastq_dir: Directory of the FASTQ files of the plates.
+        output_dir: Directory of the per-well files, None to write no per-well files.
+        layout: Barcode layout, or the path to a layout TSV.
+        failed_dir: Directory where unassigned pairs are written, untrimmed, to
+            `unknown_R1.fq.gz` and `unknown_R2.fq.gz`. Defaults to `output_dir`.
+        output_fp: If given, assigned pairs are also written to this binary file
+            object (e.g. a `PipeFeeder` to the stdin of the next tool) as interleaved
+            FASTQ, grouped by well within each chunk of reads.
+        num_workers: Number of worker processes, which decompress and rename plates
+            and assign chunks of reads to wells.
+        compresslevel: Gzip compression level of the output files.
+        report_path: If given, a TSV with the number of read pairs of each well (and
+            of unassigned pairs) and histograms of barcode mismatches is written to it.
+        stats_path: If given, read statistics of each well (see `write_read_stats`)
+            are written to this .tsv or .json file.
+        preview: If given, only a reproducible sample of this many read pairs of each
+            plate is demultiplexed, see `easy_amplicon.utils_preview`.
+
+    Returns:
+        `(well, r1_path, r2_path)` of the per-well files with reads, in layout order.
+    """
+    if isinstance(layout, str):
+        layout = BarcodeLayout.from_tsv(layout)
+    failed_dir = failed_dir or output_dir
+    if failed_dir is None:
+        raise ValueError("Either output_dir or failed_dir must be given.")
+    for directory in (output_dir, failed_dir):
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+    tasks = [
+        ((r1_path, r2_path), sample_name, False, False)
+        for r1_path, r2_path, sample_name in find_paired_end_files(fastq_dir)
+        if sample_name != "Undetermined"
+    ]
+    names = layout.wells + [UNKNOWN_WELL]
+    counts = np.zeros((len(names), 1 + 2 * (layout.max_mismatches + 1)), np.int64)
+    well_stats = {} if stats_path is not None else None
+    temp_dirs = [os.path.join(output_dir or failed_dir, f".tmp_R{i}") for i in (1, 2)]
+    for temp_dir in temp_dirs:
+        os.makedirs(temp_dir, exist_ok=True)
+
+    num_workers = max(1, num_workers)
+    executor = get_reusable_executor(max_workers=num_workers)
+    with ThreadPoolExecutor(num_workers) as compress_executor:
+        writers = [
+            _SampleWriter(temp_dir, compress_executor, compresslevel, 2 * num_workers)
+            for temp_dir in temp_dirs
+        ]
+        pending = deque()
+
+        def write_next():
+            pieces, interleaved, chunk_counts, chunk_stats = pending.popleft().result()
+            counts[:] += chunk_counts
+            for well, (data_r1, data_r2) in pieces.items():
+                writers[0].write(names[well], data_r1)
+                writers[1].write(names[well], data_r2)
+            if output_fp is not None:
+                output_fp.write(interleaved)
+            if well_stats is not None:
+                for well, stats in chunk_stats.items():
+                    _merge_read_stats(well_stats, names[well], stats)
+
+        chunks = _iter_fastq_chunks(
+            tasks, min(num_workers, len(tasks)), preview=preview
+        )
+        for chunk_r1, chunk_r2 in chunks:
+            pending.append(
+                executor.submit(
+                    _demultiplex_chunk,
+                    layout,
+                    chunk_r1,
+                    chunk_r2,
+                    output_dir is not None,
+                    output_fp is not None,
+                    well_stats is not None,
+                )
+            )
+            # keep a bounded number of chunks in flight, written in order
+            while len(pending) > 2 * num_workers:
+                write_next()
+        while pending:
+            write_next()
+        for writer in writers:
+            writer.close()
+
+    outputs = []
+    for well in names:
+        if well not in writers[0].paths:
+            continue
+        directory = failed_dir if well == UNKNOWN_WELL else output_dir
+        paths = [os.path.join(directory, f"{well}_R{i}.fq.gz") for i in (1, 2)]
+        for writer, path in zip(writers, paths):
+            move_file(writer.paths[well], path)
+        if well != UNKNOWN_WELL:
+            outputs.append((well, *paths))
+    for temp_dir in temp_dirs:
+        os.rmdir(temp_dir)
+
+    if report_path is not None:
+        _demux_report(names, counts, layout.max_mismatches).to_csv(
+            report_path, sep="\t"
+        )
+    if stats_path is not None:
+        write_read_stats(
+            {name: well_stats[name] for name in names if name in well_stats},
+            stats_path,
+        )
+    return outputs
+
+
+def _demux_report(names: list[str], counts: np.ndarray, max_mismatches: int):
+    columns = ["read_count"] + [
+        f"{side}_mismatches_{k}"
+        for side in ["fwd", "rev"]
+        for k in range(max_mismatches + 1)
+    ]
+    df = pd.DataFrame(counts, index=names, columns=columns)
+    df.index.name = "well"
+    return df
+
+
+def _demultiplex_chunk(
+    layout: BarcodeLayout,
+    chunk_r1: bytes,
+    chunk_r2: bytes,
+    per_well: bool,
+    interleave: bool,
+    tap: bool,
+) -> tuple[dict[int, tuple[bytes, bytes]], bytes, np.ndarray, dict[int, dict]]:
+    """Assign the read pairs of a chunk (from a single plate) to wells.
+
+    Returns:
+        `(pieces, interleaved, counts, stats)`, where `pieces` holds the reads of
+        each well index as `(data_r1, data_r2)` (only unassigned reads unless
+        `per_well`), `interleaved` all assigned pairs as interleaved FASTQ if
+        `interleave`, `counts` the per-well rows of the demultiplexing report and
+        `stats` the read statistics of each well if `tap`.
+    """
+    chunk_r1, lines_r1 = _locate_records(chunk_r1)
+    chunk_r2, lines_r2 = _locate_records(chunk_r2)
+    if len(lines_r1) != len(lines_r2):
+        raise ValueError("R1 and R2 chunks have different number of reads.")
+    arr_r1 = np.frombuffer(chunk_r1, dtype=np.uint8)
+    arr_r2 = np.frombuffer(chunk_r2, dtype=np.uint8)
+    well, fwd_mm, rev_mm, fwd_trim, rev_trim = layout.assign(
+        arr_r1,
+        (lines_r1[:, 1], lines_r1[:, 2] - lines_r1[:, 1]),
+        arr_r2,
+        (lines_r2[:, 1], lines_r2[:, 2] - lines_r2[:, 1]),
+    )
+
+    num_rows = layout.num_wells + 1
+    num_columns = 1 + 2 * (layout.max_mismatches + 1)
+    counts = np.zeros((num_rows, num_columns), dtype=np.int64)
+    if not len(well):
+        return {}, b"", counts, {}
+    counts[:, 0] = np.bincount(well, minlength=num_rows)
+    for column, mismatches in [(1, fwd_mm), (2 + layout.max_mismatches, rev_mm)]:
+        matched = mismatches >= 0
+        np.add.at(counts, (well[matched], column + mismatches[matched]), 1)
+
+    # records grouped by well, in their original order within each well, unassigned
+    # ones (the last well index) come last
+    order = np.argsort(well, kind="stable")
+    well = well[order]
+    wells, firsts = np.unique(well, return_index=True)
+    wells, firsts = wells.tolist(), firsts.tolist()
+    bounds = list(zip(firsts, firsts[1:] + [len(well)]))
+    num_assigned = firsts[-1] if wells and wells[-1] == layout.num_wells else len(well)
+    # all reads of a chunk are from one sample, whose name ends at the first space of
+    # each header, the well goes after it
+    sample_length = chunk_r1.find(b" ")
+    sample = chunk_r1[:sample_length]
+    suffixes = [f"_{name}".encode() for name in layout.wells] + [b""]
+    well_suffixes = [suffixes[i] for i in well.tolist()]
+
+    pieces, stats = {}, {}
+    if tap:
+        stats = {well_index: _new_read_stats() for well_index in wells}
+    record_parts = []
+    for read_number, chunk, lines, trim in [
+        (1, chunk_r1, lines_r1, fwd_trim),
+        (2, chunk_r2, lines_r2, rev_trim),
+    ]:
+        lines, trim = lines[order], trim[order]
+        # rest of the header, sequence, separator and quality of each record, without
+        # the barcode and spacer
+        starts = lines[:, :4] + np.array([sample_length, 0, 0, 0])
+        starts[:, 1] += trim
+        starts[:, 3] += trim
+        ends = lines[:, 1:]
+        slices = [
+            chunk[i:j] for i, j in zip(starts.ravel().tolist(), ends.ravel().tolist())
+        ]
+        parts = [sample] * (len(lines) * _NUM_PARTS)
+        parts[1::_NUM_PARTS] = well_suffixes
+        for k in range(4):
+            parts[k + 2 :: _NUM_PARTS] = slices[k::4]
+        for well_index, (first, last) in zip(wells, bounds):
+            if per_well or well_index == layout.num_wells:
+                data = b"".join(parts[_NUM_PARTS * first : _NUM_PARTS * last])
+                pieces.setdefault(well_index, []).append(data)
+        if tap:
+            _tap_well_stats(stats, parts, wells, bounds, read_number)
+        if interleave:
+            record_parts.append(parts[: _NUM_PARTS * num_assigned])
+
+    interleaved = b""
+    if interleave:
+        parts_r1, parts_r2 = record_parts
+        parts = parts_r1 + parts_r2
+        for k in range(_NUM_PARTS):
+            parts[k :: 2 * _NUM_PARTS] = parts_r1[k::_NUM_PARTS]
+            parts[k + _NUM_PARTS :: 2 * _NUM_PARTS] = parts_r2[k::_NUM_PARTS]
+        interleaved = b"".join(parts)
+    return {k: tuple(v) for k, v in pieces.items()}, interleaved, counts, stats
+
+
+def _tap_well_stats(
+    stats: dict[int, dict],
+    parts: list[bytes],
+    wells: list[int],
+    bounds: list[tuple[int, int]],
+    read_number: int,
+) -> None:
+    """Add records to the read statistics of their wells, as `_tap_read_stats` does,
+    given the parts of the records grouped by well (see `_demultiplex_chunk`).
+    """
+    last_records = [last - 1 for _, last in bounds]
+    seq_parts = parts[3::_NUM_PARTS]
+    seqs = np.frombuffer(b"".join(seq_parts), dtype=np.uint8)
+    n_sums = np.append(0, np.cumsum(seqs == ord("N")))
+    seq_ends = np.cumsum(np.fromiter(map(len, seq_parts), np.int64))[last_records]
+    # quality parts end with a newline, which has no expected error
+    qual_parts = parts[5::_NUM_PARTS]
+    quals = np.frombuffer(b"".join(qual_parts), dtype=np.uint8)
+    ee_sums = np.append(0, np.cumsum(np.where(quals == 10, 0, _EXPECTED_ERROR[quals])))
+    qual_ends = np.cumsum(np.fromiter(map(len, qual_parts), np.int64))[last_records]
+    seq_start = qual_start = 0
+    for well_index, (first, last), seq_end, qual_end in zip(
+        wells, bounds, seq_ends.tolist(), qual_ends.tolist()
+    ):
+        well_stats = stats[well_index]
+        if read_number == 1:
+            well_stats["read_count"] += last - first
+        well_stats["num_records"] += last - first
+        well_stats["num_bases"] += seq_end - seq_start
+        well_stats["ee_sum"] += float(ee_sums[qual_end] - ee_sums[qual_start])
+        well_stats["n_bases"] += int(n_sums[seq_end] - n_sums[seq_start])
+        seq_start, qual_start = seq_end, qual_end
+
+
+def _locate_records(chunk: bytes) -> tuple[bytes, np.ndarray]:
+    """Return a chunk of complete FASTQ records, with a trailing newline added if
+    missing, and an `(n, 5)` array of positions in it: for each record, the start of
+    its header, the start and end (newline) of its sequence, the start of its quality
+    and its end (after the last newline).
+    """
+    if chunk and not chunk.endswith(b"\n"):
+        chunk += b"\n"
+    newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+    if len(newlines) % 4:
+        raise ValueError("FASTQ chunk does not hold complete records.")
+    lines = np.zeros((len(newlines) // 4, 5), dtype=np.int64)
+    lines[1:, 0] = newlines[3:-1:4] + 1
+    lines[:, 1] = newlines[0::4] + 1
+    lines[:, 2] = newlines[1::4]
+    lines[:, 3] = newlines[2::4] + 1
+    lines[:, 4] = newlines[3::4] + 1
+    return chunk, lines
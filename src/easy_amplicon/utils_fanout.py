@@ -0,0 +1,525 @@
+"""Fan a stream of renamed reads out to several copies of an external tool.
+
+Trimming modes pipe the reads of all samples into a single cutadapt or fastp process.
+Their own multi-core modes stop scaling at a handful of cores, since a single thread
+still parses the input and writes the outputs. `ShardedTool` instead runs up to
+`num_shards` independent copies of the command, each reading the reads of its own
+samples from stdin and writing its outputs to hidden per-shard files next to the real
+ones.
+
+Samples are assigned to shards in the order they arrive, in contiguous runs of about
+the same input size, so the outputs of the shards taken in shard order hold the
+samples in the same order as a single process would. When all shards are done:
+- Output FASTQ files are concatenated, gzip members included, without recompressing.
+- JSON reports are summed with `sum_reports`.
+- Other files (e.g. HTML reports), which cannot be merged, are kept per shard as
+    `<name>.shard<i>.<ext>`.
+
+`run_sample_pool` instead runs one copy of the command per sample, on a pool of
+worker processes that each rename the reads of their sample and pipe them to it. This
+scales with the number of samples rather than the sample sizes, and reports of each
+sample are kept apart, e.g. for per-sample QC metrics.
+"""
+
+import contextlib
+import io
+import json
+import os
+import subprocess
+from concurrent.futures import wait
+from typing import Callable, Iterable, Iterator
+
+from loky import get_reusable_executor
+
+from easy_amplicon.utils import (
+    _iter_sample_chunks,
+    _merge_read_stats,
+    _new_read_stats,
+)
+from easy_amplicon.utils_files import concat_files, move_file
+from easy_amplicon.utils_manifest import get_fastq_manifest
+from easy_amplicon.utils_pipe import PIPE_BUFFER_SIZE, PipeFeeder
+
+# Smallest buffer of the `PipeFeeder` of a shard, which otherwise gets an equal share
+# of `PIPE_BUFFER_SIZE`.
+MIN_SHARD_BUFFER_SIZE = 8 * 1024 * 1024
+_SAMPLE_PREFIX = b"@sample="
+# Integer fields of cutadapt and fastp reports that are not counts, and float fields
+# that are.
+_NOT_COUNTS = {
+    "schema_version",
+    "len",
+    "error_lengths",
+    "peak",
+    "total_cycles",
+    "read1_mean_length",
+    "read2_mean_length",
+}
+_FLOAT_COUNTS = {"expect"}
+# Fields identifying the items of a list of records, e.g. the trimmed lengths and the
+# adapters of a cutadapt report.
+_RECORD_IDS = ("len", "name")
+# Paths to the number of reads of a whole report, weighting the fields without a
+# "total_reads" of their own: its own field, then those of fastp and cutadapt.
+_REPORT_READS = (
+    ("total_reads",),
+    ("summary", "before_filtering", "total_reads"),
+    ("read_counts", "input"),
+)
+# Returned for values of reports that cannot be merged, which are left out.
+_UNMERGEABLE = object()
+
+
+class ShardedTool(io.RawIOBase):
+    """A binary file object taking renamed FASTQ and running `proc_args` on it in up
+    to `num_shards` processes, each fed with the reads of a subset of samples.
+
+    Every write must only hold whole records of a single routing key, that of its
+    first record, which is the sample name of `@sample=<sample> ...` headers mapped
+    through `key`. This holds for chunks written by `cat_fastq`, `cat_fastq_se` and
+    `demultiplex_pairs`. The first time a key is seen, it is assigned to the shard
+    where the middle of its `sample_sizes` entry falls in the cumulated size of all
+    samples, never to an earlier shard than the previous key. Keys without a size are
+    assigned to the current shard. Processes are started on the first write to their
+    shard.
+
+    Closing waits for all processes, raises `subprocess.CalledProcessError` if any of
+    them failed, and merges their outputs (see the module docstring). With a single
+    shard, the command runs as it is and writes its outputs directly.
+
+    Args:
+        proc_args: Command reading FASTQ from stdin.
+        outputs: Paths of all files written by the command, which must appear as
+            they are in `proc_args`. JSON files are summed, other files ending with
+            .html are kept per shard, all others are concatenated.
+        sample_sizes: Input size of each routing key (see `get_sample_sizes`), used
+            to balance the shards.
+        num_shards: Maximum number of processes.
+        key: Maps the sample name of a record to its routing key, defaults to the
+            sample name itself.
+        quiet: Silence stdout and stderr of the processes.
+        verbose: Print the hand-off statistics of each shard (see `PipeFeeder`).
+    """
+
+    def __init__(
+        self,
+        proc_args: list[str],
+        outputs: list[str],
+        sample_sizes: dict[str, int],
+        num_shards: int = 1,
+        key: Callable[[str], str] | None = None,
+        quiet: bool = True,
+        verbose: bool = True,
+    ):
+        if num_shards < 1:
+            raise ValueError(
+                f"Number of shards must be positive, getting {num_shards}."
+            )
+        missing = [path for path in outputs if path not in proc_args]
+        if missing:
+            raise ValueError(f"Outputs {missing} are not arguments of the command.")
+        self.proc_args = proc_args
+        self.outputs = outputs
+        self.num_shards = num_shards
+        self.sample_sizes = sample_sizes
+        self.key = key
+        self.quiet = quiet
+        self.verbose = verbose
+        self.shards = {}
+        self._total_size = sum(sample_sizes.values())
+        self._seen_size = 0
+        self._current = 0
+        self._procs = {}
+        self._feeders = {}
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed ShardedTool.")
+        data = bytes(data)
+        if not data:
+            return 0
+        if not data.startswith(_SAMPLE_PREFIX):
+            raise ValueError("Reads must be renamed to `@sample=<sample> ...`.")
+        sample = data[len(_SAMPLE_PREFIX) : data.find(b" ")].decode()
+        shard = self._route(self.key(sample) if self.key is not None else sample)
+        if shard not in self._feeders:
+            self._start(shard)
+        return self._feeders[shard].write(data)
+
+    def _route(self, key: str) -> int:
+        if key not in self.shards:
+            size = self.sample_sizes.get(key, 0)
+            if self._total_size:
+                middle = (self._seen_size + size / 2) / self._total_size
+                shard = min(int(middle * self.num_shards), self.num_shards - 1)
+                self._current = max(self._current, shard)
+            self._seen_size += size
+            self.shards[key] = self._current
+        return self.shards[key]
+
+    def _start(self, shard: int) -> None:
+        args = self.proc_args
+        if self.num_shards > 1:
+            args = [_shard_path(a, shard) if a in self.outputs else a for a in args]
+        devnull = subprocess.DEVNULL if self.quiet else None
+        self._procs[shard] = proc = subprocess.Popen(
+            args, stdin=subprocess.PIPE, stdout=devnull, stderr=devnull
+        )
+        self._feeders[shard] = PipeFeeder(
+            proc.stdin,
+            buffer_size=max(PIPE_BUFFER_SIZE // self.num_shards, MIN_SHARD_BUFFER_SIZE),
+            name=f"shard {shard}" if self.num_shards > 1 else None,
+            verbose=self.verbose,
+        )
+
+    def _shard_paths(self, path: str) -> list[str]:
+        return [_shard_path(path, shard) for shard in sorted(self._procs)]
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        if not self._procs:
+            # no input, still run the command once so that all outputs exist
+            self._start(0)
+        error = None
+        for feeder in self._feeders.values():
+            try:
+                feeder.close()
+            except OSError as e:
+                # e.g. BrokenPipeError, better explained by the exit status
+                error = error or e
+        for proc in self._procs.values():
+            proc.wait()
+        super().close()
+        for proc in self._procs.values():
+            if proc.returncode:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+        if error is not None:
+            raise error
+        if self.num_shards > 1:
+            self._merge_outputs()
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and not self.closed:
+            # the input is incomplete, stop the tool and leave the outputs alone
+            for proc in self._procs.values():
+                proc.kill()
+            for feeder in self._feeders.values():
+                try:
+                    feeder.close()
+                except OSError:
+                    pass
+            for proc in self._procs.values():
+                proc.wait()
+            super().close()
+        return super().__exit__(exc_type, exc, tb)
+
+    def _merge_outputs(self) -> None:
+        for path in dict.fromkeys(self.outputs):
+            shard_paths = [p for p in self._shard_paths(path) if os.path.exists(p)]
+            if path.endswith(".json"):
+                reports = []
+                for shard_path in shard_paths:
+                    with open(shard_path) as f:
+                        reports.append(json.load(f))
+                if reports:
+                    with open(path, "w") as f:
+                        json.dump(sum_reports(reports), f, indent=2)
+            elif path.endswith(".html"):
+                stem, ext = os.path.splitext(path)
+                for shard_path in shard_paths:
+                    shard = os.path.basename(shard_path).split(".", 3)[1]
+                    move_file(shard_path, f"{stem}.{shard}{ext}")
+                continue
+            else:
+                concat_files(shard_paths, path)
+            for shard_path in shard_paths:
+                os.remove(shard_path)
+
+
+def _shard_path(path: str, shard: int) -> str:
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".shard{shard}.{name}")
+
+
+def run_sample_pool(
+    proc_args: list[str],
+    outputs: list[str],
+    tasks: list[tuple],
+    num_workers: int = 1,
+    sample_stats: dict[str, dict] | None = None,
+    iter_chunks: Callable[..., Iterator[tuple]] = _iter_sample_chunks,
+    quiet: bool = True,
+) -> dict[str, dict[str, dict]]:
+    """Run `proc_args` once per sample, `num_workers` samples at a time, each copy
+    reading the renamed reads of its sample from stdin and writing its outputs to
+    hidden per-sample files next to the real ones.
+
+    When all samples are done, output FASTQ files are concatenated in sample order,
+    JSON reports summed (see `sum_reports`) and other files ending with .html kept
+    per sample as `<name>.<sample>.html`, as `ShardedTool` does with shards.
+
+    Args:
+        proc_args: Command reading FASTQ from stdin.
+        outputs: Paths of all files written by the command, which must appear as
+            they are in `proc_args`.
+        tasks: Arguments of `iter_chunks` for each sample, whose second one is the
+            sample name (see `_iter_fastq_chunks`). Pairs must be interleaved.
+        num_workers: Number of samples processed at the same time.
+        sample_stats: If given, read statistics are collected and stored in it by
+            sample name, as in `_iter_fastq_chunks`.
+        iter_chunks: Function yielding the renamed chunks of a sample.
+        quiet: Silence stdout and stderr of the processes.
+
+    Returns:
+        The JSON report of each sample, by output path, then by sample name.
+    """
+    missing = [path for path in outputs if path not in proc_args]
+    if missing:
+        raise ValueError(f"Outputs {missing} are not arguments of the command.")
+    samples = [task[1] for task in tasks]
+    if len(set(samples)) < len(samples):
+        raise ValueError("Each sample must have a single task.")
+    if not tasks:
+        # still run the command once so that all outputs exist
+        devnull = subprocess.DEVNULL if quiet else None
+        subprocess.run(proc_args, input=b"", stdout=devnull, stderr=devnull, check=True)
+        return {path: {} for path in outputs if path.endswith(".json")}
+
+    executor = get_reusable_executor(max_workers=max(1, num_workers))
+    futures = [
+        executor.submit(
+            _run_sample,
+            [_sample_path(a, sample) if a in outputs else a for a in proc_args],
+            task,
+            iter_chunks,
+            sample_stats is not None,
+            quiet,
+        )
+        for sample, task in zip(samples, tasks)
+    ]
+    try:
+        for sample, future in zip(samples, futures):
+            stats = future.result()
+            if sample_stats is not None:
+                _merge_read_stats(sample_stats, sample, stats)
+    except BaseException:
+        # let no sample still running write its outputs after they are removed
+        for future in futures:
+            future.cancel()
+        wait(futures)
+        for path in dict.fromkeys(outputs):
+            for sample in samples:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(_sample_path(path, sample))
+        raise
+
+    reports = {}
+    for path in dict.fromkeys(outputs):
+        sample_paths = {sample: _sample_path(path, sample) for sample in samples}
+        if path.endswith(".json"):
+            reports[path] = {}
+            for sample, sample_path in sample_paths.items():
+                with open(sample_path) as f:
+                    reports[path][sample] = json.load(f)
+            with open(path, "w") as f:
+                json.dump(sum_reports(list(reports[path].values())), f, indent=2)
+        elif path.endswith(".html"):
+            stem, ext = os.path.splitext(path)
+            for sample, sample_path in sample_paths.items():
+                move_file(sample_path, f"{stem}.{sample}{ext}")
+            continue
+        else:
+            concat_files([p for p in sample_paths.values() if os.path.exists(p)], path)
+        for sample_path in sample_paths.values():
+            if os.path.exists(sample_path):
+                os.remove(sample_path)
+    return reports
+
+
+def _run_sample(
+    proc_args: list[str],
+    task: tuple,
+    iter_chunks: Callable[..., Iterator[tuple]],
+    tap: bool,
+    quiet: bool,
+) -> dict | None:
+    """Pipe the renamed chunks of a sample to a new process running `proc_args` and
+    return the read statistics of the sample if `tap`.
+    """
+    stats = _new_read_stats() if tap else None
+    devnull = subprocess.DEVNULL if quiet else None
+    proc = subprocess.Popen(
+        proc_args, stdin=subprocess.PIPE, stdout=devnull, stderr=devnull
+    )
+    try:
+        for chunks in iter_chunks(*task, stats=stats):
+            for chunk in chunks:
+                if chunk is not None:
+                    proc.stdin.write(chunk)
+    except BrokenPipeError:  # the process exited early, see its exit status
+        pass
+    except BaseException:
+        proc.kill()
+        raise
+    finally:
+        with contextlib.suppress(BrokenPipeError):
+            proc.stdin.close()
+        proc.wait()
+    if proc.returncode:
+        raise subprocess.CalledProcessError(proc.returncode, proc.args)
+    return stats
+
+
+def _sample_path(path: str, sample: str) -> str:
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".sample.{sample}.{name}")
+
+
+def get_sample_sizes(directory: str) -> dict[str, int]:
+    """Return the total size of the FASTQ files of each sample in `directory`."""
+    sizes = {}
+    for entry in get_fastq_manifest(directory):
+        if entry["sample"] is not None:
+            sizes[entry["sample"]] = sizes.get(entry["sample"], 0) + entry["size"]
+    return sizes
+
+
+def sum_reports(reports: list[dict]) -> dict:
+    """Sum JSON reports of cutadapt or fastp run on disjoint subsets of reads.
+
+    Counts are summed, histograms (lists of counts) summed position by position, and
+    lists of records (e.g. adapters, trimmed lengths) merged by their "len" or "name".
+    Other numbers and lists of numbers, such as rates, mean lengths and quality
+    curves, are averaged weighted by the "total_reads" of their object, or else of
+    the enclosing report (see `_REPORT_READS`). Values equal in all reports, such as
+    versions and settings, are kept, and fields that still cannot be merged (e.g.
+    differing strings) are left out rather than taken from one report.
+    """
+    return _merge_dicts(reports, [_get_report_reads(report) for report in reports])
+
+
+def _get_report_reads(report: dict) -> int | None:
+    for path in _REPORT_READS:
+        value = report
+        for key in path:
+            value = value.get(key) if isinstance(value, dict) else None
+        if _is_count(value):
+            return value
+    return None
+
+
+def _merge_dicts(dicts: list[dict], weights: list[int | None] | None) -> dict:
+    own_weights = [d.get("total_reads") for d in dicts]
+    if all(_is_count(weight) for weight in own_weights):
+        weights = own_weights
+    merged = {}
+    for key in dict.fromkeys(key for d in dicts for key in d):
+        present = [i for i, d in enumerate(dicts) if key in d]
+        value = _merge_values(
+            [dicts[i][key] for i in present],
+            key,
+            None if weights is None else [weights[i] for i in present],
+        )
+        if value is not _UNMERGEABLE:
+            merged[key] = value
+    return merged
+
+
+def _merge_values(values: list, key: str, weights: list[int | None] | None):
+    if all(isinstance(value, dict) for value in values):
+        return _merge_dicts(values, weights)
+    counts = key not in _NOT_COUNTS
+    if counts and all(_is_count(value) or key in _FLOAT_COUNTS for value in values):
+        return sum(values)
+    if all(isinstance(value, list) for value in values):
+        items = [item for value in values for item in value]
+        if items and all(isinstance(item, dict) for item in items):
+            return _merge_records(values, weights)
+        if counts and all(_is_count(item) for item in items):
+            merged = [0] * max(len(value) for value in values)
+            for value in values:
+                for i, item in enumerate(value):
+                    merged[i] += item
+            return merged
+    if all(value == values[0] for value in values):
+        return values[0]
+    if weights is None or not all(_is_count(w) for w in weights) or not sum(weights):
+        return _UNMERGEABLE
+    if all(_is_number(value) for value in values):
+        return _weighted_mean(values, weights)
+    if all(isinstance(value, list) for value in values) and all(
+        _is_number(item) for value in values for item in value
+    ):
+        merged = []
+        for i in range(max(len(value) for value in values)):
+            pairs = [(v[i], w) for v, w in zip(values, weights) if i < len(v)]
+            merged.append(_weighted_mean(*zip(*pairs)))
+        return merged
+    return _UNMERGEABLE
+
+
+def _weighted_mean(values: list, weights: list[int]) -> int | float:
+    if not sum(weights):
+        return values[0]
+    mean = sum(w * v for w, v in zip(weights, values)) / sum(weights)
+    return round(mean) if all(_is_count(value) for value in values) else mean
+
+
+def _merge_records(
+    lists: list[list[dict]], weights: list[int | None] | None
+) -> list[dict]:
+    items = [item for records in lists for item in records]
+    item_weights = None
+    if weights is not None:
+        item_weights = [w for records, w in zip(lists, weights) for _ in records]
+    for id_key in _RECORD_IDS:
+        if all(id_key in item for item in items):
+            groups = {}
+            for i, item in enumerate(items):
+                groups.setdefault(item[id_key], []).append(i)
+            ids = list(groups)
+            if all(isinstance(id_, (int, float)) for id_ in ids):
+                ids.sort()
+            return [
+                _merge_dicts(
+                    [items[i] for i in groups[id_]],
+                    (
+                        None
+                        if item_weights is None
+                        else [item_weights[i] for i in groups[id_]]
+                    ),
+                )
+                for id_ in ids
+            ]
+    if len({len(records) for records in lists}) == 1:
+        return [_merge_dicts(list(group), weights) for group in zip(*lists)]
+    return lists[0]
+
+
+def _is_count(value) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool)
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def get_renamed_key(samples: Iterable[str], prefix: bool) -> Callable[[str], str]:
+    """Return a `key` for `ShardedTool` mapping sample names made of two parts joined
+    by "_" to the longest of `samples` they start with (`prefix`, e.g. the plate of
+    `<plate>_<well>`) or end with (e.g. the barcode of `<sample>_<barcode>` given by
+    renaming demultiplexed reads again). Other names are kept.
+    """
+    samples = sorted(samples, key=len, reverse=True)
+
+    def key(name: str) -> str:
+        for sample in samples:
+            if name.startswith(f"{sample}_") if prefix else name.endswith(f"_{sample}"):
+                return sample
+        return name
+
+    return key
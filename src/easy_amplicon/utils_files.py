@@ -0,0 +1,181 @@
+"""In-process file assembly: batch renames, moves, copies and concatenation.
+
+Pipelines used to shell out to `mv`, `cat` and `cp` to rename demultiplexed files and
+to assemble merged outputs, one process per file and often through `shell=True`. The
+helpers here do the same without leaving the Python process:
+- Renames and moves go through `os.replace`, falling back to copy-and-delete when
+    source and destination are on different file systems.
+- Copies and concatenation move data inside the kernel with `os.copy_file_range`
+    (which shares extents on copy-on-write file systems such as btrfs and XFS) or
+    `os.sendfile`, falling back to a buffered copy where neither is supported.
+- gzip files are concatenated byte by byte, since a concatenation of gzip members is
+    itself a valid multi-member gzip file, so nothing is recompressed.
+"""
+
+import errno
+import os
+import shutil
+from typing import IO, Iterable
+
+# bytes per `copy_file_range`/`sendfile` call, large enough to amortize the syscall
+COPY_CHUNK_SIZE = 64 * 1024 * 1024
+
+# errors telling that a kernel copy is not supported for this pair of files, after
+# which the next (slower) method is tried
+_UNSUPPORTED_ERRNOS = {
+    errno.EXDEV,
+    errno.ENOSYS,
+    errno.EINVAL,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.EBADF,
+    errno.ETXTBSY,
+}
+
+
+def rename_files(
+    pairs: Iterable[tuple[str, str]],
+    directory: str | None = None,
+    missing_ok: bool = False,
+) -> list[str]:
+    """Rename files in a batch, replacing existing destinations like `mv` does.
+
+    Args:
+        pairs: `(old_name, new_name)` pairs.
+        directory: Directory that relative names are resolved against, defaults to the
+            current working directory (which is never changed).
+        missing_ok: Skip pairs whose source does not exist instead of raising.
+
+    Returns:
+        Sources that were skipped because they do not exist.
+    """
+    missing = []
+    for old_name, new_name in pairs:
+        if directory is not None:
+            old_name = os.path.join(directory, old_name)
+            new_name = os.path.join(directory, new_name)
+        if not os.path.lexists(old_name):
+            if not missing_ok:
+                raise ValueError(f"Cannot rename {old_name}, file does not exist.")
+            missing.append(old_name)
+            continue
+        move_file(old_name, new_name)
+    return missing
+
+
+def move_files(
+    paths: Iterable[str], directory: str, missing_ok: bool = False
+) -> list[str]:
+    """Move files into an existing directory, like `mv <paths> <directory>`.
+
+    Args:
+        paths: Paths of the files to move.
+        directory: Destination directory.
+        missing_ok: Skip files that do not exist instead of raising.
+
+    Returns:
+        Paths that were skipped because they do not exist.
+    """
+    if not os.path.isdir(directory):
+        raise ValueError(f"{directory} is not a directory.")
+    return rename_files(
+        [(path, os.path.join(directory, os.path.basename(path))) for path in paths],
+        missing_ok=missing_ok,
+    )
+
+
+def move_file(src: str, dst: str) -> None:
+    """Move a file with `os.replace`, copying it when `dst` is on another file
+    system. An existing `dst` is replaced.
+    """
+    try:
+        os.replace(src, dst)
+    except OSError as e:
+        if e.errno != errno.EXDEV:
+            raise
+        copy_file(src, dst)
+        shutil.copystat(src, dst)
+        os.remove(src)
+
+
+def copy_file(src: str, dst: str) -> None:
+    """Copy a file and its permission bits, like `shutil.copy`, moving the data
+    inside the kernel where supported. `dst` may be a directory.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    concat_files([src], dst)
+    shutil.copymode(src, dst)
+
+
+def concat_files(inputs: Iterable[str], output: str, append: bool = False) -> int:
+    """Concatenate files into `output`, like `cat <inputs> > <output>`.
+
+    Concatenating gzip files gives a multi-member gzip file that decompresses to the
+    concatenation of their contents, so compressed inputs are never recompressed.
+
+    Args:
+        inputs: Paths of the files to concatenate, in order.
+        output: Path to the output file.
+        append: Append to `output` instead of truncating it (`>>` instead of `>`).
+
+    Returns:
+        Number of bytes written.
+    """
+    # not opened with O_APPEND, which `copy_file_range` and `sendfile` reject
+    with open(output, "r+b" if append and os.path.exists(output) else "wb") as out:
+        out.seek(0, os.SEEK_END)
+        return sum(append_file(path, out) for path in inputs)
+
+
+def append_file(src: str, fileobj: IO[bytes]) -> int:
+    """Append the content of file `src` to the binary file object `fileobj` at its
+    current position, and return the number of bytes written.
+    """
+    fileobj.flush()
+    with open(src, "rb") as f:
+        return _copy_fd(f.fileno(), fileobj.fileno(), os.fstat(f.fileno()).st_size)
+
+
+def _copy_fd(src_fd: int, dst_fd: int, size: int) -> int:
+    """Copy `size` bytes from the current position of `src_fd` to that of `dst_fd`,
+    trying `os.copy_file_range`, `os.sendfile` and a buffered copy in turn. Copies
+    past `size` until the end of the source, which may have grown in the meantime.
+    """
+    copied = 0
+    for copy in (_copy_file_range, _sendfile):
+        try:
+            while True:
+                n = copy(src_fd, dst_fd)
+                if not n:
+                    break
+                copied += n
+            if copied >= size:
+                return copied
+        except OSError as e:
+            # only fall back if nothing was written yet, file positions are
+            # unreliable after a partial failure
+            if e.errno not in _UNSUPPORTED_ERRNOS or copied:
+                raise
+    while True:
+        data = os.read(src_fd, COPY_CHUNK_SIZE)
+        if not data:
+            return copied
+        view = memoryview(data)
+        while view:
+            n = os.write(dst_fd, view)
+            view = view[n:]
+        copied += len(data)
+
+
+def _copy_file_range(src_fd: int, dst_fd: int) -> int:
+    if not hasattr(os, "copy_file_range"):
+        raise OSError(errno.ENOSYS, "copy_file_range is not available")
+    return os.copy_file_range(src_fd, dst_fd, COPY_CHUNK_SIZE)
+
+
+def _sendfile(src_fd: int, dst_fd: int) -> int:
+    if not hasattr(os, "sendfile"):
+        raise OSError(errno.ENOSYS, "sendfile is not available")
+    # without an offset, sendfile reads from (and advances) the current position
+    return os.sendfile(dst_fd, src_fd, None, COPY_CHUNK_SIZE)
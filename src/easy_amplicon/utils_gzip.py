@@ -0,0 +1,449 @@
+"""Fast gzip readers and writers used by `easy_amplicon.utils.smart_open`.
+
+Three inflate backends are supported for reading:
+- "isal": the optional `isal` package (python-isal), about 2-3x faster than zlib.
+- "pigz": an external `pigz -dc` process, which moves inflating out of the Python
+    process altogether.
+- "python": the standard library `gzip` module.
+
+Whatever the backend, decompressed data can be read ahead on a background thread
+(see `PrefetchReader`), so inflating overlaps with parsing in the caller.
+
+For writing, `ParallelGzipWriter` deflates fixed-size blocks on a thread pool (zlib
+releases the GIL) and writes them in order as members of a multi-member gzip file,
+which any gzip reader decompresses as a whole. `BgzfWriter` does the same with the
+small members of BGZF (as written by `bgzip`), which allow random access through
+virtual offsets.
+"""
+
+import gzip
+import io
+import os
+import queue
+import shutil
+import struct
+import subprocess
+import tempfile
+import threading
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import IO
+
+from easy_amplicon.utils_cpu import available_cpus
+
+GZIP_READ_BACKENDS = ["auto", "isal", "pigz", "python"]
+# Size of the decompressed chunks passed from the prefetch thread to the reader.
+PREFETCH_CHUNK_SIZE = 1024 * 1024
+# Default amount of decompressed data read ahead by the prefetch thread.
+PREFETCH_SIZE = 16 * 1024 * 1024
+# Size of the uncompressed blocks deflated independently by `ParallelGzipWriter`.
+GZIP_BLOCK_SIZE = 1024 * 1024
+# Maximum size of the uncompressed data of a BGZF block, the same as htslib.
+BGZF_BLOCK_SIZE = 0xFF00
+# Empty BGZF block marking the end of a BGZF file.
+BGZF_EOF = bytes.fromhex("1f8b08040000000000ff0600424302001b0003000000000000000000")
+# Default level of writers, also used when "auto" has nothing to measure, i.e. for
+# files smaller than a block.
+DEFAULT_COMPRESS_LEVEL = 6
+# Candidate levels for "auto", from the fastest to the smallest output.
+AUTO_COMPRESS_LEVELS = [1, 3, 6, 9]
+
+
+def open_gzip_read(
+    file_path: str, backend: str = "auto", prefetch_size: int = PREFETCH_SIZE
+) -> io.BufferedReader:
+    """Open a gzip file for reading in binary mode.
+
+    Args:
+        file_path: Path to the gzip file.
+        backend: One of `GZIP_READ_BACKENDS`. "auto" takes the first available of
+            "isal", "pigz" and "python".
+        prefetch_size: Bytes of decompressed data to read ahead on a background
+            thread. 0 disables the thread and decompresses on the calling thread.
+
+    Returns:
+        A buffered binary file object.
+    """
+    if backend not in GZIP_READ_BACKENDS:
+        raise ValueError(
+            f"Backend must be one of {GZIP_READ_BACKENDS}, getting {backend}."
+        )
+    if backend == "auto":
+        backend = get_gzip_read_backend()
+
+    if backend == "isal":
+        from isal import igzip
+
+        raw = igzip.open(file_path, "rb")
+    elif backend == "pigz":
+        if shutil.which("pigz") is None:
+            raise ValueError("pigz is not found in PATH.")
+        raw = PigzReader(file_path)
+    else:
+        raw = gzip.open(file_path, "rb")
+
+    if prefetch_size > 0:
+        raw = PrefetchReader(raw, prefetch_size)
+    return io.BufferedReader(raw, buffer_size=PREFETCH_CHUNK_SIZE)
+
+
+def get_gzip_read_backend() -> str:
+    """Return the fastest gzip read backend available in this environment."""
+    try:
+        import isal  # noqa: F401
+
+        return "isal"
+    except ImportError:
+        pass
+    if shutil.which("pigz") is not None:
+        return "pigz"
+    return "python"
+
+
+class PigzReader(io.RawIOBase):
+    """Read the decompressed content of a gzip file from a `pigz -dc` process.
+
+    Raises OSError when the end of the stream is reached if pigz failed, e.g. on a
+    truncated or corrupted file.
+    """
+
+    def __init__(self, file_path: str):
+        self.name = file_path
+        self._proc = subprocess.Popen(
+            ["pigz", "-dc", file_path],
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        num_bytes = self._proc.stdout.readinto(buffer)
+        if not num_bytes and len(buffer):
+            self._check_exit()
+        return num_bytes
+
+    def _check_exit(self) -> None:
+        returncode = self._proc.wait()
+        if returncode:
+            error = self._proc.stderr.read().decode(errors="replace").strip()
+            raise OSError(f"pigz failed to decompress {self.name}: {error}")
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        # the reader may stop before the end of the stream
+        if self._proc.poll() is None:
+            self._proc.kill()
+        self._proc.wait()
+        self._proc.stdout.close()
+        self._proc.stderr.close()
+        super().close()
+
+
+class PrefetchReader(io.RawIOBase):
+    """Read a binary file object ahead on a background thread.
+
+    Chunks of `PREFETCH_CHUNK_SIZE` bytes are put in a queue holding about
+    `prefetch_size` bytes. Exceptions raised by the underlying file object are
+    re-raised by `readinto` in the calling thread.
+    """
+
+    def __init__(self, fileobj: IO[bytes], prefetch_size: int = PREFETCH_SIZE):
+        self.name = getattr(fileobj, "name", None)
+        self._fileobj = fileobj
+        self._queue = queue.Queue(max(1, prefetch_size // PREFETCH_CHUNK_SIZE))
+        self._stop = threading.Event()
+        self._chunk = memoryview(b"")
+        self._eof = False
+        self._thread = threading.Thread(target=self._read_ahead, daemon=True)
+        self._thread.start()
+
+    def _read_ahead(self) -> None:
+        try:
+            while not self._stop.is_set():
+                chunk = self._fileobj.read(PREFETCH_CHUNK_SIZE)
+                self._put(chunk)
+                if not chunk:
+                    break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item: bytes | Exception) -> None:
+        # wake up regularly so that closing the reader stops the thread
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                continue
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        if not self._chunk:
+            if self._eof:
+                return 0
+            item = self._queue.get()
+            if isinstance(item, Exception):
+                self._eof = True
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._chunk = memoryview(item)
+        num_bytes = min(len(buffer), len(self._chunk))
+        buffer[:num_bytes] = self._chunk[:num_bytes]
+        self._chunk = self._chunk[num_bytes:]
+        return num_bytes
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._stop.set()
+        self._thread.join()
+        self._fileobj.close()
+        super().close()
+
+
+def open_gzip_write(
+    file_path: str,
+    compresslevel: int | str = DEFAULT_COMPRESS_LEVEL,
+    threads: int | None = None,
+) -> io.BufferedWriter:
+    """Open a gzip file for writing in binary mode, compressing on a thread pool.
+
+    Args:
+        file_path: Path to the gzip file.
+        compresslevel: Compression level from 0 to 9, or "auto" to pick one with
+            `choose_compress_level` once the first block is written, in which case
+            the output depends on timings and is not reproducible. Use low levels
+            for intermediate files that are read once.
+        threads: Number of compression threads, defaults to the number of available
+            CPUs.
+
+    Returns:
+        A buffered binary file object.
+    """
+    raw = ParallelGzipWriter(file_path, compresslevel, threads)
+    return io.BufferedWriter(raw, buffer_size=GZIP_BLOCK_SIZE)
+
+
+class ParallelGzipWriter(io.RawIOBase):
+    """Write a multi-member gzip file, one member per `GZIP_BLOCK_SIZE` bytes of
+    input, deflating members on a thread pool and writing them in order. At most two
+    blocks per thread are held in memory.
+    """
+
+    block_size = GZIP_BLOCK_SIZE
+
+    def __init__(
+        self,
+        file_path: str,
+        compresslevel: int | str = DEFAULT_COMPRESS_LEVEL,
+        threads: int | None = None,
+    ):
+        if compresslevel != "auto" and compresslevel not in range(10):
+            raise ValueError(
+                f"Compression level must be 0-9 or 'auto', getting {compresslevel}."
+            )
+        self.name = file_path
+        self.compresslevel = compresslevel
+        self._threads = threads or available_cpus()
+        self._file = open(file_path, "wb")
+        self._buffer = bytearray()
+        self._executor = ThreadPoolExecutor(self._threads)
+        self._pending = deque()
+        self._num_members = 0
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        self._buffer += data
+        while len(self._buffer) >= self.block_size:
+            block = bytes(self._buffer[: self.block_size])
+            del self._buffer[: self.block_size]
+            self._submit(block)
+        return len(data)
+
+    def _submit(self, block: bytes) -> None:
+        if self.compresslevel == "auto":
+            if len(block) < self.block_size:
+                self.compresslevel = DEFAULT_COMPRESS_LEVEL
+            else:
+                self.compresslevel = choose_compress_level(
+                    block, os.path.dirname(os.path.abspath(self.name)), self._threads
+                )
+        self._pending.append(
+            self._executor.submit(self._compress, block, self.compresslevel)
+        )
+        self._num_members += 1
+        while len(self._pending) > 2 * self._threads:
+            self._write_next()
+
+    def _compress(self, block: bytes, compresslevel: int) -> bytes:
+        return compress_member(block, compresslevel)
+
+    def _write_next(self) -> None:
+        self._file.write(self._pending.popleft().result())
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        try:
+            # an empty file still gets one (empty) member, as with `gzip.open`
+            if self._buffer or not self._num_members:
+                self._submit(bytes(self._buffer))
+                self._buffer.clear()
+            while self._pending:
+                self._write_next()
+            self._write_trailer()
+        finally:
+            self._executor.shutdown(cancel_futures=True)
+            self._file.close()
+            super().close()
+
+    def _write_trailer(self) -> None:
+        pass
+
+
+def open_bgzf_write(
+    file_path: str,
+    compresslevel: int | str = DEFAULT_COMPRESS_LEVEL,
+    threads: int | None = None,
+) -> "BgzfWriter":
+    """Open a BGZF file for writing in binary mode, compressing on a thread pool.
+
+    Writes are not buffered beyond the current block, so `tell()` of the returned
+    writer is the exact uncompressed position, to be turned into a virtual offset
+    with `BgzfWriter.virtual_offset`.
+
+    Args:
+        file_path: Path to the BGZF file.
+        compresslevel: See `open_gzip_write`.
+        threads: Number of compression threads, defaults to the number of available
+            CPUs.
+    """
+    return BgzfWriter(file_path, compresslevel, threads)
+
+
+class BgzfWriter(ParallelGzipWriter):
+    """Write a BGZF file: gzip members of at most `BGZF_BLOCK_SIZE` uncompressed
+    bytes, each recording its compressed size in a "BC" extra subfield, followed by an
+    empty end-of-file block. Any gzip reader decompresses it as a whole.
+    """
+
+    block_size = BGZF_BLOCK_SIZE
+
+    def __init__(
+        self,
+        file_path: str,
+        compresslevel: int | str = DEFAULT_COMPRESS_LEVEL,
+        threads: int | None = None,
+    ):
+        super().__init__(file_path, compresslevel, threads)
+        self._position = 0
+        # offsets in the file of the blocks written so far
+        self.block_offsets = []
+        self._size = 0
+
+    def write(self, data) -> int:
+        self._position += len(data)
+        return super().write(data)
+
+    def tell(self) -> int:
+        """Return the number of uncompressed bytes written so far."""
+        return self._position
+
+    def virtual_offset(self, position: int) -> int:
+        """Return the virtual offset (offset of the block in the file shifted left by
+        16 bits, plus the offset within the uncompressed block) of an uncompressed
+        position, whose block must have been written, e.g. after closing.
+        """
+        block, within = divmod(position, self.block_size)
+        if block < len(self.block_offsets):
+            return (self.block_offsets[block] << 16) + within
+        if block == len(self.block_offsets) and not within and self.closed:
+            # end of the data, i.e. the start of the end-of-file block
+            return self._size << 16
+        raise ValueError(f"Block of position {position} is not written yet.")
+
+    def _compress(self, block: bytes, compresslevel: int) -> bytes:
+        return compress_bgzf_block(block, compresslevel)
+
+    def _write_next(self) -> None:
+        data = self._pending.popleft().result()
+        if data != BGZF_EOF:  # only an empty file has an empty block before the EOF
+            self.block_offsets.append(self._size)
+            self._file.write(data)
+            self._size += len(data)
+
+    def _write_trailer(self) -> None:
+        self._file.write(BGZF_EOF)
+
+
+def compress_member(data: bytes, compresslevel: int) -> bytes:
+    """Compress `data` into a single gzip member (with mtime 0, so that output is
+    reproducible).
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 31)
+    return compressor.compress(data) + compressor.flush()
+
+
+def compress_bgzf_block(data: bytes, compresslevel: int) -> bytes:
+    """Compress at most `BGZF_BLOCK_SIZE` bytes into a single BGZF block."""
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, -15)
+    deflated = compressor.compress(data) + compressor.flush()
+    # header with the BC subfield holding the total block size minus 1, deflated
+    # data, then CRC32 and size of the uncompressed data
+    header = b"\x1f\x8b\x08\x04\x00\x00\x00\x00\x00\xff\x06\x00BC\x02\x00"
+    trailer = struct.pack("<II", zlib.crc32(data), len(data))
+    block_size = len(header) + 2 + len(deflated) + len(trailer)
+    return header + struct.pack("<H", block_size - 1) + deflated + trailer
+
+
+_disk_throughput = {}
+
+
+def measure_disk_throughput(directory: str, num_bytes: int = 16 * 1024 * 1024) -> float:
+    """Measure the write throughput (bytes per second) of the disk holding
+    `directory` by writing and syncing a temporary file. Results are cached per
+    directory for the lifetime of the process.
+    """
+    if directory not in _disk_throughput:
+        data = os.urandom(num_bytes)
+        with tempfile.NamedTemporaryFile(dir=directory) as f:
+            start = time.perf_counter()
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+            elapsed = time.perf_counter() - start
+        _disk_throughput[directory] = num_bytes / max(elapsed, 1e-9)
+    return _disk_throughput[directory]
+
+
+def choose_compress_level(sample: bytes, directory: str, threads: int) -> int:
+    """Pick the compression level giving the smallest output without slowing down
+    writing much, given a sample of the data, the directory to write to, and the
+    number of compression threads.
+
+    For each level in `AUTO_COMPRESS_LEVELS`, the input throughput is bounded both by
+    how fast `threads` threads deflate the sample and by how fast the disk absorbs the
+    compressed output. The highest level within 10% of the best throughput wins.
+    """
+    disk_throughput = measure_disk_throughput(directory)
+    throughputs = {}
+    for level in AUTO_COMPRESS_LEVELS:
+        start = time.perf_counter()
+        compressed = compress_member(sample, level)
+        elapsed = max(time.perf_counter() - start, 1e-9)
+        cpu_throughput = len(sample) / elapsed * threads
+        io_throughput = disk_throughput * len(sample) / max(len(compressed), 1)
+        throughputs[level] = min(cpu_throughput, io_throughput)
+    best = max(throughputs.values())
+    return max(level for level, tp in throughputs.items() if tp >= 0.9 * best)
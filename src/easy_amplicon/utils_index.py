@@ -0,0 +1,604 @@
+"""Random access to the records of FASTA/FASTQ files by ID.
+
+`get_fastx_index` scans a plain or BGZF-compressed FASTA/FASTQ file once and records,
+for each record, its ID (the header up to the first whitespace, like `SeqRecord.id`),
+the offset of its first byte and its length in bytes. For BGZF files the offset is a
+virtual offset (the offset of the BGZF block in the file shifted left by 16 bits, plus
+the offset within the uncompressed block), as in samtools. The index is saved as a
+faidx-style TSV in `<directory>/.easy_amplicon/index/` and rebuilt only when the size
+or mtime of the file changes.
+
+`FastxIndex` memory-maps the file and returns the raw bytes of records, one by ID or
+many in file order. Regular (non-BGZF) gzip files cannot be accessed randomly;
+`iter_records_by_id` falls back to a sequential scan for them.
+
+For FASTQ files of reads labeled by sample (`@sample=<sample> ...`), a coarser
+sample index maps each sample to the ranges (virtual offset, uncompressed length and
+number of reads) holding its reads. `write_bgzf_fastq` writes it while compressing
+a FASTQ file to BGZF, `get_sample_index` loads (or builds) it and `fetch_sample`
+returns the reads of one sample without inflating anything else.
+"""
+
+import contextlib
+import mmap
+import os
+import struct
+import zlib
+from typing import IO, Iterable, Iterator
+
+import numpy as np
+
+from easy_amplicon.utils import _iter_fastq_blocks, get_fastx_format, smart_open
+from easy_amplicon.utils_gzip import DEFAULT_COMPRESS_LEVEL, open_bgzf_write
+from easy_amplicon.utils_manifest import CACHE_DIR, is_settled, write_cache_file
+from easy_amplicon.utils_shards import _split_block_by_sample
+
+INDEX_VERSION = 1
+SAMPLE_INDEX_VERSION = 1
+# Amount of uncompressed data scanned at once when building an index.
+INDEX_SCAN_SIZE = 4 * 1024 * 1024
+# Number of decompressed BGZF blocks kept by a `FastxIndex` for nearby records.
+BGZF_BLOCK_CACHE_SIZE = 16
+
+
+def get_compression(file_path: str) -> str:
+    """Return "bgzf", "gzip" or "plain" given the first bytes of a file."""
+    with open(file_path, "rb") as f:
+        header = f.read(18)
+    if header[:2] != b"\x1f\x8b":
+        return "plain"
+    # BGZF is gzip with an extra subfield "BC" holding the size of the block
+    if len(header) == 18 and header[3] & 4 and header[12:14] == b"BC":
+        return "bgzf"
+    return "gzip"
+
+
+def get_fastx_index(file_path: str, use_cache: bool = True) -> "FastxIndex":
+    """Load the index of a plain or BGZF FASTA/FASTQ file, building and caching it if
+    missing or stale.
+
+    Raises:
+        ValueError: If the file is compressed with regular gzip, which does not allow
+            random access, or has duplicate IDs.
+    """
+    compression = get_compression(file_path)
+    if compression == "gzip":
+        raise ValueError(
+            f"{file_path} is compressed with gzip, only plain and BGZF files can be "
+            "indexed."
+        )
+    fmt = get_fastx_format(file_path)
+    stat = os.stat(file_path)
+    index_path = os.path.join(
+        os.path.dirname(file_path),
+        CACHE_DIR,
+        "index",
+        f"{os.path.basename(file_path)}.fxi",
+    )
+    meta = {
+        "version": str(INDEX_VERSION),
+        "size": str(stat.st_size),
+        "mtime_ns": str(stat.st_mtime_ns),
+        "format": fmt,
+        "compression": compression,
+    }
+    columns = _load_index(index_path, meta) if use_cache else None
+    if columns is None:
+        columns = _build_index(file_path, fmt, compression)
+        if len(set(columns[0])) != len(columns[0]):
+            raise ValueError(f"{file_path} has duplicate record IDs.")
+        if is_settled(stat):
+            _save_index(index_path, meta, columns)
+    return FastxIndex(file_path, compression, *columns)
+
+
+class FastxIndex:
+    """Memory-mapped reader of an indexed plain or BGZF FASTA/FASTQ file. Use
+    `get_fastx_index` to get one.
+
+    Records are returned as raw bytes, header line included and ending with a newline
+    (unless the file does not).
+    """
+
+    def __init__(
+        self,
+        file_path: str,
+        compression: str,
+        ids: list[str],
+        offsets: np.ndarray,
+        lengths: np.ndarray,
+    ):
+        self.file_path = file_path
+        self.compression = compression
+        self._ids = ids
+        self._offsets = offsets
+        self._lengths = lengths
+        self._rows = None
+        self._file = open(file_path, "rb")
+        if os.fstat(self._file.fileno()).st_size:
+            self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:  # empty files cannot be mapped
+            self._mmap = b""
+        self._blocks = {}
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def __contains__(self, record_id: str) -> bool:
+        return record_id in self.rows
+
+    @property
+    def rows(self) -> dict[str, int]:
+        if self._rows is None:
+            self._rows = {record_id: i for i, record_id in enumerate(self._ids)}
+        return self._rows
+
+    def ids(self) -> list[str]:
+        """Return the IDs of all records in file order."""
+        return list(self._ids)
+
+    def fetch(self, record_id: str) -> bytes:
+        """Return the record with the given ID, raising KeyError if there is none."""
+        row = self.rows[record_id]
+        return self._read(int(self._offsets[row]), int(self._lengths[row]))
+
+    def fetch_many(self, record_ids: Iterable[str]) -> Iterator[bytes]:
+        """Yield the records with the given IDs in file order, so that reads are
+        sequential. IDs not in the file are skipped.
+        """
+        rows = sorted({self.rows[i] for i in record_ids if i in self.rows})
+        for row in rows:
+            yield self._read(int(self._offsets[row]), int(self._lengths[row]))
+
+    def _read(self, offset: int, length: int) -> bytes:
+        if self.compression == "plain":
+            return self._mmap[offset : offset + length]
+        coffset, uoffset = offset >> 16, offset & 0xFFFF
+        parts = []
+        while length > 0:
+            data, next_coffset = self._read_block(coffset)
+            part = data[uoffset : uoffset + length]
+            parts.append(part)
+            length -= len(part)
+            coffset, uoffset = next_coffset, 0
+        return b"".join(parts)
+
+    def _read_block(self, coffset: int) -> tuple[bytes, int]:
+        if coffset not in self._blocks:
+            if len(self._blocks) >= BGZF_BLOCK_CACHE_SIZE:
+                self._blocks.pop(next(iter(self._blocks)))
+            self._blocks[coffset] = _read_bgzf_block(self._mmap, coffset)
+        return self._blocks[coffset]
+
+    def close(self) -> None:
+        if isinstance(self._mmap, mmap.mmap):
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self) -> "FastxIndex":
+        return self
+
+    def __exit__(self, *args) -> None:
+        self.close()
+
+
+def iter_records_by_id(file_path: str, record_ids: Iterable[str]) -> Iterator[bytes]:
+    """Yield the raw records of a FASTA/FASTQ file with the given IDs, in file order.
+
+    Plain and BGZF files are read through their (cached) index, other gzip files are
+    scanned sequentially.
+    """
+    if get_compression(file_path) != "gzip":
+        with get_fastx_index(file_path) as index:
+            yield from index.fetch_many(record_ids)
+        return
+    record_ids = set(record_ids)
+    with smart_open(file_path, "rb") as f:
+        for data, starts, ends, record_id_list in _iter_record_chunks(
+            iter(lambda: f.read(INDEX_SCAN_SIZE), b""), get_fastx_format(file_path)
+        ):
+            for start, end, record_id in zip(starts, ends, record_id_list):
+                if record_id in record_ids:
+                    yield data[start:end]
+
+
+def write_bgzf_fastq(
+    input_fastq: str | IO[bytes],
+    output_path: str,
+    compresslevel: int = DEFAULT_COMPRESS_LEVEL,
+    threads: int | None = None,
+) -> dict[str, list[tuple[int, int, int]]]:
+    """Compress a FASTQ file of reads labeled by sample to BGZF, saving its sample
+    index next to it.
+
+    Args:
+        input_fastq: Path to a plain or gzipped FASTQ file, or a binary file object.
+            Reads are labeled like `@sample=<sample> ...` (see `cat_fastq`), or carry
+            that label after their name (`vsearch --relabel_keep`). The path may be
+            `output_path` itself, which is then replaced.
+        output_path: Path to the BGZF output.
+        compresslevel: Compression level from 0 to 9.
+        threads: Number of compression threads, defaults to the number of available
+            CPUs.
+
+    Returns:
+        The sample index, see `get_sample_index`.
+    """
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    ranges = []
+    with contextlib.ExitStack() as stack:
+        if isinstance(input_fastq, str):
+            input_fastq = stack.enter_context(smart_open(input_fastq, "rb"))
+        writer = stack.enter_context(open_bgzf_write(temp_path, compresslevel, threads))
+        for block, newlines, _ in _iter_fastq_blocks(input_fastq):
+            for sample, data, num_reads in _split_block_by_sample(block, newlines):
+                if ranges and ranges[-1][0] == sample:
+                    ranges[-1][2] += len(data)
+                    ranges[-1][3] += num_reads
+                else:
+                    ranges.append([sample, writer.tell(), len(data), num_reads])
+                writer.write(data)
+    sample_index = {}
+    for sample, position, num_bytes, num_reads in ranges:
+        sample_index.setdefault(sample, []).append(
+            (writer.virtual_offset(position), num_bytes, num_reads)
+        )
+    os.replace(temp_path, output_path)
+    _save_sample_index(output_path, sample_index)
+    return sample_index
+
+
+def get_sample_index(
+    file_path: str, use_cache: bool = True
+) -> dict[str, list[tuple[int, int, int]]]:
+    """Load the sample index of a plain or BGZF FASTQ file, building and caching it if
+    missing or stale.
+
+    Returns:
+        A dict mapping each sample, in order of first appearance, to the list of
+        `(offset, length, num_reads)` of the runs of its reads, where `offset` is a
+        virtual offset for BGZF files and `length` is in uncompressed bytes.
+
+    Raises:
+        ValueError: If the file is compressed with regular gzip, which does not allow
+            random access, or its reads are not labeled by sample.
+    """
+    index_path = _get_sample_index_path(file_path)
+    meta = _get_sample_index_meta(file_path)
+    if use_cache:
+        sample_index = _load_sample_index(index_path, meta)
+        if sample_index is not None:
+            return sample_index
+
+    if meta["compression"] == "bgzf":
+        block_coffsets, block_ustarts = _get_bgzf_blocks(file_path)
+    sample_index = {}
+    position = 0
+    with smart_open(file_path, "rb") as f:
+        for block, newlines, _ in _iter_fastq_blocks(f):
+            for sample, data, num_reads in _split_block_by_sample(block, newlines):
+                runs = sample_index.setdefault(sample, [])
+                if runs and runs[-1][0] + runs[-1][1] == position:
+                    runs[-1][1] += len(data)
+                    runs[-1][2] += num_reads
+                else:
+                    runs.append([position, len(data), num_reads])
+                position += len(data)
+    for sample, runs in sample_index.items():
+        offsets = np.array([run[0] for run in runs], dtype=np.int64)
+        if meta["compression"] == "bgzf":
+            offsets = _to_virtual_offsets(offsets, block_coffsets, block_ustarts)
+        sample_index[sample] = [
+            (offset, num_bytes, num_reads)
+            for offset, (_, num_bytes, num_reads) in zip(offsets.tolist(), runs)
+        ]
+    if is_settled(os.stat(file_path)):
+        _save_sample_index(file_path, sample_index)
+    return sample_index
+
+
+def fetch_sample(file_path: str, sample: str) -> bytes:
+    """Return the raw FASTQ reads of a sample of an indexed plain or BGZF file (see
+    `get_sample_index`), reading and inflating only the blocks holding them.
+
+    Raises:
+        KeyError: If the file has no reads of this sample.
+    """
+    runs = get_sample_index(file_path)[sample]
+    reader = FastxIndex(
+        file_path,
+        get_compression(file_path),
+        [],
+        np.zeros(0, dtype=np.int64),
+        np.zeros(0, dtype=np.int64),
+    )
+    with reader:
+        return b"".join(reader._read(offset, length) for offset, length, _ in runs)
+
+
+def _read_bgzf_block(buffer, coffset: int) -> tuple[bytes, int]:
+    """Decompress the BGZF block starting at `coffset` of `buffer`, returning its data
+    and the offset of the next block.
+    """
+    xlen, block_size = _get_bgzf_block_size(buffer, coffset)
+    deflated = buffer[coffset + 12 + xlen : coffset + block_size - 8]
+    return zlib.decompress(deflated, -15), coffset + block_size
+
+
+def _get_bgzf_block_size(buffer, coffset: int) -> tuple[int, int]:
+    """Return the size of the extra field and the total size of the BGZF block
+    starting at `coffset` of `buffer`.
+    """
+    header = buffer[coffset : coffset + 18]
+    if len(header) < 18 or header[:4] != b"\x1f\x8b\x08\x04":
+        raise ValueError(f"No BGZF block at offset {coffset}.")
+    xlen = struct.unpack("<H", header[10:12])[0]
+    # the BC subfield is conventionally the only one, look for it anyway
+    extra = buffer[coffset + 12 : coffset + 12 + xlen]
+    pos = 0
+    while pos + 4 <= xlen:
+        subfield_id, subfield_len = (
+            extra[pos : pos + 2],
+            struct.unpack("<H", extra[pos + 2 : pos + 4])[0],
+        )
+        if subfield_id == b"BC":
+            return xlen, struct.unpack("<H", extra[pos + 4 : pos + 6])[0] + 1
+        pos += 4 + subfield_len
+    raise ValueError(f"BGZF block at offset {coffset} has no BC subfield.")
+
+
+def _get_bgzf_blocks(file_path: str) -> tuple[np.ndarray, np.ndarray]:
+    """Return the offsets in the file and in the uncompressed data of all blocks of a
+    BGZF file, reading only their headers and trailers.
+    """
+    coffsets, usizes = [], []
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if size:
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+                coffset = 0
+                while coffset < size:
+                    _, block_size = _get_bgzf_block_size(buffer, coffset)
+                    coffsets.append(coffset)
+                    # the uncompressed size is the last field of the block
+                    end = coffset + block_size
+                    usizes.append(struct.unpack("<I", buffer[end - 4 : end])[0])
+                    coffset = end
+    ustarts = np.cumsum([0] + usizes[:-1]) if usizes else np.zeros(0)
+    return np.array(coffsets, dtype=np.int64), ustarts.astype(np.int64)
+
+
+def _to_virtual_offsets(
+    offsets: np.ndarray, block_coffsets: np.ndarray, block_ustarts: np.ndarray
+) -> np.ndarray:
+    """Turn offsets in the uncompressed data of a BGZF file into virtual offsets."""
+    blocks = np.searchsorted(block_ustarts, offsets, side="right") - 1
+    return (block_coffsets[blocks] << 16) + (offsets - block_ustarts[blocks])
+
+
+def _iter_bgzf_blocks(file_path: str) -> Iterator[tuple[int, bytes]]:
+    """Yield `(coffset, data)` for each block of a BGZF file."""
+    with open(file_path, "rb") as f:
+        size = os.fstat(f.fileno()).st_size
+        if not size:
+            return
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            coffset = 0
+            while coffset < size:
+                data, next_coffset = _read_bgzf_block(buffer, coffset)
+                yield coffset, data
+                coffset = next_coffset
+
+
+def _build_index(
+    file_path: str, fmt: str, compression: str
+) -> tuple[list[str], np.ndarray, np.ndarray]:
+    ids, offsets, lengths = [], [], []
+    block_coffsets, block_ustarts = [], []
+    if compression == "bgzf":
+
+        def iter_data() -> Iterator[bytes]:
+            ustart = 0
+            for coffset, data in _iter_bgzf_blocks(file_path):
+                block_coffsets.append(coffset)
+                block_ustarts.append(ustart)
+                ustart += len(data)
+                yield data
+
+    else:
+
+        def iter_data() -> Iterator[bytes]:
+            with open(file_path, "rb") as f:
+                yield from iter(lambda: f.read(INDEX_SCAN_SIZE), b"")
+
+    base = 0
+    for data, starts, ends, record_ids in _iter_record_chunks(iter_data(), fmt):
+        ids.extend(record_ids)
+        offsets.append(starts + base)
+        lengths.append(ends - starts)
+        base += len(data)
+    offsets = np.concatenate(offsets) if offsets else np.zeros(0, dtype=np.int64)
+    lengths = np.concatenate(lengths) if lengths else np.zeros(0, dtype=np.int64)
+    if compression == "bgzf" and len(offsets):
+        offsets = _to_virtual_offsets(
+            offsets,
+            np.array(block_coffsets, dtype=np.int64),
+            np.array(block_ustarts, dtype=np.int64),
+        )
+    return ids, offsets.astype(np.int64), lengths.astype(np.int64)
+
+
+def _iter_record_chunks(
+    data_iter: Iterator[bytes], fmt: str
+) -> Iterator[tuple[bytes, np.ndarray, np.ndarray, list[str]]]:
+    """Regroup a stream of bytes into chunks of complete FASTA/FASTQ records.
+
+    Yields `(data, starts, ends, ids)` where the records of `data` span
+    `data[starts[i]:ends[i]]`, and consecutive chunks are contiguous in the stream.
+    """
+    pending = b""
+    chunks = []
+    size = 0
+    for chunk in data_iter:
+        chunks.append(chunk)
+        size += len(chunk)
+        if size < INDEX_SCAN_SIZE:
+            continue
+        data = pending + b"".join(chunks)
+        chunks, size = [], 0
+        end = _find_last_record_start(data, fmt)
+        if end <= 0:
+            pending = data
+            continue
+        pending = data[end:]
+        yield _locate_records(data[:end], fmt, last=False)
+    data = pending + b"".join(chunks)
+    if data:
+        yield _locate_records(data, fmt, last=True)
+
+
+def _find_last_record_start(data: bytes, fmt: str) -> int:
+    """Return the offset of the last record starting in `data`, which may be
+    incomplete, or -1 if there is none after the first one.
+    """
+    if fmt == "fasta":
+        return data.rfind(b"\n>") + 1 or -1
+    newlines = np.flatnonzero(np.frombuffer(data, dtype=np.uint8) == 10)
+    num_lines = len(newlines) // 4 * 4
+    return int(newlines[num_lines - 1]) + 1 if num_lines else -1
+
+
+def _locate_records(
+    data: bytes, fmt: str, last: bool
+) -> tuple[bytes, np.ndarray, np.ndarray, list[str]]:
+    arr = np.frombuffer(data, dtype=np.uint8)
+    newlines = np.flatnonzero(arr == 10)
+    if fmt == "fastq":
+        if last and not data.endswith(b"\n"):
+            newlines = np.append(newlines, len(data) - 1)
+            ends_at = len(data)
+        else:
+            ends_at = None
+        if len(newlines) % 4:
+            raise ValueError("Number of lines in FASTQ file is not a multiple of 4.")
+        ends = newlines[3::4] + 1
+        if ends_at is not None:
+            ends[-1] = ends_at
+        starts = np.empty_like(ends)
+        starts[:1] = 0
+        starts[1:] = ends[:-1]
+        header_ends = newlines[0::4]
+        marker = ord("@")
+    else:
+        line_starts = np.concatenate([[0], newlines + 1])
+        line_starts = line_starts[line_starts < len(data)]
+        starts = line_starts[arr[line_starts] == ord(">")]
+        if len(arr) and (not len(starts) or starts[0] != 0):
+            raise ValueError("FASTA file does not start with '>'.")
+        ends = np.append(starts[1:], len(data))
+        header_ends = np.append(newlines, len(data))[np.searchsorted(newlines, starts)]
+        marker = ord(">")
+    if len(starts) and not (arr[starts] == marker).all():
+        raise ValueError(f"Record does not start with '{chr(marker)}'.")
+    record_ids = [
+        data[start + 1 : end].split(maxsplit=1)[0].decode() if end > start + 1 else ""
+        for start, end in zip(starts.tolist(), header_ends.tolist())
+    ]
+    return data, starts, ends, record_ids
+
+
+def _load_index(
+    index_path: str, meta: dict[str, str]
+) -> tuple[list[str], np.ndarray, np.ndarray] | None:
+    try:
+        with open(index_path) as f:
+            header = f.readline()
+            saved = dict(item.split("=", 1) for item in header[1:].split())
+            if saved != meta:
+                return None
+            rows = [line.rstrip("\n").split("\t") for line in f]
+    except (OSError, ValueError):
+        return None
+    if not rows:
+        return [], np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    ids, offsets, lengths = zip(*rows)
+    return (
+        list(ids),
+        np.array(offsets, dtype=np.int64),
+        np.array(lengths, dtype=np.int64),
+    )
+
+
+def _save_index(
+    index_path: str,
+    meta: dict[str, str],
+    columns: tuple[list[str], np.ndarray, np.ndarray],
+) -> None:
+    # the index is rebuilt each time if it cannot be saved
+    with write_cache_file(index_path) as f:
+        f.write("#" + " ".join(f"{k}={v}" for k, v in meta.items()) + "\n")
+        f.writelines(
+            f"{record_id}\t{offset}\t{length}\n"
+            for record_id, offset, length in zip(
+                columns[0], columns[1].tolist(), columns[2].tolist()
+            )
+        )
+
+
+def _get_sample_index_path(file_path: str) -> str:
+    return os.path.join(
+        os.path.dirname(file_path),
+        CACHE_DIR,
+        "index",
+        f"{os.path.basename(file_path)}.sidx",
+    )
+
+
+def _get_sample_index_meta(file_path: str) -> dict[str, str]:
+    compression = get_compression(file_path)
+    if compression == "gzip":
+        raise ValueError(
+            f"{file_path} is compressed with gzip, only plain and BGZF files can be "
+            "indexed."
+        )
+    stat = os.stat(file_path)
+    return {
+        "version": str(SAMPLE_INDEX_VERSION),
+        "size": str(stat.st_size),
+        "mtime_ns": str(stat.st_mtime_ns),
+        "compression": compression,
+    }
+
+
+def _load_sample_index(
+    index_path: str, meta: dict[str, str]
+) -> dict[str, list[tuple[int, int, int]]] | None:
+    try:
+        with open(index_path) as f:
+            header = f.readline()
+            saved = dict(item.split("=", 1) for item in header[1:].split())
+            if saved != meta:
+                return None
+            sample_index = {}
+            for line in f:
+                sample, offset, length, num_reads = line.rstrip("\n").split("\t")
+                sample_index.setdefault(sample, []).append(
+                    (int(offset), int(length), int(num_reads))
+                )
+    except (OSError, ValueError):
+        return None
+    return sample_index
+
+
+def _save_sample_index(
+    file_path: str, sample_index: dict[str, list[tuple[int, int, int]]]
+) -> None:
+    meta = _get_sample_index_meta(file_path)
+    # the index is rebuilt each time if it cannot be saved
+    with write_cache_file(_get_sample_index_path(file_path)) as f:
+        f.write("#" + " ".join(f"{k}={v}" for k, v in meta.items()) + "\n")
+        f.writelines(
+            f"{sample}\t{offset}\t{length}\t{num_reads}\n"
+            for sample, runs in sample_index.items()
+            for offset, length, num_reads in runs
+        )
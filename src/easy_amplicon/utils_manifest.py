@@ -0,0 +1,198 @@
+"""Cached manifest of the FASTQ files in a directory.
+
+Listing a directory of FASTQ files used to take four globs and two regular expressions
+per file, on every call. `get_fastq_manifest` does it in a single `os.scandir` pass and
+records, for each FASTQ file, the sample name, read type and lane parsed from its
+name together with its size and mtime. The manifest is cached in memory and in
+`<directory>/.easy_amplicon/manifest.json`, and reused as long as the mtime of the
+directory is unchanged, i.e. no file has been added, removed or renamed.
+"""
+
+import contextlib
+import io
+import json
+import os
+import re
+import time
+from typing import IO, Iterator
+
+# - sample_S1_L001_R1_001.fastq.gz or sample_S1_L001_R2_001.fastq.gz
+PATTERN_ILLUMINA = re.compile(r"^(.+?)_S\d+_L\d{3}_(R[12])_001.f(ast)?q(.gz)?$")
+# - sample_R1.fq.gz or sample_R2.fq.gz (or fastq.gz, same for the following)
+# - sample_1.fq.gz or sample_2.fq.gz
+# - sample.R1.fq.gz or sample.R2.fq.gz
+# - sample.1.fq.gz or sample.2.fq.gz
+PATTERN_CUSTOM = re.compile(r"^(.+?)(?:_|\.)((?:R)?[12]).f(ast)?q(.gz)?$")
+PATTERN_LANE = re.compile(r"_S\d+_L(\d{3})_R[12]_001")
+# Listed in the order the globs used to run, which decides which of two duplicate
+# files of a sample wins.
+FASTQ_EXTENSIONS = [".fastq.gz", ".fq.gz", ".fastq", ".fq"]
+# Hidden directory holding the caches of easy_amplicon next to the data.
+CACHE_DIR = ".easy_amplicon"
+MANIFEST_VERSION = 1
+# Files and directories modified less than this long ago are not cached by size and
+# mtime, see `is_settled`.
+RACY_WINDOW_NS = 2 * 10**9
+
+_manifests = {}
+
+
+def get_fastq_manifest(directory: str, use_cache: bool = True) -> list[dict]:
+    """List the FASTQ files in a directory.
+
+    Args:
+        directory: Directory containing FASTQ files (.fastq, .fq, .fastq.gz, .fq.gz).
+            Hidden files are ignored.
+        use_cache: Whether to reuse a manifest built earlier, in this process or
+            saved next to the data, if the directory has not changed since.
+
+    Returns:
+        One dict per file, ordered by extension then by name, with keys "path"
+        (`directory` joined with the file name), "sample", "read" ("R1" or "R2"),
+        "lane" (e.g. "L001" for Illumina file names, else None), "size" and
+        "mtime_ns". "sample" and "read" are None for files whose name does not match
+        any known pattern.
+    """
+    directory_mtime_ns = os.stat(directory).st_mtime_ns
+    key = os.path.abspath(directory)
+    manifest_path = os.path.join(directory, CACHE_DIR, "manifest.json")
+    if use_cache:
+        if key in _manifests and _manifests[key][0] == directory_mtime_ns:
+            return _with_paths(directory, _manifests[key][1])
+        cached = _load_manifest(manifest_path)
+        if cached is not None and cached["directory_mtime_ns"] == directory_mtime_ns:
+            _manifests[key] = (directory_mtime_ns, cached["files"])
+            return _with_paths(directory, cached["files"])
+
+    # creating the cache directory changes the mtime of `directory`, so do it first
+    # and scan afterwards. Files written inside the cache directory do not.
+    try:
+        os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    except OSError:
+        manifest_path = None
+    directory_stat = os.stat(directory)
+    directory_mtime_ns = directory_stat.st_mtime_ns
+    files = _scan_fastq_dir(directory)
+    if not is_settled(directory_stat):
+        return _with_paths(directory, files)
+    _manifests[key] = (directory_mtime_ns, files)
+    if manifest_path is not None:
+        _save_manifest(
+            manifest_path,
+            {
+                "version": MANIFEST_VERSION,
+                "directory_mtime_ns": directory_mtime_ns,
+                "files": files,
+            },
+        )
+    return _with_paths(directory, files)
+
+
+def _scan_fastq_dir(directory: str) -> list[dict]:
+    files = []
+    with os.scandir(directory) as it:
+        for entry in it:
+            if entry.name.startswith("."):
+                continue
+            ext_rank = next(
+                (
+                    rank
+                    for rank, ext in enumerate(FASTQ_EXTENSIONS)
+                    if entry.name.endswith(ext)
+                ),
+                None,
+            )
+            if ext_rank is None or not entry.is_file():
+                continue
+            sample_name, read_type, lane = parse_fastq_name(entry.name)
+            stat = entry.stat()
+            files.append(
+                {
+                    "name": entry.name,
+                    "sample": sample_name,
+                    "read": read_type,
+                    "lane": lane,
+                    "size": stat.st_size,
+                    "mtime_ns": stat.st_mtime_ns,
+                    "_rank": ext_rank,
+                }
+            )
+    files.sort(key=lambda x: (x.pop("_rank"), x["name"]))
+    return files
+
+
+def parse_fastq_name(file_name: str) -> tuple[str, str, str] | tuple[None, None, None]:
+    """Parse the sample name, read type ("R1" or "R2") and lane (or None) from the
+    name of a FASTQ file, or return Nones if it matches no known pattern.
+    """
+    for pattern in [PATTERN_ILLUMINA, PATTERN_CUSTOM]:
+        match = pattern.search(file_name)
+        if match:
+            sample_name, read_type = match.groups()[:2]
+            read_type = {"1": "R1", "2": "R2"}.get(read_type, read_type)
+            if read_type not in ["R1", "R2"]:
+                continue
+            lane = (
+                PATTERN_LANE.search(file_name) if pattern is PATTERN_ILLUMINA else None
+            )
+            return sample_name, read_type, f"L{lane.group(1)}" if lane else None
+    return None, None, None
+
+
+def _with_paths(directory: str, files: list[dict]) -> list[dict]:
+    manifest = []
+    for file_ in files:
+        entry = {"path": os.path.join(directory, file_["name"])}
+        entry.update((k, v) for k, v in file_.items() if k != "name")
+        manifest.append(entry)
+    return manifest
+
+
+def _load_manifest(manifest_path: str) -> dict | None:
+    try:
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _save_manifest(manifest_path: str, manifest: dict) -> None:
+    # the in-memory cache still works if it cannot be saved
+    with write_cache_file(manifest_path) as f:
+        json.dump(manifest, f)
+
+
+def is_settled(stat: os.stat_result) -> bool:
+    """Whether a file or directory was last modified at least `RACY_WINDOW_NS` ago,
+    so that a cache keyed on its size and mtime can be saved. One modified again
+    within the mtime granularity of the file system would keep its mtime, and the
+    change would go unnoticed.
+    """
+    return time.time_ns() - stat.st_mtime_ns >= RACY_WINDOW_NS
+
+
+@contextlib.contextmanager
+def write_cache_file(cache_path: str, mode: str = "w") -> Iterator[IO]:
+    """Write a cache file through a temporary file replacing it once complete.
+
+    The data directory may be read-only, so failing to write is not an error: the
+    cache is just not saved.
+    """
+    temp_path = f"{cache_path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        f = open(temp_path, mode)
+    except OSError:
+        # the cache is written to nowhere
+        yield io.BytesIO() if "b" in mode else io.StringIO()
+        return
+    try:
+        with f:
+            yield f
+        os.replace(temp_path, cache_path)
+    except OSError:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
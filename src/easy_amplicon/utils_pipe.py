@@ -0,0 +1,156 @@
+"""Feed the stdin of an external tool from a background thread.
+
+Writing straight into `Popen.stdin` couples the Python producer (decompressing and
+renaming reads) to the child process: whenever the child is busy the pipe fills up,
+the write blocks, and decompression stops. `PipeFeeder` puts a bounded in-memory
+buffer and a writer thread between the two, so that both sides run concurrently and
+only block when the buffer is full (producer) or empty (writer). The time each side
+spends stalled is recorded, which tells whether a hand-off is limited by Python or by
+the external tool.
+"""
+
+import io
+import threading
+import time
+from collections import deque
+from typing import IO
+
+# Bytes held in memory between the producer and the pipe.
+PIPE_BUFFER_SIZE = 64 * 1024 * 1024
+
+
+class PipeFeeder(io.RawIOBase):
+    """A binary file object whose writes are queued in a bounded buffer and written to
+    `pipe` by a dedicated thread.
+
+    `write` only blocks while the buffer holds `buffer_size` bytes or more. Errors of
+    the writer thread, e.g. BrokenPipeError when the child exits early, are re-raised
+    by the next `write` or by `close`. Closing drains the buffer and closes the pipe.
+
+    The `stats` dict holds:
+        - "bytes": bytes written to the pipe.
+        - "producer_stall": seconds `write` waited for space in the buffer, i.e. the
+            time the producer was held up by the external tool.
+        - "writer_idle": seconds the writer thread waited for data, i.e. the time the
+            external tool was starved by the producer.
+        - "pipe_blocked": seconds spent in writes to the pipe.
+        - "peak_buffered": maximum number of bytes held in the buffer.
+    """
+
+    def __init__(
+        self,
+        pipe: IO[bytes],
+        buffer_size: int = PIPE_BUFFER_SIZE,
+        name: str = None,
+        verbose: bool = False,
+    ):
+        if buffer_size <= 0:
+            raise ValueError(f"Buffer size must be positive, getting {buffer_size}.")
+        self.name = name or getattr(pipe, "name", None)
+        self.buffer_size = buffer_size
+        self.verbose = verbose
+        self.stats = {
+            "bytes": 0,
+            "producer_stall": 0.0,
+            "writer_idle": 0.0,
+            "pipe_blocked": 0.0,
+            "peak_buffered": 0,
+        }
+        self._pipe = pipe
+        self._chunks = deque()
+        self._buffered = 0
+        self._eof = False
+        self._error = None
+        self._cond = threading.Condition()
+        self._start = time.perf_counter()
+        self._thread = threading.Thread(target=self._write_out, daemon=True)
+        self._thread.start()
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        if self.closed:
+            raise ValueError("I/O operation on closed PipeFeeder.")
+        chunk = bytes(data)
+        if not chunk:
+            return 0
+        with self._cond:
+            # a chunk larger than the buffer is still accepted once the buffer is empty
+            if self._buffered and self._buffered + len(chunk) > self.buffer_size:
+                start = time.perf_counter()
+                while (
+                    self._error is None
+                    and self._buffered
+                    and self._buffered + len(chunk) > self.buffer_size
+                ):
+                    self._cond.wait()
+                self.stats["producer_stall"] += time.perf_counter() - start
+            if self._error is not None:
+                raise self._error
+            self._chunks.append(chunk)
+            self._buffered += len(chunk)
+            self.stats["peak_buffered"] = max(
+                self.stats["peak_buffered"], self._buffered
+            )
+            self._cond.notify_all()
+        return len(chunk)
+
+    def _write_out(self) -> None:
+        try:
+            while True:
+                with self._cond:
+                    if not self._chunks and not self._eof:
+                        start = time.perf_counter()
+                        while not self._chunks and not self._eof:
+                            self._cond.wait()
+                        self.stats["writer_idle"] += time.perf_counter() - start
+                    if not self._chunks:
+                        break
+                    chunk = self._chunks[0]
+                start = time.perf_counter()
+                self._pipe.write(chunk)
+                self.stats["pipe_blocked"] += time.perf_counter() - start
+                with self._cond:
+                    self._chunks.popleft()
+                    self._buffered -= len(chunk)
+                    self.stats["bytes"] += len(chunk)
+                    self._cond.notify_all()
+            start = time.perf_counter()
+            self._pipe.flush()
+            self.stats["pipe_blocked"] += time.perf_counter() - start
+        except Exception as e:
+            with self._cond:
+                self._error = e
+                self._chunks.clear()
+                self._buffered = 0
+                self._cond.notify_all()
+
+    def summary(self) -> str:
+        """Return a one-line summary of `stats`."""
+        elapsed = time.perf_counter() - self._start
+        return (
+            f"{self.name}: {self.stats['bytes'] / 1e6:.1f} MB in {elapsed:.1f} s, "
+            f"producer stalled {self.stats['producer_stall']:.1f} s, "
+            f"writer idle {self.stats['writer_idle']:.1f} s, "
+            f"blocked on pipe {self.stats['pipe_blocked']:.1f} s, "
+            f"peak buffer {self.stats['peak_buffered'] / 1e6:.1f} MB"
+        )
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+        self._thread.join()
+        super().close()
+        try:
+            self._pipe.close()
+        except BrokenPipeError as e:
+            # flushing the last bytes can fail the same way as the writer thread
+            self._error = self._error or e
+        if self.verbose:
+            print(self.summary())
+        if self._error is not None:
+            raise self._error
@@ -0,0 +1,272 @@
+"""Preview a run on a small, reproducible sample of the reads of each sample.
+
+A full pass over a sequencing run takes hours, while a wrong primer set, barcode layout
+or a failed sample already shows in a few thousand reads. With `preview=N`,
+`cat_fastq`, `cat_fastq_se` and `demultiplex_pairs` keep a uniform sample of N reads
+(or read pairs) of each sample while streaming it, so every later step runs on a
+fraction of the data. Each read gets a pseudo-random key hashed from the sample name
+and its index in the sample, and the N reads with the lowest keys are kept (bottom-k
+sampling, a form of reservoir sampling). The same inputs thus always give the same
+preview, whatever the number of workers, and reads keep their order. Read statistics
+(`stats_path`) are collected before sampling.
+
+`write_preview_fastq` does the same on a FASTQ of renamed reads, and
+`summarize_trim` and `summarize_zotus` condense the reports of a preview run.
+"""
+
+import json
+import os
+import zlib
+from typing import Iterator
+
+import numpy as np
+import pandas as pd
+
+from easy_amplicon.utils import _iter_fastq_blocks, _iter_sample_chunks, smart_open
+from easy_amplicon.utils_shards import is_shard_manifest, read_shard_manifest
+
+# Seed of the keys of all samples, mixed with the hash of the sample name.
+PREVIEW_SEED = 0
+_SAMPLE_PREFIX = b"@sample="
+
+
+class ReadSampler:
+    """Keep a uniform sample of `num_reads` records of a stream fed by chunks of whole
+    records, see the module docstring.
+
+    Args:
+        num_reads: Number of records to keep.
+        name: Name of the stream, e.g. the sample name, which seeds the keys.
+        seed: Seed mixed with the hash of `name`.
+    """
+
+    def __init__(self, num_reads: int, name: str, seed: int = PREVIEW_SEED):
+        if num_reads < 1:
+            raise ValueError(f"Number of reads must be positive, getting {num_reads}.")
+        self.num_reads = num_reads
+        self.num_seen = 0
+        self._seed = np.uint64((zlib.crc32(name.encode()) << 32 ^ seed) % 2**64)
+        self._keys = np.zeros(0, dtype=np.uint64)
+        self._indices = np.zeros(0, dtype=np.int64)
+        self._records = []
+
+    def add(self, *chunks: bytes, lines: int = 4) -> None:
+        """Add chunks holding the same records, e.g. R1 and R2 of the same pairs, each
+        record made of `lines` lines (8 for interleaved pairs).
+        """
+        chunks = [c + b"\n" if c and not c.endswith(b"\n") else c for c in chunks]
+        bounds = [_record_bounds(chunk, lines) for chunk in chunks]
+        num_records = len(bounds[0]) - 1
+        if any(len(b) - 1 != num_records for b in bounds):
+            raise ValueError("Chunks hold different numbers of records.")
+        indices = np.arange(self.num_seen, self.num_seen + num_records)
+        keys = _hash_keys(self._seed, indices)
+        self.num_seen += num_records
+        if len(self._keys) + num_records > self.num_reads:
+            # only records that can still make it to the sample
+            all_keys = np.concatenate([self._keys, keys])
+            threshold = np.partition(all_keys, self.num_reads - 1)[self.num_reads - 1]
+            selected = np.flatnonzero(keys <= threshold)
+        else:
+            selected = np.arange(num_records)
+        for i in selected.tolist():
+            self._records.append(
+                tuple(chunk[b[i] : b[i + 1]] for chunk, b in zip(chunks, bounds))
+            )
+        self._keys = np.concatenate([self._keys, keys[selected]])
+        self._indices = np.concatenate([self._indices, indices[selected]])
+        if len(self._keys) >= 2 * self.num_reads:
+            self._prune()
+
+    def _prune(self) -> None:
+        if len(self._keys) > self.num_reads:
+            kept = np.argpartition(self._keys, self.num_reads - 1)[: self.num_reads]
+            self._keys, self._indices = self._keys[kept], self._indices[kept]
+            self._records = [self._records[i] for i in kept.tolist()]
+
+    def get_chunks(self) -> tuple[bytes, ...] | None:
+        """Return the kept records of each stream of chunks, in input order, or None
+        if no record was added.
+        """
+        if not self._records:
+            return None
+        self._prune()
+        order = np.argsort(self._indices).tolist()
+        return tuple(
+            b"".join(self._records[i][j] for i in order)
+            for j in range(len(self._records[0]))
+        )
+
+
+def _record_bounds(chunk: bytes, lines: int) -> list[int]:
+    newlines = np.flatnonzero(np.frombuffer(chunk, dtype=np.uint8) == 10)
+    if len(newlines) % lines:
+        raise ValueError(f"Chunk does not hold whole records of {lines} lines.")
+    return [0] + (newlines[lines - 1 :: lines] + 1).tolist()
+
+
+def _hash_keys(seed: np.uint64, indices: np.ndarray) -> np.ndarray:
+    """SplitMix64 of `seed + indices`."""
+    z = indices.astype(np.uint64) + seed + np.uint64(0x9E3779B97F4A7C15)
+    z = (z ^ (z >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+    z = (z ^ (z >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+    return z ^ (z >> np.uint64(31))
+
+
+def _iter_preview_chunks(
+    paths: tuple[str, ...],
+    sample_name: str,
+    have_sample_name: bool,
+    interleaved: bool,
+    num_reads: int,
+    stats: dict = None,
+) -> Iterator[tuple[bytes, bytes | None]]:
+    """Like `_iter_sample_chunks`, but yield only a sample of `num_reads` reads (or
+    pairs), once the whole sample is read.
+    """
+    sampler = ReadSampler(num_reads, sample_name)
+    lines = 8 if len(paths) == 2 and interleaved else 4
+    for chunk_r1, chunk_r2 in _iter_sample_chunks(
+        paths, sample_name, have_sample_name, interleaved, stats=stats
+    ):
+        if chunk_r2 is None:
+            sampler.add(chunk_r1, lines=lines)
+        else:
+            sampler.add(chunk_r1, chunk_r2)
+    chunks = sampler.get_chunks()
+    if chunks is not None:
+        yield chunks if len(chunks) == 2 else (chunks[0], None)
+
+
+def write_preview_fastq(input_fastq: str, output_fastq: str, num_reads: int) -> dict:
+    """Write a sample of `num_reads` reads of each sample of a FASTQ of renamed reads
+    (`@sample=<sample> ...`, e.g. trimmed by trim.py), a read table or a shard
+    manifest, in input order, samples in order of first appearance.
+
+    Returns:
+        The number of reads of each sample in the input.
+    """
+    if is_shard_manifest(input_fastq):
+        paths = [shard["path"] for shard in read_shard_manifest(input_fastq)["shards"]]
+    else:
+        paths = [input_fastq]
+    samplers = {}
+    for path in paths:
+        with smart_open(path, "rb") as f:
+            for block, newlines, _ in _iter_fastq_blocks(f):
+                for sample, chunk in _split_samples(block, newlines):
+                    if sample not in samplers:
+                        samplers[sample] = ReadSampler(num_reads, sample)
+                    samplers[sample].add(chunk)
+    with smart_open(output_fastq, "w") as f:
+        for sampler in samplers.values():
+            f.write(sampler.get_chunks()[0].decode())
+    return {sample: sampler.num_seen for sample, sampler in samplers.items()}
+
+
+def _split_samples(block: bytes, newlines: np.ndarray) -> Iterator[tuple[str, bytes]]:
+    """Yield the runs of consecutive records of the same sample in a block."""
+    starts = [0] + (newlines[3:-1:4] + 1).tolist()
+    samples = []
+    for start in starts:
+        if not block.startswith(_SAMPLE_PREFIX, start):
+            raise ValueError("Reads must be renamed to `@sample=<sample> ...`.")
+        header = block[start + len(_SAMPLE_PREFIX) : block.find(b"\n", start)]
+        samples.append(header.split(b" ", 1)[0].decode())
+    run_start = 0
+    for i in range(1, len(starts) + 1):
+        if i == len(starts) or samples[i] != samples[run_start]:
+            end = starts[i] if i < len(starts) else len(block)
+            yield samples[run_start], block[starts[run_start] : end]
+            run_start = i
+
+
+def summarize_trim(output_dir: str) -> list[str]:
+    """Return lines summarizing the reports trim.py wrote to `output_dir`: reads per
+    sample, assignment of reads to wells and trimming by cutadapt or fastp, for those
+    reports that exist.
+    """
+    lines = []
+    stats_path = os.path.join(output_dir, "read_stats.tsv")
+    if os.path.isfile(stats_path):
+        df = pd.read_table(stats_path, index_col=0)
+        counts = df["read_count"]
+        lines.append(
+            f"Samples: {len(counts)}, reads per sample: min {counts.min():,}, "
+            f"median {int(counts.median()):,}, max {counts.max():,}"
+        )
+        ee = (df["mean_ee"] * df["read_count"]).sum() / max(counts.sum(), 1)
+        lines.append(f"Mean expected errors per read: {ee:.2f}")
+    demux_path = os.path.join(output_dir, "demux_report.tsv")
+    if os.path.isfile(demux_path):
+        counts = pd.read_table(demux_path, index_col=0)["read_count"]
+        assigned = counts.drop("unknown", errors="ignore")
+        lines.append(
+            f"Demultiplexed: {_rate(assigned.sum(), counts.sum())} of read pairs, "
+            f"{(assigned > 0).sum()}/{len(assigned)} wells with reads"
+        )
+    cutadapt_path = os.path.join(output_dir, "cutadapt", "report.json")
+    if os.path.isfile(cutadapt_path):
+        with open(cutadapt_path) as f:
+            read_counts = json.load(f)["read_counts"]
+        total = read_counts["input"]
+        line = (
+            f"cutadapt: {total:,} reads, primer found in "
+            f"{_rate(read_counts.get('read1_with_adapter') or 0, total)}"
+        )
+        too_short = (read_counts.get("filtered") or {}).get("too_short")
+        if too_short is not None:
+            line += f", too short {_rate(too_short, total)}"
+        lines.append(line + f", kept {_rate(read_counts['output'], total)}")
+    fastp_path = os.path.join(output_dir, "fastp", "report.json")
+    if os.path.isfile(fastp_path):
+        with open(fastp_path) as f:
+            report = json.load(f)
+        total = report["summary"]["before_filtering"]["total_reads"]
+        passed = report.get("filtering_result", {}).get("passed_filter_reads", 0)
+        lines.append(f"fastp: {total:,} reads, passed filters {_rate(passed, total)}")
+    return lines
+
+
+def summarize_zotus(
+    otutab_tsv: str, sintax_tsv: str | None = None, top: int = 5
+) -> list[str]:
+    """Return lines summarizing the ZOTU table written by `search_global` and the
+    SINTAX taxonomy of ZOTUs (as from `tax_sintax`), if given: number of ZOTUs, reads
+    per ZOTU and the `top` most abundant taxa (or ZOTUs without taxonomy).
+    """
+    table = pd.read_table(otutab_tsv, index_col=0)
+    abundance = table.sum(axis=1).sort_values(ascending=False)
+    lines = [
+        f"ZOTUs: {len(abundance)}, found in {int((table > 0).any(axis=0).sum())}/"
+        f"{table.shape[1]} samples, {int(abundance.sum()):,} reads assigned"
+    ]
+    if sintax_tsv is None or not os.path.isfile(sintax_tsv):
+        names = abundance.index[:top]
+        lines.append(f"Top {len(names)} ZOTUs:")
+        lines.extend(_top_lines(abundance[names], abundance.sum()))
+        return lines
+    taxonomy = pd.read_table(sintax_tsv, header=None, index_col=0)
+    # the last column is the taxonomy above the cutoff, e.g. "d:Bacteria,p:Firmicutes"
+    ranks = taxonomy.iloc[:, -1].fillna("").astype(str)
+    ranks.index = ranks.index.str.split(";").str[0]
+    taxa = ranks.reindex(abundance.index).fillna("")
+    taxa = taxa.str.split(",").str[-1].replace("", "unclassified")
+    by_taxon = abundance.groupby(taxa.values).sum().sort_values(ascending=False)
+    lines.append(f"Top {min(top, len(by_taxon))} taxa:")
+    lines.extend(_top_lines(by_taxon[:top], abundance.sum()))
+    return lines
+
+
+def print_preview_report(title: str, lines: list[str]) -> None:
+    print(f"==== Preview: {title} ====")
+    for line in lines:
+        print(line)
+
+
+def _top_lines(counts: pd.Series, total: int) -> list[str]:
+    return [f"  {name}: {_rate(count, total)}" for name, count in counts.items()]
+
+
+def _rate(count: int, total: int) -> str:
+    return f"{count / total:.1%}" if total else "n/a"
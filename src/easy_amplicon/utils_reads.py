@@ -0,0 +1,466 @@
+"""Compact columnar binary format of reads, as an intermediate in place of gzip FASTQ.
+
+A read table (`.fqa`) is an Arrow IPC file of record batches of `READS_BATCH_SIZE`
+reads, each column compressed with zstd (or LZ4):
+
+    sample       dictionary<int32, string>  sample of `@sample=<sample> ...` reads,
+                                           null for reads without such a label
+    name         string    rest of the title, after the sample label
+    length       int32     number of bases
+    seq          binary    2-bit packed bases (A, C, G, T), 4 per byte
+    n_positions  list<int32>  positions of the other bases (N, ...), in the read
+    n_bases      binary    those bases
+    qual         binary    Phred+33 qualities, optionally binned (`QUALITY_BINS`)
+
+Python stages read tables directly: `parse_fastx`/`parse_fastx_batches` hand over to
+`parse_reads`/`iter_read_batches`, `smart_open` streams them as FASTQ text
+(`open_reads_fastq`), and `fastq_input_path` feeds them to external tools through a
+named pipe. `write_reads` converts FASTQ to a read table, `reads_to_fastq` back.
+"""
+
+import argparse
+import io
+import os
+from typing import IO, Iterable, Iterator
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.ipc as ipc
+
+from easy_amplicon.utils import _parse_titles, parse_fastx_batches, smart_open
+
+READS_EXTENSION = ".fqa"
+READS_VERSION = 1
+READS_BATCH_SIZE = 65536
+READS_COMPRESSION = "zstd"
+_METADATA_KEY = b"easy_amplicon_reads"
+_SAMPLE_PREFIX = "sample="
+
+# Illumina 8-level binning: Phred scores from the first of each pair up to the next
+# one are replaced by the second of the pair.
+QUALITY_BINS = [(2, 6), (10, 15), (20, 22), (25, 27), (30, 33), (35, 37), (40, 40)]
+
+_SCHEMA = pa.schema(
+    [
+        ("sample", pa.dictionary(pa.int32(), pa.string())),
+        ("name", pa.string()),
+        ("length", pa.int32()),
+        ("seq", pa.binary()),
+        ("n_positions", pa.list_(pa.int32())),
+        ("n_bases", pa.binary()),
+        ("qual", pa.binary()),
+    ]
+)
+
+_BASE_CODES = np.full(256, 255, dtype=np.uint8)
+_BASE_CODES[np.frombuffer(b"ACGT", dtype=np.uint8)] = np.arange(4)
+# the 4 bases of each packed byte
+_UNPACKED_BASES = np.frombuffer(b"ACGT", dtype=np.uint8)[
+    (np.arange(256)[:, None] >> np.array([6, 4, 2, 0])) & 3
+]
+
+
+def _quality_lut() -> np.ndarray:
+    lut = np.arange(256, dtype=np.uint8)
+    phred = np.arange(256) - 33
+    for start, value in QUALITY_BINS:
+        lut[phred >= start] = value + 33
+    return lut
+
+
+_QUALITY_LUT = _quality_lut()
+
+
+def is_reads_file(file_path: str) -> bool:
+    """Whether `file_path` is a read table, told by its extension."""
+    return file_path.endswith(READS_EXTENSION)
+
+
+def write_reads(
+    input_fastq: str | IO[bytes],
+    output_path: str,
+    bin_quality: bool = False,
+    compression: str = READS_COMPRESSION,
+    batch_size: int = READS_BATCH_SIZE,
+) -> int:
+    """Convert a FASTQ file into a read table.
+
+    Args:
+        input_fastq: Path to a plain or gzipped FASTQ file, or a binary file object.
+        output_path: Path to the read table, which should end with `.fqa`.
+        bin_quality: Whether to bin quality scores (see `QUALITY_BINS`), which makes
+            the table much smaller but loses precision.
+        compression: "zstd" or "lz4".
+        batch_size: Maximum number of reads per record batch.
+
+    Returns:
+        Number of reads written.
+    """
+    return write_read_batches(
+        parse_fastx_batches(input_fastq, "fastq", full_title=True),
+        output_path,
+        bin_quality,
+        compression,
+        batch_size,
+    )
+
+
+def write_read_batches(
+    batches: Iterable[dict],
+    output_path: str,
+    bin_quality: bool = False,
+    compression: str = READS_COMPRESSION,
+    batch_size: int = READS_BATCH_SIZE,
+) -> int:
+    """Write batches of reads, as yielded by `parse_fastx_batches` with `full_title`,
+    to a read table. See `write_reads` for the arguments.
+    """
+    options = ipc.IpcWriteOptions(compression=compression, emit_dictionary_deltas=True)
+    metadata = {_METADATA_KEY: f"version={READS_VERSION}".encode()}
+    schema = _SCHEMA.with_metadata(metadata)
+    samples, num_reads = {}, 0
+    temp_path = f"{output_path}.{os.getpid()}.tmp"
+    with ipc.new_file(temp_path, schema, options=options) as writer:
+        for batch in batches:
+            for start in range(0, len(batch["ids"]), batch_size):
+                part = _slice_batch(batch, start, start + batch_size)
+                writer.write_batch(_encode_batch(part, samples, bin_quality, schema))
+                num_reads += len(part["ids"])
+    os.replace(temp_path, output_path)
+    return num_reads
+
+
+def iter_read_batches(
+    file_path: str, full_title: bool = False, samples: Iterable[str] | None = None
+) -> Iterator[dict]:
+    """Read a read table in batches of records like `parse_fastx_batches`.
+
+    Args:
+        file_path: Path to the read table.
+        full_title: Whether "ids" are whole titles instead of their first word.
+        samples: Only yield reads of these samples, skipping batches without any.
+
+    Returns:
+        An iterator of dicts with the keys of `parse_fastx_batches`, plus "samples"
+        (list of str, or None for unlabeled reads).
+    """
+    with pa.memory_map(file_path) as source:
+        reader = ipc.open_file(source)
+        _check_metadata(reader.schema, file_path)
+        if samples is not None:
+            wanted = set(samples)
+            # the sample column is checked first to skip other batches altogether
+            sample_reader = ipc.open_file(
+                source, options=ipc.IpcReadOptions(included_fields=[0])
+            )
+        for i in range(reader.num_record_batches):
+            if samples is None:
+                batch = reader.get_batch(i)
+                sample_ids, dictionary = _sample_column(batch.column("sample"))
+                yield _decode_batch(batch, sample_ids, dictionary, full_title)
+                continue
+            sample_column = sample_reader.get_batch(i).column(0)
+            sample_ids, dictionary = _sample_column(sample_column)
+            wanted_ids = [j for j, sample in enumerate(dictionary) if sample in wanted]
+            keep = np.flatnonzero(np.isin(sample_ids, wanted_ids))
+            if not len(keep):
+                continue
+            batch = reader.get_batch(i)
+            if len(keep) < len(batch):
+                batch = batch.take(pa.array(keep))
+                sample_ids = sample_ids[keep]
+            yield _decode_batch(batch, sample_ids, dictionary, full_title)
+
+
+def parse_reads(
+    file_path: str,
+    as_bytes: bool = False,
+    full_title: bool = False,
+    samples: Iterable[str] | None = None,
+) -> Iterator[tuple]:
+    """Parse a read table into `(id, seq, qual)` tuples like `parse_fastx`, optionally
+    only reads of some samples.
+    """
+    for batch in iter_read_batches(file_path, full_title, samples):
+        seq, qual = batch["seq"].tobytes(), batch["qual"].tobytes()
+        offsets = batch["offsets"].tolist()
+        ids = batch["ids"]
+        if as_bytes:
+            ids = [i.encode() for i in ids]
+        else:
+            seq, qual = seq.decode(), qual.decode()
+        for i, read_id in enumerate(ids):
+            start, end = offsets[i], offsets[i + 1]
+            yield read_id, seq[start:end], qual[start:end]
+
+
+def iter_fastq_chunks(
+    file_path: str, samples: Iterable[str] | None = None
+) -> Iterator[bytes]:
+    """Yield the reads of a read table as chunks of FASTQ text, one per batch."""
+    for batch in iter_read_batches(file_path, full_title=True, samples=samples):
+        yield _format_fastq(batch)
+
+
+def open_reads_fastq(file_path: str) -> IO[bytes]:
+    """Open a read table as a binary stream of FASTQ text."""
+    return io.BufferedReader(_ChunkStream(iter_fastq_chunks(file_path)))
+
+
+def reads_to_fastq(file_path: str, output_path: str) -> int:
+    """Write the reads of a read table to a (optionally gzipped) FASTQ file.
+
+    Returns:
+        Number of reads written.
+    """
+    num_reads = 0
+    with smart_open(output_path, "w") as f:
+        for batch in iter_read_batches(file_path, full_title=True):
+            f.buffer.write(_format_fastq(batch))
+            num_reads += len(batch["ids"])
+    return num_reads
+
+
+def get_read_samples(file_path: str) -> dict[str, list[int]]:
+    """Return the samples of a read table, in order of first appearance, with the
+    batches holding their reads. Only the sample column is read.
+    """
+    options = ipc.IpcReadOptions(included_fields=[0])
+    sample_batches = {}
+    with pa.memory_map(file_path) as source:
+        reader = ipc.open_file(source, options=options)
+        _check_metadata(reader.schema, file_path)
+        for i in range(reader.num_record_batches):
+            sample_ids, dictionary = _sample_column(reader.get_batch(i).column(0))
+            ids, first = np.unique(sample_ids[sample_ids >= 0], return_index=True)
+            for sample_id in ids[np.argsort(first)]:
+                sample_batches.setdefault(dictionary[sample_id], []).append(i)
+    return sample_batches
+
+
+def _slice_batch(batch: dict, start: int, end: int) -> dict:
+    if start == 0 and end >= len(batch["ids"]):
+        return batch
+    offsets = batch["offsets"][start : end + 1]
+    seq_start, seq_end = offsets[0], offsets[-1]
+    return {
+        "ids": batch["ids"][start:end],
+        "offsets": offsets - seq_start,
+        "seq": batch["seq"][seq_start:seq_end],
+        "qual": batch["qual"][seq_start:seq_end],
+    }
+
+
+def _encode_batch(
+    batch: dict, samples: dict[str, int], bin_quality: bool, schema: pa.Schema
+) -> pa.RecordBatch:
+    num_reads = len(batch["ids"])
+    offsets, seq = batch["offsets"], batch["seq"]
+    lengths = np.diff(offsets)
+
+    # titles are split into the sample label and the rest
+    sample_ids = np.full(num_reads, -1, dtype=np.int32)
+    names = []
+    for i, title in enumerate(batch["ids"]):
+        if title.startswith(_SAMPLE_PREFIX):
+            label, _, name = title.partition(" ")
+            sample = label[len(_SAMPLE_PREFIX) :]
+            sample_ids[i] = samples.setdefault(sample, len(samples))
+            names.append(name)
+        else:
+            names.append(title)
+    sample_column = pa.DictionaryArray.from_arrays(
+        pa.array(sample_ids, mask=sample_ids < 0),
+        pa.array(list(samples), pa.string()),
+    )
+
+    # bases are packed 4 per byte, each read starting on a new byte
+    codes = _BASE_CODES[seq]
+    other = np.flatnonzero(codes == 255)
+    codes[other] = 0
+    packed_offsets, is_base = _packed_layout(lengths)
+    padded = np.zeros(len(is_base), dtype=np.uint8)
+    padded[is_base] = codes
+    padded = padded.reshape(-1, 4)
+    packed = padded[:, 0] << 6 | padded[:, 1] << 4 | padded[:, 2] << 2 | padded[:, 3]
+
+    # bases other than ACGT are kept aside with their positions
+    reads = np.searchsorted(offsets, other, side="right") - 1
+    n_counts = np.bincount(reads, minlength=num_reads)
+    n_offsets = np.zeros(num_reads + 1, dtype=np.int32)
+    np.cumsum(n_counts, out=n_offsets[1:])
+    n_positions = pa.ListArray.from_arrays(
+        pa.array(n_offsets), pa.array((other - offsets[reads]).astype(np.int32))
+    )
+
+    qual = _QUALITY_LUT[batch["qual"]] if bin_quality else batch["qual"]
+    return pa.record_batch(
+        [
+            sample_column,
+            pa.array(names, pa.string()),
+            pa.array(lengths.astype(np.int32)),
+            _binary_array(packed_offsets, packed),
+            n_positions,
+            _binary_array(n_offsets, seq[other]),
+            _binary_array(offsets, qual),
+        ],
+        schema=schema,
+    )
+
+
+def _decode_batch(
+    batch: pa.RecordBatch,
+    sample_ids: np.ndarray,
+    dictionary: list[str],
+    full_title: bool,
+) -> dict:
+    num_reads = len(batch)
+    lengths = batch.column("length").to_numpy().astype(np.int64)
+    offsets = np.zeros(num_reads + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    _, packed = _binary_buffers(batch.column("seq"))
+    _, is_base = _packed_layout(lengths)
+    seq = _UNPACKED_BASES[packed].ravel()[is_base]
+    n_positions = batch.column("n_positions")
+    if len(n_positions.flatten()):
+        n_offsets, n_bases = _binary_buffers(batch.column("n_bases"))
+        n_reads = np.repeat(np.arange(num_reads), np.diff(n_offsets))
+        seq[offsets[n_reads] + n_positions.flatten().to_numpy()] = n_bases
+
+    # titles are rebuilt from sample labels, reads without label only have a name
+    labels = np.array(
+        [f"{_SAMPLE_PREFIX}{sample}" for sample in dictionary] + [None], dtype=object
+    )[sample_ids]
+    unlabeled = np.flatnonzero(sample_ids < 0)
+    if full_title or len(unlabeled):
+        names = batch.column("name").to_pylist()
+    if full_title:
+        ids = [
+            name if label is None else f"{label} {name}" if name else label
+            for label, name in zip(labels.tolist(), names)
+        ]
+    else:
+        ids = labels.tolist()
+        for i in unlabeled.tolist():
+            ids[i] = _parse_titles([names[i]], False, 0)[0]
+    samples = np.array(dictionary + [None], dtype=object)[sample_ids].tolist()
+    return {
+        "ids": ids,
+        "offsets": offsets,
+        "seq": seq,
+        "qual": _binary_buffers(batch.column("qual"))[1],
+        "samples": samples,
+    }
+
+
+def _packed_layout(lengths: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Return the offsets of reads packed 4 bases per byte, and a mask of the bases
+    (as opposed to padding) in the unpacked bytes.
+    """
+    packed_offsets = np.zeros(len(lengths) + 1, dtype=np.int64)
+    np.cumsum((lengths + 3) // 4, out=packed_offsets[1:])
+    is_base = np.ones(packed_offsets[-1] * 4, dtype=bool)
+    padding = packed_offsets[1:] * 4 - (packed_offsets[:-1] * 4 + lengths)
+    for k in range(1, 4):
+        is_base[packed_offsets[1:][padding >= k] * 4 - k] = False
+    return packed_offsets, is_base
+
+
+def _format_fastq(batch: dict) -> bytes:
+    seq, qual = batch["seq"].tobytes(), batch["qual"].tobytes()
+    offsets = batch["offsets"].tolist()
+    return b"".join(
+        b"@%s\n%s\n+\n%s\n"
+        % (
+            title.encode(),
+            seq[offsets[i] : offsets[i + 1]],
+            qual[offsets[i] : offsets[i + 1]],
+        )
+        for i, title in enumerate(batch["ids"])
+    )
+
+
+def _binary_array(offsets: np.ndarray, data: np.ndarray) -> pa.Array:
+    return pa.Array.from_buffers(
+        pa.binary(),
+        len(offsets) - 1,
+        [None, pa.py_buffer(offsets.astype(np.int32)), pa.py_buffer(data.tobytes())],
+    )
+
+
+def _binary_buffers(array: pa.Array) -> tuple[np.ndarray, np.ndarray]:
+    """Return the offsets (starting at 0) and data of a binary array."""
+    _, offsets, data = array.buffers()
+    offsets = np.frombuffer(offsets, dtype=np.int32)[
+        array.offset : array.offset + len(array) + 1
+    ].astype(np.int64)
+    if data is None:
+        return offsets - offsets[0], np.zeros(0, dtype=np.uint8)
+    data = np.frombuffer(data, dtype=np.uint8)[offsets[0] : offsets[-1]]
+    return offsets - offsets[0], data
+
+
+def _sample_column(column: pa.DictionaryArray) -> tuple[np.ndarray, list[str]]:
+    """Return the sample IDs (-1 for null) and the sample names of a sample column."""
+    sample_ids = column.indices.fill_null(-1).to_numpy().astype(np.int32)
+    return sample_ids, column.dictionary.to_pylist()
+
+
+def _check_metadata(schema: pa.Schema, file_path: str) -> None:
+    metadata = (schema.metadata or {}).get(_METADATA_KEY)
+    if metadata != f"version={READS_VERSION}".encode():
+        raise ValueError(f"{file_path} is not a read table of a supported version.")
+
+
+class _ChunkStream(io.RawIOBase):
+    """Raw binary stream over an iterator of bytes chunks."""
+
+    def __init__(self, chunks: Iterator[bytes]):
+        self._chunks = chunks
+        self._pending = memoryview(b"")
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        while not self._pending:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                return 0
+            self._pending = memoryview(chunk)
+        size = min(len(buffer), len(self._pending))
+        buffer[:size] = self._pending[:size]
+        self._pending = self._pending[size:]
+        return size
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert between FASTQ files and read tables (.fqa)."
+    )
+    parser.add_argument("-i", "--input", required=True, help="Input file")
+    parser.add_argument(
+        "-o",
+        "--output",
+        required=True,
+        help="Output file, a read table if it ends with .fqa, FASTQ otherwise",
+    )
+    parser.add_argument(
+        "--bin_quality", action="store_true", help="Bin quality scores (lossy)"
+    )
+    parser.add_argument(
+        "--compression", default=READS_COMPRESSION, choices=["zstd", "lz4"]
+    )
+    args = parser.parse_args()
+    if is_reads_file(args.output):
+        num_reads = write_reads(
+            args.input, args.output, args.bin_quality, args.compression
+        )
+    else:
+        num_reads = reads_to_fastq(args.input, args.output)
+    print(f"Converted {num_reads} reads to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,278 @@
+"""Run external commands, skipping those that already completed.
+
+Pipelines chaining cutadapt, seqkit, vsearch and the like run for hours, and a failure
+halfway used to mean running every step again (or editing the loop to skip the done
+samples by hand). `run_command` records each command that completes in a cache
+database, `<directory of its first output>/.easy_amplicon/commands.sqlite`, under a
+key hashing:
+- the command line,
+- the content of its input files (SHA-256, itself cached by path, size and mtime, so
+    unchanged inputs are not read again and rewritten identical ones still match),
+- the executable of each tool, by path, size and mtime, which change with its version
+    (not every tool has a `--version`).
+
+The size and mtime of its outputs are recorded along. A command is skipped when its
+key is recorded and all its outputs are still as they were, so running a pipeline
+again resumes after the last completed command, while any change of parameters,
+inputs or tool versions runs the affected commands again. Failed or interrupted
+commands are never recorded.
+
+Commands without outputs or fed from a pipe (stdin or a named pipe) always run, as do
+all commands when the environment variable `EASY_AMPLICON_NO_CACHE` is set.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import shutil
+import sqlite3
+import stat
+import subprocess
+import time
+from typing import IO, Iterable, Iterator
+
+from easy_amplicon.utils import print_command
+from easy_amplicon.utils_manifest import CACHE_DIR, is_settled
+
+CACHE_DB = "commands.sqlite"
+NO_CACHE_ENV = "EASY_AMPLICON_NO_CACHE"
+HASH_BLOCK_SIZE = 1024 * 1024
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS commands (
+    key TEXT PRIMARY KEY, args TEXT, outputs TEXT, finished REAL
+);
+CREATE TABLE IF NOT EXISTS digests (
+    path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER, digest TEXT
+);
+"""
+
+
+def run_command(
+    args: list[str] | list[list[str]],
+    inputs: Iterable[str] = (),
+    outputs: Iterable[str] = (),
+    stdin: str | int | IO | None = None,
+    stdout: str | int | IO | None = None,
+    stderr: str | int | IO | None = None,
+    check: bool = False,
+    ignore: Iterable[str] = (),
+    verbose: bool = True,
+    cache_db: str | None = None,
+) -> bool:
+    """Run a command to completion unless the same command already completed on the
+    same inputs and its outputs are untouched, see the module docstring.
+
+    Args:
+        args: Command, or list of commands piped into each other.
+        inputs: Paths of files or directories read by the command.
+        outputs: Paths of files or directories written by the command.
+        stdin: As in `subprocess.run`, or the path of an input file.
+        stdout: As in `subprocess.run`, or the path of an output file, only opened
+            (and truncated) if the command runs.
+        stderr: As in `subprocess.run`, or the path of a log file, only opened if the
+            command runs. A log is not an output, it may be missing. Goes to all
+            commands of a pipeline.
+        check: Raise `subprocess.CalledProcessError` if the command fails.
+        ignore: Arguments left out of the key, e.g. temporary directories.
+        verbose: Print the command (see `print_command`) and whether it is skipped.
+        cache_db: Path of the cache database, by default next to the first output.
+
+    Returns:
+        True if the command ran, False if it was skipped.
+    """
+    commands = [args] if isinstance(args[0], str) else args
+    inputs = [*inputs, *([stdin] if isinstance(stdin, str) else [])]
+    outputs = [*outputs, *([stdout] if isinstance(stdout, str) else [])]
+    cached = (
+        bool(outputs)
+        and not os.environ.get(NO_CACHE_ENV)
+        and (stdin is None or isinstance(stdin, str) or stdin == subprocess.DEVNULL)
+        and not any(_is_pipe(path) for path in inputs)
+    )
+    if cache_db is None and outputs:
+        output_dir = os.path.dirname(os.path.abspath(outputs[0]))
+        cache_db = os.path.join(output_dir, CACHE_DIR, CACHE_DB)
+    if verbose:
+        for command in commands:
+            print_command(command)
+
+    if cached:
+        ignore = set(ignore)
+        with _open_db(cache_db) as db:
+            key = _command_key(db, commands, inputs, ignore)
+            row = db.execute(
+                "SELECT outputs FROM commands WHERE key = ?", (key,)
+            ).fetchone()
+        if row is not None and json.loads(row[0]) == _stat_outputs(outputs):
+            if verbose:
+                print("Skipping the command, its outputs are up to date.")
+            return False
+
+    with contextlib.ExitStack() as stack:
+        stdin, stdout, stderr = [
+            (
+                stack.enter_context(open(stream, mode))
+                if isinstance(stream, str)
+                else stream
+            )
+            for stream, mode in [(stdin, "rb"), (stdout, "wb"), (stderr, "wb")]
+        ]
+        returncode = _run_pipeline(commands, stdin, stdout, stderr)
+    if returncode:
+        if check:
+            raise subprocess.CalledProcessError(returncode, args)
+        return True
+
+    if cached:
+        with _open_db(cache_db) as db:
+            db.execute(
+                "INSERT OR REPLACE INTO commands VALUES (?, ?, ?, ?)",
+                (
+                    key,
+                    json.dumps(commands),
+                    json.dumps(_stat_outputs(outputs)),
+                    time.time(),
+                ),
+            )
+    return True
+
+
+def _run_pipeline(commands: list[list[str]], stdin, stdout, stderr) -> int:
+    """Run commands piped into each other, returning the first non-zero exit status
+    or 0.
+    """
+    procs = []
+    for i, command in enumerate(commands):
+        last = i == len(commands) - 1
+        procs.append(
+            subprocess.Popen(
+                command,
+                stdin=procs[-1].stdout if procs else stdin,
+                stdout=stdout if last else subprocess.PIPE,
+                stderr=stderr,
+            )
+        )
+        if len(procs) > 1:
+            # let the previous command get SIGPIPE if this one exits early
+            procs[-2].stdout.close()
+    for proc in procs:
+        proc.wait()
+    return next((proc.returncode for proc in procs if proc.returncode), 0)
+
+
+@contextlib.contextmanager
+def _open_db(path: str) -> Iterator[sqlite3.Connection]:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    # several pipelines may share an output directory
+    db = sqlite3.connect(path, timeout=60)
+    try:
+        db.executescript(_SCHEMA)
+        with db:
+            yield db
+    finally:
+        db.close()
+
+
+def _command_key(
+    db: sqlite3.Connection,
+    commands: list[list[str]],
+    inputs: list[str],
+    ignore: set[str],
+) -> str:
+    key = {
+        "commands": [
+            [arg for arg in command if arg not in ignore] for command in commands
+        ],
+        "tools": [_tool_fingerprint(command[0]) for command in commands],
+        "inputs": [_input_digest(db, path) for path in inputs],
+    }
+    return hashlib.sha256(json.dumps(key).encode()).hexdigest()
+
+
+def _is_pipe(path: str) -> bool:
+    """Whether `path` is a named pipe (e.g. from `fastq_input_path`), which cannot be
+    hashed without consuming it.
+    """
+    try:
+        return stat.S_ISFIFO(os.stat(path).st_mode)
+    except FileNotFoundError:
+        return False
+
+
+def _tool_fingerprint(tool: str) -> list:
+    path = shutil.which(tool)
+    if path is None:
+        return [tool]
+    st = os.stat(path)
+    return [os.path.realpath(path), st.st_size, st.st_mtime_ns]
+
+
+def _input_digest(db: sqlite3.Connection, path: str) -> str | None:
+    """Return the SHA-256 of a file, or of the relative paths and digests of the files
+    in a directory, or None if it does not exist.
+    """
+    if os.path.isdir(path):
+        digest = hashlib.sha256()
+        for name in _list_files(path):
+            file_digest = _input_digest(db, os.path.join(path, name))
+            digest.update(f"{name}\0{file_digest}\0".encode())
+        return digest.hexdigest()
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    path = os.path.abspath(path)
+    row = db.execute(
+        "SELECT digest FROM digests WHERE path = ? AND size = ? AND mtime_ns = ?",
+        (path, st.st_size, st.st_mtime_ns),
+    ).fetchone()
+    if row is not None:
+        return row[0]
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    if is_settled(st):
+        db.execute(
+            "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?)",
+            (path, st.st_size, st.st_mtime_ns, digest.hexdigest()),
+        )
+    return digest.hexdigest()
+
+
+def _stat_outputs(outputs: list[str]) -> list:
+    """Return the size and mtime of each output file, those of the files of output
+    directories, or None for missing ones.
+    """
+    stats = []
+    for path in outputs:
+        if os.path.isdir(path):
+            stats.append(
+                [
+                    [name, *_stat_file(os.path.join(path, name))]
+                    for name in _list_files(path)
+                ]
+            )
+        else:
+            stats.append(_stat_file(path))
+    return stats
+
+
+def _stat_file(path: str) -> list[int] | None:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return [st.st_size, st.st_mtime_ns]
+
+
+def _list_files(directory: str) -> list[str]:
+    """List the files under `directory` by relative path, skipping caches."""
+    names = []
+    for root, dirs, files in os.walk(directory):
+        dirs[:] = sorted(d for d in dirs if d != CACHE_DIR)
+        names.extend(
+            os.path.relpath(os.path.join(root, name), directory) for name in files
+        )
+    return sorted(names)
@@ -0,0 +1,344 @@
+"""Sample-partitioned store of FASTQ reads, in place of a single merged FASTQ file.
+
+`write_fastq_shards` splits a FASTQ file whose reads are named like
+`@sample=<sample> ...` (as renamed by `cat_fastq`/`cat_fastq_se`) into gzip shards,
+one per sample or per group of small samples, and writes a JSON manifest next to
+them:
+
+    {
+        "version": 1,
+        "format": "fastq",
+        "num_reads": 1234,
+        "shards": [{"path": "shard_0000.fq.gz", "size": 5678, "samples": ["A1"]}],
+        "samples": {
+            "A1": {"shard": 0, "offset": 0, "length": 5678, "num_reads": 1234,
+                   "num_bytes": 91011},
+        },
+    }
+
+Each sample is stored as a contiguous run of gzip members in its shard (`offset` and
+`length` in compressed bytes), so that a single sample is read without decompressing
+anything else, samples can be read in parallel, and the concatenation of all shards
+is itself a valid gzip FASTQ file. Reads of a sample do not need to be contiguous in
+the input.
+"""
+
+import contextlib
+import errno
+import gzip
+import json
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import IO, Iterator
+
+import numpy as np
+
+from easy_amplicon.utils import _iter_fastq_blocks, smart_open
+from easy_amplicon.utils_cpu import available_cpus
+from easy_amplicon.utils_files import append_file
+from easy_amplicon.utils_gzip import DEFAULT_COMPRESS_LEVEL, compress_member
+from easy_amplicon.utils_manifest import CACHE_DIR
+from easy_amplicon.utils_reads import is_reads_file, iter_fastq_chunks
+
+SHARD_MANIFEST = "manifest.json"
+SHARD_VERSION = 1
+# Samples with less uncompressed data than this are grouped into shared shards.
+MIN_SHARD_SIZE = 16 * 1024 * 1024
+# Uncompressed bytes buffered per sample before being compressed as a gzip member.
+SHARD_MEMBER_SIZE = 1024 * 1024
+_SAMPLE_PREFIX = b"@sample="
+
+
+def write_fastq_shards(
+    input_fastq: str | IO[bytes],
+    shard_dir: str,
+    min_shard_size: int = MIN_SHARD_SIZE,
+    compresslevel: int = DEFAULT_COMPRESS_LEVEL,
+    threads: int | None = None,
+) -> str:
+    """Split a FASTQ file into per-sample gzip shards and write their manifest.
+
+    Args:
+        input_fastq: Path to a plain or gzipped FASTQ file, or a binary file object,
+            with reads named like `@sample=<sample> ...`.
+        shard_dir: Directory of the shards and of the manifest. Existing shards in it
+            are overwritten.
+        min_shard_size: Samples with less uncompressed data than this are grouped,
+            in order of first appearance, into shards of at least this size.
+        compresslevel: Gzip compression level of the shards.
+        threads: Number of threads compressing gzip members (zlib releases the GIL).
+            Defaults to the number of available CPUs.
+
+    Returns:
+        Path to the manifest.
+    """
+    os.makedirs(shard_dir, exist_ok=True)
+    temp_dir = os.path.join(shard_dir, ".tmp")
+    os.makedirs(temp_dir, exist_ok=True)
+    samples = {}
+    with contextlib.ExitStack() as stack:
+        if isinstance(input_fastq, str):
+            input_fastq = stack.enter_context(smart_open(input_fastq, "rb"))
+        threads = threads or available_cpus()
+        executor = stack.enter_context(ThreadPoolExecutor(threads))
+        # members being compressed are bounded to keep memory in check
+        writer = _SampleWriter(temp_dir, executor, compresslevel, 2 * threads)
+        for block, newlines, _ in _iter_fastq_blocks(input_fastq):
+            for sample, data, num_reads in _split_block_by_sample(block, newlines):
+                if sample not in samples:
+                    samples[sample] = {"num_reads": 0, "num_bytes": 0}
+                samples[sample]["num_reads"] += num_reads
+                samples[sample]["num_bytes"] += len(data)
+                writer.write(sample, data)
+        writer.close()
+
+    # assemble the shards, each a concatenation of per-sample runs of gzip members
+    groups, group, group_size = [], [], 0
+    for sample, info in samples.items():
+        group.append(sample)
+        group_size += info["num_bytes"]
+        if group_size >= min_shard_size:
+            groups.append(group)
+            group, group_size = [], 0
+    if group:
+        groups.append(group)
+    shards = []
+    for shard_index, group in enumerate(groups):
+        shard_name = f"shard_{shard_index:04d}.fq.gz"
+        shard_path = os.path.join(shard_dir, shard_name)
+        offset = 0
+        with open(shard_path, "wb") as out:
+            for sample in group:
+                append_file(writer.paths[sample], out)
+                os.remove(writer.paths[sample])
+                length = out.tell() - offset
+                samples[sample] = {
+                    "shard": shard_index,
+                    "offset": offset,
+                    "length": length,
+                    **samples[sample],
+                }
+                offset += length
+        shards.append({"path": shard_name, "size": offset, "samples": group})
+    os.rmdir(temp_dir)
+
+    manifest_path = os.path.join(shard_dir, SHARD_MANIFEST)
+    temp_path = f"{manifest_path}.{os.getpid()}.tmp"
+    with open(temp_path, "w") as f:
+        json.dump(
+            {
+                "version": SHARD_VERSION,
+                "format": "fastq",
+                "num_reads": sum(info["num_reads"] for info in samples.values()),
+                "shards": shards,
+                "samples": samples,
+            },
+            f,
+            indent=1,
+        )
+    os.replace(temp_path, manifest_path)
+    return manifest_path
+
+
+def is_shard_manifest(path: str) -> bool:
+    """Whether `path` is the manifest of a shard directory (or such a directory)."""
+    if os.path.isdir(path):
+        path = os.path.join(path, SHARD_MANIFEST)
+    return os.path.basename(path) == SHARD_MANIFEST and os.path.isfile(path)
+
+
+def read_shard_manifest(path: str) -> dict:
+    """Read a shard manifest, given its path or the shard directory.
+
+    Shard paths in the returned manifest are made absolute.
+    """
+    if os.path.isdir(path):
+        path = os.path.join(path, SHARD_MANIFEST)
+    with open(path) as f:
+        manifest = json.load(f)
+    if manifest.get("version") != SHARD_VERSION:
+        raise ValueError(f"Unsupported shard manifest version in {path}.")
+    shard_dir = os.path.dirname(os.path.abspath(path))
+    for shard in manifest["shards"]:
+        shard["path"] = os.path.join(shard_dir, shard["path"])
+    return manifest
+
+
+def read_sample_fastq(manifest: str | dict, sample: str) -> bytes:
+    """Return the (uncompressed) FASTQ reads of a sample of a shard store.
+
+    Only the compressed bytes of this sample are read from its shard.
+
+    Args:
+        manifest: Path to the manifest (or shard directory), or the manifest read by
+            `read_shard_manifest`.
+        sample: Name of the sample.
+    """
+    if isinstance(manifest, str):
+        manifest = read_shard_manifest(manifest)
+    info = manifest["samples"][sample]
+    with open(manifest["shards"][info["shard"]]["path"], "rb") as f:
+        f.seek(info["offset"])
+        return gzip.decompress(f.read(info["length"]))
+
+
+@contextlib.contextmanager
+def fastq_input_path(path: str) -> Iterator[str]:
+    """Give a path to pass as FASTQ input to external tools such as vsearch, given
+    either a FASTQ file, a shard manifest (or shard directory) or a read table (see
+    `easy_amplicon.utils_reads`).
+
+    A single FASTQ file is passed through unchanged. The shards of a manifest, or the
+    decoded reads of a read table, are written in order by a thread into a named pipe,
+    whose path is yielded.
+    """
+    if is_reads_file(path):
+        chunks = iter_fastq_chunks(path)
+        fifo_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR)
+    elif is_shard_manifest(path):
+        shard_paths = [shard["path"] for shard in read_shard_manifest(path)["shards"]]
+        chunks = _iter_file_chunks(shard_paths)
+        shard_dir = path if os.path.isdir(path) else os.path.dirname(path)
+        fifo_dir = os.path.join(os.path.abspath(shard_dir), ".tmp")
+    else:
+        yield path
+        return
+    os.makedirs(fifo_dir, exist_ok=True)
+    fifo_path = os.path.join(fifo_dir, f"input.{os.getpid()}.{threading.get_ident()}")
+    os.mkfifo(fifo_path)
+    errors = []
+    stop = threading.Event()
+
+    def feed():
+        try:
+            # wait for the tool to open the other end, unless it never does
+            while True:
+                try:
+                    fd = os.open(fifo_path, os.O_WRONLY | os.O_NONBLOCK)
+                    break
+                except OSError as e:
+                    if e.errno != errno.ENXIO or stop.wait(0.01):
+                        raise
+            os.set_blocking(fd, True)
+            with open(fd, "wb") as out:
+                for chunk in chunks:
+                    out.write(chunk)
+        except BrokenPipeError:  # the reader stopped early
+            pass
+        except Exception as e:
+            if not stop.is_set():
+                errors.append(e)
+
+    feeder = threading.Thread(target=feed, daemon=True)
+    feeder.start()
+    try:
+        yield fifo_path
+    finally:
+        stop.set()
+        feeder.join()
+        os.remove(fifo_path)
+        with contextlib.suppress(OSError):
+            os.rmdir(fifo_dir)
+    if errors:
+        raise errors[0]
+
+
+def _iter_file_chunks(paths: list[str]) -> Iterator[bytes]:
+    for path in paths:
+        with smart_open(path, "rb") as f:
+            yield from iter(lambda: f.read(1024 * 1024), b"")
+
+
+def _split_block_by_sample(
+    block: bytes, newlines: np.ndarray
+) -> Iterator[tuple[str, bytes, int]]:
+    """Cut a block of complete FASTQ records into runs of consecutive records of the
+    same sample, yielding `(sample, data, num_reads)`.
+
+    The sample is told by a `sample=<sample>` read name, or by the word following the
+    read name for reads relabeled with the former name kept (`vsearch --relabel_keep`).
+    """
+    headers = block.split(b"\n")[0:-1:4]
+    names = [header.split(None, 1)[0] for header in headers]
+    if names and not names[0].startswith(_SAMPLE_PREFIX):
+        names = [b"@" + (header.split(None, 2)[1:2] or [b""])[0] for header in headers]
+    names = np.array(names, dtype=object)
+    ends = newlines[3::4] + 1
+    run_starts = np.flatnonzero(names[1:] != names[:-1]) + 1
+    run_ends = np.append(run_starts, len(names))
+    run_starts = np.insert(run_starts, 0, 0)
+    for start, end in zip(run_starts, run_ends):
+        name = names[start]
+        if not name.startswith(_SAMPLE_PREFIX):
+            raise ValueError(
+                f"Read {name[1:].decode()} is not labeled like `@sample=<sample> ...`."
+            )
+        data_start = ends[start - 1] if start else 0
+        data = block[data_start : ends[end - 1]]
+        yield name[len(_SAMPLE_PREFIX) :].decode(), data, int(end - start)
+
+
+class _SampleWriter:
+    """Buffer reads per sample and append them, compressed as gzip members, to one
+    temporary file per sample. Members are compressed by a thread pool and written in
+    order.
+    """
+
+    def __init__(
+        self,
+        temp_dir: str,
+        executor: ThreadPoolExecutor,
+        compresslevel: int,
+        max_pending: int,
+    ):
+        self.temp_dir = temp_dir
+        self.executor = executor
+        self.compresslevel = compresslevel
+        self.paths = {}
+        self._buffers: dict[str, list[bytes]] = {}
+        self._buffered: dict[str, int] = {}
+        self._pending: dict[str, list[Future]] = {}
+        self._max_pending = max_pending
+        self._num_pending = 0
+
+    def write(self, sample: str, data: bytes) -> None:
+        if sample not in self.paths:
+            self.paths[sample] = os.path.join(self.temp_dir, f"{len(self.paths)}.fq.gz")
+            self._buffers[sample] = []
+            self._buffered[sample] = 0
+            self._pending[sample] = []
+            open(self.paths[sample], "wb").close()
+        self._buffers[sample].append(data)
+        self._buffered[sample] += len(data)
+        if self._buffered[sample] >= SHARD_MEMBER_SIZE:
+            self._submit(sample)
+            if self._num_pending > self._max_pending:
+                for sample_ in self.paths:
+                    self._drain(sample_, wait=True)
+        self._drain(sample, wait=False)
+
+    def close(self) -> None:
+        for sample in self.paths:
+            if self._buffers[sample]:
+                self._submit(sample)
+        for sample in self.paths:
+            self._drain(sample, wait=True)
+
+    def _submit(self, sample: str) -> None:
+        data = b"".join(self._buffers[sample])
+        self._buffers[sample].clear()
+        self._buffered[sample] = 0
+        self._pending[sample].append(
+            self.executor.submit(compress_member, data, self.compresslevel)
+        )
+        self._num_pending += 1
+
+    def _drain(self, sample: str, wait: bool) -> None:
+        pending = self._pending[sample]
+        if not pending or not (wait or pending[0].done()):
+            return
+        with open(self.paths[sample], "ab") as f:
+            while pending and (wait or pending[0].done()):
+                f.write(pending.pop(0).result())
+                self._num_pending -= 1
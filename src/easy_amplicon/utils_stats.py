@@ -0,0 +1,271 @@
+"""Read statistics of FASTQ/FASTA files, computed in process.
+
+`fastx_stats` reads a file (plain or gzip) once in large blocks and counts reads and
+bases, the length histogram and, for FASTQ, the mean quality per position. Reading a
+gzip file to the end also checks its integrity (CRC and length of every member).
+Results are cached as JSON sidecar files in `<directory>/.easy_amplicon/stats/`,
+keyed by the size and mtime of the file, so asking again for the statistics of an
+unchanged file returns immediately. `fastx_stats_many` and `fastq_dir_stats` process
+many files in parallel, the latter also checking that R1 and R2 files of each sample
+have the same number of reads.
+"""
+
+import json
+import os
+from typing import IO
+
+import numpy as np
+import pandas as pd
+from loky import get_reusable_executor
+
+from easy_amplicon.utils import (
+    _iter_fasta_blocks,
+    _iter_fastq_blocks,
+    get_fastx_format,
+    smart_open,
+)
+from easy_amplicon.utils_manifest import (
+    CACHE_DIR,
+    get_fastq_manifest,
+    is_settled,
+    write_cache_file,
+)
+
+STATS_VERSION = 1
+
+
+def fastx_stats(file_path: str, use_cache: bool = True) -> dict:
+    """Compute read statistics of a FASTQ or FASTA file, plain or gzipped.
+
+    Args:
+        file_path: Path to the file, whose format is told by its extension.
+        use_cache: Whether to reuse (and save) the statistics cached next to the file.
+
+    Returns:
+        A dict with keys "path", "format", "num_seqs", "num_bases", "min_len",
+        "avg_len", "max_len", "length_hist" (list of [length, count] pairs), and for
+        FASTQ "q20_bases", "q30_bases" and "position_quality" (mean Phred score at
+        each position, from the first base on).
+
+    Raises:
+        EOFError, OSError: If the file is a truncated or corrupted gzip file.
+        ValueError: If the file is not a well-formed FASTQ/FASTA file.
+    """
+    fmt = get_fastx_format(file_path)
+    stat = os.stat(file_path)
+    cache_path = os.path.join(
+        os.path.dirname(file_path),
+        CACHE_DIR,
+        "stats",
+        f"{os.path.basename(file_path)}.json",
+    )
+    if use_cache:
+        cached = _load_stats(cache_path, stat)
+        if cached is not None:
+            cached["path"] = file_path
+            return cached
+
+    with smart_open(file_path, "rb") as f:
+        if fmt == "fastq":
+            stats = _fastq_stats(f)
+        else:
+            stats = _fasta_stats(f)
+    stats = {"path": file_path, "format": fmt, **stats}
+    if use_cache and is_settled(stat):
+        _save_stats(cache_path, stat, stats)
+    return stats
+
+
+def fastx_stats_many(
+    file_paths: list[str],
+    num_workers: int = 4,
+    use_cache: bool = True,
+    raise_errors: bool = True,
+) -> list[dict]:
+    """Compute `fastx_stats` of many files, in parallel across files.
+
+    Args:
+        file_paths: Paths to FASTQ/FASTA files.
+        num_workers: Number of worker processes.
+        use_cache: See `fastx_stats`.
+        raise_errors: If False, the statistics of a file that fails to be read (e.g.
+            a truncated gzip file) are replaced by `{"path": ..., "error": ...}`
+            instead of raising the error.
+
+    Returns:
+        Statistics of the files, in the same order as `file_paths`.
+    """
+    func = _fastx_stats if raise_errors else _fastx_stats_or_error
+    args = [(file_path, use_cache) for file_path in file_paths]
+    if num_workers > 1 and len(file_paths) > 1:
+        executor = get_reusable_executor(max_workers=num_workers)
+        return list(executor.map(func, args))
+    return list(map(func, args))
+
+
+def _fastx_stats(args: tuple[str, bool]) -> dict:
+    return fastx_stats(*args)
+
+
+def _fastx_stats_or_error(args: tuple[str, bool]) -> dict:
+    try:
+        return fastx_stats(*args)
+    except (EOFError, OSError, ValueError) as e:
+        return {"path": args[0], "error": f"{type(e).__name__}: {e}"}
+
+
+def fastq_dir_stats(
+    directory: str, num_workers: int = 4, use_cache: bool = True
+) -> pd.DataFrame:
+    """Summarize the FASTQ files in a directory, one row per file.
+
+    Files that fail to be read are reported in the "error" column instead of raising.
+    "pair_ok" tells, for files of samples with both R1 and R2, whether both files have
+    the same number of reads.
+
+    Args:
+        directory: Directory containing FASTQ files, listed by `get_fastq_manifest`.
+        num_workers: Number of worker processes.
+        use_cache: See `fastx_stats`.
+
+    Returns:
+        A DataFrame indexed by file path, with columns "sample", "read", "num_seqs",
+        "num_bases", "min_len", "avg_len", "max_len", "q20_bases", "q30_bases",
+        "error" and "pair_ok".
+    """
+    manifest = get_fastq_manifest(directory)
+    stats = fastx_stats_many(
+        [entry["path"] for entry in manifest],
+        num_workers=num_workers,
+        use_cache=use_cache,
+        raise_errors=False,
+    )
+    columns = ["num_seqs", "num_bases", "min_len", "avg_len", "max_len"]
+    columns += ["q20_bases", "q30_bases", "error"]
+    df = pd.DataFrame(
+        [
+            {
+                "path": entry["path"],
+                "sample": entry["sample"],
+                "read": entry["read"],
+                **{col: stat.get(col) for col in columns},
+            }
+            for entry, stat in zip(manifest, stats)
+        ],
+        columns=["path", "sample", "read"] + columns,
+    ).set_index("path")
+
+    df["pair_ok"] = None
+    for _, df_sample in df.groupby("sample"):
+        if set(df_sample["read"]) != {"R1", "R2"} or df_sample["error"].notna().any():
+            continue
+        counts = df_sample.groupby("read")["num_seqs"].sum()
+        df.loc[df_sample.index, "pair_ok"] = bool(counts["R1"] == counts["R2"])
+    return df
+
+
+def _fastq_stats(file_: IO[bytes]) -> dict:
+    length_hist = np.zeros(0, dtype=np.int64)
+    qual_sum = np.zeros(0, dtype=np.float64)
+    q20_bases = q30_bases = 0
+    for block, newlines, _ in _iter_fastq_blocks(file_):
+        arr = np.frombuffer(block, dtype=np.uint8)
+        starts = np.empty_like(newlines)
+        starts[0] = 0
+        starts[1:] = newlines[:-1] + 1
+        if not (arr[starts[0::4]] == ord("@")).all():
+            raise ValueError("FASTQ record does not start with '@'.")
+        lengths = newlines[1::4] - starts[1::4]
+        if not np.array_equal(newlines[3::4] - starts[3::4], lengths):
+            raise ValueError("Sequence and quality of a FASTQ record differ in length.")
+        length_hist = _add_counts(length_hist, np.bincount(lengths))
+
+        if (lengths == lengths[0]).all():
+            # raw reads usually have the same length, gather qualities as a matrix
+            quals = arr[starts[3::4, None] + np.arange(lengths[0])]
+            block_qual_sum = quals.sum(axis=0, dtype=np.int64) - 33 * len(lengths)
+            qual_sum = _add_counts(qual_sum, block_qual_sum.astype(np.float64))
+            q20_bases += int(np.count_nonzero(quals >= 33 + 20))
+            q30_bases += int(np.count_nonzero(quals >= 33 + 30))
+            continue
+        # gather all quality bytes, with their position in the read
+        offsets = np.cumsum(lengths) - lengths
+        positions = np.arange(lengths.sum()) - np.repeat(offsets, lengths)
+        quals = arr[np.repeat(starts[3::4], lengths) + positions] - 33
+        qual_sum = _add_counts(qual_sum, np.bincount(positions, weights=quals))
+        q20_bases += int(np.count_nonzero(quals >= 20))
+        q30_bases += int(np.count_nonzero(quals >= 30))
+
+    stats = _length_stats(length_hist)
+    # reads covering each position
+    coverage = length_hist[::-1].cumsum()[::-1][1 : len(qual_sum) + 1]
+    stats["q20_bases"] = q20_bases
+    stats["q30_bases"] = q30_bases
+    stats["position_quality"] = np.round(qual_sum / np.maximum(coverage, 1), 2).tolist()
+    return stats
+
+
+def _fasta_stats(file_: IO[bytes]) -> dict:
+    length_hist = np.zeros(0, dtype=np.int64)
+    for block in _iter_fasta_blocks(file_):
+        arr = np.frombuffer(block, dtype=np.uint8)
+        newlines = np.flatnonzero(arr == 10)
+        line_starts = np.empty_like(newlines)
+        line_starts[0] = 0
+        line_starts[1:] = newlines[:-1] + 1
+        is_header = arr[line_starts] == ord(">")
+        # bases per line, summed per record
+        line_lengths = np.where(is_header, 0, newlines - line_starts)
+        record_ids = np.cumsum(is_header) - 1
+        lengths = np.bincount(record_ids, weights=line_lengths).astype(np.int64)
+        length_hist = _add_counts(length_hist, np.bincount(lengths))
+    return _length_stats(length_hist)
+
+
+def _add_counts(total: np.ndarray, counts: np.ndarray) -> np.ndarray:
+    if len(counts) > len(total):
+        total, counts = counts.astype(total.dtype), total
+    total[: len(counts)] += counts
+    return total
+
+
+def _length_stats(length_hist: np.ndarray) -> dict:
+    lengths = np.flatnonzero(length_hist)
+    num_seqs = int(length_hist.sum())
+    num_bases = int((length_hist * np.arange(len(length_hist))).sum())
+    return {
+        "num_seqs": num_seqs,
+        "num_bases": num_bases,
+        "min_len": int(lengths[0]) if num_seqs else 0,
+        "avg_len": round(num_bases / num_seqs, 2) if num_seqs else 0.0,
+        "max_len": int(lengths[-1]) if num_seqs else 0,
+        "length_hist": [[int(i), int(length_hist[i])] for i in lengths],
+    }
+
+
+def _load_stats(cache_path: str, stat: os.stat_result) -> dict | None:
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (
+        cached.get("version") != STATS_VERSION
+        or cached.get("size") != stat.st_size
+        or cached.get("mtime_ns") != stat.st_mtime_ns
+    ):
+        return None
+    return cached["stats"]
+
+
+def _save_stats(cache_path: str, stat: os.stat_result, stats: dict) -> None:
+    with write_cache_file(cache_path) as f:
+        json.dump(
+            {
+                "version": STATS_VERSION,
+                "size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "stats": stats,
+            },
+            f,
+        )
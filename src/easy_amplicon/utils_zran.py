@@ -0,0 +1,387 @@
+"""Random access into regular (non-BGZF) gzip FASTQ files.
+
+Regular gzip cannot be read from the middle: deflate blocks are not byte-aligned and
+refer back to up to 32 KiB of data before them. As in zlib's `zran.c` example,
+`get_gzip_index` inflates the file once and records a checkpoint about every
+`GZIP_INDEX_SPAN` uncompressed bytes, at a deflate block boundary: its offsets in the
+uncompressed and compressed data, its bit offset and the window of data before it.
+Inflating can then resume at any checkpoint, so that several processes read disjoint
+slices of one file at the same time (`GzipIndex.split` and `read_gzip_slice`). Each
+checkpoint also records where the first FASTQ record after it starts, so that slices
+hold whole records.
+
+The index is cached under `<dir>/.easy_amplicon/index/`. Python's `zlib` module does
+not expose `Z_BLOCK` and `inflatePrime`, so the system zlib is called through ctypes.
+"""
+
+import ctypes
+import ctypes.util
+import os
+from typing import BinaryIO, Iterator
+
+import numpy as np
+
+from easy_amplicon.utils_manifest import CACHE_DIR, is_settled, write_cache_file
+
+GZIP_INDEX_VERSION = 1
+# Uncompressed bytes between checkpoints.
+GZIP_INDEX_SPAN = 16 * 1024 * 1024
+GZIP_WINDOW_SIZE = 32 * 1024
+# Size of the input and output buffers of inflate.
+_CHUNK_SIZE = 1024 * 1024
+
+_Z_OK, _Z_STREAM_END, _Z_BUF_ERROR = 0, 1, -5
+_Z_NO_FLUSH, _Z_BLOCK = 0, 5
+# window bits of raw deflate and of deflate with a gzip header
+_WBITS_RAW, _WBITS_GZIP = -15, 31
+
+# A checkpoint: (uncompressed offset, offset of the first record after it, offset in
+# the compressed file, number of bits of the previous byte to prime, window).
+GzipPoint = tuple[int, int, int, int, bytes]
+
+
+class GzipIndex:
+    """Checkpoints of a regular gzip FASTQ file. Use `get_gzip_index` to get one."""
+
+    def __init__(
+        self, file_path: str, size: int, num_lines: int, points: list[GzipPoint]
+    ):
+        self.file_path = file_path
+        # uncompressed size and number of lines of the file
+        self.size = size
+        self.num_lines = num_lines
+        self.points = points
+
+    def __len__(self) -> int:
+        return len(self.points)
+
+    def split(self, num_slices: int) -> list[tuple[GzipPoint, int]]:
+        """Cut the file into at most `num_slices` slices of whole records of similar
+        uncompressed size.
+
+        Returns:
+            A list of `(point, end)`, the checkpoint each slice starts from and the
+            uncompressed offset where it ends, to pass to `read_gzip_slice`.
+        """
+        if not self.points:
+            return []
+        starts = np.array([point[1] for point in self.points], dtype=np.int64)
+        targets = np.arange(1, num_slices) * self.size / num_slices
+        rows = np.abs(starts[:, None] - targets[None, :]).argmin(axis=0)
+        rows = np.unique(np.concatenate([[0], rows]))
+        ends = [self.points[row][1] for row in rows[1:]] + [self.size]
+        return [(self.points[row], end) for row, end in zip(rows, ends)]
+
+
+def get_gzip_index(
+    file_path: str,
+    span: int | None = None,
+    use_cache: bool = True,
+    build: bool = True,
+) -> GzipIndex | None:
+    """Load the checkpoint index of a gzip FASTQ file, building and caching it if
+    missing or stale.
+
+    Args:
+        file_path: Path to a gzip FASTQ file, with one or more members.
+        span: Uncompressed bytes between checkpoints when building the index,
+            defaults to `GZIP_INDEX_SPAN`.
+        use_cache: Whether to load the cached index.
+        build: Whether to build the index if there is no valid cached one, which
+            inflates the whole file once. If False, None is returned instead.
+
+    Raises:
+        ValueError: If the file is not valid gzip or its number of lines is not a
+            multiple of 4.
+        OSError: If the zlib shared library cannot be loaded.
+    """
+    stat = os.stat(file_path)
+    index_path = os.path.join(
+        os.path.dirname(file_path),
+        CACHE_DIR,
+        "index",
+        f"{os.path.basename(file_path)}.zran.npz",
+    )
+    meta = {
+        "version": str(GZIP_INDEX_VERSION),
+        "size": str(stat.st_size),
+        "mtime_ns": str(stat.st_mtime_ns),
+    }
+    index = _load_gzip_index(file_path, index_path, meta) if use_cache else None
+    if index is None and build:
+        index = _build_gzip_index(file_path, span or GZIP_INDEX_SPAN)
+        if is_settled(stat):
+            _save_gzip_index(index_path, meta, index)
+    return index
+
+
+def read_gzip_slice(
+    file_path: str,
+    point: GzipPoint,
+    end: int | None = None,
+    chunk_size: int = _CHUNK_SIZE,
+) -> Iterator[bytes]:
+    """Yield the uncompressed data of a gzip file from the first record after a
+    checkpoint to the uncompressed offset `end` (the end of the file if None).
+    """
+    out, start, in_offset, bits, window = point
+    with open(file_path, "rb") as f:
+        if bits:
+            f.seek(in_offset - 1)
+            prime = f.read(1)[0] >> (8 - bits)
+        else:
+            f.seek(in_offset)
+        inflater = _Inflater(f, _WBITS_RAW, chunk_size)
+        try:
+            if bits:
+                inflater.prime(bits, prime)
+            if window:
+                inflater.set_dictionary(window)
+            position = out
+            while end is None or position < end:
+                if not inflater.read():
+                    raise ValueError(f"{file_path} is truncated.")
+                ret, data = inflater.inflate(_Z_NO_FLUSH)
+                stop = len(data) if end is None else min(len(data), end - position)
+                if position + stop > start:
+                    yield bytes(data[max(start - position, 0) : stop])
+                position += len(data)
+                if ret == _Z_STREAM_END:
+                    # skip the trailer of this member and go on with the next one
+                    inflater.skip(8)
+                    if not inflater.read():
+                        break
+                    inflater.reset(_WBITS_GZIP)
+        finally:
+            inflater.close()
+
+
+def _build_gzip_index(file_path: str, span: int) -> GzipIndex:
+    points, pending = [], []
+    total_in = total_out = num_lines = 0
+    last = last_byte = 0
+    window = b""
+    ended = False
+    with open(file_path, "rb") as f:
+        inflater = _Inflater(f, _WBITS_GZIP)
+        try:
+            while True:
+                if not inflater.read():
+                    if not ended:
+                        raise ValueError(f"{file_path} is truncated.")
+                    break
+                ended = False
+                avail_in = inflater.avail_in
+                ret, data = inflater.inflate(_Z_BLOCK)
+                total_in += avail_in - inflater.avail_in
+                if len(data):
+                    newlines = np.flatnonzero(data == 10)
+                    if pending:
+                        # records start after every fourth newline
+                        starts = newlines[(3 - num_lines) % 4 :: 4] + 1 + total_out
+                        for point in pending:
+                            row = np.searchsorted(starts, point[0])
+                            if row < len(starts):
+                                point[1] = int(starts[row])
+                        pending = [point for point in pending if point[1] is None]
+                    num_lines += len(newlines)
+                    total_out += len(data)
+                    last_byte = data[-1]
+                    window = (window + data[-GZIP_WINDOW_SIZE:].tobytes())[
+                        -GZIP_WINDOW_SIZE:
+                    ]
+                if ret == _Z_STREAM_END:
+                    # another member may follow
+                    ended = True
+                    inflater.reset(_WBITS_GZIP)
+                    continue
+                data_type = inflater.data_type
+                # at a block boundary, which is not the end of the last block
+                if (
+                    data_type & 128
+                    and not data_type & 64
+                    and (total_out == 0 or total_out - last > span)
+                ):
+                    point = [total_out, 0 if total_out == 0 else None]
+                    points.append(point + [total_in, data_type & 7, window])
+                    if point[1] is None:
+                        pending.append(points[-1])
+                    last = total_out
+        finally:
+            inflater.close()
+    if total_out and last_byte != 10:  # no trailing newline
+        num_lines += 1
+    if num_lines % 4:
+        raise ValueError(f"Number of lines in {file_path} is not a multiple of 4.")
+    points = [
+        tuple(point)
+        for point in points
+        if point[1] is not None and point[1] < total_out
+    ]
+    return GzipIndex(file_path, total_out, num_lines, points)
+
+
+def _load_gzip_index(
+    file_path: str, index_path: str, meta: dict[str, str]
+) -> GzipIndex | None:
+    try:
+        with np.load(index_path) as data:
+            saved = dict(item.split("=", 1) for item in data["meta"].tolist())
+            if saved != meta:
+                return None
+            columns = [data[key].tolist() for key in ("out", "start", "in", "bits")]
+            windows = [
+                window[:length].tobytes()
+                for window, length in zip(data["windows"], data["window_lengths"])
+            ]
+            size, num_lines = data["stats"].tolist()
+    except (OSError, ValueError, KeyError):
+        return None
+    return GzipIndex(file_path, size, num_lines, list(zip(*columns, windows)))
+
+
+def _save_gzip_index(index_path: str, meta: dict[str, str], index: GzipIndex) -> None:
+    points = index.points
+    windows = np.zeros((len(points), GZIP_WINDOW_SIZE), dtype=np.uint8)
+    for row, point in enumerate(points):
+        windows[row, : len(point[4])] = np.frombuffer(point[4], dtype=np.uint8)
+    # the index is rebuilt each time if it cannot be saved
+    with write_cache_file(index_path, "wb") as f:
+        np.savez_compressed(
+            f,
+            meta=np.array([f"{k}={v}" for k, v in meta.items()]),
+            stats=np.array([index.size, index.num_lines], dtype=np.int64),
+            **{
+                key: np.array([point[i] for point in points], dtype=np.int64)
+                for i, key in enumerate(["out", "start", "in", "bits"])
+            },
+            windows=windows,
+            window_lengths=np.array([len(p[4]) for p in points], dtype=np.int64),
+        )
+
+
+class _ZStream(ctypes.Structure):
+    _fields_ = [
+        ("next_in", ctypes.c_void_p),
+        ("avail_in", ctypes.c_uint),
+        ("total_in", ctypes.c_ulong),
+        ("next_out", ctypes.c_void_p),
+        ("avail_out", ctypes.c_uint),
+        ("total_out", ctypes.c_ulong),
+        ("msg", ctypes.c_char_p),
+        ("state", ctypes.c_void_p),
+        ("zalloc", ctypes.c_void_p),
+        ("zfree", ctypes.c_void_p),
+        ("opaque", ctypes.c_void_p),
+        ("data_type", ctypes.c_int),
+        ("adler", ctypes.c_ulong),
+        ("reserved", ctypes.c_ulong),
+    ]
+
+
+_zlib = None
+
+
+def _get_zlib() -> ctypes.CDLL:
+    global _zlib
+    if _zlib is None:
+        name = ctypes.util.find_library("z")
+        if name is None:
+            raise OSError("zlib shared library not found.")
+        zlib = ctypes.CDLL(name)
+        stream = ctypes.POINTER(_ZStream)
+        signatures = {
+            "inflateInit2_": [stream, ctypes.c_int, ctypes.c_char_p, ctypes.c_int],
+            "inflate": [stream, ctypes.c_int],
+            "inflateEnd": [stream],
+            "inflateReset2": [stream, ctypes.c_int],
+            "inflatePrime": [stream, ctypes.c_int, ctypes.c_int],
+            "inflateSetDictionary": [stream, ctypes.c_char_p, ctypes.c_uint],
+        }
+        for func_name, argtypes in signatures.items():
+            getattr(zlib, func_name).argtypes = argtypes
+            getattr(zlib, func_name).restype = ctypes.c_int
+        zlib.zlibVersion.restype = ctypes.c_char_p
+        _zlib = zlib
+    return _zlib
+
+
+class _Inflater:
+    """Inflate stream of the system zlib, fed from a binary file."""
+
+    def __init__(self, f: BinaryIO, wbits: int, chunk_size: int = _CHUNK_SIZE):
+        self._zlib = _get_zlib()
+        self._f = f
+        self._chunk_size = chunk_size
+        self._stream = _ZStream()
+        self._input = None
+        self._output = ctypes.create_string_buffer(chunk_size)
+        self._check(
+            self._zlib.inflateInit2_(
+                ctypes.byref(self._stream),
+                wbits,
+                self._zlib.zlibVersion(),
+                ctypes.sizeof(_ZStream),
+            )
+        )
+
+    @property
+    def avail_in(self) -> int:
+        return self._stream.avail_in
+
+    @property
+    def data_type(self) -> int:
+        return self._stream.data_type
+
+    def read(self) -> bool:
+        """Make sure that input is available, returning False at the end of file."""
+        if self._stream.avail_in:
+            return True
+        chunk = self._f.read(self._chunk_size)
+        if not chunk:
+            return False
+        self._input = ctypes.create_string_buffer(chunk, len(chunk))
+        self._stream.next_in = ctypes.addressof(self._input)
+        self._stream.avail_in = len(chunk)
+        return True
+
+    def inflate(self, flush: int) -> tuple[int, np.ndarray]:
+        """Inflate available input, returning the zlib return code and the output,
+        which is only valid until the next call.
+        """
+        self._stream.next_out = ctypes.addressof(self._output)
+        self._stream.avail_out = self._chunk_size
+        ret = self._zlib.inflate(ctypes.byref(self._stream), flush)
+        if ret != _Z_BUF_ERROR:
+            self._check(ret)
+        produced = self._chunk_size - self._stream.avail_out
+        return ret, np.frombuffer(self._output, dtype=np.uint8, count=produced)
+
+    def skip(self, num_bytes: int) -> None:
+        """Skip input bytes."""
+        while num_bytes and self.read():
+            skipped = min(num_bytes, self._stream.avail_in)
+            self._stream.next_in += skipped
+            self._stream.avail_in -= skipped
+            num_bytes -= skipped
+
+    def prime(self, bits: int, value: int) -> None:
+        self._check(self._zlib.inflatePrime(ctypes.byref(self._stream), bits, value))
+
+    def set_dictionary(self, window: bytes) -> None:
+        self._check(
+            self._zlib.inflateSetDictionary(
+                ctypes.byref(self._stream), window, len(window)
+            )
+        )
+
+    def reset(self, wbits: int) -> None:
+        self._check(self._zlib.inflateReset2(ctypes.byref(self._stream), wbits))
+
+    def close(self) -> None:
+        self._zlib.inflateEnd(ctypes.byref(self._stream))
+
+    def _check(self, ret: int) -> None:
+        if ret not in (_Z_OK, _Z_STREAM_END):
+            msg = self._stream.msg.decode() if self._stream.msg else f"error {ret}"
+            raise ValueError(f"Invalid gzip data: {msg}.")
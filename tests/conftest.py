@@ -0,0 +1,43 @@
+import random
+
+import pytest
+
+
+@pytest.fixture
+def make_fastq():
+    """Return a function making FASTQ text of `num_reads` random reads, with headers
+    formatted from `header_fmt` and the read index.
+    """
+
+    def make(num_reads: int, seed: int, header_fmt: str = "@read{i} 1:N:0:1") -> str:
+        rng = random.Random(seed)
+        records = []
+        for i in range(num_reads):
+            length = rng.randint(1, 30)
+            seq = "".join(rng.choice("ACGTN") for _ in range(length))
+            qual = "".join(rng.choice("#:FI") for _ in range(length))
+            records.append(f"{header_fmt.format(i=i)}\n{seq}\n+\n{qual}\n")
+        return "".join(records)
+
+    return make
+
+
+@pytest.fixture
+def make_sample_fastq():
+    """Return a function making records of reads named like `cat_fastq` does, with
+    samples mixed together.
+    """
+
+    def make(sample_sizes: dict[str, int], seed: int) -> list[str]:
+        rng = random.Random(seed)
+        records = []
+        for sample, num_reads in sample_sizes.items():
+            for i in range(num_reads):
+                seq = "".join(rng.choices("ACGT", k=rng.randint(1, 50)))
+                records.append(
+                    f"@sample={sample} 1 {i} orig\n{seq}\n+\n{'I' * len(seq)}\n"
+                )
+        rng.shuffle(records)
+        return records
+
+    return make
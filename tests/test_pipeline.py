@@ -0,0 +1,37 @@
+import gzip
+import os
+import shutil
+
+import pytest
+
+from easy_amplicon import pipeline
+
+
+def test_tee_unoise3(tmp_path, monkeypatch, make_fastq):
+    # stands in for vsearch, copying the reads it is given to the ZOTU FASTA
+    def copy_unoise3(input_fastq, output_fasta, **kwargs):
+        assert not os.path.isfile(input_fastq)  # a named pipe
+        with open(input_fastq, "rb") as f, open(output_fasta, "wb") as out:
+            shutil.copyfileobj(f, out)
+
+    monkeypatch.setattr(pipeline, "TEE_BLOCK_SIZE", 1000)
+    monkeypatch.setattr(pipeline, "unoise3", copy_unoise3)
+    data = make_fastq(500, seed=1).encode()
+    (tmp_path / "reads.fq").write_bytes(data)
+    output_fastq, zotu_fasta = tmp_path / "merged.fq.gz", tmp_path / "zotu.fa"
+    pipeline.tee_unoise3(
+        str(tmp_path / "reads.fq"), str(output_fastq), str(zotu_fasta), min_size=8
+    )
+    assert gzip.decompress(output_fastq.read_bytes()) == data
+    assert zotu_fasta.read_bytes() == data
+    assert not (tmp_path / ".tmp").exists()
+
+    # errors of unoise3 surface, even before it reads anything
+    def fail_unoise3(input_fastq, output_fasta, **kwargs):
+        raise FileNotFoundError("vsearch")
+
+    monkeypatch.setattr(pipeline, "unoise3", fail_unoise3)
+    with pytest.raises(FileNotFoundError):
+        pipeline.tee_unoise3(
+            str(tmp_path / "reads.fq"), str(output_fastq), str(zotu_fasta), 8
+        )
@@ -1,6 +1,11 @@
-import pytest
+import os
 from pathlib import Path
 
+import pytest
+
+from easy_amplicon import usearch_workflow
+from easy_amplicon.utils import read_table
+
 
 @pytest.fixture
 def test_data_dir():
@@ -136,3 +141,33 @@ def test_usearch_workflow(script_runner, test_data_dir, amplicon_type, prefix):
     ), f"Script failed with return code {ret_aggregate_samples.returncode}"
     assert fasta_output_file.exists(), f"Output file not created: {fasta_output_file}"
     assert biom_output_file.exists(), f"Output file not created: {biom_output_file}"
+
+
+def test_search_global_add_unknown(tmp_path, monkeypatch):
+    """
+    Reads matching no ZOTU are counted per sample, several of them in one sample.
+    """
+
+    # stands in for vsearch, writing a ZOTU table and the unmatched reads
+    def fake_search_global(input_fastq, zotu_fasta, output_tsv, not_matched, *args):
+        with open(output_tsv, "w") as f:
+            f.write("#OTU ID\tS1\tS2\nZOTU1\t5\t3\n")
+        with open(not_matched, "w") as f:
+            f.write(">sample=S1\nACGT\n>sample=S2\nACGA\n>sample=S1\nACGG\n")
+
+    monkeypatch.setattr(usearch_workflow, "search_global", fake_search_global)
+    (tmp_path / "merged.fq").write_text("@sample=S1 1 0 r\nACGT\n+\nIIII\n")
+    (tmp_path / "zotu.fa").write_text(">ZOTU1\nACGT\n")
+    output_tsv = tmp_path / "out" / "otutab.tsv"
+    usearch_workflow.search_global_add_unknown(
+        str(tmp_path / "merged.fq"),
+        str(tmp_path / "zotu.fa"),
+        str(output_tsv),
+        id_=0.97,
+        unknown_name="UNKNOWN",
+        num_threads=1,
+    )
+    table = read_table(str(output_tsv))
+    assert table.loc["UNKNOWN"].to_dict() == {"S1": 2, "S2": 1}
+    assert table.loc["ZOTU1"].to_dict() == {"S1": 5, "S2": 3}
+    assert sorted(os.listdir(tmp_path / "out")) == ["notmatched.fa", "otutab.tsv"]
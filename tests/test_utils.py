@@ -0,0 +1,279 @@
+import gzip
+import io
+import json
+
+import pandas as pd
+import pytest
+from Bio import SeqIO
+
+from easy_amplicon.utils import (
+    _iter_fastq_pair_chunks,
+    _iter_fastq_se_chunks,
+    _rename_read_concat,
+    _rename_read_illumina,
+    cat_fastq,
+    cat_fastq_se,
+    parse_fastx,
+    parse_fastx_batches,
+    write_fastx,
+)
+
+
+def legacy_cat_pair(
+    text_r1: str, text_r2: str, sample_name: str, have_sample_name: bool = False
+) -> str:
+    """The text path `cat_fastq` used before the bytes kernel."""
+    rename_read = _rename_read_concat if have_sample_name else _rename_read_illumina
+    r1_file, r2_file = io.StringIO(text_r1, newline=None), io.StringIO(
+        text_r2, newline=None
+    )
+    out = []
+    paired_read_iter = zip(
+        zip(*[r1_file] * 4, strict=True), zip(*[r2_file] * 4, strict=True), strict=True
+    )
+    for read_index, (r1_lines, r2_lines) in enumerate(paired_read_iter, start=1):
+        out.append(
+            rename_read(r1_lines[0], sample_name, 1, read_index) + "".join(r1_lines[1:])
+        )
+        out.append(
+            rename_read(r2_lines[0], sample_name, 2, read_index) + "".join(r2_lines[1:])
+        )
+    return "".join(out)
+
+
+@pytest.mark.parametrize("block_size", [7, 64, 1 << 20])
+@pytest.mark.parametrize("line_ending", ["\n", "\r\n"])
+@pytest.mark.parametrize("trailing_newline", [True, False])
+def test_pair_chunks_match_text_path(
+    block_size, line_ending, trailing_newline, make_fastq
+):
+    text_r1 = make_fastq(50, seed=1)
+    text_r2 = make_fastq(50, seed=2, header_fmt="@read{i} 2:N:0:1")
+    if not trailing_newline:
+        text_r1, text_r2 = text_r1[:-1], text_r2[:-1]
+    raw_r1 = text_r1.replace("\n", line_ending).encode()
+    raw_r2 = text_r2.replace("\n", line_ending).encode()
+
+    chunks = _iter_fastq_pair_chunks(
+        io.BytesIO(raw_r1), io.BytesIO(raw_r2), "S1", block_size=block_size
+    )
+    result = b"".join(chunk for chunk, _ in chunks).decode()
+    assert result == legacy_cat_pair(text_r1, text_r2, "S1")
+
+
+@pytest.mark.parametrize("block_size", [5, 1 << 20])
+def test_pair_chunks_have_sample_name(block_size, make_fastq):
+    text_r1 = make_fastq(20, seed=3, header_fmt="@sample=fwd_{i} 1 {i} read{i}")
+    text_r2 = make_fastq(20, seed=4, header_fmt="@sample=fwd_{i} 2 {i} read{i}")
+    chunks = _iter_fastq_pair_chunks(
+        io.BytesIO(text_r1.encode()),
+        io.BytesIO(text_r2.encode()),
+        "A1",
+        have_sample_name=True,
+        interleaved=False,
+        block_size=block_size,
+    )
+    chunks_r1, chunks_r2 = zip(*chunks)
+    expected = legacy_cat_pair(text_r1, text_r2, "A1", have_sample_name=True)
+    expected_lines = expected.splitlines(keepends=True)
+    assert b"".join(chunks_r1).decode() == "".join(
+        "".join(expected_lines[i : i + 4]) for i in range(0, len(expected_lines), 8)
+    )
+    assert b"".join(chunks_r2).decode() == "".join(
+        "".join(expected_lines[i + 4 : i + 8]) for i in range(0, len(expected_lines), 8)
+    )
+
+
+@pytest.mark.parametrize(
+    "header_fmt",
+    [
+        "@read{i}",  # no comment
+        "@read{i} 1:N:0:{i}",  # varying comment
+        "@read{i} 1:N:0:1 extra",  # more than one space
+        " @read{i} 1:N:0:1",  # leading whitespace
+        "@read{i}\t1:N:0:1",  # tab
+    ],
+)
+def test_pair_chunks_header_formats(header_fmt, make_fastq):
+    text_r1 = make_fastq(12, seed=11, header_fmt=header_fmt)
+    # the last header has no comment in R2
+    text_r2 = make_fastq(11, seed=12, header_fmt=header_fmt) + make_fastq(
+        1, seed=13, header_fmt="@last"
+    )
+    chunks = _iter_fastq_pair_chunks(
+        io.BytesIO(text_r1.encode()), io.BytesIO(text_r2.encode()), "S1"
+    )
+    result = b"".join(chunk for chunk, _ in chunks).decode()
+    assert result == legacy_cat_pair(text_r1, text_r2, "S1")
+
+
+def test_pair_chunks_unequal_reads(make_fastq):
+    text_r1 = make_fastq(10, seed=5)
+    text_r2 = make_fastq(9, seed=6)
+    with pytest.raises(ValueError):
+        list(
+            _iter_fastq_pair_chunks(
+                io.BytesIO(text_r1.encode()), io.BytesIO(text_r2.encode()), "S1"
+            )
+        )
+
+
+def test_se_chunks_truncated_record(make_fastq):
+    text = make_fastq(3, seed=7).rsplit("\n", 2)[0] + "\n"
+    with pytest.raises(ValueError):
+        list(_iter_fastq_se_chunks(io.BytesIO(text.encode()), "S1"))
+
+
+def test_cat_fastq(tmp_path, make_fastq):
+    expected = []
+    for idx, sample in enumerate(["s1", "s2"]):
+        text_r1 = make_fastq(30, seed=idx)
+        text_r2 = make_fastq(30, seed=idx + 10)
+        with gzip.open(tmp_path / f"{sample}_R1.fq.gz", "wt") as f:
+            f.write(text_r1)
+        (tmp_path / f"{sample}_R2.fq").write_text(text_r2)
+        expected.append(legacy_cat_pair(text_r1, text_r2, sample))
+
+    out = io.BytesIO()
+    cat_fastq(str(tmp_path), out, out)
+    assert out.getvalue().decode() == "".join(expected)
+
+    out_text = io.StringIO()
+    cat_fastq(str(tmp_path), out_text)
+    assert out_text.getvalue() == "".join(expected)
+
+
+def test_cat_fastq_se(tmp_path, make_fastq):
+    text = make_fastq(30, seed=8)
+    (tmp_path / "s1_R1.fastq").write_text(text)
+    out = io.BytesIO()
+    cat_fastq_se(str(tmp_path), out)
+    expected = "".join(
+        _rename_read_illumina(lines[0], "s1", 1, i) + "".join(lines[1:])
+        for i, lines in enumerate(zip(*[io.StringIO(text)] * 4), start=1)
+    )
+    assert out.getvalue().decode() == expected
+
+
+@pytest.mark.parametrize("ordered", [True, False])
+def test_cat_fastq_parallel(tmp_path, ordered, make_fastq):
+    for idx in range(5):
+        (tmp_path / f"s{idx}_R1.fq").write_text(make_fastq(20 + idx, seed=idx))
+        (tmp_path / f"s{idx}_R2.fq").write_text(make_fastq(20 + idx, seed=idx + 10))
+    expected = io.BytesIO()
+    cat_fastq(str(tmp_path), expected, expected)
+    out = io.BytesIO()
+    cat_fastq(str(tmp_path), out, out, num_workers=2, ordered=ordered)
+    if ordered:
+        assert out.getvalue() == expected.getvalue()
+    else:
+        # samples may come in any order, but read pairs stay together
+        lines = out.getvalue().split(b"\n")
+        expected_lines = expected.getvalue().split(b"\n")
+        assert sorted(zip(*[iter(lines)] * 8)) == sorted(
+            zip(*[iter(expected_lines)] * 8)
+        )
+
+
+def test_cat_fastq_parallel_error(tmp_path, make_fastq):
+    (tmp_path / "s1_R1.fq").write_text(make_fastq(3, seed=1))
+    (tmp_path / "s1_R2.fq").write_text(make_fastq(2, seed=2))
+    (tmp_path / "s2_R1.fq").write_text(make_fastq(3, seed=3))
+    (tmp_path / "s2_R2.fq").write_text(make_fastq(3, seed=4))
+    with pytest.raises(ValueError):
+        cat_fastq(str(tmp_path), io.BytesIO(), num_workers=2)
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_cat_fastq_stats(tmp_path, num_workers, make_fastq):
+    fastq_dir = tmp_path / "fastq"
+    fastq_dir.mkdir()
+    texts = {}
+    for idx in range(3):
+        texts[f"s{idx}"] = make_fastq(20 + idx, seed=idx), make_fastq(20 + idx, seed=9)
+        (fastq_dir / f"s{idx}_R1.fq").write_text(texts[f"s{idx}"][0])
+        (fastq_dir / f"s{idx}_R2.fq").write_text(texts[f"s{idx}"][1])
+    stats_path = tmp_path / "read_stats.tsv"
+    cat_fastq(
+        str(fastq_dir),
+        io.BytesIO(),
+        num_workers=num_workers,
+        stats_path=str(stats_path),
+    )
+    df = pd.read_table(stats_path, index_col="sample")
+
+    for sample, (text_r1, text_r2) in texts.items():
+        seqs = text_r1.splitlines()[1::4] + text_r2.splitlines()[1::4]
+        quals = text_r1.splitlines()[3::4] + text_r2.splitlines()[3::4]
+        ee = [sum(10 ** (-(ord(c) - 33) / 10) for c in qual) for qual in quals]
+        num_bases = sum(map(len, seqs))
+        assert df.loc[sample, "read_count"] == len(seqs) // 2
+        assert df.loc[sample, "num_bases"] == num_bases
+        assert df.loc[sample, "mean_ee"] == pytest.approx(sum(ee) / len(ee), abs=1e-4)
+        assert df.loc[sample, "n_fraction"] == pytest.approx(
+            "".join(seqs).count("N") / num_bases, abs=1e-6
+        )
+
+
+def test_cat_fastq_se_stats(tmp_path, make_fastq):
+    fastq_dir = tmp_path / "fastq"
+    fastq_dir.mkdir()
+    (fastq_dir / "s1_S1_L001_R1_001.fq").write_text(make_fastq(10, seed=1))
+    (fastq_dir / "s1_S1_L002_R1_001.fq").write_text(make_fastq(5, seed=2))
+    stats_path = tmp_path / "read_stats.json"
+    cat_fastq_se(str(fastq_dir), io.BytesIO(), stats_path=str(stats_path))
+    stats = json.loads(stats_path.read_text())
+    # lanes of a sample are summed up
+    assert stats["s1"]["read_count"] == 15
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_parse_fastx_fastq(tmp_path, compress, make_fastq):
+    text = make_fastq(500, seed=1, header_fmt="@read{i}\t1:N:0:1 ")
+    path = tmp_path / ("reads.fq.gz" if compress else "reads.fq")
+    path.write_bytes(gzip.compress(text.encode()) if compress else text.encode())
+    expected = [
+        (
+            r.id,
+            str(r.seq),
+            "".join(chr(q + 33) for q in r.letter_annotations["phred_quality"]),
+        )
+        for r in SeqIO.parse(io.StringIO(text), "fastq")
+    ]
+    assert list(parse_fastx(str(path))) == expected
+    records = list(parse_fastx(str(path), as_bytes=True, full_title=True))
+    assert records[0] == (b"read0\t1:N:0:1", *(s.encode() for s in expected[0][1:]))
+
+    batches = list(parse_fastx_batches(str(path)))
+    assert sum(len(batch["ids"]) for batch in batches) == len(expected)
+    offsets, seq, qual = batches[0]["offsets"], batches[0]["seq"], batches[0]["qual"]
+    assert seq[offsets[3] : offsets[4]].tobytes().decode() == expected[3][1]
+    assert qual[offsets[3] : offsets[4]].tobytes().decode() == expected[3][2]
+
+    out = io.BytesIO()
+    assert write_fastx(out, records) == len(records)
+    assert out.getvalue().decode() == text.replace(" \n", "\n")
+
+
+def test_parse_fastx_fasta(tmp_path):
+    text = ">a desc\nACGT\nAC\n>b\n\n>c\r\nA\n>\nGG\n>d\nACGTACGTAC"
+    path = tmp_path / "seqs.fasta"
+    path.write_text(text)
+    expected = [
+        (r.id, str(r.seq), None) for r in SeqIO.parse(io.StringIO(text), "fasta")
+    ]
+    assert list(parse_fastx(str(path))) == expected
+    with open(path, "rb") as f:
+        assert [r[0] for r in parse_fastx(f, "fasta", full_title=True)][0] == "a desc"
+    out = io.StringIO()
+    write_fastx(out, expected[:2], "fasta")
+    assert out.getvalue() == ">a\nACGTAC\n>b\n\n"
+
+
+def test_parse_fastx_malformed(tmp_path):
+    path = tmp_path / "reads.fq"
+    path.write_text("@a\nACG\n+\nII\n")
+    with pytest.raises(ValueError):
+        list(parse_fastx(str(path)))
+    with pytest.raises(ValueError):
+        write_fastx(io.StringIO(), [("a", "ACG", None)])
@@ -0,0 +1,52 @@
+import argparse
+
+import pytest
+
+from easy_amplicon import utils_cpu
+from easy_amplicon.utils_cpu import (
+    get_cgroup_cpu_limit,
+    parse_threads,
+    resolve_threads,
+    split_threads,
+)
+
+
+def test_cgroup_cpu_limit(tmp_path, monkeypatch):
+    proc_cgroup = tmp_path / "cgroup"
+    monkeypatch.setattr(utils_cpu, "CGROUP_ROOT", str(tmp_path / "fs"))
+    monkeypatch.setattr(utils_cpu, "PROC_CGROUP", str(proc_cgroup))
+
+    # cgroup v2, the limit of a parent applies
+    (tmp_path / "fs" / "app" / "job").mkdir(parents=True)
+    (tmp_path / "fs" / "app" / "job" / "cpu.max").write_text("max 100000\n")
+    (tmp_path / "fs" / "app" / "cpu.max").write_text("150000 100000\n")
+    proc_cgroup.write_text("0::/app/job\n")
+    assert get_cgroup_cpu_limit() == 1.5
+    assert utils_cpu.available_cpus() <= 2
+
+    # cgroup v1, in a container where only the root of the mount exists
+    (tmp_path / "fs" / "cpu,cpuacct").mkdir()
+    (tmp_path / "fs" / "cpu,cpuacct" / "cpu.cfs_quota_us").write_text("400000\n")
+    (tmp_path / "fs" / "cpu,cpuacct" / "cpu.cfs_period_us").write_text("100000\n")
+    proc_cgroup.write_text("5:cpu,cpuacct:/docker/abc\n4:memory:/docker/abc\n")
+    assert get_cgroup_cpu_limit() == 4
+
+    (tmp_path / "fs" / "cpu,cpuacct" / "cpu.cfs_quota_us").write_text("-1\n")
+    assert get_cgroup_cpu_limit() is None
+    proc_cgroup.unlink()
+    assert get_cgroup_cpu_limit() is None
+
+
+def test_threads():
+    assert resolve_threads("auto") == resolve_threads(None) >= 1
+    assert parse_threads("3") == 3
+    for value in ["0", "-2", "many"]:
+        with pytest.raises(argparse.ArgumentTypeError):
+            parse_threads(value)
+
+    assert split_threads(8, [2, 1, 1]) == [4, 2, 2]
+    assert split_threads(64, [1, 2]) == [22, 42]
+    # every stage gets a thread even when there are not enough
+    assert split_threads(1, [1, 2, 1]) == [1, 1, 1]
+    with pytest.raises(ValueError):
+        split_threads(4, [1, 0])
@@ -0,0 +1,145 @@
+import gzip
+import io
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from easy_amplicon.utils_demux import (
+    DEFAULT_BARCODE_LAYOUT,
+    BarcodeLayout,
+    demultiplex_pairs,
+)
+
+DATA_DIR = os.path.join(os.path.dirname(DEFAULT_BARCODE_LAYOUT))
+
+
+def write_pairs(path_prefix, pairs):
+    for read_number in (1, 2):
+        text = "".join(
+            f"@r{i} {read_number}:N:0:1\n{pair[read_number - 1]}\n+\n"
+            f"{'F' * len(pair[read_number - 1])}\n"
+            for i, pair in enumerate(pairs)
+        )
+        with gzip.open(f"{path_prefix}_R{read_number}.fq.gz", "wt") as f:
+            f.write(text)
+
+
+def test_barcode_layout():
+    layout = BarcodeLayout.from_tsv()
+    assert len(layout.wells) == 384
+    from_fasta = BarcodeLayout.from_fasta(
+        os.path.join(DATA_DIR, "barcodes_fwd.fasta"),
+        os.path.join(DATA_DIR, "barcodes_rev.fasta"),
+        os.path.join(DATA_DIR, "patterns.txt"),
+    )
+    assert (from_fasta.grid == layout.grid).all()
+    assert (from_fasta.fwd.trims == layout.fwd.trims).all()
+
+    # exact and one-off matches, N counts as a mismatch, ties are ambiguous
+    layout = BarcodeLayout(["A1", "A2"], ["AAAA", "AATT"], [1, 2], ["CCCC"] * 2, [0, 0])
+    seqs = [b"AAAAGT", b"AANAG", b"AAAT", b"AATTGGG", b"AATT", b"CCCCG", b"CAC"]
+    chunk = b"".join(seqs)
+    starts = np.cumsum([0] + [len(seq) for seq in seqs[:-1]])
+    lengths = np.array([len(seq) for seq in seqs])
+    arr = np.frombuffer(chunk, dtype=np.uint8)
+    index, mismatches = layout.fwd.lookup(arr, starts, lengths)
+    assert index.tolist() == [0, 0, -1, 1, -1, -1, -1]
+    assert mismatches.tolist() == [0, 1, -1, 0, -1, -1, -1]
+
+    with pytest.raises(ValueError):
+        BarcodeLayout(["A1", "A2"], ["AAAA"] * 2, [1, 1], ["CCCC"] * 2, [0, 0])
+    with pytest.raises(ValueError):
+        BarcodeLayout(["A1"], ["AAAAAAAAAAA"], [1], ["CCCC"], [0])
+
+
+def test_demultiplex_pairs(tmp_path):
+    layout_path = tmp_path / "layout.tsv"
+    pd.DataFrame(
+        {
+            "well": ["A1", "A2", "B1"],
+            "bcF": ["ACGTAC", "TTGCAA", "ACGTAC"],
+            "linkF": [1, 2, 1],
+            "bcR": ["GGATCC", "GGATCC", "CATGCA"],
+            "linkR": [0, 0, 3],
+        }
+    ).to_csv(layout_path, sep="\t", index=False)
+    (tmp_path / "fastq").mkdir()
+    write_pairs(
+        tmp_path / "fastq" / "plate1",
+        [
+            ("ACGTACNAAAA", "GGATCCTTTT"),  # A1
+            ("TTGCTAGGCCCC", "GGATCCGG"),  # A2, 1 mismatch in read 1
+            ("ACGTACT", "CATGCNTTTGGG"),  # B1, 1 mismatch in read 2, no insert
+            ("TTGCAAGG", "CATGCATTTGGG"),  # no such well
+            ("ACGTAC", "GGATCCAA"),  # read 1 too short for the spacer
+            ("AAAAAAAAAAAAA", "GGATCCAA"),  # no barcode in read 1
+            ("ACGTACGCCCC", "GGATCCTTGG"),  # A1
+        ],
+    )
+    wells = demultiplex_pairs(
+        str(tmp_path / "fastq"),
+        str(tmp_path / "demux"),
+        str(layout_path),
+        failed_dir=str(tmp_path / "failed"),
+        report_path=str(tmp_path / "report.tsv"),
+        stats_path=str(tmp_path / "stats.tsv"),
+    )
+    assert [well for well, _, _ in wells] == ["A1", "A2", "B1"]
+    assert not os.path.exists(tmp_path / "demux" / ".tmp_R1")
+
+    def read(path):
+        with gzip.open(path, "rt") as f:
+            return f.read().splitlines()
+
+    lines = read(tmp_path / "demux" / "A1_R1.fq.gz")
+    assert lines[0::4] == ["@sample=plate1_A1 1 1 r0", "@sample=plate1_A1 1 7 r6"]
+    assert lines[1::4] == ["AAAA", "CCCC"]
+    assert lines[3::4] == ["FFFF", "FFFF"]
+    assert read(tmp_path / "demux" / "A1_R2.fq.gz")[1::4] == ["TTTT", "TTGG"]
+    assert read(tmp_path / "demux" / "A2_R1.fq.gz")[:2] == [
+        "@sample=plate1_A2 1 2 r1",
+        "CCCC",
+    ]
+    assert read(tmp_path / "demux" / "B1_R1.fq.gz")[1] == ""
+    assert read(tmp_path / "demux" / "B1_R2.fq.gz")[1] == "GGG"
+    # unassigned pairs are kept untrimmed
+    failed = read(tmp_path / "failed" / "unknown_R1.fq.gz")
+    assert failed[0::4] == [f"@sample=plate1 1 {i} r{i - 1}" for i in (4, 5, 6)]
+    assert failed[1] == "TTGCAAGG"
+
+    report = pd.read_table(tmp_path / "report.tsv", index_col=0)
+    assert report["read_count"].to_dict() == {"A1": 2, "A2": 1, "B1": 1, "unknown": 3}
+    assert report.loc["A2", ["fwd_mismatches_0", "fwd_mismatches_1"]].tolist() == [0, 1]
+    assert report.loc["B1", ["rev_mismatches_0", "rev_mismatches_1"]].tolist() == [0, 1]
+    assert report.loc["unknown", "fwd_mismatches_0"] == 1
+    stats = pd.read_table(tmp_path / "stats.tsv", index_col=0)
+    assert stats.loc["A1", "read_count"] == 2
+    assert stats.loc["A1", "num_bases"] == 16
+
+    # streamed: no per-well files, assigned pairs interleaved in the same order
+    stream = io.BytesIO()
+    wells = demultiplex_pairs(
+        str(tmp_path / "fastq"),
+        None,
+        str(layout_path),
+        failed_dir=str(tmp_path / "failed2"),
+        output_fp=stream,
+    )
+    assert wells == [] and os.listdir(tmp_path / "failed2") == [
+        "unknown_R1.fq.gz",
+        "unknown_R2.fq.gz",
+    ]
+    lines = stream.getvalue().decode().splitlines()
+    assert lines[0::8] == [
+        "@sample=plate1_A1 1 1 r0",
+        "@sample=plate1_A1 1 7 r6",
+        "@sample=plate1_A2 1 2 r1",
+        "@sample=plate1_B1 1 3 r2",
+    ]
+    assert lines[4::8][0] == "@sample=plate1_A1 2 1 r0"
+    assert lines[1::8] == ["AAAA", "CCCC", "CCCC", ""]
+    assert lines[5::8] == ["TTTT", "TTGG", "GG", "GGG"]
+    with pytest.raises(ValueError):
+        demultiplex_pairs(str(tmp_path / "fastq"), None, output_fp=stream)
@@ -0,0 +1,244 @@
+import gzip
+import io
+import json
+import subprocess
+import sys
+
+import pytest
+
+from easy_amplicon.utils import cat_fastq
+from easy_amplicon.utils_fanout import (
+    ShardedTool,
+    get_renamed_key,
+    get_sample_sizes,
+    run_sample_pool,
+    sum_reports,
+)
+
+# a stand-in for cutadapt: compresses stdin to argv[1], writes a JSON report to
+# argv[2] and an HTML report to argv[3]
+TOOL = """
+import gzip, json, sys
+data = sys.stdin.buffer.read()
+with open(sys.argv[1], "wb") as f:
+    f.write(gzip.compress(data))
+with open(sys.argv[2], "w") as f:
+    json.dump({"read_counts": {"input": data.count(b"@sample=")}, "schema_version": [0, 3]}, f)
+with open(sys.argv[3], "w") as f:
+    f.write("<html></html>")
+"""
+
+
+@pytest.mark.parametrize("num_shards", [1, 3])
+def test_sharded_tool(tmp_path, num_shards, make_fastq):
+    fastq_dir = tmp_path / "fastq"
+    fastq_dir.mkdir()
+    for idx in range(5):
+        num_reads = 20 * (idx + 1)
+        (fastq_dir / f"s{idx}_R1.fq").write_text(make_fastq(num_reads, seed=idx))
+        (fastq_dir / f"s{idx}_R2.fq").write_text(make_fastq(num_reads, seed=idx + 10))
+    expected = io.BytesIO()
+    cat_fastq(str(fastq_dir), expected, expected)
+
+    outputs = [str(tmp_path / name) for name in ["out.fq.gz", "report.json", "r.html"]]
+    sizes = get_sample_sizes(str(fastq_dir))
+    assert sorted(sizes) == [f"s{idx}" for idx in range(5)]
+    with ShardedTool(
+        [sys.executable, "-c", TOOL, *outputs], outputs, sizes, num_shards
+    ) as tool:
+        cat_fastq(str(fastq_dir), tool, tool)
+    # contiguous runs of samples of sizes 1 to 5: 1 + 2 + 3, 4 and 5
+    expected_shards = [0] * 5 if num_shards == 1 else [0, 0, 0, 1, 2]
+    assert list(tool.shards.values()) == expected_shards
+    with gzip.open(outputs[0]) as f:
+        assert f.read() == expected.getvalue()
+    with open(outputs[1]) as f:
+        report = json.load(f)
+    assert report == {"read_counts": {"input": 2 * 300}, "schema_version": [0, 3]}
+    html = ["r.html"] if num_shards == 1 else [f"r.shard{i}.html" for i in range(3)]
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == sorted(
+        ["out.fq.gz", "report.json"] + html
+    )
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_run_sample_pool(tmp_path, num_workers, make_fastq):
+    fastq_dir = tmp_path / "fastq"
+    fastq_dir.mkdir()
+    tasks = []
+    for idx in range(3):
+        for read in (1, 2):
+            text = make_fastq(10 * (idx + 1), seed=idx + 10 * read)
+            (fastq_dir / f"s{idx}_R{read}.fq").write_text(text)
+        r1, r2 = [str(fastq_dir / f"s{idx}_R{read}.fq") for read in (1, 2)]
+        tasks.append(((r1, r2), f"s{idx}", False, True))
+    expected = io.BytesIO()
+    cat_fastq(str(fastq_dir), expected, expected)
+
+    outputs = [str(tmp_path / name) for name in ["out.fq.gz", "report.json", "r.html"]]
+    sample_stats = {}
+    reports = run_sample_pool(
+        [sys.executable, "-c", TOOL, *outputs],
+        outputs,
+        tasks,
+        num_workers,
+        sample_stats,
+    )
+    with gzip.open(outputs[0]) as f:
+        assert f.read() == expected.getvalue()
+    assert reports == {
+        outputs[1]: {
+            f"s{idx}": {
+                "read_counts": {"input": 20 * (idx + 1)},
+                "schema_version": [0, 3],
+            }
+            for idx in range(3)
+        }
+    }
+    with open(outputs[1]) as f:
+        assert json.load(f)["read_counts"] == {"input": 120}
+    assert {s: stats["read_count"] for s, stats in sample_stats.items()} == {
+        "s0": 10,
+        "s1": 20,
+        "s2": 30,
+    }
+    assert sorted(p.name for p in tmp_path.iterdir() if p.is_file()) == sorted(
+        ["out.fq.gz", "report.json"] + [f"r.s{idx}.html" for idx in range(3)]
+    )
+
+    fail = [sys.executable, "-c", "import sys; sys.exit(3)", outputs[0]]
+    with pytest.raises(subprocess.CalledProcessError):
+        run_sample_pool(fail, outputs[:1], tasks[:1])
+    # outputs of the other samples are removed when one fails
+    for path in tmp_path.iterdir():
+        if path.is_file():
+            path.unlink()
+    fail_s2 = f"import sys; '.sample.s2.' in sys.argv[1] and sys.exit(3)\n{TOOL}"
+    with pytest.raises(subprocess.CalledProcessError):
+        run_sample_pool(
+            [sys.executable, "-c", fail_s2, *outputs], outputs, tasks, num_workers
+        )
+    assert not [p for p in tmp_path.iterdir() if p.is_file()]
+    with pytest.raises(ValueError):
+        run_sample_pool(fail, outputs[:1], tasks[:1] * 2)
+
+
+def test_sharded_tool_errors(tmp_path):
+    output = str(tmp_path / "out.fq")
+    with pytest.raises(ValueError):
+        ShardedTool(["cat"], [output], {})
+    tool = ShardedTool(
+        [sys.executable, "-c", "import sys; sys.exit(3)", output], [output], {}, 2
+    )
+    with pytest.raises(subprocess.CalledProcessError):
+        with tool:
+            tool.write(b"@sample=s1 1 1 r1\nA\n+\nF\n")
+    with pytest.raises(ValueError):
+        ShardedTool(["cat", output], [output], {}).write(b"@r1\nA\n+\nF\n")
+
+    key = get_renamed_key(["a", "a_b", "c"], prefix=True)
+    assert [key(name) for name in ["a_b_A1", "a_A1", "c_A1", "d_A1"]] == [
+        "a_b",
+        "a",
+        "c",
+        "d_A1",
+    ]
+    assert get_renamed_key(["bc_1"], prefix=False)("s_1_bc_1") == "bc_1"
+
+
+def test_sum_reports():
+    def report(reads, lengths, q30_rate):
+        return {
+            "cutadapt_version": "4.4",
+            "read_counts": {"input": reads, "filtered": {"too_short": None}},
+            "adapters_read1": [
+                {
+                    "name": "1",
+                    "three_prime_end": {
+                        "error_lengths": [6, 13],
+                        "trimmed_lengths": [
+                            {"len": length, "expect": 0.5, "counts": [count]}
+                            for length, count in lengths
+                        ],
+                    },
+                }
+            ],
+            "summary": {"total_reads": reads, "q30_rate": q30_rate, "peak": 3},
+        }
+
+    merged = sum_reports(
+        [report(10, [(3, 2), (5, 1)], 0.9), report(30, [(4, 1), (3, 1)], 0.5)]
+    )
+    assert merged == {
+        "cutadapt_version": "4.4",
+        "read_counts": {"input": 40, "filtered": {"too_short": None}},
+        "adapters_read1": [
+            {
+                "name": "1",
+                "three_prime_end": {
+                    "error_lengths": [6, 13],
+                    "trimmed_lengths": [
+                        {"len": 3, "expect": 1.0, "counts": [3]},
+                        {"len": 4, "expect": 0.5, "counts": [1]},
+                        {"len": 5, "expect": 0.5, "counts": [1]},
+                    ],
+                },
+            }
+        ],
+        "summary": {"total_reads": 40, "q30_rate": pytest.approx(0.6), "peak": 3},
+    }
+
+
+def test_sum_reports_fastp():
+    def report(reads, dup_rate, peak, curve, adapter):
+        return {
+            "summary": {
+                "fastp_version": "0.23.4",
+                "before_filtering": {"total_reads": reads, "q30_rate": dup_rate},
+            },
+            "duplication": {"rate": dup_rate},
+            "insert_size": {"peak": peak, "unknown": reads // 10},
+            "read1_before_filtering": {
+                "total_reads": 2 * reads,
+                "quality_curves": {"mean": curve},
+            },
+            "adapter_cutting": {
+                "adapter_trimmed_reads": reads // 2,
+                "read1_adapter_sequence": adapter,
+            },
+            "command": f"fastp -i {adapter}",
+        }
+
+    merged = sum_reports(
+        [
+            report(10, 0.1, 100, [30.0, 20.0], "AGATC"),
+            report(30, 0.5, 200, [34.0, 28.0, 10.0], "AGATC"),
+        ]
+    )
+    assert merged == {
+        "summary": {
+            "fastp_version": "0.23.4",
+            "before_filtering": {"total_reads": 40, "q30_rate": pytest.approx(0.4)},
+        },
+        # weighted by the reads of the report
+        "duplication": {"rate": pytest.approx(0.4)},
+        "insert_size": {"peak": 175, "unknown": 4},
+        # weighted by the reads of their own object
+        "read1_before_filtering": {
+            "total_reads": 80,
+            "quality_curves": {"mean": pytest.approx([33.0, 26.0, 10.0])},
+        },
+        "adapter_cutting": {
+            "adapter_trimmed_reads": 20,
+            "read1_adapter_sequence": "AGATC",
+        },
+        "command": "fastp -i AGATC",
+    }
+    # values that differ cannot be merged without reads to weight them
+    merged = sum_reports(
+        [
+            {"duplication": {"rate": 0.1}, "command": "fastp -i a"},
+            {"duplication": {"rate": 0.5}, "command": "fastp -i b"},
+        ]
+    )
+    assert merged == {"duplication": {}}
@@ -0,0 +1,106 @@
+import errno
+import gzip
+import os
+
+import pandas as pd
+import pytest
+
+from easy_amplicon import utils_files
+from easy_amplicon.trim import merge, rename_files_with_mmv
+from easy_amplicon.utils_files import concat_files, copy_file, move_files
+
+
+def test_rename_and_move(tmp_path):
+    for name in ["a.fq.gz", "b.fq.gz", "unknown.fq.gz"]:
+        (tmp_path / name).write_text(name)
+    (tmp_path / "patterns.txt").write_text("a.fq.gz s1.fq.gz\n\nb.fq.gz s2.fq.gz\n")
+    (tmp_path / "c.fq.gz").write_text("old")
+    (tmp_path / "patterns2.txt").write_text("missing.fq.gz c.fq.gz\n")
+    rename_files_with_mmv(str(tmp_path), str(tmp_path / "patterns.txt"))
+    rename_files_with_mmv(str(tmp_path), str(tmp_path / "patterns2.txt"))
+    assert (tmp_path / "s1.fq.gz").read_text() == "a.fq.gz"
+    assert (tmp_path / "s2.fq.gz").read_text() == "b.fq.gz"
+    assert (tmp_path / "c.fq.gz").read_text() == "old"
+    assert not (tmp_path / "a.fq.gz").exists()
+
+    (tmp_path / "failed").mkdir()
+    paths = [str(tmp_path / "unknown.fq.gz"), str(tmp_path / "missing.fq.gz")]
+    with pytest.raises(ValueError):
+        move_files(paths[1:], str(tmp_path / "failed"))
+    assert move_files(paths, str(tmp_path / "failed"), missing_ok=True) == paths[1:]
+    assert os.listdir(tmp_path / "failed") == ["unknown.fq.gz"]
+
+
+@pytest.mark.parametrize("fallback", [None, "copy_file_range", "sendfile"])
+def test_concat_files(tmp_path, monkeypatch, fallback, make_fastq):
+    def unsupported(*args):
+        raise OSError(errno.EXDEV, "not supported")
+
+    if fallback == "copy_file_range":
+        monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+    elif fallback == "sendfile":
+        monkeypatch.setattr(os, "copy_file_range", unsupported, raising=False)
+        monkeypatch.setattr(os, "sendfile", unsupported, raising=False)
+    monkeypatch.setattr(utils_files, "COPY_CHUNK_SIZE", 1000)
+
+    texts = [make_fastq(50, seed=i).encode() for i in range(3)]
+    paths = []
+    for i, text in enumerate(texts):
+        paths.append(str(tmp_path / f"{i}.fq.gz"))
+        with open(paths[-1], "wb") as f:
+            f.write(gzip.compress(text))
+    (tmp_path / "empty.fq.gz").touch()
+    output = str(tmp_path / "merged.fq.gz")
+    size = concat_files(paths[:2] + [str(tmp_path / "empty.fq.gz")], output)
+    assert size == os.path.getsize(output)
+    concat_files(paths[2:], output, append=True)
+    with gzip.open(output) as f:
+        assert f.read() == b"".join(texts)
+
+    copy_file(paths[0], str(tmp_path / "copies"))
+    os.makedirs(tmp_path / "dir")
+    copy_file(paths[0], str(tmp_path / "dir"))
+    for copy in [tmp_path / "copies", tmp_path / "dir" / "0.fq.gz"]:
+        assert copy.read_bytes() == (tmp_path / "0.fq.gz").read_bytes()
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_merge(tmp_path, num_workers, make_fastq):
+    fastq_dir = tmp_path / "bcl"
+    fastq_dir.mkdir()
+    # plain and gzipped inputs, listed out of order
+    for sample, num_reads in [("s2", 3), ("s1", 2), ("s3", 0)]:
+        for read in ["R1", "R2"]:
+            text = make_fastq(num_reads, seed=int(read == "R2")).encode()
+            if sample == "s1":
+                (fastq_dir / f"{sample}_S1_L001_{read}_001.fq").write_bytes(text)
+            else:
+                path = fastq_dir / f"{sample}_S1_L001_{read}_001.fastq.gz"
+                path.write_bytes(gzip.compress(text))
+    (fastq_dir / "s4_S4_L001_R1_001.fastq.gz").write_bytes(b"")
+    with pytest.raises(ValueError):
+        merge(str(fastq_dir), str(tmp_path / "out"), num_workers)
+    os.remove(fastq_dir / "s4_S4_L001_R1_001.fastq.gz")
+
+    merge(str(fastq_dir), str(tmp_path / "out"), num_workers)
+    index = pd.read_table(tmp_path / "out" / "merged_index.tsv", index_col=0)
+    assert index["read_count"].to_dict() == {"s1": 2, "s2": 3, "s3": 0}
+    for read_num in [1, 2]:
+        path = tmp_path / "out" / f"merged_R{read_num}.fastq.gz"
+        with gzip.open(path, "rt") as f:
+            lines = f.read().splitlines()
+        expected = make_fastq(3, seed=read_num - 1).splitlines()
+        assert lines[0::4] == [
+            f"@sample={sample} {i} {read_num}"
+            for sample, num_reads in [("s1", 2), ("s2", 3)]
+            for i in range(1, num_reads + 1)
+        ]
+        assert lines[1::4] == expected[1::4][:2] + expected[1::4]
+        assert lines[3::4] == expected[3::4][:2] + expected[3::4]
+        # one gzip member per sample, at the offsets of the index
+        data = path.read_bytes()
+        offset, size = index.loc["s2", [f"R{read_num}_offset", f"R{read_num}_size"]]
+        assert offset + size == index.loc["s3", f"R{read_num}_offset"]
+        member = gzip.decompress(data[offset : offset + size]).decode()
+        assert member.splitlines()[0] == f"@sample=s2 1 {read_num}"
+        assert index[f"R{read_num}_size"].sum() == len(data)
@@ -0,0 +1,151 @@
+import gzip
+import shutil
+
+import pytest
+from Bio import bgzf
+
+from easy_amplicon.utils import smart_open
+from easy_amplicon.utils_gzip import (
+    AUTO_COMPRESS_LEVELS,
+    BGZF_BLOCK_SIZE,
+    BGZF_EOF,
+    DEFAULT_COMPRESS_LEVEL,
+    GZIP_BLOCK_SIZE,
+    PREFETCH_CHUNK_SIZE,
+    choose_compress_level,
+    get_gzip_read_backend,
+    open_bgzf_write,
+    open_gzip_read,
+    open_gzip_write,
+)
+
+BACKENDS = ["python"]
+if shutil.which("pigz") is not None:
+    BACKENDS.append("pigz")
+if get_gzip_read_backend() == "isal":
+    BACKENDS.append("isal")
+
+
+@pytest.fixture
+def gz_path(tmp_path):
+    # a few prefetch chunks, written as two gzip members
+    content = b"".join(b"line %d\n" % i for i in range(300_000))
+    path = tmp_path / "test.txt.gz"
+    with open(path, "wb") as f:
+        f.write(gzip.compress(content[:1000]))
+        f.write(gzip.compress(content[1000:]))
+    assert len(content) > 2 * PREFETCH_CHUNK_SIZE
+    return str(path), content
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+@pytest.mark.parametrize("prefetch_size", [0, PREFETCH_CHUNK_SIZE, 10**8])
+def test_open_gzip_read(gz_path, backend, prefetch_size):
+    path, content = gz_path
+    with open_gzip_read(path, backend, prefetch_size) as f:
+        assert f.read(5) == content[:5]
+        assert f.read() == content[5:]
+        assert f.read() == b""
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_smart_open_text(gz_path, backend):
+    path, content = gz_path
+    with smart_open(path, backend=backend) as f:
+        lines = list(f)
+    assert lines == content.decode().splitlines(keepends=True)
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_close_before_end(gz_path, backend):
+    path, content = gz_path
+    f = smart_open(path, "rb", backend=backend, prefetch_size=PREFETCH_CHUNK_SIZE)
+    assert f.readline() == b"line 0\n"
+    f.close()
+    assert f.closed
+
+
+@pytest.mark.parametrize("backend", BACKENDS)
+def test_truncated_gzip(tmp_path, backend):
+    path = tmp_path / "truncated.gz"
+    path.write_bytes(gzip.compress(b"ACGT\n" * 100_000)[:-100])
+    with pytest.raises((EOFError, OSError)):
+        with smart_open(str(path), "rb", backend=backend) as f:
+            f.read()
+
+
+def test_invalid_backend(gz_path):
+    with pytest.raises(ValueError):
+        open_gzip_read(gz_path[0], backend="zstd")
+
+
+@pytest.mark.parametrize("compresslevel", [1, "auto"])
+@pytest.mark.parametrize("num_bytes", [0, 100, 3 * GZIP_BLOCK_SIZE + 5])
+def test_parallel_gzip_writer(tmp_path, compresslevel, num_bytes):
+    content = b"".join(b"ACGT %d\n" % i for i in range(num_bytes // 5))[:num_bytes]
+    path = str(tmp_path / "out.gz")
+    with open_gzip_write(path, compresslevel, threads=2) as f:
+        f.write(content[:7])
+        f.write(content[7:])
+    with gzip.open(path, "rb") as f:
+        assert f.read() == content
+    # members are reproducible
+    with open(path, "rb") as f:
+        compressed = f.read()
+    with open_gzip_write(path, compresslevel, threads=3) as f:
+        f.write(content)
+    with open(path, "rb") as f:
+        assert f.read() == compressed or compresslevel == "auto"
+
+
+@pytest.mark.parametrize("num_bytes", [0, 3 * BGZF_BLOCK_SIZE + 5])
+def test_bgzf_writer(tmp_path, num_bytes):
+    content = b"".join(b"ACGT %d\n" % i for i in range(num_bytes // 5))[:num_bytes]
+    path = str(tmp_path / "out.gz")
+    with open_bgzf_write(path, threads=2) as writer:
+        writer.write(content[:7])
+        writer.write(content[7:])
+        assert writer.tell() == len(content)
+    with gzip.open(path, "rb") as f:
+        assert f.read() == content
+    with open(path, "rb") as f:
+        assert f.read().endswith(BGZF_EOF)
+    # virtual offsets of positions are understood by other BGZF readers
+    with bgzf.BgzfReader(path, "rb") as reader:
+        for position in range(0, len(content), BGZF_BLOCK_SIZE // 3):
+            reader.seek(writer.virtual_offset(position))
+            assert reader.read(10) == content[position : position + 10]
+
+
+def test_smart_open_write_text(tmp_path):
+    path = str(tmp_path / "out.txt.gz")
+    with smart_open(path, "w", compresslevel=1) as f:
+        f.write("line\n" * 10)
+    with smart_open(path) as f:
+        assert f.read() == "line\n" * 10
+
+
+def test_choose_compress_level(tmp_path):
+    level = choose_compress_level(b"ACGT" * 100_000, str(tmp_path), threads=1)
+    assert level in AUTO_COMPRESS_LEVELS
+
+
+def test_default_compress_level(tmp_path, monkeypatch):
+    # the default level is fixed, without probing the disk or timing compression
+    def fail(*args, **kwargs):
+        raise AssertionError("choose_compress_level called")
+
+    monkeypatch.setattr("easy_amplicon.utils_gzip.choose_compress_level", fail)
+    content = "ACGT\n" * GZIP_BLOCK_SIZE
+    outputs = []
+    for name, compresslevel in [
+        ("default.gz", None),
+        ("level.gz", DEFAULT_COMPRESS_LEVEL),
+    ]:
+        path = str(tmp_path / name)
+        kwargs = {} if compresslevel is None else {"compresslevel": compresslevel}
+        with smart_open(path, "w", **kwargs) as f:
+            f.write(content)
+        with open(path, "rb") as f:
+            outputs.append(f.read())
+    assert outputs[0] == outputs[1]
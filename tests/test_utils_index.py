@@ -0,0 +1,142 @@
+import gzip
+import os
+
+import pytest
+from Bio import bgzf
+
+from easy_amplicon import utils_index
+from easy_amplicon.utils_gzip import BgzfWriter
+from easy_amplicon.utils_index import (
+    fetch_sample,
+    get_compression,
+    get_fastx_index,
+    get_sample_index,
+    iter_records_by_id,
+    write_bgzf_fastq,
+)
+from easy_amplicon.utils_manifest import RACY_WINDOW_NS
+
+
+def make_fasta(num_records: int) -> str:
+    return "".join(
+        f">seq{i} desc {i}\n" + "ACGTTGCA" * (i % 5) + "\n" + "GG" * (i % 3) + "\n"
+        for i in range(num_records)
+    )
+
+
+def write(path, text: str, compression: str) -> str:
+    if compression == "bgzf":
+        with bgzf.BgzfWriter(str(path), "wb") as f:
+            f.write(text.encode())
+    elif compression == "gzip":
+        path.write_bytes(gzip.compress(text.encode()))
+    else:
+        path.write_text(text)
+    return str(path)
+
+
+def split_records(text: str, fmt: str) -> dict[str, str]:
+    if fmt == "fastq":
+        lines = text.splitlines(keepends=True)
+        records = ["".join(lines[i : i + 4]) for i in range(0, len(lines), 4)]
+    else:
+        records = [">" + r for r in text.split(">")[1:]]
+    return {r[1:].split()[0]: r for r in records}
+
+
+@pytest.mark.parametrize("compression", ["plain", "bgzf"])
+@pytest.mark.parametrize("fmt", ["fastq", "fasta"])
+def test_fastx_index(tmp_path, monkeypatch, compression, fmt, make_fastq):
+    # small scan chunks to cover records spanning chunks and BGZF blocks
+    monkeypatch.setattr(utils_index, "INDEX_SCAN_SIZE", 1000)
+    text = make_fastq(3000, seed=1) if fmt == "fastq" else make_fasta(3000)
+    path = write(tmp_path / f"reads.{fmt}.gz", text, compression)
+    assert get_compression(path) == compression
+    records = split_records(text, fmt)
+
+    with get_fastx_index(path) as index:
+        assert index.ids() == list(records)
+        assert index.fetch("read1234" if fmt == "fastq" else "seq1234") == (
+            records["read1234" if fmt == "fastq" else "seq1234"].encode()
+        )
+        wanted = list(records)[::-7]
+        assert list(index.fetch_many(wanted + ["missing"])) == [
+            records[i].encode() for i in reversed(wanted)
+        ]
+        with pytest.raises(KeyError):
+            index.fetch("missing")
+    # files modified within the racy window are not cached
+    index_path = tmp_path / ".easy_amplicon" / "index" / f"reads.{fmt}.gz.fxi"
+    assert not os.path.exists(index_path)
+    mtime_ns = os.stat(path).st_mtime_ns - 10 * RACY_WINDOW_NS
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    with get_fastx_index(path) as index:
+        assert index.ids() == list(records)
+    assert os.path.exists(index_path)
+
+    # the cached index is used unless the file changes
+    monkeypatch.setattr(utils_index, "_build_index", None)
+    with get_fastx_index(path) as index:
+        assert len(index) == len(records)
+    os.utime(path, ns=(0, 0))
+    with pytest.raises(TypeError):
+        get_fastx_index(path)
+
+
+def test_iter_records_by_id_gzip(tmp_path, make_fastq):
+    text = make_fastq(100, seed=2)
+    path = write(tmp_path / "reads.fq.gz", text, "gzip")
+    with pytest.raises(ValueError):
+        get_fastx_index(path)
+    records = split_records(text, "fastq")
+    assert list(iter_records_by_id(path, ["read50", "read3"])) == [
+        records["read3"].encode(),
+        records["read50"].encode(),
+    ]
+
+
+def test_fastx_index_no_trailing_newline(tmp_path):
+    path = write(tmp_path / "reads.fq", "@a\nAC\n+\nII\n@b\nG\n+\nI", "plain")
+    with get_fastx_index(path) as index:
+        assert index.fetch("b") == b"@b\nG\n+\nI"
+
+
+def test_sample_index(tmp_path, monkeypatch, make_sample_fastq):
+    # small blocks to cover samples spanning blocks
+    monkeypatch.setattr(BgzfWriter, "block_size", 1000)
+    records = make_sample_fastq({"A1": 300, "A2": 3, "B1": 200}, seed=3)
+    records.sort(key=lambda r: r.split()[0])
+    # a sample may come back later in the file
+    records = records[:100] + records[-5:] + records[100:-5]
+    input_path = tmp_path / "merged.fq"
+    input_path.write_text("".join(records))
+    path = str(tmp_path / "merged.fq.gz")
+
+    sample_index = write_bgzf_fastq(str(input_path), path, threads=2)
+    assert get_compression(path) == "bgzf"
+    assert {s: sum(r[2] for r in runs) for s, runs in sample_index.items()} == {
+        "A1": 300,
+        "A2": 3,
+        "B1": 200,
+    }
+    assert len(sample_index["A1"]) == 2
+    with gzip.open(path, "rt") as f:
+        assert f.read() == "".join(records)
+    for sample in sample_index:
+        expected = "".join(r for r in records if r.startswith(f"@sample={sample} "))
+        assert fetch_sample(path, sample).decode() == expected
+    with pytest.raises(KeyError):
+        fetch_sample(path, "C1")
+    # the same index is built by scanning the file
+    assert get_sample_index(path, use_cache=False) == sample_index
+
+    # reads relabeled by vsearch --relabel_keep
+    input_path.write_text(
+        "@filtered1 sample=A1 1\nAC\n+\nII\n@filtered2 sample=B1\nG\n+\nI\n"
+    )
+    assert get_sample_index(str(input_path)) == {
+        "A1": [(0, 31, 1)],
+        "B1": [(31, 27, 1)],
+    }
+    # not cached within the racy window
+    assert not os.path.exists(tmp_path / ".easy_amplicon" / "index" / "merged.fq.sidx")
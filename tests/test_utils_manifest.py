@@ -0,0 +1,102 @@
+import os
+
+import pytest
+
+from easy_amplicon import utils_manifest
+from easy_amplicon.utils import find_paired_end_files
+from easy_amplicon.utils_manifest import (
+    get_fastq_manifest,
+    is_settled,
+    parse_fastq_name,
+    write_cache_file,
+)
+
+
+def age_directory(directory) -> None:
+    """Move the mtime of a directory out of the racy window, so that it gets cached."""
+    mtime_ns = os.stat(directory).st_mtime_ns - 10 * utils_manifest.RACY_WINDOW_NS
+    os.utime(directory, ns=(mtime_ns, mtime_ns))
+
+
+@pytest.mark.parametrize(
+    "file_name, expected",
+    [
+        ("A1_S1_L001_R1_001.fastq.gz", ("A1", "R1", "L001")),
+        ("A1_S12_L002_R2_001.fq", ("A1", "R2", "L002")),
+        ("B_2_R1.fq.gz", ("B_2", "R1", None)),
+        ("B.2.fastq", ("B", "R2", None)),
+        ("B.fastq", (None, None, None)),
+    ],
+)
+def test_parse_fastq_name(file_name, expected):
+    assert parse_fastq_name(file_name) == expected
+
+
+def test_find_paired_end_files(tmp_path):
+    for name in [
+        "s2_S2_L001_R1_001.fastq.gz",
+        "s2_S2_L001_R2_001.fastq.gz",
+        "s1_R1.fq",
+        "s1_R2.fq",
+        "s1_R1.fastq.gz",  # duplicate, wins over .fq like with the former globs
+        "s3_R1.fq",  # missing pair
+        "other.fq",  # no pattern
+        ".hidden_R1.fq",
+        "notes.txt",
+    ]:
+        (tmp_path / name).write_text("@r\nA\n+\nI\n")
+    with pytest.warns(UserWarning):
+        pairs = find_paired_end_files(str(tmp_path))
+    assert pairs == [
+        (str(tmp_path / "s1_R1.fastq.gz"), str(tmp_path / "s1_R2.fq"), "s1"),
+        (
+            str(tmp_path / "s2_S2_L001_R1_001.fastq.gz"),
+            str(tmp_path / "s2_S2_L001_R2_001.fastq.gz"),
+            "s2",
+        ),
+    ]
+
+
+def test_manifest_cache(tmp_path, monkeypatch):
+    (tmp_path / "s1_R1.fq").write_text("@r\nA\n+\nI\n")
+    (tmp_path / "s1_R2.fq").write_text("@r\nA\n+\nI\n")
+    # recently modified directories are scanned but not cached
+    manifest = get_fastq_manifest(str(tmp_path))
+    assert not (tmp_path / ".easy_amplicon" / "manifest.json").exists()
+
+    age_directory(tmp_path)
+    assert get_fastq_manifest(str(tmp_path)) == manifest
+    assert (tmp_path / ".easy_amplicon" / "manifest.json").exists()
+    assert manifest[0]["size"] == 9 and manifest[0]["read"] == "R1"
+
+    # served from the cache saved next to the data, without scanning
+    utils_manifest._manifests.clear()
+
+    def fail(directory):
+        raise AssertionError("Directory scanned again.")
+
+    monkeypatch.setattr(utils_manifest, "_scan_fastq_dir", fail)
+    assert get_fastq_manifest(str(tmp_path)) == manifest
+    monkeypatch.undo()
+
+    # adding a file invalidates the cache
+    (tmp_path / "s2_R1.fq").write_text("@r\nA\n+\nI\n")
+    assert len(get_fastq_manifest(str(tmp_path))) == 3
+
+
+def test_cache_helpers(tmp_path):
+    path = tmp_path / "data.txt"
+    path.write_text("data")
+    assert not is_settled(path.stat())
+    age_directory(path)
+    assert is_settled(path.stat())
+
+    cache_path = tmp_path / ".easy_amplicon" / "data.json"
+    with write_cache_file(str(cache_path)) as f:
+        f.write("{}")
+    assert cache_path.read_text() == "{}"
+    assert sorted(p.name for p in cache_path.parent.iterdir()) == ["data.json"]
+    # caches that cannot be written are not saved, without an error
+    with write_cache_file(str(path / "data.json")) as f:
+        f.write("{}")
+    assert path.read_text() == "data"
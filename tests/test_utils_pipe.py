@@ -0,0 +1,73 @@
+import io
+import subprocess
+import sys
+import time
+
+import pytest
+
+from easy_amplicon.utils import cat_fastq
+from easy_amplicon.utils_pipe import PipeFeeder
+
+
+class SlowPipe(io.BytesIO):
+    """An in-memory pipe that takes some time for each write."""
+
+    def write(self, data) -> int:
+        time.sleep(0.01)
+        return super().write(data)
+
+    def close(self) -> None:
+        self.result = self.getvalue()
+        super().close()
+
+
+@pytest.mark.parametrize("buffer_size", [1, 100, 10**6])
+def test_pipe_feeder_order(buffer_size):
+    pipe = SlowPipe()
+    chunks = [b"chunk %d\n" % i * (i % 7) for i in range(50)]
+    with PipeFeeder(pipe, buffer_size=buffer_size) as feeder:
+        for chunk in chunks:
+            feeder.write(chunk)
+    assert pipe.result == b"".join(chunks)
+    assert feeder.stats["bytes"] == len(pipe.result)
+    assert feeder.stats["pipe_blocked"] > 0
+    if buffer_size == 1:
+        # the producer is held up by the slow pipe
+        assert feeder.stats["producer_stall"] > 0
+        assert feeder.stats["peak_buffered"] <= max(map(len, chunks))
+
+
+def test_pipe_feeder_subprocess(tmp_path, make_fastq):
+    fastq_dir = tmp_path / "fastq"
+    fastq_dir.mkdir()
+    for idx in range(3):
+        (fastq_dir / f"s{idx}_R1.fq").write_text(make_fastq(20, seed=idx))
+        (fastq_dir / f"s{idx}_R2.fq").write_text(make_fastq(20, seed=idx + 10))
+    expected = io.BytesIO()
+    cat_fastq(str(fastq_dir), expected, expected)
+
+    output = tmp_path / "out.fq"
+    with open(output, "wb") as output_fp:
+        proc = subprocess.Popen(
+            [
+                sys.executable,
+                "-c",
+                "import shutil, sys; shutil.copyfileobj(sys.stdin.buffer, sys.stdout.buffer)",
+            ],
+            stdin=subprocess.PIPE,
+            stdout=output_fp,
+        )
+        with PipeFeeder(proc.stdin) as feeder:
+            cat_fastq(str(fastq_dir), feeder, feeder)
+        assert proc.wait() == 0
+    assert output.read_bytes() == expected.getvalue()
+    assert "producer stalled" in feeder.summary()
+
+
+def test_pipe_feeder_broken_pipe():
+    proc = subprocess.Popen([sys.executable, "-c", "pass"], stdin=subprocess.PIPE)
+    proc.wait()
+    with pytest.raises(BrokenPipeError):
+        with PipeFeeder(proc.stdin, buffer_size=1024) as feeder:
+            for _ in range(1000):
+                feeder.write(b"A" * 1024)
@@ -0,0 +1,170 @@
+import gzip
+import io
+import json
+
+import pandas as pd
+import pytest
+
+from easy_amplicon.utils import cat_fastq, cat_fastq_se
+from easy_amplicon.utils_preview import (
+    ReadSampler,
+    summarize_trim,
+    summarize_zotus,
+    write_preview_fastq,
+)
+
+
+def _records(data: bytes) -> list[bytes]:
+    lines = data.splitlines(keepends=True)
+    return [b"".join(lines[i : i + 4]) for i in range(0, len(lines), 4)]
+
+
+def test_read_sampler(make_fastq):
+    data = make_fastq(500, seed=1).encode()
+    records = _records(data)
+    samples = []
+    for chunk_size in [1, 7, 500]:
+        sampler = ReadSampler(50, "s1")
+        for i in range(0, len(records), chunk_size):
+            sampler.add(b"".join(records[i : i + chunk_size]))
+        samples.append(sampler.get_chunks()[0])
+    # the sample does not depend on how reads are chunked
+    assert samples[0] == samples[1] == samples[2]
+    kept = _records(samples[0])
+    assert len(kept) == 50
+    # reads keep their order
+    assert sorted(kept, key=records.index) == kept
+    # samples of other names differ, small inputs are kept whole
+    sampler = ReadSampler(50, "s2")
+    sampler.add(data)
+    assert sampler.get_chunks()[0] != samples[0]
+    sampler = ReadSampler(50, "s2")
+    sampler.add(data[:-1])  # no trailing newline
+    sampler.add(b"")
+    assert sampler.num_seen == 500
+    assert ReadSampler(600, "s1").get_chunks() is None
+    with pytest.raises(ValueError):
+        sampler.add(b"@r\nA\n+\n")
+    with pytest.raises(ValueError):
+        ReadSampler(0, "s1")
+
+
+@pytest.mark.parametrize("num_workers", [1, 2])
+def test_cat_fastq_preview(tmp_path, num_workers, make_fastq):
+    for idx in range(3):
+        (tmp_path / f"s{idx}_R1.fq").write_text(make_fastq(40 + idx, seed=idx))
+        (tmp_path / f"s{idx}_R2.fq").write_text(make_fastq(40 + idx, seed=idx + 10))
+    full, preview = io.BytesIO(), io.BytesIO()
+    cat_fastq(str(tmp_path), full, full)
+    stats_path = tmp_path / "read_stats.tsv"
+    cat_fastq(
+        str(tmp_path),
+        preview,
+        preview,
+        num_workers=num_workers,
+        stats_path=str(stats_path),
+        preview=10,
+    )
+    pairs = _records(preview.getvalue())
+    full_pairs = _records(full.getvalue())
+    assert len(pairs) == 2 * 3 * 10
+    # interleaved pairs stay together and in order
+    full_indices = [full_pairs.index(pair) for pair in pairs]
+    assert full_indices[0::2] == sorted(full_indices[0::2])
+    assert [j - i for i, j in zip(full_indices[0::2], full_indices[1::2])] == [1] * 30
+    # statistics count all reads
+    assert pd.read_table(stats_path, index_col=0)["read_count"].tolist() == [40, 41, 42]
+
+    r1, r2 = io.BytesIO(), io.BytesIO()
+    cat_fastq(str(tmp_path), r1, r2, preview=10)
+    assert [
+        a + b for a, b in zip(_records(r1.getvalue()), _records(r2.getvalue()))
+    ] == [a + b for a, b in zip(pairs[0::2], pairs[1::2])]
+
+    se = io.BytesIO()
+    cat_fastq_se(str(tmp_path), se, preview=5)
+    assert len(_records(se.getvalue())) == 15
+
+
+def test_write_preview_fastq(tmp_path, make_fastq, make_sample_fastq):
+    sizes = {"A1": 300, "A2": 3, "B1": 40}
+    records = make_sample_fastq(sizes, seed=1)
+    input_fastq = tmp_path / "reads.fq"
+    input_fastq.write_text("".join(records))
+    output_fastq = tmp_path / "preview.fq"
+    assert write_preview_fastq(str(input_fastq), str(output_fastq), 20) == {
+        sample: sizes[sample] for sample in dict.fromkeys(r[8:10] for r in records)
+    }
+    kept = output_fastq.read_text().splitlines(keepends=True)
+    kept = ["".join(kept[i : i + 4]) for i in range(0, len(kept), 4)]
+    samples = [record[8:10] for record in kept]
+    assert {s: samples.count(s) for s in sizes} == {"A1": 20, "A2": 3, "B1": 20}
+    # reads of a sample keep their order
+    a1 = [r for r in records if r.startswith("@sample=A1 ")]
+    assert [a1.index(r) for r in kept if r.startswith("@sample=A1 ")] == sorted(
+        a1.index(r) for r in kept if r.startswith("@sample=A1 ")
+    )
+    # the same for a gzip input
+    input_gz = tmp_path / "reads.fq.gz"
+    with gzip.open(input_gz, "wt") as f:
+        f.write("".join(records))
+    write_preview_fastq(str(input_gz), str(tmp_path / "preview_gz.fq"), 20)
+    assert (tmp_path / "preview_gz.fq").read_text() == output_fastq.read_text()
+
+    (tmp_path / "plain.fq").write_text(make_fastq(3, seed=1))
+    with pytest.raises(ValueError):
+        write_preview_fastq(str(tmp_path / "plain.fq"), str(output_fastq), 20)
+
+
+def test_summaries(tmp_path):
+    pd.DataFrame(
+        {"read_count": [10, 30, 20], "mean_ee": [0.5, 0.1, 0.3]},
+        index=pd.Index(["s1", "s2", "s3"], name="sample"),
+    ).to_csv(tmp_path / "read_stats.tsv", sep="\t")
+    pd.DataFrame(
+        {"read_count": [50, 0, 10]},
+        index=pd.Index(["A1", "A2", "unknown"], name="well"),
+    ).to_csv(tmp_path / "demux_report.tsv", sep="\t")
+    (tmp_path / "cutadapt").mkdir()
+    (tmp_path / "cutadapt" / "report.json").write_text(
+        json.dumps(
+            {
+                "read_counts": {
+                    "input": 200,
+                    "filtered": {"too_short": 20},
+                    "output": 150,
+                    "read1_with_adapter": 180,
+                }
+            }
+        )
+    )
+    assert summarize_trim(str(tmp_path)) == [
+        "Samples: 3, reads per sample: min 10, median 20, max 30",
+        "Mean expected errors per read: 0.23",
+        "Demultiplexed: 83.3% of read pairs, 1/2 wells with reads",
+        "cutadapt: 200 reads, primer found in 90.0%, too short 10.0%, kept 75.0%",
+    ]
+    # only the reports that exist are summarized
+    assert summarize_trim(str(tmp_path / "cutadapt")) == []
+
+    otutab = tmp_path / "otutab.tsv"
+    otutab.write_text("#OTU ID\ts1\ts2\nZOTU1\t60\t0\nZOTU2\t10\t20\nZOTU3\t5\t5\n")
+    assert summarize_zotus(str(otutab), top=2) == [
+        "ZOTUs: 3, found in 2/2 samples, 100 reads assigned",
+        "Top 2 ZOTUs:",
+        "  ZOTU1: 60.0%",
+        "  ZOTU2: 30.0%",
+    ]
+    sintax = tmp_path / "sintax.tsv"
+    sintax.write_text(
+        "ZOTU1;size=60\td:Bacteria(1.00),g:Bacillus(0.90)\t+\td:Bacteria,g:Bacillus\n"
+        "ZOTU2;size=30\td:Bacteria(1.00),g:Vibrio(0.50)\t+\td:Bacteria\n"
+        "ZOTU3;size=10\td:Bacteria(0.50)\t+\t\n"
+    )
+    assert summarize_zotus(str(otutab), str(sintax)) == [
+        "ZOTUs: 3, found in 2/2 samples, 100 reads assigned",
+        "Top 3 taxa:",
+        "  g:Bacillus: 60.0%",
+        "  d:Bacteria: 30.0%",
+        "  unclassified: 10.0%",
+    ]
@@ -0,0 +1,212 @@
+import gzip
+import json
+import random
+import shutil
+import subprocess
+import sys
+
+import pytest
+
+from easy_amplicon.utils_primer import (
+    IUPAC_CODES,
+    PrimerLocator,
+    PrimerTrimmer,
+    parse_linked_adapter,
+)
+
+# copies stdin to stdout
+COPY = "import sys; sys.stdout.buffer.write(sys.stdin.buffer.read())"
+FRONT = "GTGTGYCAGCMGCCGCGGTAA"  # 16S 515F
+BACK = "ATTAGAWACCCBNGTAGTCCGG"  # reverse complement of 16S 806R
+
+
+def _matches(primer_base: str, read_base: str) -> bool:
+    return bool(IUPAC_CODES[primer_base] & IUPAC_CODES.get(read_base, 0))
+
+
+def _distances(primer: str, read: str, free_start: bool) -> list[list[int]]:
+    """Edit distance table of each prefix of `primer` to each prefix of `read`."""
+    rows = [[0 if free_start else j for j in range(len(read) + 1)]]
+    for i, p in enumerate(primer, 1):
+        row = [i]
+        for j, r in enumerate(read, 1):
+            sub = rows[-1][j - 1] + (not _matches(p, r))
+            row.append(min(sub, rows[-1][j] + 1, row[-1] + 1))
+        rows.append(row)
+    return rows
+
+
+def _front_possible(read: str) -> bool:
+    return min(_distances(FRONT, read, False)[-1]) <= int(len(FRONT) * 0.1)
+
+
+def _back_possible(insert: str) -> bool:
+    rows = _distances(BACK, insert, True)
+    if min(rows[-1]) <= int(len(BACK) * 0.1):
+        return True
+    return any(rows[a][-1] <= int(a * 0.1) for a in range(3, len(BACK)))
+
+
+def _mutate(seq: str, rng: random.Random, errors: int) -> str:
+    seq = list(seq)
+    for _ in range(errors):
+        if not seq:
+            break
+        i = rng.randrange(len(seq))
+        op = rng.choice("sid")
+        if op == "s":
+            seq[i] = rng.choice("ACGT")
+        elif op == "i":
+            seq.insert(i, rng.choice("ACGT"))
+        else:
+            del seq[i]
+    return "".join(seq)
+
+
+def _concrete(primer: str, rng: random.Random) -> str:
+    return "".join(
+        rng.choice([b for b in "ACGT" if IUPAC_CODES[b] & IUPAC_CODES[p]])
+        for p in primer
+    )
+
+
+def _make_reads(n: int, seed: int = 0) -> list[str]:
+    rng = random.Random(seed)
+    reads = []
+    for _ in range(n):
+        insert = "".join(rng.choice("ACGT") for _ in range(rng.randint(0, 60)))
+        front = _concrete(FRONT, rng)
+        kind = rng.random()
+        if kind < 0.3:
+            front = _mutate(front, rng, rng.randint(1, 3))
+        elif kind < 0.4:
+            front = ""
+        back = _concrete(BACK, rng)[: rng.randint(0, len(BACK))]
+        if rng.random() < 0.5:
+            back = _mutate(back, rng, rng.randint(0, 2)) if back else back
+            insert += back + "".join(rng.choice("ACGT") for _ in range(5))
+        reads.append(front + insert)
+    return reads
+
+
+def test_parse_linked_adapter():
+    assert parse_linked_adapter(f"^{FRONT};required...{BACK};optional") == (
+        FRONT,
+        BACK,
+    )
+    assert parse_linked_adapter(f"^{FRONT}...{BACK}") == (FRONT, BACK)
+    assert parse_linked_adapter("^acgt") == ("ACGT", None)
+    assert parse_linked_adapter(f"{FRONT}...{BACK}") is None
+    assert parse_linked_adapter(f"^{FRONT};min_overlap=5") is None
+
+
+def test_locate():
+    locator = PrimerLocator(FRONT, BACK)
+    insert = "ACGTTGCAAGCTTAGCGATCGATTACGATCGGATCCATGCAAGTC"
+    reads = [
+        "GTGTGCCAGCAGCCGCGGTAA" + insert,  # exact 5' primer
+        "GTGTGCCAGCAGCCGCGCTAA" + insert,  # one mismatch
+        insert,  # no 5' primer
+        "GTGTGCCAGCAGCCGCGGTAA" + insert + "ATTAGAAACCCTTGTAGTCCGG",  # 3' primer
+        "GTGTGCCAGCAGCCGCGGTAA" + insert + "ATTAGAAAC",  # partial 3' primer
+        "GTGTGCCAGCAGCCGCGGTAA" + insert.replace("G", "N", 1),
+        "GTGTG",
+        "",
+    ]
+    starts, resolved = locator.locate([read.encode() for read in reads])
+    assert starts.tolist() == [21, 0, 0, 21, 21, 0, 0, 0]
+    assert resolved.tolist() == [True, False, True, False, False, False, True, True]
+
+
+def test_locate_is_sound():
+    # reads settled natively are those where cutadapt finds nothing to do beyond
+    # cutting an exact 5' primer
+    reads = _make_reads(400)
+    starts, resolved = PrimerLocator(FRONT, BACK).locate([r.encode() for r in reads])
+    assert 0.2 < resolved.mean() < 0.8
+    for read, start, ok in zip(reads, starts.tolist(), resolved.tolist()):
+        if not ok:
+            continue
+        if start:
+            assert all(map(_matches, FRONT, read))
+            assert not _back_possible(read[start:])
+        else:
+            assert not _front_possible(read)
+
+
+def _fastq(reads: list[str]) -> bytes:
+    return "".join(
+        f"@sample=s {i} r\n{read}\n+\n{'I' * len(read)}\n"
+        for i, read in enumerate(reads)
+    ).encode()
+
+
+def test_primer_trimmer(tmp_path):
+    insert = "ACGTTGCAAGCTTAGCGATCGATTACGATCGGATCCATGCAAGTC"
+    reads = [
+        "GTGTGCCAGCAGCCGCGGTAA" + insert,
+        "GTGTGTCAGCCGCCGCGGTAA" + insert[:10],
+        insert,
+    ]
+    output, too_short = str(tmp_path / "out.fq.gz"), str(tmp_path / "short.fq")
+    report = str(tmp_path / "report.json")
+    trimmer = PrimerTrimmer(
+        FRONT, BACK, output, too_short, first_k=30, min_length=15, report=report
+    )
+    with trimmer:
+        data = _fastq(reads)
+        # writes need not end at record boundaries
+        trimmer.write(data[:50])
+        trimmer.write(data[50:])
+    with gzip.open(output, "rb") as f:
+        assert f.read() == _fastq([insert[:30], insert[:30]]).replace(
+            b"@sample=s 1 r", b"@sample=s 2 r"
+        )
+    with open(too_short, "rb") as f:
+        assert f.read() == b"@sample=s 1 r\n%s\n+\n%s\n" % (
+            insert[:10].encode(),
+            b"I" * 10,
+        )
+    with open(report) as f:
+        counts = json.load(f)
+    assert counts["read_counts"] == {
+        "input": 3,
+        "filtered": {"too_short": 1},
+        "output": 2,
+        "read1_with_adapter": 2,
+    }
+    assert counts["basepair_counts"]["output"] == 60
+    assert counts["primer_locator"] == {"native": 3, "fallback": 0}
+
+    # unclear reads go through cutadapt, here a command returning them as they are
+    output = str(tmp_path / "out.fq")
+    trimmer = PrimerTrimmer(FRONT, BACK, output, batch_size=100)
+    trimmer.cutadapt_args = [sys.executable, "-c", COPY]
+    reads.insert(1, "GTGTGCCAGCAGCCGCGCTAA" + insert)
+    with trimmer:
+        trimmer.write(_fastq(reads))
+    with open(output, "rb") as f:
+        assert f.read() == _fastq([insert, reads[1], insert[:10], insert])
+    assert trimmer.counts["fallback"] == 1
+    assert trimmer.counts["with_adapter"] == 2
+
+
+@pytest.mark.skipif(shutil.which("cutadapt") is None, reason="cutadapt not found")
+def test_primer_trimmer_matches_cutadapt(tmp_path):
+    reads = _make_reads(2000, seed=1)
+    data = _fastq(reads)
+    adapter = f"^{FRONT};required...{BACK};optional"
+    expected = subprocess.run(
+        ["cutadapt", "-a", adapter, "-l", "50", "-m", "10", "--quiet", "-"],
+        input=data,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    output = str(tmp_path / "out.fq")
+    with PrimerTrimmer(
+        FRONT, BACK, output, first_k=50, min_length=10, batch_size=10000
+    ) as trimmer:
+        trimmer.write(data)
+    with open(output, "rb") as f:
+        assert f.read() == expected
+    assert trimmer.counts["fallback"] < len(reads)
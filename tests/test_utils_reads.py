@@ -0,0 +1,71 @@
+import random
+
+import pytest
+
+from easy_amplicon import utils_reads
+from easy_amplicon.utils import parse_fastx, parse_fastx_batches, smart_open
+from easy_amplicon.utils_reads import (
+    get_read_samples,
+    iter_fastq_chunks,
+    parse_reads,
+    reads_to_fastq,
+    write_reads,
+)
+from easy_amplicon.utils_shards import fastq_input_path
+
+
+@pytest.fixture
+def fastq_text(make_sample_fastq) -> str:
+    rng = random.Random(0)
+    records = []
+    for record in make_sample_fastq({"A1": 300, "A2": 3, "B1": 200}, seed=4):
+        title, seq, _, qual, _ = record.split("\n")
+        if rng.random() < 0.1:  # bases other than ACGT
+            seq = seq[:-1] + rng.choice("NRY")
+        records.append(f"{title}\n{seq}\n+\n{qual}\n")
+    records.sort(key=lambda r: r.split()[0])
+    records += ["@unlabeled read 1\nACGTN\n+\nIII#I\n", "@sample=C1\n\n+\n\n"]
+    return "".join(records)
+
+
+def test_read_table(tmp_path, fastq_text):
+    fastq_path = tmp_path / "reads.fq"
+    fastq_path.write_text(fastq_text)
+    path = str(tmp_path / "reads.fqa")
+    assert write_reads(str(fastq_path), path, batch_size=100) == 505
+
+    assert list(parse_fastx(path)) == list(parse_fastx(str(fastq_path)))
+    assert list(parse_fastx(path, as_bytes=True, full_title=True)) == list(
+        parse_fastx(str(fastq_path), as_bytes=True, full_title=True)
+    )
+    batches = list(parse_fastx_batches(path))
+    assert sum(len(batch["ids"]) for batch in batches) == 505
+    with smart_open(path) as f:
+        assert f.read() == fastq_text
+    reads_to_fastq(path, str(tmp_path / "out.fq.gz"))
+    with smart_open(str(tmp_path / "out.fq.gz")) as f:
+        assert f.read() == fastq_text
+    with fastq_input_path(path) as input_path:
+        with open(input_path) as f:
+            assert f.read() == fastq_text
+
+    sample_batches = get_read_samples(path)
+    assert list(sample_batches) == ["A1", "A2", "B1", "C1"]
+    assert sample_batches["A2"] == [3]
+    lines = fastq_text.splitlines(keepends=True)
+    records = ["".join(lines[i : i + 4]) for i in range(0, len(lines), 4)]
+    for sample in sample_batches:
+        expected = [r for r in records if r.split()[0] == f"@sample={sample}"]
+        data = b"".join(iter_fastq_chunks(path, [sample])).decode()
+        assert data == "".join(expected)
+
+
+def test_read_table_binned_quality(tmp_path, monkeypatch):
+    (tmp_path / "reads.fq").write_text("@sample=A1 1\nACGTA\n+\n#+5?I\n")
+    path = str(tmp_path / "reads.fqa")
+    write_reads(str(tmp_path / "reads.fq"), path, bin_quality=True, compression="lz4")
+    # Phred 2, 10, 20, 30 and 40
+    assert list(parse_reads(path)) == [("sample=A1", "ACGTA", "'07BI")]
+    monkeypatch.setattr(utils_reads, "READS_VERSION", 2)
+    with pytest.raises(ValueError):
+        list(parse_reads(path))
@@ -0,0 +1,113 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from easy_amplicon.usearch_workflow import _cluster_unoise3
+from easy_amplicon.utils_run import CACHE_DB, NO_CACHE_ENV, run_command
+
+# copies argv[1] to argv[2] upper-cased and counts its runs in argv[3]
+TOOL = """
+import sys
+with open(sys.argv[1]) as f, open(sys.argv[2], "w") as out:
+    out.write(f.read().upper())
+with open(sys.argv[3], "a") as f:
+    f.write("run\\n")
+"""
+
+
+def test_run_command(tmp_path, monkeypatch):
+    monkeypatch.delenv(NO_CACHE_ENV, raising=False)
+    input_path, output_path = str(tmp_path / "in.txt"), str(tmp_path / "out.txt")
+    runs = tmp_path / "runs.txt"
+    (tmp_path / "in.txt").write_text("acgt")
+
+    def run(*extra, **kwargs):
+        args = [sys.executable, "-c", TOOL, input_path, output_path, str(runs), *extra]
+        return run_command(args, [input_path], [output_path], **kwargs)
+
+    assert run()
+    assert not run()
+    assert (tmp_path / "out.txt").read_text() == "ACGT"
+    assert os.path.exists(tmp_path / ".easy_amplicon" / CACHE_DB)
+    # other arguments, modified outputs, modified inputs
+    assert run("x")
+    (tmp_path / "out.txt").write_text("")
+    assert run() and not run()
+    (tmp_path / "in.txt").write_text("tgca")
+    assert run() and (tmp_path / "out.txt").read_text() == "TGCA"
+    # rewritten identical inputs still match
+    os.utime(input_path, ns=(0, 0))
+    assert not run()
+    monkeypatch.setenv(NO_CACHE_ENV, "1")
+    assert run()
+    assert runs.read_text().count("run") == 5
+
+    # failed commands are not recorded, pipelines and stdout
+    monkeypatch.delenv(NO_CACHE_ENV)
+    fail = [sys.executable, "-c", "import sys; sys.exit(2)"]
+    with pytest.raises(subprocess.CalledProcessError):
+        run_command(fail, outputs=[output_path], check=True)
+    assert run_command(fail, outputs=[output_path])
+    upper = [sys.executable, "-c", "import sys; print(sys.stdin.read().upper())"]
+    pipeline = [["cat", input_path], upper]
+    stdout = str(tmp_path / "piped.txt")
+    assert run_command(pipeline, [input_path], stdout=stdout)
+    assert not run_command(pipeline, [input_path], stdout=stdout)
+    assert (tmp_path / "piped.txt").read_text() == "TGCA\n"
+    # named pipes are not hashed, which would block
+    os.mkfifo(tmp_path / "fifo")
+    assert run_command(["true"], [str(tmp_path / "fifo")], [output_path])
+
+
+# writes each output of a usearch command, the outputs of `-fastx_relabel` from its
+# input, and logs the command in argv[0]'s directory
+FAKE_USEARCH = """
+import os, sys
+outputs = {"-zotus", "-tabbedout", "-fastaout", "-otutabout", "-biomout", "-mapout",
+    "-notmatched", "-dbmatched", "-output", "-treeout", "-clusterout"}
+content = sys.argv[1]
+if sys.argv[1] == "-fastx_relabel":
+    with open(sys.argv[2]) as f:
+        content = f.read().replace(">", ">ZOTU")
+for flag, path in zip(sys.argv[1:], sys.argv[2:]):
+    if flag in outputs:
+        with open(path, "w") as f:
+            f.write(content)
+with open(os.path.join(os.path.dirname(sys.argv[0]), "runs.txt"), "a") as f:
+    f.write(sys.argv[1] + "\\n")
+"""
+
+
+def test_cluster_unoise3_resume(tmp_path, monkeypatch):
+    monkeypatch.delenv(NO_CACHE_ENV, raising=False)
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    for tool in ["usearch10", "usearch11"]:
+        (bin_dir / tool).write_text(f"#!{sys.executable}\n{FAKE_USEARCH}")
+        (bin_dir / tool).chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    (tmp_path / "merged.fq").write_text("@r\nACGT\n+\nIIII\n")
+    (tmp_path / "uniques.fa").write_text(">u1\nACGT\n")
+    output_dir = tmp_path / "out"
+
+    def cluster():
+        _cluster_unoise3(
+            str(tmp_path / "merged.fq"),
+            str(tmp_path / "uniques.fa"),
+            minsize=8,
+            id_=0.97,
+            output_dir=str(output_dir),
+            num_threads=1,
+            backend="usearch",
+        )
+
+    cluster()
+    runs = (bin_dir / "runs.txt").read_text().split()
+    assert runs[:3] == ["-unoise3", "-fastx_relabel", "-otutab"]
+    assert (output_dir / "unoise3_zotu.fa").read_text() == "-unoise3"
+    assert (output_dir / "unoise3_zotu.tsv").read_text() == "-otutab"
+    # every step is skipped when run again
+    cluster()
+    assert (bin_dir / "runs.txt").read_text().split() == runs
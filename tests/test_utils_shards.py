@@ -0,0 +1,70 @@
+import gzip
+
+import pandas as pd
+import pytest
+
+from easy_amplicon import utils_shards
+from easy_amplicon.usearch_workflow import add_depth_to_metadata
+from easy_amplicon.utils_shards import (
+    fastq_input_path,
+    read_sample_fastq,
+    read_shard_manifest,
+    write_fastq_shards,
+)
+
+
+def test_write_fastq_shards(tmp_path, monkeypatch, make_sample_fastq):
+    monkeypatch.setattr(utils_shards, "SHARD_MEMBER_SIZE", 500)
+    sizes = {"A1": 400, "A2": 3, "B1": 20, "B2": 30, "C1": 300}
+    records = make_sample_fastq(sizes, seed=1)
+    input_path = tmp_path / "merged.fq.gz"
+    input_path.write_bytes(gzip.compress("".join(records).encode()))
+
+    manifest_path = write_fastq_shards(
+        str(input_path), str(tmp_path / "shards"), min_shard_size=5000, threads=2
+    )
+    manifest = read_shard_manifest(manifest_path)
+    assert manifest["num_reads"] == len(records)
+    assert {s: info["num_reads"] for s, info in manifest["samples"].items()} == sizes
+    # small samples are grouped, large ones get a shard of their own
+    assert 1 < len(manifest["shards"]) < len(sizes)
+    assert not (tmp_path / "shards" / ".tmp").exists()
+
+    all_data = b""
+    for shard in manifest["shards"]:
+        with open(shard["path"], "rb") as f:
+            all_data += f.read()
+    text = gzip.decompress(all_data).decode()
+    assert sorted(text.splitlines()) == sorted("".join(records).splitlines())
+    for sample in sizes:
+        expected = "".join(r for r in records if r.startswith(f"@sample={sample} "))
+        assert read_sample_fastq(manifest, sample).decode() == expected
+
+    # shards are streamed to tools through a named pipe
+    with fastq_input_path(manifest_path) as input_fastq:
+        with open(input_fastq) as f:
+            assert f.read() == text
+    with fastq_input_path(str(input_path)) as input_fastq:
+        assert input_fastq == str(input_path)
+
+    metadata_path = tmp_path / "metadata.tsv"
+    pd.DataFrame({"sample": list(sizes), "group": 1}).to_csv(
+        metadata_path, sep="\t", index=False
+    )
+    add_depth_to_metadata(None, str(metadata_path), read_stats=manifest_path)
+    df = pd.read_table(metadata_path, index_col="sample")
+    assert df["read_count"].to_dict() == sizes
+
+
+def test_fastq_input_path_not_read(tmp_path):
+    (tmp_path / "reads.fq").write_text("@sample=A 1\nAC\n+\nII\n")
+    manifest_path = write_fastq_shards(str(tmp_path / "reads.fq"), str(tmp_path))
+    # the feeder is released even if nothing reads from the pipe
+    with fastq_input_path(manifest_path):
+        pass
+
+
+def test_write_fastq_shards_bad_names(tmp_path):
+    (tmp_path / "reads.fq").write_text("@sample=A 1\nAC\n+\nII\n@B 1\nA\n+\nI\n")
+    with pytest.raises(ValueError):
+        write_fastq_shards(str(tmp_path / "reads.fq"), str(tmp_path / "shards"))
@@ -0,0 +1,87 @@
+import gzip
+import os
+
+import numpy as np
+import pytest
+
+from easy_amplicon.utils_manifest import RACY_WINDOW_NS
+from easy_amplicon.utils_stats import fastq_dir_stats, fastx_stats
+
+
+def expected_fastq_stats(text: str) -> dict:
+    lines = text.splitlines()
+    seqs, quals = lines[1::4], lines[3::4]
+    lengths = [len(seq) for seq in seqs]
+    max_len = max(lengths)
+    position_quality = []
+    for pos in range(max_len):
+        scores = [ord(q[pos]) - 33 for q in quals if len(q) > pos]
+        position_quality.append(round(sum(scores) / len(scores), 2))
+    scores = [ord(c) - 33 for q in quals for c in q]
+    return {
+        "num_seqs": len(seqs),
+        "num_bases": sum(lengths),
+        "min_len": min(lengths),
+        "max_len": max_len,
+        "length_hist": [[i, lengths.count(i)] for i in sorted(set(lengths))],
+        "q20_bases": sum(s >= 20 for s in scores),
+        "q30_bases": sum(s >= 30 for s in scores),
+        "position_quality": position_quality,
+    }
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_fastq_stats(tmp_path, compress, make_fastq):
+    text = make_fastq(500, seed=1)
+    path = tmp_path / ("reads.fq.gz" if compress else "reads.fq")
+    path.write_bytes(gzip.compress(text.encode()) if compress else text.encode())
+    stats = fastx_stats(str(path), use_cache=False)
+    expected = expected_fastq_stats(text)
+    assert {key: stats[key] for key in expected} == expected
+    assert stats["format"] == "fastq"
+
+
+def test_fasta_stats(tmp_path):
+    text = ">a desc\nACGT\nAC\n>b\n\n>c\nA\n>d\nACGTACGTAC"
+    path = tmp_path / "seqs.fasta"
+    path.write_text(text)
+    stats = fastx_stats(str(path), use_cache=False)
+    assert stats["num_seqs"] == 4
+    assert stats["num_bases"] == 17
+    assert stats["length_hist"] == [[0, 1], [1, 1], [6, 1], [10, 1]]
+
+
+def test_stats_cache(tmp_path, make_fastq):
+    path = tmp_path / "reads.fq"
+    path.write_text(make_fastq(10, seed=2))
+    # files modified within the racy window are not cached
+    stats = fastx_stats(str(path))
+    assert not (tmp_path / ".easy_amplicon" / "stats" / "reads.fq.json").exists()
+    mtime_ns = path.stat().st_mtime_ns - 10 * RACY_WINDOW_NS
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    assert fastx_stats(str(path)) == stats
+    assert (tmp_path / ".easy_amplicon" / "stats" / "reads.fq.json").exists()
+
+    # a stale cache entry is ignored once the file changes
+    os.utime(path, ns=(0, 0))
+    (tmp_path / ".easy_amplicon" / "stats" / "reads.fq.json").write_text(
+        '{"version": 1, "size": %d, "mtime_ns": 0, "stats": {"num_seqs": -1}}'
+        % path.stat().st_size
+    )
+    assert fastx_stats(str(path))["num_seqs"] == -1
+    path.write_text(make_fastq(12, seed=2))
+    assert fastx_stats(str(path))["num_seqs"] == 12
+    assert stats["num_seqs"] == 10
+
+
+def test_fastq_dir_stats(tmp_path, make_fastq):
+    (tmp_path / "s1_R1.fq").write_text(make_fastq(10, seed=1))
+    (tmp_path / "s1_R2.fq").write_text(make_fastq(10, seed=2))
+    (tmp_path / "s2_R1.fq").write_text(make_fastq(10, seed=3))
+    (tmp_path / "s2_R2.fq").write_text(make_fastq(9, seed=4))
+    (tmp_path / "s3_R1.fq.gz").write_bytes(gzip.compress(b"@r\nA\n+\nI\n" * 100)[:-10])
+    df = fastq_dir_stats(str(tmp_path), num_workers=2)
+    assert df.loc[str(tmp_path / "s1_R1.fq"), "num_seqs"] == 10
+    assert df["pair_ok"].tolist() == [None, True, True, False, False]
+    assert df["error"].notna().tolist() == [True, False, False, False, False]
+    assert np.isnan(df.loc[str(tmp_path / "s3_R1.fq.gz"), "num_seqs"])
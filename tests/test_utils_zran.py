@@ -0,0 +1,74 @@
+import argparse
+import gzip
+import os
+import zlib
+
+import pytest
+
+from easy_amplicon import utils_zran
+from easy_amplicon.usearch_workflow import split_fastq
+from easy_amplicon.utils_manifest import RACY_WINDOW_NS
+from easy_amplicon.utils_zran import get_gzip_index, read_gzip_slice
+
+
+def test_gzip_index(tmp_path, monkeypatch, make_fastq):
+    text = make_fastq(20000, seed=1).encode()
+    path = str(tmp_path / "reads.fq.gz")
+    # two members, one of them with deflate blocks ending mid-byte
+    with open(path, "wb") as f:
+        f.write(gzip.compress(text[:300_000], compresslevel=1))
+        f.write(gzip.compress(text[300_000:]))
+
+    # files modified within the racy window are not cached
+    get_gzip_index(path, span=50_000)
+    assert not os.path.exists(tmp_path / ".easy_amplicon" / "index")
+    mtime_ns = os.stat(path).st_mtime_ns - 10 * RACY_WINDOW_NS
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+    index = get_gzip_index(path, span=50_000)
+    assert index.size == len(text)
+    assert index.num_lines == text.count(b"\n")
+    assert len(index) > 10
+    assert any(point[3] for point in index.points)
+    for num_slices in [1, 4, 100]:
+        slices = index.split(num_slices)
+        assert 1 <= len(slices) <= num_slices
+        parts = [b"".join(read_gzip_slice(path, *s, chunk_size=4096)) for s in slices]
+        assert b"".join(parts) == text
+        assert all(part.startswith(b"@read") for part in parts)
+    assert os.path.exists(
+        tmp_path / ".easy_amplicon" / "index" / "reads.fq.gz.zran.npz"
+    )
+
+    # the cached index is used unless the file changes
+    monkeypatch.setattr(utils_zran, "_build_gzip_index", None)
+    assert get_gzip_index(path).points == index.points
+    os.utime(path, ns=(0, 0))
+    assert get_gzip_index(path, build=False) is None
+
+
+def test_gzip_index_invalid(tmp_path):
+    path = tmp_path / "reads.fq.gz"
+    path.write_bytes(gzip.compress(b"@a\nAC\n+\nII\n@b\nG\n+\nI")[:-20])
+    with pytest.raises(ValueError):
+        get_gzip_index(str(path))
+    path.write_bytes(gzip.compress(b"@a\nAC\n+\n"))
+    with pytest.raises(ValueError):
+        get_gzip_index(str(path))
+    path.write_bytes(zlib.compress(b"@a\nAC\n+\nII\n"))
+    with pytest.raises(ValueError):
+        get_gzip_index(str(path))
+
+
+def test_split_fastq_gzip(tmp_path, monkeypatch, make_fastq):
+    monkeypatch.setattr(utils_zran, "GZIP_INDEX_SPAN", 20_000)
+    text = make_fastq(5000, seed=2)
+    path = tmp_path / "reads.fq.gz"
+    path.write_bytes(gzip.compress(text.encode()))
+    (tmp_path / "split").mkdir()
+    args = argparse.Namespace(
+        input_file=str(path), output_dir=str(tmp_path / "split"), num_splits=3
+    )
+    split_fastq(args)
+    pieces = sorted(os.listdir(tmp_path / "split"))
+    assert pieces == ["split_00.fastq", "split_01.fastq", "split_02.fastq"]
+    assert "".join((tmp_path / "split" / p).read_text() for p in pieces) == text